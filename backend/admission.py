@@ -0,0 +1,168 @@
+"""
+リクエストの流入制御（バルクヘッドと負荷遮断）
+ルートを優先度のクラスに分け、クラスごとに同時実行数と短い待ち行列を持たせる
+待ち行列もあふれたリクエストは 503 + Retry-After で返し、Webhook・決済の枠は他のクラスに使わせない
+同時実行数はプロセスごとに数える（同期ワーカーでは常に1件のため効果がない。Dockerfileはgthreadワーカーで動かす）
+"""
+import os
+import time
+import logging
+import threading
+from flask import request, jsonify, g
+
+logger = logging.getLogger(__name__)
+
+# 流入制御を有効にするか
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+
+# 待ち行列で待つ最大秒数（超えた場合は503）
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2"))
+
+# 503で返す Retry-After（秒）
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "2"))
+
+# クラスごとの「同時実行数/待ち行列の長さ」（環境変数で上書き）
+# critical: Webhook・購入開始 / auth: ログイン・登録 / standard: 決済の操作 / low: マイページの参照・管理画面
+DEFAULT_LIMITS = {
+    'critical': ('ADMISSION_CRITICAL', '8/32'),
+    'auth': ('ADMISSION_AUTH', '4/8'),
+    'standard': ('ADMISSION_STANDARD', '4/8'),
+    'low': ('ADMISSION_LOW', '4/2'),
+}
+
+# エンドポイント（またはBlueprint）とクラスの対応。どれにも当たらないもの（ヘルスチェック等）は制御しない
+ROUTE_CLASSES = {
+    'webhook': 'critical',
+    'payment.checkout': 'critical',
+    'payment.subscription': 'critical',
+    'auth': 'auth',
+    'payment': 'standard',
+    'billing': 'standard',
+    'user': 'low',
+    'admin': 'low',
+}
+
+
+class Bulkhead:
+    """同時実行数の上限と長さに上限のある待ち行列"""
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._shed = 0
+        self._timed_out = 0
+
+    def try_acquire(self):
+        """実行枠を確保（確保できた場合はTrue。待ち行列が満杯・待ち時間切れの場合はFalse）"""
+        with self._condition:
+            if self._in_flight < self.max_concurrent and not self._waiting:
+                self._in_flight += 1
+                self._admitted += 1
+                return True
+
+            if self._waiting >= self.max_queue:
+                self._shed += 1
+                return False
+
+            self._waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self._in_flight >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timed_out += 1
+                        self._shed += 1
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+            self._in_flight += 1
+            self._admitted += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'admitted': self._admitted,
+                'shed': self._shed,
+                'timed_out': self._timed_out,
+            }
+
+
+def parse_limit(value):
+    """「同時実行数/待ち行列の長さ」形式の設定を (同時実行数, 待ち行列の長さ) に変換"""
+    concurrent, _, queue = value.partition('/')
+    return int(concurrent), int(queue or 0)
+
+
+class AdmissionController:
+    """ルートのクラスごとのバルクヘッドをまとめて管理する"""
+
+    def __init__(self, limits=None, route_classes=None):
+        if limits is None:
+            limits = {name: parse_limit(os.getenv(env_name, default))
+                      for name, (env_name, default) in DEFAULT_LIMITS.items()}
+        self.route_classes = ROUTE_CLASSES if route_classes is None else route_classes
+        self.bulkheads = {name: Bulkhead(name, *limit) for name, limit in limits.items()}
+
+    def classify(self, endpoint, blueprint):
+        """エンドポイントのクラス名を返す（制御しない場合はNone）"""
+        return self.route_classes.get(endpoint) or self.route_classes.get(blueprint)
+
+    def stats(self):
+        return {name: bulkhead.stats() for name, bulkhead in self.bulkheads.items()}
+
+
+# プロセス全体で共有する流入制御
+admission_controller = AdmissionController()
+
+
+def _overloaded_response():
+    response = jsonify({
+        "success": False,
+        "error": "アクセスが集中しています。しばらくしてから再度お試しください",
+        "retry_after": ADMISSION_RETRY_AFTER_SECONDS
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER_SECONDS)
+    return response
+
+
+def setup_admission_control(app, controller=None):
+    """リクエストの流入制御を設定"""
+    controller = controller or admission_controller
+
+    @app.before_request
+    def admit_request():
+        route_class = controller.classify(request.endpoint, request.blueprint)
+        bulkhead = controller.bulkheads.get(route_class)
+        if bulkhead is None or request.method == 'OPTIONS':
+            return None
+
+        if not bulkhead.try_acquire():
+            logger.warning(f"Shedding {request.endpoint} ({route_class}): bulkhead full")
+            return _overloaded_response()
+        g.admission_bulkhead = bulkhead
+        return None
+
+    @app.teardown_request
+    def release_admission(exc=None):
+        bulkhead = g.pop('admission_bulkhead', None)
+        if bulkhead is not None:
+            bulkhead.release()
@@ -0,0 +1,45 @@
+"""add user_billing_summary table
+
+Revision ID: 006
+Revises: 005_add_processed_events_table
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005_add_processed_events_table'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_billing_summary',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('subscription_id', sa.String(), nullable=True),
+    sa.Column('price_id', sa.String(), nullable=True),
+    sa.Column('plan_name', sa.String(length=100), nullable=True),
+    sa.Column('subscription_status', sa.String(), nullable=True),
+    sa.Column('cancel_at_period_end', sa.Boolean(), nullable=True),
+    sa.Column('current_period_end', sa.Integer(), nullable=True),
+    sa.Column('scheduled_schedule_id', sa.String(), nullable=True),
+    sa.Column('scheduled_price_id', sa.String(), nullable=True),
+    sa.Column('scheduled_change_date', sa.Integer(), nullable=True),
+    sa.Column('lifetime_spend', sa.Numeric(precision=12, scale=2), nullable=True),
+    sa.Column('currency', sa.String(length=3), nullable=True),
+    sa.Column('last_payment_id', sa.String(), nullable=True),
+    sa.Column('last_purchase_session_id', sa.String(), nullable=True),
+    sa.Column('last_purchase_product', sa.String(length=255), nullable=True),
+    sa.Column('last_purchase_amount', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('last_purchase_at', sa.String(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # サマリーは既存データから遅延再構築されるため、ここでは埋めない
+
+
+def downgrade():
+    op.drop_table('user_billing_summary')
@@ -0,0 +1,36 @@
+"""add revenue_rollups table
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('revenue_rollups',
+    sa.Column('grain', sa.String(length=5), nullable=False),
+    sa.Column('period', sa.String(length=10), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('source', sa.String(length=10), nullable=False),
+    sa.Column('product', sa.String(length=255), nullable=False),
+    sa.Column('plan_name', sa.String(length=100), nullable=False),
+    sa.Column('amount', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('grain', 'period', 'currency', 'source', 'product', 'plan_name')
+    )
+    # 既存データの集計は `flask admin rebuild-revenue-rollups` で行う
+
+
+def downgrade():
+    op.drop_table('revenue_rollups')
@@ -0,0 +1,159 @@
+"""partition ledger and invoices by month
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+# 作成時点で当月から何か月先までパーティションを用意するか（以降は ensure_future_partitions が作成）
+MONTHS_AHEAD = 3
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def _months_until_ahead(first_month):
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    current_month = datetime.date(today.year, today.month, 1)
+    last_month = _add_months(current_month, MONTHS_AHEAD)
+    # データがない（first_month が date.max）場合も当月から作成する
+    month = min(first_month, current_month)
+    while month <= last_month:
+        yield month
+        month = _add_months(month, 1)
+
+
+def _epoch(month):
+    return int(datetime.datetime.combine(month, datetime.time(), tzinfo=datetime.timezone.utc).timestamp())
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        # SQLiteはパーティション非対応（repositories.partitioning がアーカイブテーブルで代替する）
+        return
+
+    # ---- ledger: created_at（ISO文字列）で月次パーティション ----
+    # 文字列の範囲比較をロケールに依存させないため created_at は COLLATE "C" にする
+    # 主キーにパーティションキーを含めるため session_id 単独の一意性はなくなる
+    # （記録側は created_at を常にStripeのcreatedから作り、複合キーの ON CONFLICT で重複を防ぐ）
+    op.execute("ALTER TABLE ledger RENAME TO ledger_unpartitioned")
+    op.execute("ALTER INDEX IF EXISTS ledger_pkey RENAME TO ledger_unpartitioned_pkey")
+    op.execute("""
+        CREATE TABLE ledger (
+            session_id VARCHAR NOT NULL,
+            user_id INTEGER,
+            amount NUMERIC(10, 2) CHECK (amount >= 0),
+            currency VARCHAR(3),
+            status VARCHAR,
+            product_name VARCHAR(255),
+            created_at VARCHAR COLLATE "C" NOT NULL,
+            PRIMARY KEY (session_id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("CREATE TABLE ledger_default PARTITION OF ledger DEFAULT")
+    op.execute("CREATE INDEX ix_ledger_user_id_created_at ON ledger (user_id, created_at)")
+
+    first_created_at = bind.execute(sa.text("SELECT min(created_at) FROM ledger_unpartitioned")).scalar()
+    first_month = datetime.date.fromisoformat(first_created_at[:7] + "-01") if first_created_at else datetime.date.max
+    for month in _months_until_ahead(first_month):
+        op.execute(
+            f"CREATE TABLE ledger_y{month.year:04d}m{month.month:02d} PARTITION OF ledger "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+        )
+
+    op.execute("""
+        INSERT INTO ledger (session_id, user_id, amount, currency, status, product_name, created_at)
+        SELECT session_id, user_id, amount, currency, status, product_name,
+               COALESCE(created_at, '1970-01-01T00:00:00+00:00')
+        FROM ledger_unpartitioned
+    """)
+    op.execute("DROP TABLE ledger_unpartitioned")
+
+    # ---- invoices: created（Unix timestamp）で月次パーティション ----
+    # ledger と同様に id 単独の一意性はなくなる（created はStripeの値のみを使う）
+    op.execute("ALTER TABLE invoices RENAME TO invoices_unpartitioned")
+    op.execute("ALTER INDEX IF EXISTS invoices_pkey RENAME TO invoices_unpartitioned_pkey")
+    op.execute("""
+        CREATE TABLE invoices (
+            id VARCHAR NOT NULL,
+            subscription_id VARCHAR,
+            status VARCHAR,
+            amount_due NUMERIC(10, 2),
+            currency VARCHAR(3),
+            created INTEGER NOT NULL,
+            PRIMARY KEY (id, created)
+        ) PARTITION BY RANGE (created)
+    """)
+    op.execute("CREATE TABLE invoices_default PARTITION OF invoices DEFAULT")
+    op.execute("CREATE INDEX ix_invoices_subscription_id_created ON invoices (subscription_id, created)")
+
+    first_created = bind.execute(sa.text("SELECT min(created) FROM invoices_unpartitioned")).scalar()
+    if first_created:
+        first_day = datetime.datetime.fromtimestamp(first_created, tz=datetime.timezone.utc).date()
+        first_month = datetime.date(first_day.year, first_day.month, 1)
+    else:
+        first_month = datetime.date.max
+    for month in _months_until_ahead(first_month):
+        op.execute(
+            f"CREATE TABLE invoices_y{month.year:04d}m{month.month:02d} PARTITION OF invoices "
+            f"FOR VALUES FROM ({_epoch(month)}) TO ({_epoch(_add_months(month, 1))})"
+        )
+
+    op.execute("""
+        INSERT INTO invoices (id, subscription_id, status, amount_due, currency, created)
+        SELECT id, subscription_id, status, amount_due, currency, COALESCE(created, 0)
+        FROM invoices_unpartitioned
+    """)
+    op.execute("DROP TABLE invoices_unpartitioned")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    # パーティションを通常のテーブルに戻す（archive スキーマへ切り離したパーティションは戻さない）
+    op.execute("ALTER TABLE ledger RENAME TO ledger_partitioned")
+    op.execute("ALTER INDEX ledger_pkey RENAME TO ledger_partitioned_pkey")
+    op.execute("""
+        CREATE TABLE ledger (
+            session_id VARCHAR NOT NULL PRIMARY KEY,
+            user_id INTEGER,
+            amount NUMERIC(10, 2) CHECK (amount >= 0),
+            currency VARCHAR(3),
+            status VARCHAR,
+            product_name VARCHAR(255),
+            created_at VARCHAR
+        )
+    """)
+    op.execute("INSERT INTO ledger SELECT * FROM ledger_partitioned ON CONFLICT (session_id) DO NOTHING")
+    op.execute("DROP TABLE ledger_partitioned CASCADE")
+
+    op.execute("ALTER TABLE invoices RENAME TO invoices_partitioned")
+    op.execute("ALTER INDEX invoices_pkey RENAME TO invoices_partitioned_pkey")
+    op.execute("""
+        CREATE TABLE invoices (
+            id VARCHAR NOT NULL PRIMARY KEY,
+            subscription_id VARCHAR,
+            status VARCHAR,
+            amount_due NUMERIC(10, 2),
+            currency VARCHAR(3),
+            created INTEGER
+        )
+    """)
+    op.execute("INSERT INTO invoices SELECT * FROM invoices_partitioned ON CONFLICT (id) DO NOTHING")
+    op.execute("DROP TABLE invoices_partitioned CASCADE")
@@ -0,0 +1,26 @@
+"""add index on user_sessions.created_at
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 有効期限の判定とスイーパーの削除対象の検索に使う
+    op.create_index('ix_user_sessions_created_at', 'user_sessions', ['created_at'])
+    # 既に溜まっている期限切れ・無効化済みの行はスイーパーが少しずつ削除する
+
+
+def downgrade():
+    op.drop_index('ix_user_sessions_created_at', table_name='user_sessions')
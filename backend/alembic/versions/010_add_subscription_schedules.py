@@ -0,0 +1,40 @@
+"""add subscription_schedules table
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('subscription_schedules',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('subscription_id', sa.String(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('customer_id', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('current_price_id', sa.String(), nullable=True),
+    sa.Column('next_price_id', sa.String(), nullable=True),
+    sa.Column('change_date', sa.Integer(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_subscription_schedules_subscription_id', 'subscription_schedules', ['subscription_id'])
+    op.create_index('ix_subscription_schedules_user_id', 'subscription_schedules', ['user_id'])
+    # 既存の変更予約は flask admin sync-subscription-schedules でStripeから取り込む
+
+
+def downgrade():
+    op.drop_index('ix_subscription_schedules_user_id', table_name='subscription_schedules')
+    op.drop_index('ix_subscription_schedules_subscription_id', table_name='subscription_schedules')
+    op.drop_table('subscription_schedules')
@@ -0,0 +1,354 @@
+"""
+売上分析（MRR・チャーン・ARPU・プラン構成）
+subscriptions / invoices / ledger を列指向のNumPy配列に一括ロードし、ベクトル演算で集計する
+"""
+import logging
+import datetime
+import numpy as np
+from sqlalchemy import select
+from models import Subscription, Invoice, Ledger
+from repositories import get_session, get_plan_name_from_price_id
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+
+# 終了扱いにするサブスクリプションのステータス
+ENDED_STATUSES = ('canceled', 'incomplete_expired', 'unpaid')
+
+# 時系列計算で一度に展開する行列の上限（サブスクリプション数 × 時点数）
+SERIES_CHUNK_CELLS = 5_000_000
+
+NO_END = np.iinfo(np.int64).max
+
+# 月額の算出に使う請求書の遡り期間（月次課金なら期間開始前の直近請求書が含まれる）
+INVOICE_LOOKBACK_DAYS = 45
+
+
+# ============================================
+# 変換ユーティリティ
+# ============================================
+
+def iso_to_epoch(values):
+    """ISO文字列の配列をUnix秒の配列に変換（不正値・欠損はNaT → int64最小値）"""
+    strings = np.array([value or '' for value in values], dtype='U19')  # タイムゾーン部分を切り捨て
+    if not len(strings):
+        return np.zeros(0, dtype=np.int64)
+    strings = np.char.replace(strings, ' ', 'T')
+    strings = np.where(strings == '', 'NaT', strings)
+    try:
+        return strings.astype('datetime64[s]').astype(np.int64)
+    except ValueError:
+        # 一部に不正な文字列が混ざっている場合は1件ずつ変換
+        return np.array([_iso_to_epoch_one(value) for value in strings], dtype=np.int64)
+
+
+def _iso_to_epoch_one(value):
+    try:
+        return np.datetime64(value, 's').astype(np.int64)
+    except ValueError:
+        return np.datetime64('NaT', 's').astype(np.int64)
+
+
+def to_epoch(value):
+    """date / datetime / ISO文字列 / Unix秒をUnix秒（UTC）に変換"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return int(value.timestamp())
+    if isinstance(value, datetime.date):
+        return int(datetime.datetime(value.year, value.month, value.day, tzinfo=datetime.timezone.utc).timestamp())
+    raise ValueError(f"Unsupported date value: {value!r}")
+
+
+def epoch_to_iso(epoch):
+    return datetime.datetime.fromtimestamp(int(epoch), tz=datetime.timezone.utc).isoformat()
+
+
+def _column(rows, index, dtype=object):
+    return np.array([row[index] for row in rows], dtype=dtype)
+
+
+def _numeric(values):
+    """Numeric(Decimal)/Noneの配列をfloat配列に変換"""
+    return np.array([float(value) if value is not None else 0.0 for value in values], dtype=np.float64)
+
+
+# ============================================
+# データセット
+# ============================================
+
+class RevenueDataset:
+    """売上分析用の列指向データセット"""
+
+    def __init__(self, subscriptions, invoices, ledger):
+        (sub_ids, sub_user_ids, sub_price_ids, sub_statuses,
+         sub_period_ends, sub_created_at) = subscriptions
+        (inv_sub_ids, inv_statuses, inv_amounts, inv_currencies, inv_created) = invoices
+        (led_user_ids, led_amounts, led_currencies, led_statuses, led_created_at) = ledger
+
+        # 通貨を共通のコードに変換
+        all_currencies = np.concatenate([inv_currencies, led_currencies, np.array(['jpy'], dtype=object)])
+        all_currencies = np.array([(c or 'jpy').lower() for c in all_currencies], dtype=object)
+        self.currencies, currency_codes = np.unique(all_currencies.astype(str), return_inverse=True)
+        inv_currency_codes = currency_codes[:len(inv_currencies)]
+        led_currency_codes = currency_codes[len(inv_currencies):len(inv_currencies) + len(led_currencies)]
+        default_currency = currency_codes[-1]
+
+        # サブスクリプションIDを請求書と共通のコードに変換
+        n_subs = len(sub_ids)
+        all_sub_ids = np.concatenate([sub_ids, inv_sub_ids]).astype(str)
+        _, sub_codes = np.unique(all_sub_ids, return_inverse=True)
+        sub_id_codes = sub_codes[:n_subs]
+        inv_sub_codes = sub_codes[n_subs:]
+
+        # サブスクリプションの有効期間 [start, end)
+        starts = iso_to_epoch(sub_created_at)
+        starts = np.where(starts == np.iinfo(np.int64).min, 0, starts)
+        period_ends = np.array([value if value is not None else -1 for value in sub_period_ends], dtype=np.int64)
+        ended = np.isin(sub_statuses.astype(str), ENDED_STATUSES)
+        ends = np.where(ended, np.where(period_ends >= 0, period_ends, starts), NO_END)
+
+        # 月額 = 各サブスクリプションの直近の支払い済み請求書の金額（月次課金を前提）
+        paid = inv_statuses.astype(str) == 'paid'
+        paid_sub_codes = inv_sub_codes[paid]
+        paid_amounts = inv_amounts[paid]
+        paid_currency_codes = inv_currency_codes[paid]
+        order = np.lexsort((inv_created[paid], paid_sub_codes))
+        sorted_codes = paid_sub_codes[order]
+        is_last = np.ones(len(order), dtype=bool)
+        is_last[:-1] = sorted_codes[1:] != sorted_codes[:-1]
+        last_index = order[is_last]
+
+        n_codes = int(sub_codes.max()) + 1 if len(sub_codes) else 0
+        monthly_by_code = np.zeros(n_codes, dtype=np.float64)
+        currency_by_code = np.full(n_codes, default_currency, dtype=np.int64)
+        monthly_by_code[paid_sub_codes[last_index]] = paid_amounts[last_index]
+        currency_by_code[paid_sub_codes[last_index]] = paid_currency_codes[last_index]
+
+        self.sub_user_ids = np.array([uid if uid is not None else -1 for uid in sub_user_ids], dtype=np.int64)
+        self.plan_ids, self.sub_plan_codes = np.unique(
+            np.array([pid or '' for pid in sub_price_ids], dtype=str), return_inverse=True
+        )
+        self.sub_starts = starts
+        self.sub_ends = ends
+        self.sub_monthly = monthly_by_code[sub_id_codes]
+        self.sub_currency = currency_by_code[sub_id_codes]
+
+        # 収益（支払い済みの請求書・単発購入）
+        self.inv_paid_amounts = paid_amounts
+        self.inv_paid_currency = paid_currency_codes
+        self.inv_paid_created = inv_created[paid]
+
+        led_paid = led_statuses.astype(str) == 'paid'
+        self.led_amounts = led_amounts[led_paid]
+        self.led_currency = led_currency_codes[led_paid]
+        self.led_created = iso_to_epoch(led_created_at[led_paid])
+        self.led_user_ids = led_user_ids[led_paid]
+
+    @classmethod
+    def load(cls, start=None, end=None):
+        """DBから一括ロード（期間を指定すると請求書・台帳は必要な範囲の行のみ読む）"""
+        start_epoch, end_epoch = to_epoch(start), to_epoch(end)
+        session = get_session()
+        try:
+            subscription_rows = session.execute(select(
+                Subscription.id,
+                Subscription.user_id,
+                Subscription.price_id,
+                Subscription.status,
+                Subscription.current_period_end,
+                Subscription.created_at,
+            )).all()
+
+            invoice_query = select(
+                Invoice.subscription_id,
+                Invoice.status,
+                Invoice.amount_due,
+                Invoice.currency,
+                Invoice.created,
+            )
+            ledger_query = select(
+                Ledger.user_id,
+                Ledger.amount,
+                Ledger.currency,
+                Ledger.status,
+                Ledger.created_at,
+            )
+            if start_epoch is not None:
+                invoice_query = invoice_query.where(
+                    Invoice.created >= start_epoch - INVOICE_LOOKBACK_DAYS * SECONDS_PER_DAY
+                )
+                ledger_query = ledger_query.where(Ledger.created_at >= epoch_to_iso(start_epoch))
+            if end_epoch is not None:
+                invoice_query = invoice_query.where(Invoice.created < end_epoch)
+                ledger_query = ledger_query.where(Ledger.created_at < epoch_to_iso(end_epoch))
+            invoice_rows = session.execute(invoice_query).all()
+            ledger_rows = session.execute(ledger_query).all()
+        finally:
+            session.close()
+
+        logger.info(
+            f"Revenue dataset loaded: {len(subscription_rows)} subscriptions, "
+            f"{len(invoice_rows)} invoices, {len(ledger_rows)} ledger rows"
+        )
+
+        return cls(
+            subscriptions=(
+                _column(subscription_rows, 0),
+                _column(subscription_rows, 1),
+                _column(subscription_rows, 2),
+                _column(subscription_rows, 3),
+                _column(subscription_rows, 4),
+                _column(subscription_rows, 5),
+            ),
+            invoices=(
+                _column(invoice_rows, 0),
+                _column(invoice_rows, 1),
+                _numeric(row[2] for row in invoice_rows),
+                _column(invoice_rows, 3),
+                np.array([row[4] or 0 for row in invoice_rows], dtype=np.int64),
+            ),
+            ledger=(
+                np.array([row[0] if row[0] is not None else -1 for row in ledger_rows], dtype=np.int64),
+                _numeric(row[1] for row in ledger_rows),
+                _column(ledger_rows, 2),
+                _column(ledger_rows, 3),
+                _column(ledger_rows, 4),
+            ),
+        )
+
+    # ============================================
+    # 集計
+    # ============================================
+
+    def active_at(self, t):
+        """時点tで有効なサブスクリプションのマスク"""
+        return (self.sub_starts <= t) & (self.sub_ends > t)
+
+    def _by_currency(self, codes, weights):
+        return np.bincount(codes, weights=weights, minlength=len(self.currencies))
+
+    def mrr_at(self, t):
+        """時点tの通貨別MRR"""
+        return self._by_currency(self.sub_currency, self.sub_monthly * self.active_at(t))
+
+    def compute_metrics(self, start, end):
+        """期間 [start, end) のMRR・チャーン・ARPU・プラン構成を計算"""
+        start, end = to_epoch(start), to_epoch(end)
+        if end <= start:
+            raise ValueError("end must be after start")
+
+        active_start = self.active_at(start)
+        active_end = self.active_at(end)
+        new = (self.sub_starts >= start) & (self.sub_starts < end)
+        churned = (self.sub_ends >= start) & (self.sub_ends < end) & (self.sub_starts < self.sub_ends)
+        churned_from_start = churned & active_start
+
+        mrr_start = self._by_currency(self.sub_currency, self.sub_monthly * active_start)
+        mrr_end = self._by_currency(self.sub_currency, self.sub_monthly * active_end)
+        new_mrr = self._by_currency(self.sub_currency, self.sub_monthly * new)
+        churned_mrr = self._by_currency(self.sub_currency, self.sub_monthly * churned)
+
+        inv_in_range = (self.inv_paid_created >= start) & (self.inv_paid_created < end)
+        led_in_range = (self.led_created >= start) & (self.led_created < end)
+        subscription_revenue = self._by_currency(self.inv_paid_currency, self.inv_paid_amounts * inv_in_range)
+        one_time_revenue = self._by_currency(self.led_currency, self.led_amounts * led_in_range)
+
+        # ARPU = 期末MRR / 期末の有効ユーザー数（通貨別）
+        arpu = np.zeros(len(self.currencies))
+        for code in range(len(self.currencies)):
+            mask = active_end & (self.sub_currency == code)
+            users = np.unique(self.sub_user_ids[mask])
+            if len(users):
+                arpu[code] = mrr_end[code] / len(users)
+
+        currencies = {}
+        for code, currency in enumerate(self.currencies):
+            if not (mrr_start[code] or mrr_end[code] or new_mrr[code] or churned_mrr[code]
+                    or subscription_revenue[code] or one_time_revenue[code]):
+                continue
+            currencies[str(currency)] = {
+                'mrr_start': float(mrr_start[code]),
+                'mrr_end': float(mrr_end[code]),
+                'new_mrr': float(new_mrr[code]),
+                'churned_mrr': float(churned_mrr[code]),
+                'net_new_mrr': float(new_mrr[code] - churned_mrr[code]),
+                'arpu': float(arpu[code]),
+                'revenue': {
+                    'subscription': float(subscription_revenue[code]),
+                    'one_time': float(one_time_revenue[code]),
+                    'total': float(subscription_revenue[code] + one_time_revenue[code]),
+                },
+            }
+
+        active_start_count = int(active_start.sum())
+        return {
+            'period': {'start': epoch_to_iso(start), 'end': epoch_to_iso(end)},
+            'subscribers': {
+                'start': active_start_count,
+                'end': int(active_end.sum()),
+                'new': int(new.sum()),
+                'churned': int(churned_from_start.sum()),
+            },
+            'churn_rate': float(churned_from_start.sum() / active_start_count) if active_start_count else 0.0,
+            'currencies': currencies,
+            'plan_mix': self.plan_mix(active_end),
+        }
+
+    def plan_mix(self, active):
+        """有効なサブスクリプションのプラン構成"""
+        counts = np.bincount(self.sub_plan_codes[active], minlength=len(self.plan_ids))
+        mrr = np.bincount(self.sub_plan_codes[active], weights=self.sub_monthly[active], minlength=len(self.plan_ids))
+        total = counts.sum()
+        return [
+            {
+                'price_id': str(price_id) or None,
+                'plan_name': get_plan_name_from_price_id(str(price_id)),
+                'subscribers': int(counts[code]),
+                'share': float(counts[code] / total) if total else 0.0,
+                'mrr': float(mrr[code]),
+            }
+            for code, price_id in enumerate(self.plan_ids)
+            if counts[code]
+        ]
+
+    def mrr_series(self, start, end, interval_days=1):
+        """期間内の一定間隔ごとの通貨別MRR推移"""
+        start, end = to_epoch(start), to_epoch(end)
+        points = np.arange(start, end + 1, max(int(interval_days), 1) * SECONDS_PER_DAY, dtype=np.int64)
+        series = np.zeros((len(self.currencies), len(points)))
+
+        # サブスクリプション × 時点 の有効行列を分割して計算（メモリ使用量を制限）
+        chunk = max(SERIES_CHUNK_CELLS // max(len(points), 1), 1)
+        for offset in range(0, len(self.sub_starts), chunk):
+            part = slice(offset, offset + chunk)
+            active = (self.sub_starts[part, None] <= points[None, :]) & (self.sub_ends[part, None] > points[None, :])
+            weighted = active * self.sub_monthly[part, None]
+            for code in range(len(self.currencies)):
+                series[code] += weighted[self.sub_currency[part] == code].sum(axis=0)
+
+        return {
+            'points': [epoch_to_iso(point) for point in points],
+            'mrr': {
+                str(currency): series[code].tolist()
+                for code, currency in enumerate(self.currencies)
+                if series[code].any()
+            },
+        }
+
+
+def compute_revenue_metrics(start, end):
+    """DBからロードして期間の指標を計算"""
+    return RevenueDataset.load(start=start, end=end).compute_metrics(start, end)
+
+
+def compute_mrr_series(start, end, interval_days=1):
+    """DBからロードしてMRR推移を計算"""
+    return RevenueDataset.load(start=start, end=end).mrr_series(start, end, interval_days)
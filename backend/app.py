@@ -2,13 +2,14 @@
 Flask アプリケーションのエントリーポイント
 """
 import os
-import stripe
 from dotenv import load_dotenv
 from flask import Flask, jsonify
 from flask_cors import CORS
 from repositories import init_db
-from routes import auth_bp, user_bp, payment_bp, webhook_bp
+from repositories.customer_provisioning import customer_provisioner
+from routes import auth_bp, user_bp, payment_bp, webhook_bp, admin_bp
 from routes.billing_portal_routes import billing_bp
+from stripe_client import configure_stripe
 
 load_dotenv()
 
@@ -24,18 +25,22 @@ CORS(app,
      allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
      supports_credentials=True)
 
-# 環境変数からStripeの公開鍵・秘密鍵を取得
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+# Stripeの秘密鍵とHTTPクライアント（接続プール・タイムアウト）を設定
+configure_stripe()
 
 # データベース初期化
 init_db()
 
+# 前回の停止時に残った顧客作成ジョブを処理するため、登録を待たずに作成スレッドを起動
+customer_provisioner.ensure_started()
+
 # Blueprintを登録
 app.register_blueprint(auth_bp)
 app.register_blueprint(user_bp)
 app.register_blueprint(payment_bp)
 app.register_blueprint(webhook_bp)
 app.register_blueprint(billing_bp)
+app.register_blueprint(admin_bp)
 
 
 # ヘルスチェックエンドポイント
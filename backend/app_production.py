@@ -2,13 +2,13 @@
 Stripe Gym production-ready application entry point
 """
 import os
-import stripe
 from datetime import datetime
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 from repositories import init_db
-from routes import auth_bp, user_bp, payment_bp, webhook_bp
+from routes import auth_bp, user_bp, payment_bp, webhook_bp, admin_bp
 from routes.billing_portal_routes import billing_bp
+from stripe_client import configure_stripe
 
 def create_app():
     app = Flask(__name__)
@@ -49,12 +49,16 @@ def create_app():
              allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
              supports_credentials=True)
     
-    # Stripe API設定
-    stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+    # Stripe API設定（APIキー・接続プール・タイムアウト）
+    configure_stripe()
     
     # データベース初期化
     init_db()
     
+    # 前回の停止時に残った顧客作成ジョブを処理するため、登録を待たずに作成スレッドを起動
+    from repositories.customer_provisioning import customer_provisioner
+    customer_provisioner.ensure_started()
+    
     # Enhanced health check endpoint
     @app.route("/health")
     def health_check():
@@ -76,12 +80,32 @@ def create_app():
         except:
             cache_health = {'cache_available': False}
         
+        from repositories.session_cache import get_session_cache_stats
+        from repositories.session_sweeper import session_sweeper
+        from repositories.customer_cache import get_customer_cache_stats
+        from repositories.customer_provisioning import customer_provisioner
+        from repositories.hosted_session_cache import get_hosted_session_cache_stats
+        from plan_catalog import get_plan_catalog_stats
+        from security import rate_limiter, ip_filter
+        from admission import admission_controller
+        from stripe_client import get_stripe_stats
+        
         return jsonify({
             'status': 'ok',
             'timestamp': datetime.now().isoformat(),
             'version': os.getenv('APP_VERSION', '1.0.0'),
             'environment': os.getenv('FLASK_ENV', 'development'),
-            'cache': cache_health
+            'cache': cache_health,
+            'session_cache': get_session_cache_stats(),
+            'session_sweeper': session_sweeper.stats(),
+            'rate_limiter': rate_limiter.stats(),
+            'ip_filter': ip_filter.stats(),
+            'admission': admission_controller.stats(),
+            'stripe': get_stripe_stats(),
+            'stripe_customer_cache': get_customer_cache_stats(),
+            'customer_provisioning': customer_provisioner.stats(),
+            'hosted_session_cache': get_hosted_session_cache_stats(),
+            'plan_catalog': get_plan_catalog_stats()
         })
     
     # Blueprint registration with enhanced monitoring
@@ -91,15 +115,18 @@ def create_app():
         app.register_blueprint(payment_bp)
         app.register_blueprint(webhook_bp)
         app.register_blueprint(billing_bp)
+        app.register_blueprint(admin_bp)
         
         # Apply security enhancements where available
         try:
-            from security import rate_limit
+            # Per-blueprint rate limits (auth / checkout / webhook)
+            from security import setup_rate_limits
+            setup_rate_limits(app)
             
-            @auth_bp.before_request
-            def rate_limit_auth():
-                # Apply rate limiting to prevent brute force
-                pass
+            # Per-route-class bulkheads (load shedding with 503 + Retry-After)
+            from admission import setup_admission_control, ADMISSION_CONTROL_ENABLED
+            if ADMISSION_CONTROL_ENABLED:
+                setup_admission_control(app)
         
             from monitoring import monitor_critical_operations
             
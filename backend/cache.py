@@ -5,6 +5,8 @@ import os
 import json
 import hashlib
 import time
+import threading
+from collections import OrderedDict
 from functools import wraps
 from datetime import datetime, timedelta
 try:
@@ -110,6 +112,61 @@ class CacheService:
             return 0
 
 
+class LocalTTLCache:
+    """プロセス内のTTL付きキャッシュ（件数はLRUで制限し、ヒット・ミス数を記録）"""
+    
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (値, 期限（monotonic）)
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """値を取得（期限切れ・未登録の場合はNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def set(self, key, value, ttl=None):
+        """値を保存（上限を超えた場合は最も使われていないものから削除）"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self):
+        """件数とヒット率"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
 def cached(ttl=None, key_prefix=None):
     """キャッシュデコレータ"""
     def decorator(func):
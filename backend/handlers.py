@@ -1,10 +1,49 @@
+import functools
 import stripe
-from repositories import record_ledger, record_invoice, upsert_subscription, get_session
+from repositories import (
+    record_ledger,
+    record_invoice,
+    upsert_subscription,
+    get_session,
+    rebuild_billing_summary,
+    refresh_subscription_summary_for,
+    upsert_subscription_schedule,
+    set_scheduled_change,
+    clear_scheduled_change,
+    clear_stripe_customer,
+)
 from models import Subscription, ProcessedEvent
+from stripe_client import stripe_fanout, stripe_lane
+from plan_catalog import plan_catalog
+from repositories.hosted_session_cache import forget_session
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 旧プランの自動解約
+def _schedule_cancellation(old_subs):
+    """旧サブスクリプションをStripeで期間終了時に解約設定（即座に削除しない）し、成功した分のDBの解約予定フラグを更新
+
+    Stripeへの呼び出しは並列に行う。期限内に終わらなかった分は customer.subscription.updated で追って反映される
+    画面からの操作ではないため、Stripeのレートはバックグラウンドの枠を使う
+    """
+    calls = {
+        old_sub.id: functools.partial(stripe.Subscription.modify, old_sub.id, cancel_at_period_end=True)
+        for old_sub in old_subs
+    }
+    with stripe_lane('background'):
+        result = stripe_fanout(calls)
+    for old_sub in old_subs:
+        if old_sub.id in result.results:
+            # DBの解約予定フラグを更新（statusはactiveのまま）
+            old_sub.cancel_at_period_end = True
+            print(f"Auto-scheduled cancellation for old subscription: {old_sub.id}")
+        elif old_sub.id in result.errors:
+            print(f"Error scheduling cancellation for old subscription {old_sub.id}: {result.errors[old_sub.id]}")
+        else:
+            logger.warning(f"Cancellation request for old subscription {old_sub.id} did not finish in time")
+
+
 # 重複防止機能
 def is_event_processed(event_id):
     """イベントが既に処理済みかチェック"""
@@ -38,6 +77,9 @@ def mark_event_processed(event_id, event_type):
 # Webhookイベントハンドラー関数
 def handle_checkout_completed(webhook_object):
     """チェックアウト完了時の処理"""
+    # 完了したセッションは購入開始で再利用しない
+    forget_session(webhook_object.get("id"))
+    
     if webhook_object.get("mode") == "payment":
         # メタデータからユーザーIDと商品名を取得
         metadata = webhook_object.get("metadata", {})
@@ -50,7 +92,8 @@ def handle_checkout_completed(webhook_object):
         else:
             user_id = int(user_id) if user_id else None
             
-        record_ledger(webhook_object, user_id=user_id, product_name=product_name)  # 単発購入の台帳記録
+        # 単発購入の台帳記録（支払い済みであれば請求サマリーにも同じトランザクションで反映）
+        record_ledger(webhook_object, user_id=user_id, product_name=product_name)
     elif webhook_object.get("mode") == "subscription":
         # サブスクリプション作成時は、メタデータからユーザーIDを取得してサブスクリプションを更新
         metadata = webhook_object.get("metadata", {})
@@ -84,18 +127,7 @@ def handle_checkout_completed(webhook_object):
                     
                     if other_active_subs:
                         print(f"Found {len(other_active_subs)} other active subscriptions for user {user_id}")
-                        for old_sub in other_active_subs:
-                            try:
-                                # Stripeで期間終了時に解約設定（即座に削除しない）
-                                stripe.Subscription.modify(
-                                    old_sub.id,
-                                    cancel_at_period_end=True
-                                )
-                                # DBの解約予定フラグを更新（statusはactiveのまま）
-                                old_sub.cancel_at_period_end = True
-                                print(f"Auto-scheduled cancellation for old subscription: {old_sub.id}")
-                            except stripe.error.StripeError as e:
-                                print(f"Error scheduling cancellation for old subscription {old_sub.id}: {e}")
+                        _schedule_cancellation(other_active_subs)
                         session.commit()
                         print(f"Completed auto-cancellation scheduling for user {user_id}")
                     
@@ -104,6 +136,9 @@ def handle_checkout_completed(webhook_object):
                 session.rollback()
             finally:
                 session.close()
+            
+            # 請求サマリーを再計算（ユーザーと紐づく前に届いた請求書の支払いも含める）
+            rebuild_billing_summary(user_id)
     record_invoice(webhook_object)
     return "", 200
 
@@ -111,6 +146,7 @@ def handle_checkout_completed(webhook_object):
 def handle_invoice_paid(webhook_object):
     """請求書支払い完了時の処理"""
     print(f"✅ Invoice paid: {webhook_object.get('id')}")
+    # 請求サマリーへの反映（サブスクリプションの所有ユーザーに加算）も同じトランザクションで行う
     record_invoice(webhook_object)
     return "", 200
 
@@ -146,18 +182,7 @@ def handle_subscription_created(webhook_object):
             
             if other_active_subs:
                 print(f"Found {len(other_active_subs)} other active subscriptions for user {user_id}")
-                for old_sub in other_active_subs:
-                    try:
-                        # Stripeで期間終了時に解約設定（即座に削除しない）
-                        stripe.Subscription.modify(
-                            old_sub.id,
-                            cancel_at_period_end=True
-                        )
-                        # DBの解約予定フラグを更新（statusはactiveのまま）
-                        old_sub.cancel_at_period_end = True
-                        print(f"Auto-scheduled cancellation for old subscription: {old_sub.id}")
-                    except stripe.error.StripeError as e:
-                        print(f"Error scheduling cancellation for old subscription {old_sub.id}: {e}")
+                _schedule_cancellation(other_active_subs)
                 session.commit()
                 print(f"Completed auto-cancellation scheduling for user {user_id}")
         except Exception as e:
@@ -202,6 +227,12 @@ def handle_subscription_created(webhook_object):
         except Exception as e:
             print(f"Error searching checkout session for user_id: {e}")
     
+    # 請求サマリーを再計算（自動解約した旧プランも含めて再選択し、ユーザーと紐づく前に届いた請求書の支払いも含める）
+    if user_id:
+        rebuild_billing_summary(user_id)
+    else:
+        refresh_subscription_summary_for(webhook_object.get("id"))
+    
     return "", 200
 
 
@@ -220,6 +251,12 @@ def handle_subscription_updated(webhook_object):
         user_id = int(user_id) if user_id else None
     
     upsert_subscription(webhook_object, user_id=user_id)
+    
+    # 請求サマリーを更新（メタデータでユーザーと紐づいた場合は、それ以前の請求書の支払いも含めて再計算）
+    if user_id:
+        rebuild_billing_summary(user_id)
+    else:
+        refresh_subscription_summary_for(webhook_object.get("id"))
     return "", 200
 
 
@@ -250,4 +287,48 @@ def handle_subscription_deleted(webhook_object):
     finally:
         session.close()
     
+    # 請求サマリーのプラン情報を更新
+    refresh_subscription_summary_for(subscription_id)
+    
+    return "", 200
+
+
+def handle_subscription_schedule_event(webhook_object):
+    """サブスクリプションスケジュールの作成・更新・終了時の処理（subscription_schedule.*）"""
+    schedule_id = webhook_object.get('id')
+    logger.info(f"✅ Subscription schedule {webhook_object.get('status')}: {schedule_id}")
+    
+    schedule = upsert_subscription_schedule(webhook_object)
+    
+    # 請求サマリーの変更予約を合わせる
+    if schedule.next_price_id and schedule.user_id:
+        set_scheduled_change(schedule.user_id, schedule.id, schedule.next_price_id, schedule.change_date)
+    else:
+        clear_scheduled_change(schedule.id)
+    
+    return "", 200
+
+
+def handle_checkout_expired(webhook_object):
+    """チェックアウトの期限切れ時の処理（再利用していたセッションを破棄）"""
+    logger.info(f"✅ Checkout session expired: {webhook_object.get('id')}")
+    
+    forget_session(webhook_object.get("id"))
+    return "", 200
+
+
+def handle_customer_deleted(webhook_object):
+    """Stripe Customer削除時の処理（確認済みキャッシュとユーザーのCustomer IDを消す）"""
+    customer_id = webhook_object.get('id')
+    logger.info(f"✅ Customer deleted: {customer_id}")
+    
+    clear_stripe_customer(customer_id)
+    return "", 200
+
+
+def handle_plan_catalog_event(event_type, webhook_object):
+    """Price/Productの作成・更新・削除時の処理（プランカタログを更新）"""
+    logger.info(f"✅ {event_type}: {webhook_object.get('id')}")
+    
+    plan_catalog.handle_event(event_type, webhook_object)
     return "", 200
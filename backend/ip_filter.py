@@ -0,0 +1,245 @@
+"""
+IPアドレスの許可・拒否リスト（IPv4/IPv6のCIDR対応）
+リストをプレフィックス木（ビット単位のトライ）に変換し、1回の判定をプレフィックス長に比例する手数で行う
+リストはファイルまたはRedisから読み込み、変更があれば再起動せずに丸ごと差し替える
+"""
+import os
+import time
+import logging
+import ipaddress
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 許可・拒否リストのファイル（1行に「allow <CIDR>」または「block <CIDR>」。#以降はコメント）
+IP_FILTER_FILE = os.getenv("IP_FILTER_FILE")
+
+# Redisから読み込むか（セット ip_filter:allow / ip_filter:block と、更新ごとに増やす ip_filter:version）
+IP_FILTER_REDIS = os.getenv("IP_FILTER_REDIS", "false").lower() in ("1", "true", "yes")
+
+# 読み込み元の変更を確認する間隔（秒）
+IP_FILTER_RELOAD_SECONDS = float(os.getenv("IP_FILTER_RELOAD_SECONDS", "10"))
+
+REDIS_KEY_PREFIX = "ip_filter"
+
+
+# ============================================
+# プレフィックス木
+# ============================================
+
+class CIDRTrie:
+    """CIDRの集合を保持するビット単位のトライ（IPv4とIPv6で別の木を持つ）"""
+
+    def __init__(self, networks=()):
+        # ノードは [0の子, 1の子, 終端か] のリスト
+        self._roots = {4: [None, None, False], 6: [None, None, False]}
+        self.size = 0
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        """CIDR（または単一のIPアドレス）を追加"""
+        if not isinstance(network, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+            network = ipaddress.ip_network(str(network).strip(), strict=False)
+
+        node = self._roots[network.version]
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        for position in range(network.prefixlen):
+            if node[2]:
+                # より広い範囲が既に登録されている
+                return
+            bit = (bits >> (width - 1 - position)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        node[2] = True
+        # より狭い範囲は不要になる
+        node[0] = node[1] = None
+        self.size += 1
+
+    def contains(self, address):
+        """アドレスがいずれかの範囲に含まれるか（address は ip_address() の戻り値）"""
+        node = self._roots[address.version]
+        bits = int(address)
+        width = address.max_prefixlen
+        for position in range(width):
+            if node[2]:
+                return True
+            node = node[(bits >> (width - 1 - position)) & 1]
+            if node is None:
+                return False
+        return node[2]
+
+
+class IPMatcher:
+    """許可・拒否リストをまとめた判定器（作成後は変更しない）"""
+
+    def __init__(self, allow=(), block=()):
+        self.allow = CIDRTrie(allow)
+        self.block = CIDRTrie(block)
+
+    def is_allowed(self, ip_str):
+        try:
+            address = ipaddress.ip_address(ip_str)
+        except ValueError:
+            return False
+
+        # IPv4射影アドレス（::ffff:a.b.c.d）はIPv4として判定
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+
+        if self.block.contains(address):
+            return False
+        # 許可リストが設定されている場合はホワイトリスト型
+        if self.allow.size:
+            return self.allow.contains(address)
+        return True
+
+
+def parse_entries(lines):
+    """ファイル形式の行を (許可リスト, 拒否リスト) に変換（不正な行はログに出して無視）"""
+    allow, block = [], []
+    for number, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        action, _, value = line.partition(' ')
+        target = {'allow': allow, 'block': block}.get(action.lower())
+        try:
+            if target is None:
+                raise ValueError(f"unknown action '{action}'")
+            target.append(ipaddress.ip_network(value.strip(), strict=False))
+        except ValueError as e:
+            logger.warning(f"Ignoring IP filter line {number}: {e}")
+    return allow, block
+
+
+# ============================================
+# 読み込みと差し替え
+# ============================================
+
+def _redis():
+    try:
+        from cache import redis_client
+        return redis_client
+    except Exception:
+        return None
+
+
+class IPFilter:
+    """許可・拒否リストの読み込みと差し替え
+
+    判定は常に現在の IPMatcher を参照するだけで、再読み込みは新しい IPMatcher を作ってから参照を差し替える
+    """
+
+    def __init__(self, static_allow=(), static_block=(), path=IP_FILTER_FILE, use_redis=IP_FILTER_REDIS,
+                 reload_interval=IP_FILTER_RELOAD_SECONDS):
+        self.static_allow = list(static_allow)
+        self.static_block = list(static_block)
+        self.path = path
+        self.use_redis = use_redis
+        self.reload_interval = reload_interval
+        self._matcher = IPMatcher(self.static_allow, self.static_block)
+        self._source_version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'reloads': 0, 'errors': 0, 'loaded_at': None}
+
+    def is_allowed(self, ip_str):
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload_if_changed()
+        return self._matcher.is_allowed(ip_str)
+
+    def _current_version(self):
+        """読み込み元の版（ファイルの更新時刻とRedisの版番号）"""
+        version = []
+        if self.path:
+            try:
+                version.append(os.stat(self.path).st_mtime_ns)
+            except OSError:
+                version.append(None)
+        if self.use_redis:
+            client = _redis()
+            version.append(client.get(f"{REDIS_KEY_PREFIX}:version") if client is not None else None)
+        return tuple(version)
+
+    def reload_if_changed(self, force=False):
+        """読み込み元が変わっていれば読み込み直す（読み込んだ場合はTrue）"""
+        # 定期確認は他のスレッドが確認中なら待たずに、現在のリストで判定を続ける
+        if not self._lock.acquire(blocking=force):
+            return False
+        try:
+            self._checked_at = time.monotonic()
+            if not force and not self.path and not self.use_redis:
+                return False
+
+            version = self._current_version()
+            if not force and version == self._source_version:
+                return False
+
+            file_allow, file_block = self._load_file()
+            redis_allow, redis_block = self._load_redis()
+            matcher = IPMatcher(self.static_allow + file_allow + redis_allow,
+                                self.static_block + file_block + redis_block)
+
+            self._matcher = matcher
+            self._source_version = version
+            self._stats['reloads'] += 1
+            self._stats['loaded_at'] = time.time()
+            logger.info(f"IP filter reloaded: {matcher.allow.size} allow, {matcher.block.size} block entries")
+            return True
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.error(f"Error reloading IP filter (keeping previous lists): {e}")
+            return False
+        finally:
+            self._lock.release()
+
+    def _load_file(self):
+        if not self.path or not os.path.exists(self.path):
+            return [], []
+        with open(self.path, encoding='utf-8') as f:
+            return parse_entries(f)
+
+    def _load_redis(self):
+        client = _redis() if self.use_redis else None
+        if client is None:
+            return [], []
+        lines = [f"allow {member.decode()}" for member in client.smembers(f"{REDIS_KEY_PREFIX}:allow")]
+        lines += [f"block {member.decode()}" for member in client.smembers(f"{REDIS_KEY_PREFIX}:block")]
+        return parse_entries(lines)
+
+    def set_static(self, allow=(), block=()):
+        """コードで与えるリスト（SecurityConfig.ALLOWED_IPS / BLOCKED_IPS）を差し替える"""
+        self.static_allow, self.static_block = list(allow), list(block)
+        self.reload_if_changed(force=True)
+
+    def stats(self):
+        matcher = self._matcher
+        return {
+            'allow_entries': matcher.allow.size,
+            'block_entries': matcher.block.size,
+            'sources': [name for name, enabled in (('file', self.path), ('redis', self.use_redis)) if enabled],
+            **self._stats,
+        }
+
+
+def publish_to_redis(allow=None, block=None, replace=False):
+    """Redisのリストに追加（replace=Trueの場合は置き換え）して版番号を進める（全プロセスが次の確認で読み込む）"""
+    client = _redis()
+    if client is None:
+        raise RuntimeError("Redis is not available")
+
+    pipe = client.pipeline()
+    for name, entries in (('allow', allow), ('block', block)):
+        if entries is None:
+            continue
+        key = f"{REDIS_KEY_PREFIX}:{name}"
+        if replace:
+            pipe.delete(key)
+        values = [str(ipaddress.ip_network(entry, strict=False)) for entry in entries]
+        if values:
+            pipe.sadd(key, *values)
+    pipe.incr(f"{REDIS_KEY_PREFIX}:version")
+    pipe.execute()
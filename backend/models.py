@@ -39,13 +39,13 @@ class User(Base):
 # 支払い台帳
 class Ledger(Base):
     __tablename__ = "ledger"
-    session_id = Column(String, primary_key=True)  # Stripeのsession IDを主キーに
+    session_id = Column(String, primary_key=True)  # Stripeのsession IDを主キーに（PostgreSQLでは (session_id, created_at)）
     user_id = Column(Integer)  # ユーザーID（外部キー）
     amount = Column(Numeric(10, 2), CheckConstraint("amount >= 0"))
     currency = Column(String(3))
     status = Column(String)  # Stripeの実際のステータス値に合わせて制約を緩和
     product_name = Column(String(255))  # 商品名
-    created_at = Column(String)  # ISO文字列で統一
+    created_at = Column(String)  # ISO文字列で統一（PostgreSQLでは月次パーティションのキー、COLLATE "C"）
 
 
 # サブスクリプション
@@ -66,12 +66,12 @@ class Subscription(Base):
 # 請求書
 class Invoice(Base):
     __tablename__ = "invoices"
-    id = Column(String, primary_key=True)  # Stripeのinvoice IDを主キーに
+    id = Column(String, primary_key=True)  # Stripeのinvoice IDを主キーに（PostgreSQLでは (id, created)）
     subscription_id = Column(String)  # Stripeのsubscription ID
     status = Column(String)  # 請求書ステータス（paidなど）
     amount_due = Column(Numeric(10, 2))
     currency = Column(String(3))
-    created = Column(Integer)  # Unix timestampで統一
+    created = Column(Integer)  # Unix timestampで統一（PostgreSQLでは月次パーティションのキー）
 
 
 # セッション管理用のテーブル
@@ -81,7 +81,7 @@ class UserSession(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     session_token = Column(String(255), unique=True, nullable=False)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
     last_activity = Column(DateTime, default=datetime.datetime.utcnow)
     is_active = Column(Boolean, default=True)
     
@@ -96,3 +96,73 @@ class ProcessedEvent(Base):
     id = Column(String, primary_key=True)  # Stripe event ID
     processed_at = Column(DateTime, default=datetime.datetime.utcnow)
     event_type = Column(String(100))  # イベントタイプ（例：customer.subscription.updated）
+
+
+# サブスクリプションスケジュール（プラン変更予約。Webhookで更新するStripeの写し）
+class SubscriptionSchedule(Base):
+    __tablename__ = 'subscription_schedules'
+    
+    id = Column(String, primary_key=True)  # Stripeのsubscription schedule ID
+    subscription_id = Column(String, index=True)  # 対象のサブスクリプションID
+    user_id = Column(Integer, index=True)
+    customer_id = Column(String)
+    status = Column(String)  # not_started / active / completed / released / canceled
+    current_price_id = Column(String)  # 現在のフェーズの価格ID
+    next_price_id = Column(String)  # 次のフェーズの価格ID（変更予約がない場合はNone）
+    change_date = Column(Integer)  # 次のフェーズの開始日時（Unix timestamp）
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+# Stripe Customer作成の待ち行列（ユーザー登録と同じトランザクションで積み、バックグラウンドで作成する）
+class CustomerProvisioningJob(Base):
+    __tablename__ = 'customer_provisioning_jobs'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, unique=True, nullable=False)
+    status = Column(String(20), default='pending', index=True)  # pending / done / failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.datetime.utcnow)  # 再試行の予定時刻
+    locked_until = Column(DateTime)  # 処理中のワーカーが確保している期限
+    customer_id = Column(String)  # 作成したStripe Customer ID
+    last_error = Column(String)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+# ユーザーごとの請求サマリー（Webhookで更新する読み取り用モデル）
+class UserBillingSummary(Base):
+    __tablename__ = 'user_billing_summary'
+    
+    user_id = Column(Integer, primary_key=True)  # ユーザーIDを主キーに（1ユーザー1行）
+    subscription_id = Column(String)  # 現在のサブスクリプションID
+    price_id = Column(String)
+    plan_name = Column(String(100))
+    subscription_status = Column(String)
+    cancel_at_period_end = Column(Boolean, default=False)
+    current_period_end = Column(Integer)  # Unix timestamp
+    scheduled_schedule_id = Column(String)  # プラン変更予約のスケジュールID
+    scheduled_price_id = Column(String)
+    scheduled_change_date = Column(Integer)  # Unix timestamp
+    lifetime_spend = Column(Numeric(12, 2), default=0)  # 単発購入 + 支払い済み請求書の累計
+    currency = Column(String(3))
+    last_payment_id = Column(String)  # 直近に反映した支払い
+    last_purchase_session_id = Column(String)
+    last_purchase_product = Column(String(255))
+    last_purchase_amount = Column(Numeric(10, 2))
+    last_purchase_at = Column(String)  # ISO文字列で統一
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+# 売上ロールアップ（日次・月次の事前集計。ダッシュボードは生データを走査しない）
+class RevenueRollup(Base):
+    __tablename__ = 'revenue_rollups'
+    
+    grain = Column(String(5), primary_key=True)  # 'day' または 'month'
+    period = Column(String(10), primary_key=True)  # 'YYYY-MM-DD'（日次）または 'YYYY-MM'（月次）、UTC
+    currency = Column(String(3), primary_key=True)
+    source = Column(String(10), primary_key=True)  # 'ledger'（単発購入）または 'invoice'（サブスクリプション請求）
+    product = Column(String(255), primary_key=True, default='')  # 単発購入は商品名、請求書はprice_id
+    plan_name = Column(String(100), primary_key=True, default='')  # 請求書のみ（単発購入は空文字）
+    amount = Column(Numeric(14, 2), nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
@@ -0,0 +1,321 @@
+"""
+料金プランのカタログ
+価格ID・プランタイプからプランを辞書で引く（リクエストごとに環境変数やStripeを読まない）
+
+プランは設定（STANDARD_PRICE_ID / PREMIUM_PRICE_ID / PLAN_CATALOG）から初回利用時に一度だけ読み込む
+PLAN_CATALOG_STRIPE_SYNC=true の場合は、メタデータに plan_type を持つStripeのPrice/Productも取り込み、
+price.* / product.* のWebhookで更新する（他のプロセスにはRedisのバージョン番号で再読み込みを伝える）
+"""
+import os
+import json
+import time
+import logging
+import threading
+import stripe
+
+logger = logging.getLogger(__name__)
+
+# StripeのPrice/Productからプランを取り込むか
+PLAN_CATALOG_STRIPE_SYNC = os.getenv("PLAN_CATALOG_STRIPE_SYNC", "false").lower() == "true"
+
+# 他のプロセスでの更新を確認する間隔（秒。Stripe連携が有効な場合のみ）
+PLAN_CATALOG_CHECK_SECONDS = float(os.getenv("PLAN_CATALOG_CHECK_SECONDS", "30"))
+
+# 価格IDが見つからない場合の表示名
+UNKNOWN_PLAN_NAME = "不明なプラン"
+
+# 既定の2プラン（環境変数名, 表示名）
+DEFAULT_PLANS = {
+    "standard": ("STANDARD_PRICE_ID", "スタンダードプラン"),
+    "premium": ("PREMIUM_PRICE_ID", "プレミアムプラン"),
+}
+
+VERSION_KEY = "plan_catalog:version"
+
+
+class Plan:
+    """料金プラン（1つの価格ID）"""
+
+    __slots__ = ('plan_type', 'price_id', 'name', 'product_id', 'unit_amount', 'currency', 'active', 'configured')
+
+    def __init__(self, plan_type, price_id, name, product_id=None, unit_amount=None, currency=None,
+                 active=True, configured=False):
+        self.plan_type = plan_type
+        self.price_id = price_id
+        self.name = name
+        self.product_id = product_id
+        self.unit_amount = unit_amount
+        self.currency = currency
+        self.active = active
+        self.configured = configured  # 設定で定義したプラン（名前と価格IDはStripeより優先）
+
+    def to_dict(self):
+        return {
+            'plan_type': self.plan_type,
+            'price_id': self.price_id,
+            'name': self.name,
+            'unit_amount': self.unit_amount,
+            'currency': self.currency,
+            'active': self.active,
+        }
+
+
+def _config_plans():
+    """設定のプラン（PLAN_CATALOG は [{"plan_type", "price_id", "name"}] のJSON）"""
+    fallback_price_id = os.getenv("PRICE_ID")
+    plans = []
+    for plan_type, (env_name, name) in DEFAULT_PLANS.items():
+        price_id = os.getenv(env_name, fallback_price_id)
+        if price_id:
+            plans.append(Plan(plan_type, price_id, name, configured=True))
+
+    raw = os.getenv("PLAN_CATALOG")
+    if raw:
+        try:
+            for entry in json.loads(raw):
+                plans.append(Plan(entry["plan_type"], entry["price_id"], entry["name"], configured=True))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Invalid PLAN_CATALOG: {e}")
+    return plans
+
+
+def _object_id(value):
+    """展開済みのオブジェクトでもIDだけを取り出す"""
+    if isinstance(value, dict):
+        return value.get('id')
+    return value
+
+
+class PlanCatalog:
+    """価格ID・プランタイプごとのプラン（読み取りはロックなし、更新は辞書ごと差し替える）"""
+
+    def __init__(self, stripe_sync=PLAN_CATALOG_STRIPE_SYNC, check_interval=PLAN_CATALOG_CHECK_SECONDS):
+        self.stripe_sync = stripe_sync
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._by_price = {}
+        self._by_type = {}
+        self._products = {}  # product_id -> {'name', 'metadata', 'active'}
+        self._loaded = False
+        self._version = None
+        self._checked_at = 0
+        self._loaded_at = None
+        self._reloads = 0
+        self._events = 0
+
+    # --------------------------------------------
+    # 読み込み
+    # --------------------------------------------
+
+    def load(self):
+        """設定（とStripe）からプランを読み込み直す"""
+        with self._lock:
+            by_price, by_type, products = {}, {}, {}
+            for plan in _config_plans():
+                # 同じ価格IDが複数のプランタイプに割り当てられた場合は後の定義を名前に使う（PRICE_IDだけの設定ではプレミアム）
+                by_price[plan.price_id] = plan
+                by_type[plan.plan_type] = plan
+
+            if self.stripe_sync:
+                try:
+                    self._sync_from_stripe(by_price, by_type, products)
+                except stripe.error.StripeError as e:
+                    logger.error(f"Plan catalog sync from Stripe failed, using configured plans only: {e}")
+
+            self._by_price, self._by_type, self._products = by_price, by_type, products
+            self._version = self._remote_version()
+            self._loaded = True
+            self._checked_at = time.monotonic()
+            self._loaded_at = time.time()
+            self._reloads += 1
+            logger.info(f"Plan catalog loaded: {len(by_price)} prices, {len(by_type)} plan types")
+
+    def _sync_from_stripe(self, by_price, by_type, products):
+        for product in stripe.Product.list(active=True, limit=100).auto_paging_iter():
+            products[product['id']] = {
+                'name': product.get('name'),
+                'metadata': dict(product.get('metadata') or {}),
+                'active': product.get('active', True),
+            }
+        for price in stripe.Price.list(active=True, limit=100).auto_paging_iter():
+            self._apply_price(price, by_price, by_type, products)
+
+    def _apply_price(self, price, by_price, by_type, products):
+        """Priceをプランとして反映（plan_type を持たない価格は対象外）"""
+        price_id = price.get('id')
+        product_id = _object_id(price.get('product'))
+        product = products.get(product_id) or {}
+        metadata = price.get('metadata') or {}
+        existing = by_price.get(price_id)
+
+        plan_type = (metadata.get('plan_type') or (product.get('metadata') or {}).get('plan_type')
+                     or (existing.plan_type if existing else None))
+        if not plan_type:
+            return
+
+        active = bool(price.get('active', True)) and not price.get('deleted') and product.get('active', True)
+        if existing is not None and existing.configured:
+            name = existing.name
+        else:
+            name = metadata.get('plan_name') or (product.get('metadata') or {}).get('plan_name') \
+                or product.get('name') or (existing.name if existing else UNKNOWN_PLAN_NAME)
+
+        plan = Plan(plan_type, price_id, name, product_id=product_id, unit_amount=price.get('unit_amount'),
+                    currency=price.get('currency'), active=active, configured=existing.configured if existing else False)
+        by_price[price_id] = plan
+
+        # プランタイプの現在の価格は、設定で定義した価格を優先し、なければ有効な最新の価格
+        # 設定で定義した価格が無効になった場合は無効のまま残し、購入できないようにする（get_by_type が None を返す）
+        current = by_type.get(plan_type)
+        if current is not None and current.price_id == price_id:
+            if active or current.configured:
+                by_type[plan_type] = plan
+            else:
+                del by_type[plan_type]
+        elif active and (current is None or not current.configured):
+            by_type[plan_type] = plan
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+            return
+        if not self.stripe_sync or time.monotonic() - self._checked_at < self.check_interval:
+            return
+        self._checked_at = time.monotonic()
+        version = self._remote_version()
+        if version != self._version:
+            logger.info(f"Plan catalog changed in another process ({self._version} -> {version}), reloading")
+            self.load()
+
+    # --------------------------------------------
+    # 他プロセスとの同期（Redisがなければプロセス内のみ）
+    # --------------------------------------------
+
+    def _remote_version(self):
+        from cache import redis_client
+        if redis_client is None:
+            return None
+        try:
+            value = redis_client.get(VERSION_KEY)
+            return int(value) if value is not None else None
+        except Exception as e:
+            logger.warning(f"Plan catalog version check failed: {e}")
+            return self._version
+
+    def _bump_version(self):
+        from cache import redis_client
+        if redis_client is None:
+            return None
+        try:
+            return redis_client.incr(VERSION_KEY)
+        except Exception as e:
+            logger.warning(f"Plan catalog version update failed: {e}")
+            return self._version
+
+    # --------------------------------------------
+    # 参照
+    # --------------------------------------------
+
+    def get(self, price_id):
+        """価格IDのプラン（なければ None）"""
+        self._ensure_loaded()
+        return self._by_price.get(price_id)
+
+    def get_by_type(self, plan_type):
+        """プランタイプの現在のプラン（なければ、またはStripeで無効になっていれば None）"""
+        self._ensure_loaded()
+        plan = self._by_type.get(plan_type)
+        return plan if plan is not None and plan.active else None
+
+    def plan_name(self, price_id):
+        plan = self.get(price_id)
+        return plan.name if plan else UNKNOWN_PLAN_NAME
+
+    def plan_types(self):
+        """購入できるプランタイプ"""
+        self._ensure_loaded()
+        return tuple(plan_type for plan_type, plan in self._by_type.items() if plan.active)
+
+    def plans(self):
+        """プランタイプごとの現在のプラン（購入できるもの）"""
+        self._ensure_loaded()
+        return [plan for plan in self._by_type.values() if plan.active]
+
+    # --------------------------------------------
+    # Webhook
+    # --------------------------------------------
+
+    def handle_event(self, event_type, webhook_object):
+        """price.* / product.* を反映（Stripe連携が無効な場合は設定が正なので何もしない）"""
+        if not self.stripe_sync:
+            return False
+        self._ensure_loaded()
+
+        with self._lock:
+            by_price, by_type, products = dict(self._by_price), dict(self._by_type), dict(self._products)
+
+            if event_type.startswith("product."):
+                product_id = webhook_object.get('id')
+                previous_name = (products.get(product_id) or {}).get('name')
+                products[product_id] = {
+                    'name': webhook_object.get('name'),
+                    'metadata': dict(webhook_object.get('metadata') or {}),
+                    'active': bool(webhook_object.get('active', True)) and event_type != "product.deleted",
+                }
+                for plan in [p for p in by_price.values() if p.product_id == product_id]:
+                    # 商品名以外（価格のメタデータ）で付けた名前はそのまま残す
+                    metadata = {'plan_type': plan.plan_type}
+                    if plan.name != previous_name:
+                        metadata['plan_name'] = plan.name
+                    self._apply_price({'id': plan.price_id, 'product': product_id, 'active': plan.active,
+                                       'unit_amount': plan.unit_amount, 'currency': plan.currency,
+                                       'metadata': metadata}, by_price, by_type, products)
+            else:
+                price = dict(webhook_object)
+                if event_type == "price.deleted":
+                    price['active'] = False
+                product_id = _object_id(price.get('product'))
+                if product_id and product_id not in products:
+                    try:
+                        product = stripe.Product.retrieve(product_id)
+                        products[product_id] = {'name': product.get('name'),
+                                                'metadata': dict(product.get('metadata') or {}),
+                                                'active': product.get('active', True)}
+                    except stripe.error.StripeError as e:
+                        logger.warning(f"Could not fetch product {product_id} for price {price.get('id')}: {e}")
+                self._apply_price(price, by_price, by_type, products)
+
+            self._by_price, self._by_type, self._products = by_price, by_type, products
+            self._events += 1
+            version = self._bump_version()
+            if version is not None:
+                self._version = version
+
+        logger.info(f"Plan catalog updated from {event_type}: {webhook_object.get('id')}")
+        return True
+
+    def stats(self):
+        return {
+            'loaded': self._loaded,
+            'stripe_sync': self.stripe_sync,
+            'prices': len(self._by_price),
+            'plan_types': list(self._by_type),
+            'reloads': self._reloads,
+            'events': self._events,
+            'loaded_at': self._loaded_at,
+        }
+
+
+plan_catalog = PlanCatalog()
+
+
+def get_plan(price_id):
+    return plan_catalog.get(price_id)
+
+
+def get_plan_by_type(plan_type):
+    return plan_catalog.get_by_type(plan_type)
+
+
+def get_plan_catalog_stats():
+    return plan_catalog.stats()
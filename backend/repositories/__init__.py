@@ -17,7 +17,9 @@ from .user_repository import (
     get_user_purchase_history,
     authenticate_user,
     upsert_stripe_customer,
+    clear_stripe_customer,
 )
+from .password_hasher import PasswordHasherBusy
 
 # セッション
 from .session_repository import (
@@ -42,6 +44,35 @@ from .subscription_repository import (
     get_plan_name_from_price_id,
 )
 
+# サブスクリプションスケジュール
+from .subscription_schedule_repository import (
+    upsert_subscription_schedule,
+    get_pending_schedules,
+)
+
+# 請求サマリー
+from .billing_summary_repository import (
+    get_billing_summary,
+    rebuild_billing_summary,
+    add_payment_to_summary,
+    refresh_subscription_summary,
+    refresh_subscription_summary_for,
+    set_scheduled_change,
+    clear_scheduled_change,
+)
+
+# 売上ロールアップ
+from .revenue_rollup_repository import (
+    rebuild_revenue_rollups,
+    get_revenue_rollups,
+)
+
+# パーティション管理
+from .partitioning import (
+    ensure_future_partitions,
+    archive_old_partitions,
+)
+
 __all__ = [
     # データベース
     'init_db',
@@ -58,6 +89,8 @@ __all__ = [
     'get_user_purchase_history',
     'authenticate_user',
     'upsert_stripe_customer',
+    'clear_stripe_customer',
+    'PasswordHasherBusy',
     
     # セッション
     'create_session',
@@ -75,4 +108,25 @@ __all__ = [
     'get_subscriptions',
     'get_user_subscriptions',
     'get_plan_name_from_price_id',
+    
+    # サブスクリプションスケジュール
+    'upsert_subscription_schedule',
+    'get_pending_schedules',
+    
+    # 請求サマリー
+    'get_billing_summary',
+    'rebuild_billing_summary',
+    'add_payment_to_summary',
+    'refresh_subscription_summary',
+    'refresh_subscription_summary_for',
+    'set_scheduled_change',
+    'clear_scheduled_change',
+    
+    # 売上ロールアップ
+    'rebuild_revenue_rollups',
+    'get_revenue_rollups',
+    
+    # パーティション管理
+    'ensure_future_partitions',
+    'archive_old_partitions',
 ]
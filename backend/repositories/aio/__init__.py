@@ -0,0 +1,95 @@
+"""
+非同期リポジトリパッケージ
+repositoriesパッケージと同じ関数名をコルーチンとしてエクスポート
+
+Flaskの非同期ビューから利用する:
+
+    from repositories import aio
+
+    @bp.route("/example")
+    async def example():
+        user, subscriptions = await asyncio.gather(
+            aio.get_user_by_id(user_id),
+            aio.get_user_subscriptions(user_id),
+        )
+
+get_plan_name_from_price_id と now はDBアクセスを伴わないため同期関数のまま
+"""
+
+# データベース
+from .database import init_db, get_session, now
+
+# ユーザー
+from .user_repository import (
+    hash_password,
+    verify_password,
+    create_user,
+    get_user_by_email,
+    get_user_by_id,
+    get_all_users,
+    get_user_purchase_history,
+    authenticate_user,
+    upsert_stripe_customer,
+    clear_stripe_customer,
+)
+from ..password_hasher import PasswordHasherBusy
+
+# セッション
+from .session_repository import (
+    create_session,
+    validate_session,
+    logout_user,
+    get_user_from_session,
+)
+
+# 支払い・請求書
+from .payment_repository import (
+    record_ledger,
+    get_ledger,
+    record_invoice,
+)
+
+# サブスクリプション
+from .subscription_repository import (
+    upsert_subscription,
+    get_subscriptions,
+    get_user_subscriptions,
+    get_plan_name_from_price_id,
+)
+
+__all__ = [
+    # データベース
+    'init_db',
+    'get_session',
+    'now',
+    
+    # ユーザー
+    'hash_password',
+    'verify_password',
+    'create_user',
+    'get_user_by_email',
+    'get_user_by_id',
+    'get_all_users',
+    'get_user_purchase_history',
+    'authenticate_user',
+    'upsert_stripe_customer',
+    'clear_stripe_customer',
+    'PasswordHasherBusy',
+    
+    # セッション
+    'create_session',
+    'validate_session',
+    'logout_user',
+    'get_user_from_session',
+    
+    # 支払い・請求書
+    'record_ledger',
+    'get_ledger',
+    'record_invoice',
+    
+    # サブスクリプション
+    'upsert_subscription',
+    'get_subscriptions',
+    'get_user_subscriptions',
+    'get_plan_name_from_price_id',
+]
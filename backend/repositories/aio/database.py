@@ -0,0 +1,74 @@
+"""
+非同期データベース初期化・共通ユーティリティ（SQLAlchemy asyncio）
+"""
+import os
+import asyncio
+import weakref
+import logging
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from ..database import now
+
+logger = logging.getLogger(__name__)
+
+database_url = None
+
+# イベントループごとのエンジン（asyncpgの接続はループをまたいで再利用できない）
+_engines = weakref.WeakKeyDictionary()
+
+
+def to_async_url(url):
+    """同期用のDATABASE_URLを非同期ドライバ用のURLに変換"""
+    if url.startswith("postgresql+asyncpg://") or url.startswith("sqlite+aiosqlite://"):
+        return url
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+
+def init_db():
+    """非同期エンジンの接続先を設定（テーブル作成は同期版のinit_dbに任せる）"""
+    global database_url
+    database_url = to_async_url(os.getenv("ASYNC_DATABASE_URL") or os.getenv("DATABASE_URL"))
+    _engines.clear()
+    logger.info("非同期データベース初期化完了")
+
+
+def _engine_options():
+    """エンジンのプール設定"""
+    pool_size = os.getenv("ASYNC_DB_POOL_SIZE")
+    if pool_size:
+        # ASGIサーバーなどイベントループが長生きする環境向け
+        return {"pool_size": int(pool_size), "pool_pre_ping": True}
+    # Flaskの非同期ビューはリクエストごとにイベントループを作るため、プールせず都度接続する
+    return {"poolclass": NullPool}
+
+
+def get_engine():
+    """現在のイベントループ用のエンジンを取得"""
+    if database_url is None:
+        init_db()
+
+    loop = asyncio.get_running_loop()
+    engine = _engines.get(loop)
+    if engine is None:
+        engine = create_async_engine(database_url, **_engine_options())
+        _engines[loop] = engine
+    return engine
+
+
+def get_session():
+    """非同期セッションを取得"""
+    return async_sessionmaker(get_engine(), class_=AsyncSession, expire_on_commit=False)()
+
+
+async def dispose_engine():
+    """現在のイベントループのエンジンを破棄"""
+    engine = _engines.pop(asyncio.get_running_loop(), None)
+    if engine is not None:
+        await engine.dispose()
+
@@ -0,0 +1,163 @@
+"""
+支払い・請求書関連の非同期リポジトリ
+"""
+import asyncio
+import logging
+import stripe
+from sqlalchemy import select
+from models import Ledger, Invoice
+from .database import get_session
+from ..payment_repository import stripe_created, ledger_created_at, insert_if_absent_statement, add_invoice_to_summary
+from ..billing_summary_repository import add_payment_to_summary
+from ..revenue_rollup_repository import add_ledger_to_rollups, add_invoice_to_rollups
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# 内部ユーティリティ
+# ============================================
+
+def _ledger_lookup(session_id, created_at=None):
+    """台帳の既存レコード検索（created_atがわかる場合はパーティションを絞り込む）"""
+    query = select(Ledger).filter_by(session_id=session_id)
+    if created_at:
+        query = query.filter_by(created_at=created_at)
+    return query
+
+
+def _invoice_lookup(invoice_id, created=None):
+    """請求書の既存レコード検索（createdがわかる場合はパーティションを絞り込む）"""
+    query = select(Invoice).filter_by(id=invoice_id)
+    if created:
+        query = query.filter_by(created=created)
+    return query
+
+
+async def _first(session, query):
+    result = await session.execute(query.limit(1))
+    return result.scalars().first()
+
+
+async def _created(webhook_object, retrieve):
+    """Stripeオブジェクトのcreated（欠けている場合のみスレッドでStripeから取得）"""
+    if webhook_object.get("created"):
+        return webhook_object["created"]
+    return await asyncio.to_thread(stripe_created, webhook_object, retrieve)
+
+
+async def _insert_if_absent(session, model, values):
+    """レコードを挿入し、挿入した場合は True（重複の場合は False。コミットは呼び出し側）"""
+    stmt = insert_if_absent_statement(session.get_bind().dialect.name, model, values)
+    if stmt is None:
+        session.add(model(**values))
+        await session.flush()
+        return True
+    result = await session.execute(stmt)
+    return result.rowcount > 0
+
+
+# ============================================
+# 支払い台帳
+# ============================================
+
+async def record_ledger(webhook_object, user_id=None, product_name=None):
+    """支払い台帳を記録"""
+    session_id = webhook_object.get("id")
+    created_at = ledger_created_at(await _created(webhook_object, stripe.checkout.Session.retrieve))
+    values = {
+        'session_id': session_id,
+        'user_id': user_id,
+        'amount': webhook_object.get("amount_total"),
+        'currency': webhook_object.get("currency"),
+        'status': webhook_object.get("payment_status"),
+        'product_name': product_name,
+        'created_at': created_at,
+    }
+
+    session = get_session()
+    try:
+        # 既存のレコードをチェック（created_atも条件にして該当月のパーティションだけを探索させる）
+        existing_entry = await _first(session, _ledger_lookup(session_id, created_at))
+        if existing_entry:
+            logger.info(f"Ledger entry already exists: {session_id}")
+            return existing_entry
+
+        # 同時・再送の配信はON CONFLICTで1件にする（挿入した配信だけがロールアップに加算する）
+        ledger_entry = Ledger(**values)
+        if not await _insert_if_absent(session, Ledger, values):
+            logger.info(f"Ledger entry already exists: {session_id}")
+            await session.rollback()
+            return await _first(session, _ledger_lookup(session_id, created_at))
+        # 売上ロールアップ・請求サマリーも同じトランザクションで加算
+        await session.run_sync(add_ledger_to_rollups, ledger_entry)
+        if ledger_entry.status == 'paid':
+            await session.run_sync(add_payment_to_summary, user_id, session_id, ledger_entry.amount,
+                                   ledger_entry.currency, product_name, created_at)
+        await session.commit()
+        logger.info(f"Ledger recorded: {session_id}")
+        return ledger_entry
+    except Exception as e:
+        logger.error(f"Error recording ledger: {e}")
+        await session.rollback()
+        raise e
+    finally:
+        await session.close()
+
+
+async def get_ledger():
+    """支払い台帳を取得"""
+    session = get_session()
+    try:
+        result = await session.execute(select(Ledger))
+        return result.scalars().all()
+    except Exception as e:
+        logger.error(f"Error getting ledger: {e}")
+        raise e
+    finally:
+        await session.close()
+
+
+# ============================================
+# 請求書
+# ============================================
+
+async def record_invoice(webhook_object):
+    """請求書を記録"""
+    invoice_id = webhook_object.get("id")
+    created = await _created(webhook_object, stripe.Invoice.retrieve)  # Unix timestamp
+    values = {
+        'id': invoice_id,
+        'subscription_id': webhook_object.get("subscription"),
+        'status': webhook_object.get("status"),
+        'amount_due': webhook_object.get("amount_due"),
+        'currency': webhook_object.get("currency"),
+        'created': created,
+    }
+
+    session = get_session()
+    try:
+        # 既存の請求書をチェック
+        existing_invoice = await _first(session, _invoice_lookup(invoice_id, created))
+        if existing_invoice:
+            logger.info(f"Invoice already exists: {invoice_id}")
+            return existing_invoice
+
+        # 同時・再送の配信はON CONFLICTで1件にする（挿入した配信だけがロールアップに加算する）
+        invoice_entry = Invoice(**values)
+        if not await _insert_if_absent(session, Invoice, values):
+            logger.info(f"Invoice already exists: {invoice_id}")
+            await session.rollback()
+            return await _first(session, _invoice_lookup(invoice_id, created))
+        # 売上ロールアップ・請求サマリー（サブスクリプションの所有ユーザー）も同じトランザクションで加算
+        await session.run_sync(add_invoice_to_rollups, invoice_entry)
+        await session.run_sync(add_invoice_to_summary, invoice_entry)
+        await session.commit()
+        logger.info(f"Invoice recorded: {invoice_id}")
+        return invoice_entry
+    except Exception as e:
+        logger.error(f"Error recording invoice: {e}")
+        await session.rollback()
+        raise e
+    finally:
+        await session.close()
@@ -0,0 +1,151 @@
+"""
+セッション管理の非同期リポジトリ
+"""
+import datetime
+import logging
+import secrets
+from sqlalchemy import select, update
+from models import UserSession
+from .database import get_session
+from .user_repository import get_user_by_id
+from ..session_activity import activity_buffer
+from ..session_sweeper import session_sweeper, session_expiry_cutoff
+from ..session_cache import get_cached_session, cache_session, invalidate_sessions
+from ..session_tokens import (
+    signed_tokens_enabled,
+    is_signed_token,
+    issue_signed_token,
+    validate_signed_token,
+    revoke_signed_tokens,
+    SESSION_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def create_session(user_id):
+    """ユーザーセッションを作成"""
+    session_token = secrets.token_urlsafe(32)
+
+    session = get_session()
+    try:
+        # 既存のセッションを無効化（署名付きトークンは後で失効セットにも登録する）
+        result = await session.execute(
+            select(UserSession.session_token)
+            .where(UserSession.user_id == user_id, UserSession.is_active == True)
+        )
+        previous_tokens = result.scalars().all()
+        await session.execute(
+            update(UserSession)
+            .where(UserSession.user_id == user_id, UserSession.is_active == True)
+            .values(is_active=False)
+        )
+
+        # 新しいセッションを作成
+        new_session = UserSession(
+            user_id=user_id,
+            session_token=session_token,
+            created_at=datetime.datetime.utcnow(),
+            last_activity=datetime.datetime.utcnow(),
+            is_active=True
+        )
+
+        session.add(new_session)
+
+        # 署名付きトークンはセッションIDを埋め込むため、採番後に発行し直す
+        if signed_tokens_enabled():
+            await session.flush()
+            session_token = issue_signed_token(user_id, new_session.id)
+            new_session.session_token = session_token
+
+        await session.commit()
+        invalidate_sessions(previous_tokens)
+        revoke_signed_tokens(previous_tokens)
+        session_sweeper.ensure_started()
+
+        return session_token
+
+    except Exception as e:
+        logger.error(f"Error creating session: {e}")
+        await session.rollback()
+        raise e
+    finally:
+        await session.close()
+
+
+async def validate_session(session_token):
+    """セッションを検証"""
+    # 署名付きトークンはDBを参照せずに検証する
+    if is_signed_token(session_token):
+        user_id = validate_signed_token(session_token)
+        if user_id:
+            activity_buffer.record(session_token, datetime.datetime.utcnow())
+        return user_id
+
+    # 直近に検証済みのトークンはDBを照会しない
+    user_id = get_cached_session(session_token)
+    if user_id:
+        activity_buffer.record(session_token, datetime.datetime.utcnow())
+        return user_id
+
+    session = get_session()
+    try:
+        # セッションを検索（有効期限切れの行は条件で除外し、削除はスイーパーに任せる）
+        result = await session.execute(
+            select(UserSession).where(
+                UserSession.session_token == session_token,
+                UserSession.is_active == True,
+                UserSession.created_at > session_expiry_cutoff()
+            )
+        )
+        user_session = result.scalars().first()
+
+        if not user_session:
+            return None
+
+        # 最終アクティビティはバッファに記録し、まとめて書き込む（検証自体は読み取りのみ）
+        activity_buffer.record(session_token, datetime.datetime.utcnow(), user_session.last_activity)
+
+        expires_at = user_session.created_at.replace(tzinfo=datetime.timezone.utc).timestamp() + SESSION_TTL_SECONDS
+        cache_session(session_token, user_session.user_id, expires_at)
+
+        return user_session.user_id
+
+    except Exception as e:
+        logger.error(f"Error validating session: {e}")
+        return None
+    finally:
+        await session.close()
+
+
+async def logout_user(session_token):
+    """ユーザーをログアウト"""
+    session = get_session()
+    try:
+        # セッションを無効化
+        result = await session.execute(
+            update(UserSession)
+            .where(UserSession.session_token == session_token, UserSession.is_active == True)
+            .values(is_active=False)
+        )
+        await session.commit()
+        invalidate_sessions([session_token])
+        activity_buffer.discard(session_token)
+        revoke_signed_tokens([session_token])
+        return result.rowcount > 0
+
+    except Exception as e:
+        logger.error(f"Error logging out user: {e}")
+        await session.rollback()
+        return False
+    finally:
+        await session.close()
+
+
+async def get_user_from_session(session_token):
+    """セッションからユーザー情報を取得"""
+    user_id = await validate_session(session_token)
+    if not user_id:
+        return None
+
+    return await get_user_by_id(user_id)
@@ -0,0 +1,110 @@
+"""
+サブスクリプション関連の非同期リポジトリ
+"""
+import datetime
+import logging
+from sqlalchemy import select
+from models import Subscription
+from ..subscription_repository import get_plan_name_from_price_id
+from .database import get_session
+
+logger = logging.getLogger(__name__)
+
+
+async def upsert_subscription(webhook_object, user_id=None):
+    """サブスクリプションを更新"""
+    subscription_id = webhook_object.get("id")
+
+    items = (webhook_object.get("items") or {}).get("data", [])
+    first_item = items[0] if items else {}
+
+    # Noneを回避するフォールバック
+    current_period_end = (
+        webhook_object.get("current_period_end")
+        or first_item.get("current_period_end")
+        or webhook_object.get("trial_end")
+        or webhook_object.get("billing_cycle_anchor")
+    )
+
+    # Stripeのcreated（epoch）をISO文字列に変換
+    created_epoch = webhook_object.get("created")
+    created_at = (
+        datetime.datetime.fromtimestamp(created_epoch, tz=datetime.timezone.utc).isoformat()
+        if created_epoch
+        else datetime.datetime.now(datetime.timezone.utc).isoformat()
+    )
+
+    values = {
+        "price_id": (first_item.get("price") or {}).get("id"),
+        "status": webhook_object.get("status"),
+        "current_period_end": current_period_end,
+        "cancel_at_period_end": webhook_object.get("cancel_at_period_end", False),
+        "trial_end": webhook_object.get("trial_end"),
+        "latest_invoice": webhook_object.get("latest_invoice"),
+    }
+
+    session = get_session()
+    try:
+        subscription = await session.get(Subscription, subscription_id)
+
+        if subscription:
+            # user_idがNoneでない場合のみ更新（既存のuser_idを保持）
+            if user_id is not None:
+                subscription.user_id = user_id
+            for key, value in values.items():
+                setattr(subscription, key, value)
+            logger.info(f"Subscription updated: {subscription.id}")
+        else:
+            subscription = Subscription(
+                id=subscription_id,
+                user_id=user_id,
+                customer_id=webhook_object.get("customer"),
+                created_at=created_at,
+                **values,
+            )
+            session.add(subscription)
+            logger.info(f"Subscription created: {subscription.id}")
+
+        await session.commit()
+        return subscription
+    except Exception as e:
+        logger.error(f"Error recording subscription: {e}")
+        await session.rollback()
+
+        # 重複キーエラーの場合は既存レコードを返す
+        if "duplicate key value violates unique constraint" in str(e):
+            existing_subscription = await session.get(Subscription, subscription_id)
+            if existing_subscription:
+                return existing_subscription
+
+        raise e
+    finally:
+        await session.close()
+
+
+async def get_subscriptions():
+    """サブスクリプションを取得"""
+    session = get_session()
+    try:
+        result = await session.execute(select(Subscription))
+        return result.scalars().all()
+    except Exception as e:
+        logger.error(f"Error getting subscriptions: {e}")
+        raise e
+    finally:
+        await session.close()
+
+
+async def get_user_subscriptions(user_id):
+    """ユーザーのサブスクリプション履歴を取得"""
+    session = get_session()
+    try:
+        result = await session.execute(
+            select(Subscription).filter_by(user_id=user_id).order_by(Subscription.created_at.desc())
+        )
+        return result.scalars().all()
+    except Exception as e:
+        logger.error(f"Error getting user subscriptions: {e}")
+        raise e
+    finally:
+        await session.close()
@@ -0,0 +1,233 @@
+"""
+ユーザー関連の非同期リポジトリ
+"""
+import asyncio
+import logging
+import stripe
+from sqlalchemy import select, update
+from models import User, Ledger
+from .. import user_repository as sync_user_repository
+from .database import get_session
+from ..password_hasher import needs_rehash, PasswordHasherBusy
+from ..customer_cache import is_customer_verified, mark_customer_verified, invalidate_customer
+from ..customer_provisioning import enqueue_customer_provisioning, provision_pending_customer, customer_provisioner
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# パスワード関連
+# ============================================
+
+async def hash_password(password):
+    """パスワードをハッシュ化（プロセスプールでの計算完了をスレッドで待つ）"""
+    return await asyncio.to_thread(sync_user_repository.hash_password, password)
+
+
+async def verify_password(password, password_hash):
+    """パスワードを検証（プロセスプールでの計算完了をスレッドで待つ）"""
+    return await asyncio.to_thread(sync_user_repository.verify_password, password, password_hash)
+
+
+# ============================================
+# ユーザー管理
+# ============================================
+
+async def create_user(email, password_hash, name, phone=None, birthdate=None, terms_accepted=False, privacy_accepted=False):
+    """ユーザーを登録"""
+    session = get_session()
+    try:
+        # メールアドレスの重複チェック
+        result = await session.execute(select(User).filter_by(email=email))
+        if result.scalars().first():
+            raise ValueError("このメールアドレスは既に登録されています")
+
+        user = User(
+            email=email,
+            password_hash=password_hash,
+            name=name,
+            phone=phone,
+            birthdate=birthdate,
+            terms_accepted=terms_accepted,
+            privacy_accepted=privacy_accepted
+        )
+        session.add(user)
+        await session.flush()
+        # Stripe Customerはユーザーと同じトランザクションで積んだジョブからバックグラウンドで作成する
+        enqueue_customer_provisioning(session, user)
+        await session.commit()
+        logger.info(f"User created: {user.email}")
+        customer_provisioner.notify()
+        return user
+    except Exception as e:
+        logger.error(f"Error creating user: {e}")
+        await session.rollback()
+        raise e
+    finally:
+        await session.close()
+
+
+async def get_user_by_email(email):
+    """メールアドレスでユーザーを取得"""
+    session = get_session()
+    try:
+        result = await session.execute(select(User).filter_by(email=email))
+        return result.scalars().first()
+    except Exception as e:
+        logger.error(f"Error getting user by email: {e}")
+        raise e
+    finally:
+        await session.close()
+
+
+async def get_user_by_id(user_id):
+    """IDでユーザーを取得"""
+    session = get_session()
+    try:
+        return await session.get(User, user_id)
+    except Exception as e:
+        logger.error(f"Error getting user by id: {e}")
+        raise e
+    finally:
+        await session.close()
+
+
+async def get_all_users():
+    """全ユーザーを取得"""
+    session = get_session()
+    try:
+        result = await session.execute(select(User))
+        return result.scalars().all()
+    except Exception as e:
+        logger.error(f"Error getting all users: {e}")
+        raise e
+    finally:
+        await session.close()
+
+
+async def get_user_purchase_history(user_id):
+    """ユーザーの購入履歴を取得"""
+    session = get_session()
+    try:
+        result = await session.execute(
+            select(Ledger).filter_by(user_id=user_id).order_by(Ledger.created_at.desc())
+        )
+        return result.scalars().all()
+    except Exception as e:
+        logger.error(f"Error getting user purchase history: {e}")
+        raise e
+    finally:
+        await session.close()
+
+
+async def authenticate_user(email, password):
+    """ユーザーのログインを検証"""
+    user = await get_user_by_email(email)
+    if not user:
+        return None
+
+    if not await verify_password(password, user.password_hash):
+        return None
+
+    # 旧形式・反復回数の少ないハッシュはログイン成功時に現在の設定で作り直す
+    if needs_rehash(user.password_hash):
+        try:
+            user.password_hash = await hash_password(password)
+        except PasswordHasherBusy:
+            # 混雑時は再ハッシュを見送り、次回のログインで行う
+            logger.info(f"Password hash upgrade deferred for user {user.id}")
+            return user
+
+        session = get_session()
+        try:
+            await session.execute(
+                update(User).where(User.id == user.id).values(password_hash=user.password_hash)
+            )
+            await session.commit()
+            logger.info(f"Password hash upgraded for user {user.id}")
+        except Exception as e:
+            logger.error(f"Error upgrading password hash for user {user.id}: {e}")
+            await session.rollback()
+        finally:
+            await session.close()
+
+    return user
+
+
+# ============================================
+# Stripe Customer管理
+# ============================================
+
+async def upsert_stripe_customer(user):
+    """ユーザーのStripe Customerを作成または取得（Stripe呼び出しはスレッドで実行）"""
+    # 既にStripe Customer IDが存在する場合は返す
+    if user.stripe_customer_id:
+        # 期限内に確認済みであればStripeに問い合わせない（削除はcustomer.deletedで反映される）
+        if is_customer_verified(user.stripe_customer_id):
+            return user.stripe_customer_id
+        try:
+            # Stripeで有効なCustomerか確認
+            customer = await asyncio.to_thread(stripe.Customer.retrieve, user.stripe_customer_id)
+            if not customer.get('deleted'):
+                mark_customer_verified(user.stripe_customer_id)
+                return user.stripe_customer_id
+        except stripe.error.StripeError:
+            # Customer IDが無効な場合は新規作成
+            pass
+        invalidate_customer(user.stripe_customer_id)
+    else:
+        # 登録時のジョブが未完了であれば、ワーカーと同じ冪等キーで作成する（二重に作成しない）
+        customer_id = await asyncio.to_thread(provision_pending_customer, user)
+        if customer_id:
+            return customer_id
+
+    # 新しいStripe Customerを作成
+    try:
+        customer = await asyncio.to_thread(
+            stripe.Customer.create,
+            email=user.email,
+            name=user.name,
+            metadata={
+                'user_id': str(user.id)
+            }
+        )
+    except stripe.error.StripeError as e:
+        logger.error(f"Error creating Stripe Customer: {e}")
+        raise e
+
+    # DBにCustomer IDを保存
+    session = get_session()
+    try:
+        db_user = await session.get(User, user.id)
+        if db_user:
+            db_user.stripe_customer_id = customer.id
+            await session.commit()
+            logger.info(f"Stripe Customer created and saved: {customer.id} for user {user.id}")
+    except Exception as e:
+        logger.error(f"Error saving stripe_customer_id: {e}")
+        await session.rollback()
+    finally:
+        await session.close()
+
+    mark_customer_verified(customer.id)
+    return customer.id
+
+
+async def clear_stripe_customer(customer_id):
+    """削除されたStripe Customerをユーザーから外す（次回の購入時に新しいCustomerを作成する）"""
+    invalidate_customer(customer_id)
+    session = get_session()
+    try:
+        result = await session.execute(
+            update(User).where(User.stripe_customer_id == customer_id).values(stripe_customer_id=None)
+        )
+        await session.commit()
+        if result.rowcount:
+            logger.info(f"Cleared deleted Stripe Customer {customer_id} from {result.rowcount} user(s)")
+        return result.rowcount
+    except Exception as e:
+        logger.error(f"Error clearing stripe_customer_id {customer_id}: {e}")
+        await session.rollback()
+        raise e
+    finally:
+        await session.close()
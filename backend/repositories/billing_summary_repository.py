@@ -0,0 +1,287 @@
+"""
+ユーザー請求サマリー（読み取りモデル）のリポジトリ
+マイページはこのテーブルを主キーで1回読むだけで描画できる
+"""
+import logging
+from decimal import Decimal
+from sqlalchemy import func, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from models import UserBillingSummary, Ledger, Invoice, Subscription
+from .database import get_session
+from .subscription_repository import get_plan_name_from_price_id
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# 内部ユーティリティ
+# ============================================
+
+def _select_current_subscription(subscriptions):
+    """表示対象のサブスクリプションを選択（解約予定でないもの → 期間終了が遅いものを優先）"""
+    active_subscriptions = [sub for sub in subscriptions if sub.status == 'active']
+    if not active_subscriptions:
+        return None
+
+    return max(
+        active_subscriptions,
+        key=lambda sub: (not sub.cancel_at_period_end, sub.current_period_end or 0)
+    )
+
+
+def _apply_subscription(summary, subscription):
+    """サマリーのプラン情報をサブスクリプションに合わせる"""
+    # 対象のサブスクリプションが変わった場合、プラン変更予約は引き継がない
+    if subscription is None or subscription.id != summary.subscription_id:
+        summary.scheduled_schedule_id = None
+        summary.scheduled_price_id = None
+        summary.scheduled_change_date = None
+
+    if subscription is None:
+        summary.subscription_id = None
+        summary.price_id = None
+        summary.plan_name = None
+        summary.subscription_status = None
+        summary.cancel_at_period_end = False
+        summary.current_period_end = None
+        return
+
+    summary.subscription_id = subscription.id
+    summary.price_id = subscription.price_id
+    summary.plan_name = get_plan_name_from_price_id(subscription.price_id)
+    summary.subscription_status = subscription.status
+    summary.cancel_at_period_end = subscription.cancel_at_period_end or False
+    summary.current_period_end = subscription.current_period_end
+
+
+def _first_payment_currency(session, user_id):
+    """ユーザーの最初の支払いの通貨（単発購入を優先、支払いがなければNone）"""
+    currency = session.query(Ledger.currency).filter(
+        Ledger.user_id == user_id,
+        Ledger.status == 'paid',
+        Ledger.currency.isnot(None),
+    ).order_by(Ledger.created_at).limit(1).scalar()
+    if currency:
+        return currency
+
+    return session.query(Invoice.currency).join(
+        Subscription, Subscription.id == Invoice.subscription_id
+    ).filter(
+        Subscription.user_id == user_id,
+        Invoice.status == 'paid',
+        Invoice.currency.isnot(None),
+    ).order_by(Invoice.created).limit(1).scalar()
+
+
+def _create_if_absent(session, user_id):
+    """サマリー行を作成し、作成した場合は True（既存の場合は False。コミットは呼び出し側）
+    同時の初回支払いは一方だけが作成し、もう一方は作成済みの行に加算する
+    """
+    dialect_name = session.get_bind().dialect.name
+    if dialect_name == 'postgresql':
+        stmt = postgresql.insert(UserBillingSummary).values(user_id=user_id).on_conflict_do_nothing()
+    elif dialect_name == 'sqlite':
+        stmt = sqlite.insert(UserBillingSummary).values(user_id=user_id).on_conflict_do_nothing()
+    else:
+        # UPSERT非対応のDBでは存在確認→挿入で代替
+        if session.get(UserBillingSummary, user_id) is not None:
+            return False
+        session.add(UserBillingSummary(user_id=user_id))
+        session.flush()
+        return True
+    return session.execute(stmt).rowcount > 0
+
+
+def _rebuild(session, user_id):
+    """台帳・請求書・サブスクリプションからサマリーを再計算（コミットは呼び出し側）"""
+    # 再計算中の加算（add_payment_to_summary）はロックで待たせ、再計算の後に加算させる
+    summary = session.get(UserBillingSummary, user_id, with_for_update=True)
+    if summary is None:
+        summary = UserBillingSummary(user_id=user_id)
+        session.add(summary)
+
+    subscriptions = session.query(Subscription).filter_by(user_id=user_id).all()
+    _apply_subscription(summary, _select_current_subscription(subscriptions))
+
+    # 累計は1つの通貨だけで持つ（設定済みの通貨、未設定なら最初の支払いの通貨）
+    currency = summary.currency or _first_payment_currency(session, user_id)
+    summary.currency = currency
+
+    ledger_query = session.query(func.coalesce(func.sum(Ledger.amount), 0)).filter(
+        Ledger.user_id == user_id,
+        Ledger.status == 'paid'
+    )
+    invoice_query = session.query(func.coalesce(func.sum(Invoice.amount_due), 0)).join(
+        Subscription, Subscription.id == Invoice.subscription_id
+    ).filter(
+        Subscription.user_id == user_id,
+        Invoice.status == 'paid'
+    )
+    last_purchase_query = session.query(Ledger).filter_by(
+        user_id=user_id,
+        status='paid'
+    )
+    if currency:
+        ledger_query = ledger_query.filter(Ledger.currency == currency)
+        invoice_query = invoice_query.filter(Invoice.currency == currency)
+        last_purchase_query = last_purchase_query.filter(Ledger.currency == currency)
+    summary.lifetime_spend = Decimal(ledger_query.scalar()) + Decimal(invoice_query.scalar())
+
+    last_purchase = last_purchase_query.order_by(Ledger.created_at.desc()).first()
+    if last_purchase:
+        summary.last_payment_id = last_purchase.session_id
+        summary.last_purchase_session_id = last_purchase.session_id
+        summary.last_purchase_product = last_purchase.product_name
+        summary.last_purchase_amount = last_purchase.amount
+        summary.last_purchase_at = last_purchase.created_at
+
+    return summary
+
+
+# ============================================
+# 読み取り
+# ============================================
+
+def get_billing_summary(user_id):
+    """ユーザーの請求サマリーを取得（未作成の場合は再構築）"""
+    session = get_session()
+    try:
+        summary = session.get(UserBillingSummary, user_id)
+        if summary is None:
+            summary = _rebuild(session, user_id)
+            session.commit()
+            session.refresh(summary)
+        return summary
+    except Exception as e:
+        logger.error(f"Error getting billing summary for user {user_id}: {e}")
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+# ============================================
+# 更新（Webhookハンドラー・支払いの記録から呼び出す）
+# ============================================
+
+def rebuild_billing_summary(user_id):
+    """ユーザーの請求サマリーを全再計算"""
+    session = get_session()
+    try:
+        _rebuild(session, user_id)
+        session.commit()
+        logger.info(f"Billing summary rebuilt for user {user_id}")
+    except Exception as e:
+        logger.error(f"Error rebuilding billing summary for user {user_id}: {e}")
+        session.rollback()
+    finally:
+        session.close()
+
+
+def add_payment_to_summary(session, user_id, payment_id, amount, currency, product_name=None, paid_at=None):
+    """新規に記録した支払いをサマリーに加算（台帳・請求書の挿入と同じトランザクションで呼び出す。コミットは呼び出し側）
+    挿入した配信だけが呼び出すため再送で二重加算せず、加算はSQLで行うため同時の更新を失わない
+    product_nameがある場合は単発購入として、より新しければ直近購入も更新する
+    サマリーと通貨が異なる支払いは累計に混ぜず、ログに残してスキップする
+    """
+    if not user_id or amount is None:
+        return
+
+    if _create_if_absent(session, user_id):
+        # 初回は全再計算（同じトランザクションで記録した今回の支払いも含まれる）
+        _rebuild(session, user_id)
+        return
+
+    query = session.query(UserBillingSummary).filter(UserBillingSummary.user_id == user_id)
+    values = {
+        UserBillingSummary.lifetime_spend: func.coalesce(UserBillingSummary.lifetime_spend, 0) + Decimal(amount),
+        UserBillingSummary.last_payment_id: payment_id,
+    }
+    if currency:
+        query = query.filter(or_(UserBillingSummary.currency.is_(None), UserBillingSummary.currency == currency))
+        values[UserBillingSummary.currency] = func.coalesce(UserBillingSummary.currency, currency)
+    if not query.update(values, synchronize_session=False):
+        logger.warning(f"Skipped payment {payment_id} for billing summary of user {user_id}: currency {currency} differs from summary")
+        return
+
+    if product_name is not None:
+        session.query(UserBillingSummary).filter(
+            UserBillingSummary.user_id == user_id,
+            or_(UserBillingSummary.last_purchase_at.is_(None), UserBillingSummary.last_purchase_at <= paid_at),
+        ).update({
+            UserBillingSummary.last_purchase_session_id: payment_id,
+            UserBillingSummary.last_purchase_product: product_name,
+            UserBillingSummary.last_purchase_amount: amount,
+            UserBillingSummary.last_purchase_at: paid_at,
+        }, synchronize_session=False)
+
+
+def refresh_subscription_summary(user_id):
+    """サマリーのプラン情報をユーザーのサブスクリプションから更新"""
+    if not user_id:
+        return
+
+    session = get_session()
+    try:
+        summary = session.get(UserBillingSummary, user_id)
+        if summary is None:
+            _rebuild(session, user_id)
+        else:
+            subscriptions = session.query(Subscription).filter_by(user_id=user_id).all()
+            _apply_subscription(summary, _select_current_subscription(subscriptions))
+        session.commit()
+    except Exception as e:
+        logger.error(f"Error refreshing subscription summary for user {user_id}: {e}")
+        session.rollback()
+    finally:
+        session.close()
+
+
+def refresh_subscription_summary_for(subscription_id):
+    """サブスクリプションIDから所有ユーザーを特定してサマリーを更新"""
+    session = get_session()
+    try:
+        user_id = session.query(Subscription.user_id).filter_by(id=subscription_id).scalar()
+    except Exception as e:
+        logger.error(f"Error looking up subscription owner {subscription_id}: {e}")
+        user_id = None
+    finally:
+        session.close()
+
+    refresh_subscription_summary(user_id)
+    return user_id
+
+
+def set_scheduled_change(user_id, schedule_id, price_id, change_date):
+    """プラン変更予約をサマリーに記録"""
+    session = get_session()
+    try:
+        summary = session.get(UserBillingSummary, user_id)
+        if summary is None:
+            summary = _rebuild(session, user_id)
+        summary.scheduled_schedule_id = schedule_id
+        summary.scheduled_price_id = price_id
+        summary.scheduled_change_date = change_date
+        session.commit()
+    except Exception as e:
+        logger.error(f"Error setting scheduled change for user {user_id}: {e}")
+        session.rollback()
+    finally:
+        session.close()
+
+
+def clear_scheduled_change(schedule_id):
+    """プラン変更予約をサマリーから削除"""
+    session = get_session()
+    try:
+        session.query(UserBillingSummary).filter_by(scheduled_schedule_id=schedule_id).update({
+            'scheduled_schedule_id': None,
+            'scheduled_price_id': None,
+            'scheduled_change_date': None,
+        })
+        session.commit()
+    except Exception as e:
+        logger.error(f"Error clearing scheduled change {schedule_id}: {e}")
+        session.rollback()
+    finally:
+        session.close()
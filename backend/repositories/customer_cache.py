@@ -0,0 +1,52 @@
+"""
+Stripe Customerの確認済みキャッシュ
+users.stripe_customer_id を正として扱い、Stripe上で有効なことの確認は一定時間ごとにだけ行う
+削除は customer.deleted のWebhookで users から消すことで全プロセスに反映する
+"""
+import os
+import logging
+from cache import LocalTTLCache
+
+logger = logging.getLogger(__name__)
+
+# 確認済みとして扱う秒数。0でキャッシュしない（毎回Stripeで確認する）
+STRIPE_CUSTOMER_VERIFY_TTL_SECONDS = int(os.getenv("STRIPE_CUSTOMER_VERIFY_TTL_SECONDS", "86400"))
+
+# プロセス内キャッシュの最大件数
+STRIPE_CUSTOMER_CACHE_MAX_SIZE = int(os.getenv("STRIPE_CUSTOMER_CACHE_MAX_SIZE", "10000"))
+
+_verified = LocalTTLCache(STRIPE_CUSTOMER_VERIFY_TTL_SECONDS, max_size=STRIPE_CUSTOMER_CACHE_MAX_SIZE)
+
+
+def is_customer_verified(customer_id):
+    """期限内にStripeで有効なことを確認済みか"""
+    if STRIPE_CUSTOMER_VERIFY_TTL_SECONDS <= 0 or not customer_id:
+        return False
+    return _verified.get(customer_id) is not None
+
+
+def mark_customer_verified(customer_id):
+    """Stripeで有効なことを確認した（または作成した）Customerを記録"""
+    if STRIPE_CUSTOMER_VERIFY_TTL_SECONDS <= 0 or not customer_id:
+        return
+    _verified.set(customer_id, True)
+
+
+def invalidate_customer(customer_id):
+    """確認済みの記録を削除（Customerが削除された場合）"""
+    if customer_id:
+        _verified.delete(customer_id)
+
+
+def get_customer_cache_stats():
+    """キャッシュのヒット・ミス数（misses が Stripe.Customer.retrieve を呼んだ回数）"""
+    return {
+        'enabled': STRIPE_CUSTOMER_VERIFY_TTL_SECONDS > 0,
+        'ttl_seconds': STRIPE_CUSTOMER_VERIFY_TTL_SECONDS,
+        **_verified.stats(),
+    }
+
+
+def clear_customer_cache():
+    """キャッシュと統計をリセット"""
+    _verified.clear()
@@ -0,0 +1,310 @@
+"""
+Stripe Customerの非同期作成（ユーザー登録の応答にStripeの往復を含めない）
+登録時にユーザーと同じトランザクションで customer_provisioning_jobs に積み、バックグラウンドのスレッドが作成する
+購入開始時に未完了であれば、処理中のワーカーを少し待ち、それでもなければ同じ冪等キーでその場で作成する
+諦めた（failed）ジョブの冪等キーは再利用しない（Stripeは24時間は保存したエラーを返し、それ以降はキーを忘れるため）
+"""
+import os
+import time
+import logging
+import datetime
+import threading
+import stripe
+from sqlalchemy import or_
+from models import User, CustomerProvisioningJob
+from . import database
+from .customer_cache import mark_customer_verified
+
+logger = logging.getLogger(__name__)
+
+# ジョブを確認する間隔（秒。登録直後は待たずに起こす）。0以下の場合はバックグラウンドで実行しない
+PROVISION_INTERVAL_SECONDS = float(os.getenv("STRIPE_CUSTOMER_PROVISION_INTERVAL_SECONDS", "5"))
+
+# 1回の実行で処理するジョブ数
+PROVISION_BATCH_SIZE = int(os.getenv("STRIPE_CUSTOMER_PROVISION_BATCH_SIZE", "20"))
+
+# 失敗として諦めるまでの試行回数（失敗したユーザーは購入開始時にその場で作成する）
+PROVISION_MAX_ATTEMPTS = int(os.getenv("STRIPE_CUSTOMER_PROVISION_MAX_ATTEMPTS", "5"))
+
+# 再試行の間隔（秒。試行ごとに倍にする）
+PROVISION_RETRY_BASE_SECONDS = float(os.getenv("STRIPE_CUSTOMER_PROVISION_RETRY_BASE_SECONDS", "10"))
+PROVISION_RETRY_MAX_SECONDS = float(os.getenv("STRIPE_CUSTOMER_PROVISION_RETRY_MAX_SECONDS", "600"))
+
+# ワーカーがジョブを確保する秒数（この間に終わらなければ別のワーカーが拾う）
+PROVISION_LEASE_SECONDS = float(os.getenv("STRIPE_CUSTOMER_PROVISION_LEASE_SECONDS", "30"))
+
+# 購入開始時に処理中のワーカーを待つ秒数
+PROVISION_WAIT_SECONDS = float(os.getenv("STRIPE_CUSTOMER_PROVISION_WAIT_SECONDS", "2"))
+
+
+def idempotency_key(job_id):
+    """ジョブごとの冪等キー（ワーカーと購入開始の両方から作成しても同じCustomerになる）"""
+    return f"customer-provision-{job_id}"
+
+
+def enqueue_customer_provisioning(session, user):
+    """ユーザー登録のトランザクション内で作成ジョブを積む（commitは呼び出し側で行う）"""
+    session.add(CustomerProvisioningJob(
+        user_id=user.id,
+        status='pending',
+        attempts=0,
+        next_attempt_at=datetime.datetime.utcnow(),
+    ))
+
+
+def create_customer_for_job(user, job_id, use_job_key=True):
+    """Customerを作成し、ユーザーとジョブに保存（ユーザーのCustomer IDを返す）
+    use_job_key=False の場合はジョブの冪等キーを付けずに作成する（諦めたジョブ用）
+    """
+    options = {'idempotency_key': idempotency_key(job_id)} if use_job_key else {}
+    customer = stripe.Customer.create(
+        email=user.email,
+        name=user.name,
+        metadata={
+            'user_id': str(user.id)
+        },
+        **options,
+    )
+
+    session = database.get_session()
+    try:
+        # 別の経路で設定済みの場合は上書きしない
+        session.query(User).filter(User.id == user.id, User.stripe_customer_id.is_(None)).update(
+            {User.stripe_customer_id: customer.id}, synchronize_session=False)
+        session.query(CustomerProvisioningJob).filter_by(id=job_id).update({
+            CustomerProvisioningJob.status: 'done',
+            CustomerProvisioningJob.customer_id: customer.id,
+            CustomerProvisioningJob.locked_until: None,
+            CustomerProvisioningJob.last_error: None,
+        }, synchronize_session=False)
+        session.commit()
+        customer_id = session.query(User.stripe_customer_id).filter_by(id=user.id).scalar() or customer.id
+    except Exception as e:
+        logger.error(f"Error saving provisioned Stripe Customer {customer.id} for user {user.id}: {e}")
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+    mark_customer_verified(customer_id)
+    logger.info(f"Stripe Customer provisioned: {customer_id} for user {user.id}")
+    return customer_id
+
+
+def _pending_job(user_id):
+    """(現在のCustomer ID, 未完了のジョブ) を返す"""
+    session = database.get_session()
+    try:
+        customer_id = session.query(User.stripe_customer_id).filter_by(id=user_id).scalar()
+        job = session.query(CustomerProvisioningJob).filter(
+            CustomerProvisioningJob.user_id == user_id,
+            CustomerProvisioningJob.status != 'done',
+        ).first()
+        if job is not None:
+            session.expunge(job)
+        return customer_id, job
+    finally:
+        session.close()
+
+
+def provision_pending_customer(user):
+    """未完了の作成ジョブがあればそのCustomerを返す（ジョブがなければ None。呼び出し側で通常どおり作成する）"""
+    customer_id, job = _pending_job(user.id)
+    if customer_id:
+        # 登録後にワーカーが作成済み（呼び出し元のユーザーが古い）
+        mark_customer_verified(customer_id)
+        return customer_id
+    if job is None:
+        return None
+
+    # ワーカーが処理中であれば、完了を少し待つ
+    if job.locked_until is not None and job.locked_until > datetime.datetime.utcnow():
+        customer_id = customer_provisioner.wait_for_customer(user.id)
+        if customer_id:
+            mark_customer_verified(customer_id)
+            return customer_id
+
+    # 諦めたジョブは冪等キーを付けずに作成し、ジョブを完了にする
+    return create_customer_for_job(user, job.id, use_job_key=job.status != 'failed')
+
+
+class CustomerProvisioner:
+    """登録時に積んだジョブからStripe Customerを作成する"""
+
+    def __init__(self, interval=PROVISION_INTERVAL_SECONDS, batch_size=PROVISION_BATCH_SIZE,
+                 max_attempts=PROVISION_MAX_ATTEMPTS, lease=PROVISION_LEASE_SECONDS, wait=PROVISION_WAIT_SECONDS):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = {
+            'runs': 0,
+            'provisioned': 0,
+            'failed_attempts': 0,
+            'gave_up': 0,
+            'last_run_at': None,
+        }
+
+    def _claim(self, session, job_id, now):
+        """他のワーカーが確保していなければ確保する（確保できたら試行回数を返す）"""
+        claimed = session.query(CustomerProvisioningJob).filter(
+            CustomerProvisioningJob.id == job_id,
+            CustomerProvisioningJob.status == 'pending',
+            or_(CustomerProvisioningJob.locked_until.is_(None), CustomerProvisioningJob.locked_until <= now),
+        ).update({
+            CustomerProvisioningJob.locked_until: now + datetime.timedelta(seconds=self.lease),
+            CustomerProvisioningJob.attempts: CustomerProvisioningJob.attempts + 1,
+        }, synchronize_session=False)
+        session.commit()
+        if not claimed:
+            return None
+        return session.query(CustomerProvisioningJob.attempts).filter_by(id=job_id).scalar()
+
+    def _record_failure(self, job_id, attempts, error):
+        gave_up = attempts >= self.max_attempts
+        delay = min(PROVISION_RETRY_BASE_SECONDS * 2 ** (attempts - 1), PROVISION_RETRY_MAX_SECONDS)
+        session = database.get_session()
+        try:
+            session.query(CustomerProvisioningJob).filter_by(id=job_id).update({
+                CustomerProvisioningJob.status: 'failed' if gave_up else 'pending',
+                CustomerProvisioningJob.next_attempt_at: datetime.datetime.utcnow() + datetime.timedelta(seconds=delay),
+                CustomerProvisioningJob.locked_until: None,
+                CustomerProvisioningJob.last_error: str(error)[:500],
+            }, synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            logger.error(f"Error recording provisioning failure for job {job_id}: {e}")
+            session.rollback()
+        finally:
+            session.close()
+        with self._lock:
+            self._stats['failed_attempts'] += 1
+            if gave_up:
+                self._stats['gave_up'] += 1
+
+    def run_once(self, now=None):
+        """期限の来たジョブを処理（処理したジョブ数を返す）"""
+        from stripe_client import stripe_lane
+
+        now = now or datetime.datetime.utcnow()
+        claimed = []
+        session = database.get_session()
+        try:
+            job_ids = [row.id for row in session.query(CustomerProvisioningJob.id).filter(
+                CustomerProvisioningJob.status == 'pending',
+                CustomerProvisioningJob.next_attempt_at <= now,
+                or_(CustomerProvisioningJob.locked_until.is_(None), CustomerProvisioningJob.locked_until <= now),
+            ).order_by(CustomerProvisioningJob.id).limit(self.batch_size).all()]
+            for job_id in job_ids:
+                attempts = self._claim(session, job_id, now)
+                if attempts is not None:
+                    job = session.get(CustomerProvisioningJob, job_id)
+                    claimed.append((job_id, job.user_id, attempts))
+        except Exception as e:
+            logger.error(f"Error claiming customer provisioning jobs: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+        provisioned = 0
+        for job_id, user_id, attempts in claimed:
+            try:
+                user = self._get_user(user_id)
+                if user.stripe_customer_id:
+                    self._mark_done(job_id, user)
+                else:
+                    with stripe_lane('background'):
+                        create_customer_for_job(user, job_id)
+                    provisioned += 1
+            except Exception as e:
+                logger.warning(f"Customer provisioning failed for user {user_id} (attempt {attempts}): {e}")
+                self._record_failure(job_id, attempts, e)
+
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['provisioned'] += provisioned
+            self._stats['last_run_at'] = datetime.datetime.utcnow().isoformat()
+        return len(claimed)
+
+    @staticmethod
+    def _get_user(user_id):
+        session = database.get_session()
+        try:
+            user = session.get(User, user_id)
+            if user is None:
+                raise LookupError(f"User {user_id} not found")
+            session.expunge(user)
+            return user
+        finally:
+            session.close()
+
+    @staticmethod
+    def _mark_done(job_id, user):
+        """登録後に購入開始などで作成済みのジョブを完了にする"""
+        session = database.get_session()
+        try:
+            session.query(CustomerProvisioningJob).filter_by(id=job_id).update({
+                CustomerProvisioningJob.status: 'done',
+                CustomerProvisioningJob.customer_id: user.stripe_customer_id,
+                CustomerProvisioningJob.locked_until: None,
+            }, synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def wait_for_customer(self, user_id, timeout=None):
+        """ワーカーがCustomerを保存するまで待つ（期限内に保存されなければ None）"""
+        deadline = time.monotonic() + (self.wait if timeout is None else timeout)
+        while True:
+            session = database.get_session()
+            try:
+                customer_id = session.query(User.stripe_customer_id).filter_by(id=user_id).scalar()
+            finally:
+                session.close()
+            if customer_id or time.monotonic() >= deadline:
+                return customer_id
+            time.sleep(0.1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'interval_seconds': self.interval,
+                'running': self._thread is not None and self._thread.is_alive(),
+                **self._stats,
+            }
+
+    def notify(self):
+        """新しいジョブを積んだことを知らせる（スレッドが未起動であれば起動する）"""
+        self.ensure_started()
+        self._wakeup.set()
+
+    def ensure_started(self):
+        """バックグラウンドの作成スレッドを起動（起動済み・無効の場合は何もしない）"""
+        if self.interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="customer-provisioner", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            # 1回で処理しきれなかった分は続けて処理する
+            while self.run_once() >= self.batch_size:
+                pass
+
+
+# プロセス全体で共有するワーカー
+customer_provisioner = CustomerProvisioner()
@@ -6,7 +6,7 @@ import datetime
 import logging
 from sqlalchemy import create_engine, inspect
 from sqlalchemy.orm import Session
-from models import Base, User, Ledger, Subscription, UserSession
+from models import Base, User, Ledger, Subscription, Invoice, UserSession, UserBillingSummary, RevenueRollup, SubscriptionSchedule, CustomerProvisioningJob
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -33,8 +33,18 @@ def init_db():
             tables_to_create.append(Ledger.__table__)
         if 'subscriptions' not in existing_tables:
             tables_to_create.append(Subscription.__table__)
+        if 'invoices' not in existing_tables:
+            tables_to_create.append(Invoice.__table__)
         if 'user_sessions' not in existing_tables:
             tables_to_create.append(UserSession.__table__)
+        if 'user_billing_summary' not in existing_tables:
+            tables_to_create.append(UserBillingSummary.__table__)
+        if 'revenue_rollups' not in existing_tables:
+            tables_to_create.append(RevenueRollup.__table__)
+        if 'subscription_schedules' not in existing_tables:
+            tables_to_create.append(SubscriptionSchedule.__table__)
+        if 'customer_provisioning_jobs' not in existing_tables:
+            tables_to_create.append(CustomerProvisioningJob.__table__)
         
         # 必要なテーブルのみ作成
         for table in tables_to_create:
@@ -42,6 +52,13 @@ def init_db():
             
         logger.info("データベース初期化完了")
         
+        # 台帳・請求書の月次パーティションを先行作成（PostgreSQLでパーティション化済みの場合のみ）
+        from .partitioning import ensure_future_partitions
+        try:
+            ensure_future_partitions()
+        except Exception as partition_error:
+            logger.warning(f"パーティション作成エラー: {partition_error}")
+        
     except Exception as e:
         logger.error(f"データベース初期化エラー: {e}")
         # フォールバック: 全テーブルを作成
@@ -0,0 +1,145 @@
+"""
+作成済みのStripeホスト画面セッション（Checkout / Customer Portal）の再利用
+ダブルクリックや再読み込みで同じ購入を開始した場合は、Stripeを呼ばずに開いたままのセッションを返す
+キーは (ユーザー, 種類, 価格, Customer)。完了・期限切れは checkout.session.completed / expired のWebhookと成功画面で消す
+Redisがあれば全プロセスで共有する。なければプロセス内だけで再利用し、他のプロセスの完了を消せないため
+Checkoutの再利用はダブルクリック対策の短い時間に限る
+"""
+import os
+import json
+import time
+import logging
+import threading
+from cache import LocalTTLCache
+
+logger = logging.getLogger(__name__)
+
+# Checkoutセッションを再利用する秒数（Stripe側の有効期限より長くはしない）。0で再利用しない
+CHECKOUT_SESSION_REUSE_SECONDS = int(os.getenv("STRIPE_CHECKOUT_SESSION_REUSE_SECONDS", "600"))
+
+# Redisがない場合にCheckoutセッションを再利用する秒数（完了したセッションを他のプロセスが返し続けないよう短くする）
+LOCAL_CHECKOUT_SESSION_REUSE_SECONDS = int(os.getenv("STRIPE_CHECKOUT_SESSION_LOCAL_REUSE_SECONDS", "10"))
+
+# Customer Portalセッションを再利用する秒数（ポータルのURLは短時間で失効する）。0で再利用しない
+PORTAL_SESSION_REUSE_SECONDS = int(os.getenv("STRIPE_PORTAL_SESSION_REUSE_SECONDS", "60"))
+
+# Stripe側の有効期限の何秒前から再利用しないか
+EXPIRY_MARGIN_SECONDS = 60
+
+KEY_PREFIX = "hosted_session"
+
+_local = LocalTTLCache(CHECKOUT_SESSION_REUSE_SECONDS, max_size=10000)
+_local_by_id = LocalTTLCache(CHECKOUT_SESSION_REUSE_SECONDS, max_size=10000)
+
+# Redisを使う場合のヒット・ミス数（プロセス内のキャッシュは LocalTTLCache が数える）
+_shared_counts = {'hits': 0, 'misses': 0}
+_counts_lock = threading.Lock()
+
+
+def _redis():
+    from cache import redis_client
+    return redis_client
+
+
+def _reuse_seconds(kind):
+    if kind == 'portal':
+        return PORTAL_SESSION_REUSE_SECONDS
+    if _redis() is None:
+        return min(CHECKOUT_SESSION_REUSE_SECONDS, LOCAL_CHECKOUT_SESSION_REUSE_SECONDS)
+    return CHECKOUT_SESSION_REUSE_SECONDS
+
+
+def _key(user_id, kind, price_key, customer_id):
+    return f"{KEY_PREFIX}:{user_id}:{kind}:{price_key or '-'}:{customer_id or '-'}"
+
+
+def get_open_session(user_id, kind, price_key, customer_id):
+    """再利用できるセッション（{'id', 'url'}）。なければ None"""
+    if _reuse_seconds(kind) <= 0:
+        return None
+    key = _key(user_id, kind, price_key, customer_id)
+
+    redis_client = _redis()
+    if redis_client is not None:
+        try:
+            value = redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"Hosted session cache read failed: {e}")
+            value = None
+        with _counts_lock:
+            _shared_counts['hits' if value else 'misses'] += 1
+        return json.loads(value) if value else None
+    return _local.get(key)
+
+
+def remember_session(user_id, kind, price_key, customer_id, session):
+    """作成したセッションを記録（Stripe側の有効期限が近いものは記録しない）"""
+    ttl = _reuse_seconds(kind)
+    expires_at = session.get('expires_at')
+    if expires_at:
+        ttl = min(ttl, int(expires_at - time.time()) - EXPIRY_MARGIN_SECONDS)
+    if ttl <= 0:
+        return
+
+    key = _key(user_id, kind, price_key, customer_id)
+    value = {'id': session.get('id'), 'url': session.get('url')}
+
+    redis_client = _redis()
+    if redis_client is not None:
+        try:
+            pipeline = redis_client.pipeline()
+            pipeline.setex(key, ttl, json.dumps(value))
+            pipeline.setex(f"{KEY_PREFIX}:by_id:{value['id']}", ttl, key)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Hosted session cache write failed: {e}")
+        return
+    _local.set(key, value, ttl=ttl)
+    _local_by_id.set(value['id'], key, ttl=ttl)
+
+
+def forget_session(session_id):
+    """完了・期限切れになったセッションを再利用しないようにする"""
+    if not session_id:
+        return
+
+    redis_client = _redis()
+    if redis_client is not None:
+        try:
+            by_id = f"{KEY_PREFIX}:by_id:{session_id}"
+            key = redis_client.get(by_id)
+            if key:
+                redis_client.delete(key.decode() if isinstance(key, bytes) else key, by_id)
+        except Exception as e:
+            logger.warning(f"Hosted session cache invalidation failed for {session_id}: {e}")
+        return
+
+    key = _local_by_id.get(session_id)
+    if key:
+        _local.delete(key)
+        _local_by_id.delete(session_id)
+
+
+def get_hosted_session_cache_stats():
+    """再利用のヒット・ミス数（misses がセッションを作成した回数）"""
+    if _redis() is None:
+        counts = _local.stats()
+    else:
+        with _counts_lock:
+            counts = dict(_shared_counts)
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_rate'] = round(counts['hits'] / lookups, 4) if lookups else 0.0
+    return {
+        'checkout_reuse_seconds': _reuse_seconds('checkout'),
+        'portal_reuse_seconds': PORTAL_SESSION_REUSE_SECONDS,
+        'shared': _redis() is not None,
+        **counts,
+    }
+
+
+def clear_hosted_session_cache():
+    """プロセス内のキャッシュと統計をリセット"""
+    _local.clear()
+    _local_by_id.clear()
+    with _counts_lock:
+        _shared_counts.update(hits=0, misses=0)
@@ -0,0 +1,184 @@
+"""
+台帳・請求書の月次パーティション管理
+PostgreSQLでは宣言的パーティション（migration 008で作成）の先行作成・切り離しを行い、
+それ以外（SQLite）ではパーティションの代わりに古い行をアーカイブテーブルへ移動する
+"""
+import os
+import datetime
+import logging
+from sqlalchemy import text
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# 先行して作成しておく月数（当月を含まない）
+DEFAULT_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+# オンラインに残す月数（これより古い月は切り離してアーカイブ）
+DEFAULT_RETAIN_MONTHS = int(os.getenv("PARTITION_RETAIN_MONTHS", "24"))
+
+# 切り離したパーティションの移動先スキーマ
+ARCHIVE_SCHEMA = "archive"
+
+
+# ============================================
+# 内部ユーティリティ
+# ============================================
+
+def _month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def _epoch(month):
+    return int(datetime.datetime.combine(month, datetime.time(), tzinfo=datetime.timezone.utc).timestamp())
+
+
+# テーブルごとのパーティションキーと境界値の表現
+# ledger.created_at はISO文字列（COLLATE "C"）、invoices.created はUnix timestamp
+PARTITIONED_TABLES = {
+    'ledger': {
+        'column': 'created_at',
+        'bound': lambda month: f"'{month.isoformat()}'",
+        'value': lambda month: month.isoformat(),
+    },
+    'invoices': {
+        'column': 'created',
+        'bound': lambda month: str(_epoch(month)),
+        'value': _epoch,
+    },
+}
+
+
+def partition_name(table, month):
+    """月次パーティション名（例: ledger_y2026m10）"""
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def _is_postgres(connection):
+    return connection.dialect.name == 'postgresql'
+
+
+def _is_partitioned(connection, table):
+    """テーブルが宣言的パーティションになっているか（migration 008適用済みか）"""
+    return bool(connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table AND c.relnamespace = 'public'::regnamespace"
+    ), {"table": table}).scalar())
+
+
+def create_partition_sql(table, month):
+    """指定月のパーティションを作成するDDL（migrationからも利用）"""
+    spec = PARTITIONED_TABLES[table]
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ({spec['bound'](month)}) TO ({spec['bound'](_add_months(month, 1))})"
+    )
+
+
+def month_range(first_month, last_month):
+    """first_month から last_month までの月初日のリスト（両端を含む）"""
+    months = []
+    month = _month_start(first_month)
+    while month <= last_month:
+        months.append(month)
+        month = _add_months(month, 1)
+    return months
+
+
+# ============================================
+# パーティションの先行作成
+# ============================================
+
+def ensure_future_partitions(months_ahead=DEFAULT_MONTHS_AHEAD, today=None):
+    """当月から months_ahead か月先までのパーティションを作成（作成したパーティション名を返す）"""
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    months = month_range(_month_start(today), _add_months(_month_start(today), months_ahead))
+
+    created = []
+    with database.engine.begin() as connection:
+        if not _is_postgres(connection):
+            # SQLiteにはパーティションがないため何もしない
+            return created
+
+        for table in PARTITIONED_TABLES:
+            if not _is_partitioned(connection, table):
+                logger.warning(f"{table} is not partitioned; run alembic upgrade to enable partitioning")
+                continue
+            for month in months:
+                name = partition_name(table, month)
+                if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+                    connection.execute(text(create_partition_sql(table, month)))
+                    created.append(name)
+
+    if created:
+        logger.info(f"Partitions created: {', '.join(created)}")
+    return created
+
+
+# ============================================
+# 古いパーティションのアーカイブ
+# ============================================
+
+def _archive_postgres(connection, table, cutoff):
+    """cutoffより前の月のパーティションを切り離して archive スキーマへ移動"""
+    archived = []
+    partitions = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :table AND p.relnamespace = 'public'::regnamespace"
+    ), {"table": table}).scalars().all()
+
+    cutoff_name = partition_name(table, cutoff)
+    for name in sorted(partitions):
+        # 名前の形式（table_yYYYYmMM）は文字列比較で月の前後と一致する（defaultパーティションは対象外）
+        if not name.startswith(f"{table}_y") or name >= cutoff_name:
+            continue
+        connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        connection.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+        archived.append(name)
+    return archived
+
+
+def _archive_rows(connection, table, cutoff):
+    """パーティションのないDB向け: cutoffより前の行を {table}_archive へ移動"""
+    spec = PARTITIONED_TABLES[table]
+    archive_table = f"{table}_archive"
+    condition = f"{spec['column']} < :cutoff"
+    params = {"cutoff": spec['value'](cutoff)}
+
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {archive_table} AS SELECT * FROM {table} WHERE 0 = 1"))
+    moved = connection.execute(text(
+        f"INSERT INTO {archive_table} SELECT * FROM {table} WHERE {condition}"
+    ), params).rowcount
+    connection.execute(text(f"DELETE FROM {table} WHERE {condition}"), params)
+    return [f"{archive_table} ({moved} rows)"] if moved else []
+
+
+def archive_old_partitions(retain_months=DEFAULT_RETAIN_MONTHS, today=None):
+    """retain_months より古い月のデータをオンラインのテーブルから外す（アーカイブ先の一覧を返す）
+
+    売上ロールアップ・請求サマリーは集計済みのため、アーカイブ後も過去分の合計は残る
+    """
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    cutoff = _add_months(_month_start(today), -retain_months)
+
+    archived = []
+    with database.engine.begin() as connection:
+        if _is_postgres(connection):
+            connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+            for table in PARTITIONED_TABLES:
+                if _is_partitioned(connection, table):
+                    archived.extend(_archive_postgres(connection, table, cutoff))
+        else:
+            for table in PARTITIONED_TABLES:
+                archived.extend(_archive_rows(connection, table, cutoff))
+
+    if archived:
+        logger.info(f"Archived before {cutoff}: {', '.join(archived)}")
+    return archived
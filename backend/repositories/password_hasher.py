@@ -0,0 +1,155 @@
+"""
+パスワードハッシュ（PBKDF2）の計算を専用のプロセスプールで行う
+リクエストスレッドでCPUを占有しないよう、件数に上限のあるキューで受け付け、あふれた場合は PasswordHasherBusy を送出する
+
+保存形式: pbkdf2_sha256$<反復回数>$<salt>$<hash>
+旧形式（<salt>:<hash>）は反復回数100000として検証し、ログイン成功時に現在の設定で再ハッシュする
+"""
+import os
+import hmac
+import hashlib
+import secrets
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "pbkdf2_sha256"
+
+# 旧形式（salt:hash）の反復回数
+LEGACY_ITERATIONS = 100000
+
+# 新しく作成するハッシュの反復回数（引き上げると既存ユーザーは次回ログイン時に再ハッシュされる）
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", str(LEGACY_ITERATIONS)))
+
+# プロセスプールのワーカー数（0の場合は呼び出し元のスレッドで計算）
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+
+# 実行中の分を除いて待機できる件数（これを超えると PasswordHasherBusy）
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+
+# 1件の計算を待つ最大秒数（超えた場合も PasswordHasherBusy）
+PASSWORD_HASH_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_HASH_TIMEOUT_SECONDS", "10"))
+
+
+class PasswordHasherBusy(Exception):
+    """ハッシュ計算の待ち行列が上限に達している（503で応答する）"""
+
+
+def _pbkdf2(password, salt, iterations):
+    """PBKDF2-HMAC-SHA256（プロセスプールのワーカーで実行される）"""
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), iterations).hex()
+
+
+class PasswordHasherPool:
+    """件数に上限のあるPBKDF2計算用プロセスプール"""
+
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_queue=PASSWORD_HASH_MAX_QUEUE,
+                 timeout=PASSWORD_HASH_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._in_flight = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # スレッドワーカー（gthread）の中からforkすると、他のスレッドが持っていたロックが子プロセスで
+                # 解放されないままになるため、forkserver から子プロセスを起動する
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("forkserver"))
+            return self._executor
+
+    def compute(self, password, salt, iterations):
+        """ハッシュを計算（待ち行列があふれている場合は PasswordHasherBusy）"""
+        if self.workers <= 0:
+            return _pbkdf2(password, salt, iterations)
+
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise PasswordHasherBusy("パスワード処理が混み合っています")
+            self._in_flight += 1
+
+        try:
+            future = self._get_executor().submit(_pbkdf2, password, salt, iterations)
+        except Exception:
+            self._release()
+            raise
+        # 待ちきれずに戻った場合も計算はプールに残るため、計算が終わった時点で枠を返す
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # 待ちきれないのは混雑しているため（503で応答する）
+            with self._lock:
+                self._timed_out += 1
+            raise PasswordHasherBusy("パスワード処理が混み合っています")
+
+    def _release(self, future=None):
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# プロセス全体で共有するプール
+hasher_pool = PasswordHasherPool()
+
+
+# ============================================
+# ハッシュの作成・検証
+# ============================================
+
+def _parse(password_hash):
+    """保存形式を (反復回数, salt, hash) に分解（不正な形式はNone）"""
+    if password_hash.startswith(f"{ALGORITHM}$"):
+        _, iterations, salt, hash_hex = password_hash.split('$')
+        return int(iterations), salt, hash_hex
+    salt, hash_hex = password_hash.split(':')
+    return LEGACY_ITERATIONS, salt, hash_hex
+
+
+def make_password_hash(password, iterations=None):
+    """パスワードのハッシュを作成"""
+    iterations = iterations or PASSWORD_HASH_ITERATIONS
+    salt = secrets.token_hex(16)
+    return f"{ALGORITHM}${iterations}${salt}${hasher_pool.compute(password, salt, iterations)}"
+
+
+def check_password_hash(password, password_hash):
+    """パスワードを検証（PasswordHasherBusy以外のエラーは不一致として扱う）"""
+    try:
+        iterations, salt, hash_hex = _parse(password_hash)
+    except (ValueError, AttributeError):
+        return False
+    return hmac.compare_digest(hasher_pool.compute(password, salt, iterations), hash_hex)
+
+
+def needs_rehash(password_hash):
+    """保存されたハッシュが現在の設定より弱い（または旧形式）か"""
+    try:
+        iterations, _, _ = _parse(password_hash)
+    except (ValueError, AttributeError):
+        return False
+    return not password_hash.startswith(f"{ALGORITHM}$") or iterations < PASSWORD_HASH_ITERATIONS
@@ -3,11 +3,93 @@
 """
 import datetime
 import logging
-from models import Ledger, Invoice
+import stripe
+from sqlalchemy.dialects import postgresql, sqlite
+from models import Ledger, Invoice, Subscription
 from .database import get_session
+from .revenue_rollup_repository import add_ledger_to_rollups, add_invoice_to_rollups
+from .billing_summary_repository import add_payment_to_summary
 
 logger = logging.getLogger(__name__)
 
+# PostgreSQLでは月次パーティションのため主キーにパーティションキーを含める（単一列の一意性はない）
+# 同じIDの重複はStripeのcreatedを常に同じ値で保存することで、この複合キーで防ぐ
+PARTITION_KEY_COLUMNS = {
+    Ledger: ['session_id', 'created_at'],
+    Invoice: ['id', 'created'],
+}
+
+
+# ============================================
+# 内部ユーティリティ
+# ============================================
+
+def _ledger_lookup(session, session_id, created_at=None):
+    """台帳の既存レコード検索（created_atがわかる場合はパーティションを絞り込む）"""
+    query = session.query(Ledger).filter_by(session_id=session_id)
+    if created_at:
+        query = query.filter_by(created_at=created_at)
+    return query
+
+
+def _invoice_lookup(session, invoice_id, created=None):
+    """請求書の既存レコード検索（createdがわかる場合はパーティションを絞り込む）"""
+    query = session.query(Invoice).filter_by(id=invoice_id)
+    if created:
+        query = query.filter_by(created=created)
+    return query
+
+
+def stripe_created(webhook_object, retrieve):
+    """Stripeオブジェクトのcreated（Unix timestamp）
+    パーティションキーになるため記録時刻では補わない（再送で別の行になる）。欠けている場合はStripeから取得する
+    """
+    created = webhook_object.get("created")
+    if created:
+        return created
+    object_id = webhook_object.get("id")
+    logger.warning(f"Stripe object {object_id} has no created; retrieving it from Stripe")
+    created = retrieve(object_id).get("created")
+    if not created:
+        raise ValueError(f"Stripe object {object_id} has no created timestamp")
+    return created
+
+
+def ledger_created_at(created):
+    """Stripeのcreated（epoch）を台帳のISO文字列に変換"""
+    return datetime.datetime.fromtimestamp(created, tz=datetime.timezone.utc).isoformat()
+
+
+def insert_if_absent_statement(dialect_name, model, values):
+    """重複時は何もしないINSERT文を作成（PostgreSQL・SQLiteのみ対応、それ以外はNone）"""
+    if dialect_name == 'postgresql':
+        stmt = postgresql.insert(model).values(values)
+        return stmt.on_conflict_do_nothing(index_elements=PARTITION_KEY_COLUMNS[model])
+    if dialect_name == 'sqlite':
+        # SQLiteはパーティションなしの単一列の主キー
+        return sqlite.insert(model).values(values).on_conflict_do_nothing()
+    return None
+
+
+def _insert_if_absent(session, model, values):
+    """レコードを挿入し、挿入した場合は True（重複の場合は False。コミットは呼び出し側）"""
+    stmt = insert_if_absent_statement(session.get_bind().dialect.name, model, values)
+    if stmt is None:
+        # UPSERT非対応のDBでは通常のINSERT（重複は一意制約のエラーになる）
+        session.add(model(**values))
+        session.flush()
+        return True
+    return session.execute(stmt).rowcount > 0
+
+
+def add_invoice_to_summary(session, invoice_entry):
+    """支払い済みの請求書をサブスクリプションの所有ユーザーのサマリーに加算（コミットは呼び出し側）"""
+    if invoice_entry.status != 'paid' or not invoice_entry.subscription_id:
+        return
+    user_id = session.query(Subscription.user_id).filter_by(id=invoice_entry.subscription_id).scalar()
+    add_payment_to_summary(session, user_id, invoice_entry.id, invoice_entry.amount_due, invoice_entry.currency,
+                           paid_at=ledger_created_at(invoice_entry.created))
+
 
 # ============================================
 # 支払い台帳
@@ -16,54 +98,42 @@ logger = logging.getLogger(__name__)
 def record_ledger(webhook_object, user_id=None, product_name=None):
     """支払い台帳を記録"""
     session_id = webhook_object.get("id")
-    amount_total = webhook_object.get("amount_total")
-    currency = webhook_object.get("currency")
-    payment_status = webhook_object.get("payment_status")
-
-    # Stripeのcreated（epoch）をISO文字列に変換
-    created_epoch = webhook_object.get("created")
-    created_at = (
-        datetime.datetime.fromtimestamp(created_epoch, tz=datetime.timezone.utc).isoformat()
-        if created_epoch
-        else datetime.datetime.now(datetime.timezone.utc).isoformat()
-    )
-    
-    try:
-        session = get_session()
+    created_at = ledger_created_at(stripe_created(webhook_object, stripe.checkout.Session.retrieve))
+    values = {
+        'session_id': session_id,
+        'user_id': user_id,
+        'amount': webhook_object.get("amount_total"),
+        'currency': webhook_object.get("currency"),
+        'status': webhook_object.get("payment_status"),
+        'product_name': product_name,
+        'created_at': created_at,
+    }
 
-        # 既存のレコードをチェック
-        existing_entry = session.query(Ledger).filter_by(session_id=session_id).first()
+    session = get_session()
+    try:
+        # 既存のレコードをチェック（created_atも条件にして該当月のパーティションだけを探索させる）
+        existing_entry = _ledger_lookup(session, session_id, created_at).first()
         if existing_entry:
             logger.info(f"Ledger entry already exists: {session_id}")
             return existing_entry
 
-        ledger_entry = Ledger(
-            session_id=session_id,
-            user_id=user_id,
-            amount=amount_total,
-            currency=currency,
-            status=payment_status,
-            product_name=product_name,
-            created_at=created_at,
-        )
-        session.add(ledger_entry)
+        # 同時・再送の配信はON CONFLICTで1件にする（挿入した配信だけがロールアップに加算する）
+        ledger_entry = Ledger(**values)
+        if not _insert_if_absent(session, Ledger, values):
+            logger.info(f"Ledger entry already exists: {session_id}")
+            session.rollback()
+            return _ledger_lookup(session, session_id, created_at).first()
+        # 売上ロールアップ・請求サマリーも同じトランザクションで加算
+        add_ledger_to_rollups(session, ledger_entry)
+        if ledger_entry.status == 'paid':
+            add_payment_to_summary(session, user_id, session_id, ledger_entry.amount, ledger_entry.currency,
+                                   product_name=product_name, paid_at=created_at)
         session.commit()
-        logger.info(f"Ledger recorded: {ledger_entry.session_id}")
+        logger.info(f"Ledger recorded: {session_id}")
         return ledger_entry
     except Exception as e:
         logger.error(f"Error recording ledger: {e}")
         session.rollback()
-        
-        # 重複キーエラーの場合は既存レコードを返す
-        if "duplicate key value violates unique constraint" in str(e):
-            logger.info(f"Duplicate key error for session_id: {session_id}, returning existing entry")
-            try:
-                existing_entry = session.query(Ledger).filter_by(session_id=session_id).first()
-                if existing_entry:
-                    return existing_entry
-            except Exception as query_error:
-                logger.error(f"Error querying existing entry: {query_error}")
-        
         raise e
     finally:
         session.close()
@@ -89,49 +159,39 @@ def get_ledger():
 def record_invoice(webhook_object):
     """請求書を記録"""
     invoice_id = webhook_object.get("id")
-    subscription_id = webhook_object.get("subscription")
-    status = webhook_object.get("status")
-    amount_due = webhook_object.get("amount_due")
-    currency = webhook_object.get("currency")
-    created = webhook_object.get("created")  # Unix timestamp
+    created = stripe_created(webhook_object, stripe.Invoice.retrieve)  # Unix timestamp
+    values = {
+        'id': invoice_id,
+        'subscription_id': webhook_object.get("subscription"),
+        'status': webhook_object.get("status"),
+        'amount_due': webhook_object.get("amount_due"),
+        'currency': webhook_object.get("currency"),
+        'created': created,
+    }
 
     session = get_session()
     try:
         # 既存の請求書をチェック
-        existing_invoice = session.query(Invoice).filter_by(id=invoice_id).first()
-        logger.info(f"Checking existing invoice for ID: {invoice_id}, found: {existing_invoice is not None}")
-        
+        existing_invoice = _invoice_lookup(session, invoice_id, created).first()
         if existing_invoice:
             logger.info(f"Invoice already exists: {invoice_id}")
             return existing_invoice
-        
-        # 新しいインボイスを作成
-        invoice_entry = Invoice(
-            id=invoice_id,
-            subscription_id=subscription_id,
-            status=status,
-            amount_due=amount_due,
-            currency=currency,
-            created=created,
-        )
-        session.add(invoice_entry)
-        logger.info(f"Invoice recorded: {invoice_entry.id}")
+
+        # 同時・再送の配信はON CONFLICTで1件にする（挿入した配信だけがロールアップに加算する）
+        invoice_entry = Invoice(**values)
+        if not _insert_if_absent(session, Invoice, values):
+            logger.info(f"Invoice already exists: {invoice_id}")
+            session.rollback()
+            return _invoice_lookup(session, invoice_id, created).first()
+        # 売上ロールアップ・請求サマリー（サブスクリプションの所有ユーザー）も同じトランザクションで加算
+        add_invoice_to_rollups(session, invoice_entry)
+        add_invoice_to_summary(session, invoice_entry)
         session.commit()
+        logger.info(f"Invoice recorded: {invoice_id}")
         return invoice_entry
     except Exception as e:
         logger.error(f"Error recording invoice: {e}")
         session.rollback()
-        
-        # 重複キーエラーの場合は既存レコードを返す
-        if "duplicate key value violates unique constraint" in str(e):
-            logger.info(f"Duplicate key error for invoice_id: {invoice_id}, returning existing entry")
-            try:
-                existing_invoice = session.query(Invoice).filter_by(id=invoice_id).first()
-                if existing_invoice:
-                    return existing_invoice
-            except Exception as query_error:
-                logger.error(f"Error querying existing invoice: {query_error}")
-        
         raise e
     finally:
         session.close()
@@ -0,0 +1,299 @@
+"""
+売上ロールアップ（日次・月次の事前集計）のリポジトリ
+台帳・請求書の新規記録時に同じトランザクション内で加算し、
+過去分は期間を指定して並列に再集計する
+"""
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import SingletonThreadPool
+from models import RevenueRollup, Ledger, Invoice, Subscription
+from . import database
+from .database import get_session
+from .subscription_repository import get_plan_name_from_price_id
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_KEY_COLUMNS = ['grain', 'period', 'currency', 'source', 'product', 'plan_name']
+
+# 再集計の並列数（1日単位のタスクをスレッドで処理）。各スレッドがDB接続を使うため上限を設ける
+DEFAULT_REBUILD_WORKERS = 4
+MAX_REBUILD_WORKERS = 8
+
+
+# ============================================
+# 内部ユーティリティ
+# ============================================
+
+def _rollup_rows(source, currency, product, plan_name, amount, day, count=1):
+    """1件の支払いに対応する日次・月次のロールアップ行を作成"""
+    base = {
+        'currency': currency or '',
+        'source': source,
+        'product': product or '',
+        'plan_name': plan_name or '',
+        'amount': Decimal(amount),
+        'count': count,
+        'updated_at': datetime.datetime.utcnow(),
+    }
+    return [
+        dict(base, grain='day', period=day.isoformat()),
+        dict(base, grain='month', period=day.strftime('%Y-%m')),
+    ]
+
+
+def increment_statement(dialect_name, rows):
+    """ロールアップ行を加算するUPSERT文を作成（PostgreSQL・SQLiteのみ対応、それ以外はNone）"""
+    if dialect_name == 'postgresql':
+        insert = postgresql.insert
+    elif dialect_name == 'sqlite':
+        insert = sqlite.insert
+    else:
+        return None
+
+    stmt = insert(RevenueRollup).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=ROLLUP_KEY_COLUMNS,
+        set_={
+            'amount': RevenueRollup.amount + stmt.excluded.amount,
+            'count': RevenueRollup.count + stmt.excluded.count,
+            'updated_at': stmt.excluded.updated_at,
+        }
+    )
+
+
+def _increment_rows(session, rows):
+    """ロールアップ行を加算（コミットは呼び出し側）"""
+    stmt = increment_statement(session.get_bind().dialect.name, rows)
+    if stmt is not None:
+        session.execute(stmt)
+        return
+
+    # UPSERT非対応のDBでは読み取り→加算で代替
+    for row in rows:
+        key = tuple(row[column] for column in ROLLUP_KEY_COLUMNS)
+        rollup = session.get(RevenueRollup, key)
+        if rollup is None:
+            session.add(RevenueRollup(**row))
+        else:
+            rollup.amount = (rollup.amount or Decimal(0)) + row['amount']
+            rollup.count = (rollup.count or 0) + row['count']
+
+
+def ledger_rollup_rows(ledger_entry):
+    """台帳レコードに対応するロールアップ行（支払い済み以外は空）"""
+    if ledger_entry.status != 'paid' or ledger_entry.amount is None:
+        return []
+    day = datetime.date.fromisoformat(ledger_entry.created_at[:10])
+    return _rollup_rows('ledger', ledger_entry.currency, ledger_entry.product_name, '', ledger_entry.amount, day)
+
+
+def invoice_rollup_rows(invoice_entry, price_id):
+    """請求書レコードに対応するロールアップ行（支払い済み以外は空）"""
+    if invoice_entry.status != 'paid' or invoice_entry.amount_due is None:
+        return []
+    created = invoice_entry.created or int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+    day = datetime.datetime.fromtimestamp(created, tz=datetime.timezone.utc).date()
+    plan_name = get_plan_name_from_price_id(price_id) if price_id else ''
+    return _rollup_rows('invoice', invoice_entry.currency, price_id, plan_name, invoice_entry.amount_due, day)
+
+
+def _shares_connections_across_threads():
+    """別スレッドのセッションが同じデータベースを参照できるか（インメモリSQLiteはスレッドごとに別DB）"""
+    return not isinstance(database.engine.pool, SingletonThreadPool)
+
+
+def _day_bounds(day):
+    """UTCの1日の範囲（ISO文字列とUnix timestamp）"""
+    next_day = day + datetime.timedelta(days=1)
+    start_epoch = int(datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc).timestamp())
+    return day.isoformat(), next_day.isoformat(), start_epoch, start_epoch + 86400
+
+
+# ============================================
+# 記録（record_ledger / record_invoice から呼び出す）
+# ============================================
+
+def add_ledger_to_rollups(session, ledger_entry):
+    """新規の台帳レコードをロールアップに加算（コミットは呼び出し側）"""
+    rows = ledger_rollup_rows(ledger_entry)
+    if rows:
+        _increment_rows(session, rows)
+
+
+def add_invoice_to_rollups(session, invoice_entry):
+    """新規の請求書レコードをロールアップに加算（コミットは呼び出し側）"""
+    price_id = None
+    if invoice_entry.subscription_id:
+        price_id = session.query(Subscription.price_id).filter_by(id=invoice_entry.subscription_id).scalar()
+    rows = invoice_rollup_rows(invoice_entry, price_id)
+    if rows:
+        _increment_rows(session, rows)
+
+
+# ============================================
+# 再集計
+# ============================================
+
+def _rebuild_day(day):
+    """1日分の日次ロールアップを生データから再集計"""
+    day_start, day_end, epoch_start, epoch_end = _day_bounds(day)
+    period = day.isoformat()
+
+    session = get_session()
+    try:
+        session.query(RevenueRollup).filter_by(grain='day', period=period).delete(synchronize_session=False)
+
+        ledger_groups = session.query(
+            Ledger.currency, Ledger.product_name, func.sum(Ledger.amount), func.count()
+        ).filter(
+            Ledger.status == 'paid',
+            Ledger.amount.isnot(None),
+            Ledger.created_at >= day_start,
+            Ledger.created_at < day_end,
+        ).group_by(Ledger.currency, Ledger.product_name).all()
+
+        invoice_groups = session.query(
+            Invoice.currency, Subscription.price_id, func.sum(Invoice.amount_due), func.count()
+        ).outerjoin(
+            Subscription, Subscription.id == Invoice.subscription_id
+        ).filter(
+            Invoice.status == 'paid',
+            Invoice.amount_due.isnot(None),
+            Invoice.created >= epoch_start,
+            Invoice.created < epoch_end,
+        ).group_by(Invoice.currency, Subscription.price_id).all()
+
+        # 空文字に正規化すると別々のグループが同じキーになり得るため、ここで合算する
+        totals = {}
+        for source, groups in (('ledger', ledger_groups), ('invoice', invoice_groups)):
+            for currency, product, amount, count in groups:
+                plan_name = get_plan_name_from_price_id(product) if source == 'invoice' and product else ''
+                key = (currency or '', source, product or '', plan_name)
+                total = totals.setdefault(key, [Decimal(0), 0])
+                total[0] += Decimal(amount)
+                total[1] += count
+
+        # 削除後に増分更新が同じキーの行を挿入している場合があるため、UPSERTで加算して書き込む
+        rows = [
+            {
+                'grain': 'day', 'period': period, 'currency': currency, 'source': source,
+                'product': product, 'plan_name': plan_name, 'amount': amount, 'count': count,
+                'updated_at': datetime.datetime.utcnow(),
+            }
+            for (currency, source, product, plan_name), (amount, count) in totals.items()
+        ]
+        if rows:
+            _increment_rows(session, rows)
+
+        session.commit()
+        return len(totals)
+    except Exception as e:
+        logger.error(f"Error rebuilding daily revenue rollup for {period}: {e}")
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+def _rebuild_month(month):
+    """月次ロールアップを日次ロールアップから再集計"""
+    session = get_session()
+    try:
+        session.query(RevenueRollup).filter_by(grain='month', period=month).delete(synchronize_session=False)
+
+        groups = session.query(
+            RevenueRollup.currency,
+            RevenueRollup.source,
+            RevenueRollup.product,
+            RevenueRollup.plan_name,
+            func.sum(RevenueRollup.amount),
+            func.sum(RevenueRollup.count),
+        ).filter(
+            RevenueRollup.grain == 'day',
+            RevenueRollup.period.like(f"{month}-%"),
+        ).group_by(
+            RevenueRollup.currency, RevenueRollup.source, RevenueRollup.product, RevenueRollup.plan_name
+        ).all()
+
+        rows = [
+            {
+                'grain': 'month', 'period': month, 'currency': currency, 'source': source,
+                'product': product, 'plan_name': plan_name, 'amount': amount, 'count': count,
+                'updated_at': datetime.datetime.utcnow(),
+            }
+            for currency, source, product, plan_name, amount, count in groups
+        ]
+        if rows:
+            _increment_rows(session, rows)
+
+        session.commit()
+    except Exception as e:
+        logger.error(f"Error rebuilding monthly revenue rollup for {month}: {e}")
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+def rebuild_revenue_rollups(start, end, workers=DEFAULT_REBUILD_WORKERS):
+    """[start, end) の日次ロールアップを並列に再集計し、該当する月の月次ロールアップを作り直す"""
+    days = [start + datetime.timedelta(days=offset) for offset in range((end - start).days)]
+    if not days:
+        return {"days": 0, "months": 0, "rows": 0}
+
+    # 日単位のタスクは互いに別の行を書き換えるため並列に実行できる
+    # （インメモリSQLiteのように接続をスレッド間で共有できない場合は逐次実行）
+    if _shares_connections_across_threads():
+        with ThreadPoolExecutor(max_workers=min(max(1, workers), MAX_REBUILD_WORKERS)) as executor:
+            row_counts = list(executor.map(_rebuild_day, days))
+    else:
+        row_counts = [_rebuild_day(day) for day in days]
+
+    # 月次は日次の合計（範囲外の日は増分更新済みの日次行をそのまま使う）
+    months = sorted({day.strftime('%Y-%m') for day in days})
+    for month in months:
+        _rebuild_month(month)
+
+    logger.info(f"Revenue rollups rebuilt: {start} - {end} ({len(days)} days, {len(months)} months)")
+    return {"days": len(days), "months": len(months), "rows": sum(row_counts)}
+
+
+# ============================================
+# 読み取り
+# ============================================
+
+def get_revenue_rollups(grain, start_period, end_period, currency=None):
+    """ロールアップ行を取得（periodは start_period 以上 end_period 未満）"""
+    session = get_session()
+    try:
+        query = session.query(RevenueRollup).filter(
+            RevenueRollup.grain == grain,
+            RevenueRollup.period >= start_period,
+            RevenueRollup.period < end_period,
+        )
+        if currency:
+            query = query.filter(RevenueRollup.currency == currency)
+
+        return [
+            {
+                "period": rollup.period,
+                "currency": rollup.currency,
+                "source": rollup.source,
+                "product": rollup.product,
+                "plan_name": rollup.plan_name,
+                "amount": float(rollup.amount),
+                "count": rollup.count,
+            }
+            for rollup in query.order_by(
+                RevenueRollup.period, RevenueRollup.currency, RevenueRollup.source, RevenueRollup.product
+            ).all()
+        ]
+    except Exception as e:
+        logger.error(f"Error getting revenue rollups: {e}")
+        raise e
+    finally:
+        session.close()
@@ -0,0 +1,126 @@
+"""
+セッションの最終アクティビティ（last_activity）の書き込みバッファ
+validate_session は読み取りだけを行い、更新はメモリに溜めてバックグラウンドでまとめて書き込む
+"""
+import os
+import atexit
+import datetime
+import logging
+import threading
+import time
+from sqlalchemy import case
+from models import UserSession
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# 同じセッションの last_activity を更新する最小間隔（秒）
+MIN_UPDATE_INTERVAL_SECONDS = int(os.getenv("SESSION_ACTIVITY_MIN_INTERVAL_SECONDS", "60"))
+
+# バッファをDBへ書き込む間隔（秒）。0以下の場合はバッファせず即時に書き込む
+FLUSH_INTERVAL_SECONDS = float(os.getenv("SESSION_ACTIVITY_FLUSH_SECONDS", "10"))
+
+# 1回のUPDATE文で更新するセッション数の上限
+FLUSH_BATCH_SIZE = 500
+
+
+class SessionActivityBuffer:
+    """セッショントークンごとの最新アクティビティ時刻を保持し、一括UPDATEで書き込む"""
+
+    def __init__(self, min_interval=MIN_UPDATE_INTERVAL_SECONDS, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.min_interval = datetime.timedelta(seconds=min_interval)
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._recorded = {}  # 直近に記録した時刻（DBの値を読まない署名付きトークン向け）
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def should_record(self, last_activity, now):
+        """前回の記録から最小間隔が経過しているか"""
+        return last_activity is None or now - last_activity >= self.min_interval
+
+    def record(self, session_token, now, last_activity=None):
+        """アクティビティを記録（最小間隔内の場合は何もしない）"""
+        if not self.should_record(last_activity, now):
+            return False
+
+        with self._lock:
+            # 直近に記録した時刻からも最小間隔を判定する（同じセッションの連続リクエスト）
+            recorded = self._recorded.get(session_token)
+            if recorded is not None and now - recorded < self.min_interval:
+                return False
+            self._pending[session_token] = now
+            self._recorded[session_token] = now
+
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_worker()
+        return True
+
+    def discard(self, session_token):
+        """書き込み待ちのアクティビティを破棄（ログアウト時）"""
+        with self._lock:
+            self._pending.pop(session_token, None)
+            self._recorded.pop(session_token, None)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """書き込み待ちのアクティビティを一括でDBへ書き込み（書き込んだセッション数を返す）"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            # 最小間隔を過ぎた記録は判定に不要なので捨てる
+            cutoff = datetime.datetime.utcnow() - self.min_interval
+            self._recorded = {token: at for token, at in self._recorded.items() if at > cutoff}
+        if not pending:
+            return 0
+
+        items = list(pending.items())
+        session = database.get_session()
+        try:
+            for offset in range(0, len(items), FLUSH_BATCH_SIZE):
+                batch = dict(items[offset:offset + FLUSH_BATCH_SIZE])
+                # UPDATE ... SET last_activity = CASE session_token WHEN ... END WHERE session_token IN (...)
+                session.query(UserSession).filter(
+                    UserSession.session_token.in_(list(batch)),
+                    UserSession.is_active == True
+                ).update(
+                    {'last_activity': case(batch, value=UserSession.session_token)},
+                    synchronize_session=False
+                )
+            session.commit()
+            return len(items)
+        except Exception as e:
+            logger.error(f"Error flushing session activity: {e}")
+            session.rollback()
+            # 失敗した分は次回に再送（その間に記録された新しい時刻を優先）
+            with self._lock:
+                for session_token, timestamp in items:
+                    self._pending.setdefault(session_token, timestamp)
+            return 0
+        finally:
+            session.close()
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="session-activity-flush", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+# プロセス全体で共有するバッファ
+activity_buffer = SessionActivityBuffer()
+
+# 終了時に書き込み待ちの分を書き込む
+atexit.register(activity_buffer.flush)
@@ -0,0 +1,143 @@
+"""
+検証済みセッションのキャッシュ（トークン → ユーザーID・有効期限）
+プロセス内のTTLキャッシュを一次、Redisを任意の二次として、user_sessions の照会を省略する
+"""
+import os
+import time
+import hashlib
+import logging
+from cache import LocalTTLCache, CacheService
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの保持時間（秒）。他プロセスでのログアウトはこの時間だけ遅れて反映される。0で無効
+SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "30"))
+
+# プロセス内キャッシュの最大件数
+SESSION_CACHE_MAX_SIZE = int(os.getenv("SESSION_CACHE_MAX_SIZE", "10000"))
+
+# Redisを二次キャッシュとして使うか（プロセス間でキャッシュとログアウトを共有する）
+SESSION_CACHE_REDIS = os.getenv("SESSION_CACHE_REDIS", "false").lower() in ("1", "true", "yes")
+
+_local_cache = LocalTTLCache(SESSION_CACHE_TTL_SECONDS, max_size=SESSION_CACHE_MAX_SIZE)
+
+# 二次キャッシュのヒット数と、どちらにもなくDBを照会した回数
+_shared_hits = 0
+_db_lookups = 0
+
+
+# ============================================
+# 内部ユーティリティ
+# ============================================
+
+def _key(session_token):
+    """トークンそのものは保存しない（Redisに平文のトークンを置かない）"""
+    return hashlib.sha256(session_token.encode()).hexdigest()
+
+
+def _redis_key(key):
+    return f"{CacheService.CACHE_PREFIX}:session:{key}"
+
+
+def _redis():
+    """二次キャッシュのRedisクライアント（無効・接続できない場合はNone）"""
+    if not SESSION_CACHE_REDIS:
+        return None
+    from cache import redis_client
+    return redis_client
+
+
+# ============================================
+# 取得・保存・無効化
+# ============================================
+
+def get_cached_session(session_token):
+    """キャッシュ済みのユーザーIDを取得（ない場合・期限切れの場合はNone）"""
+    global _shared_hits, _db_lookups
+    if SESSION_CACHE_TTL_SECONDS <= 0 or not session_token:
+        return None
+
+    key = _key(session_token)
+    entry = _local_cache.get(key)
+    if entry is not None:
+        user_id, expires_at = entry
+        if expires_at > time.time():
+            return user_id
+        _local_cache.delete(key)
+
+    client = _redis()
+    if client is not None:
+        try:
+            value = client.get(_redis_key(key))
+            if value:
+                user_id, expires_at = (int(part) for part in value.decode().split(":"))
+                if expires_at > time.time():
+                    _local_cache.set(key, (user_id, expires_at), ttl=min(SESSION_CACHE_TTL_SECONDS, expires_at - time.time()))
+                    _shared_hits += 1
+                    return user_id
+        except Exception as e:
+            logger.warning(f"Session cache get error: {e}")
+
+    _db_lookups += 1
+    return None
+
+
+def cache_session(session_token, user_id, expires_at):
+    """検証済みセッションをキャッシュ（expires_at はセッションの有効期限（epoch））"""
+    if SESSION_CACHE_TTL_SECONDS <= 0:
+        return
+
+    ttl = min(SESSION_CACHE_TTL_SECONDS, expires_at - time.time())
+    if ttl <= 0:
+        return
+
+    key = _key(session_token)
+    _local_cache.set(key, (user_id, int(expires_at)), ttl=ttl)
+
+    client = _redis()
+    if client is not None:
+        try:
+            client.setex(_redis_key(key), max(1, int(ttl)), f"{user_id}:{int(expires_at)}")
+        except Exception as e:
+            logger.warning(f"Session cache set error: {e}")
+
+
+def invalidate_sessions(session_tokens):
+    """セッションのキャッシュを削除（ログアウト・再ログイン時）"""
+    keys = [_key(session_token) for session_token in session_tokens if session_token]
+    if not keys:
+        return
+
+    for key in keys:
+        _local_cache.delete(key)
+
+    client = _redis()
+    if client is not None:
+        try:
+            client.delete(*[_redis_key(key) for key in keys])
+        except Exception as e:
+            logger.warning(f"Session cache delete error: {e}")
+
+
+def get_session_cache_stats():
+    """キャッシュのヒット・ミス数（db_lookups が user_sessions を実際に照会した回数）"""
+    local = _local_cache.stats()
+    saved = local['hits'] + _shared_hits
+    lookups = saved + _db_lookups
+    return {
+        'enabled': SESSION_CACHE_TTL_SECONDS > 0,
+        'shared_tier': SESSION_CACHE_REDIS,
+        'size': local['size'],
+        'local_hits': local['hits'],
+        'shared_hits': _shared_hits,
+        'db_lookups': _db_lookups,
+        'hit_rate': round(saved / lookups, 4) if lookups else 0.0,
+    }
+
+
+def clear_session_cache():
+    """キャッシュと統計をリセット"""
+    global _shared_hits, _db_lookups
+    _local_cache.clear()
+    _shared_hits = 0
+    _db_lookups = 0
@@ -7,6 +7,17 @@ import secrets
 from models import UserSession
 from .database import get_session
 from .user_repository import get_user_by_id
+from .session_activity import activity_buffer
+from .session_sweeper import session_sweeper, session_expiry_cutoff
+from .session_cache import get_cached_session, cache_session, invalidate_sessions
+from .session_tokens import (
+    signed_tokens_enabled,
+    is_signed_token,
+    issue_signed_token,
+    validate_signed_token,
+    revoke_signed_tokens,
+    SESSION_TTL_SECONDS,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +29,13 @@ def create_session(user_id):
     try:
         session = get_session()
         
-        # 既存のセッションを無効化
+        # 既存のセッションを無効化（署名付きトークンは後で失効セットにも登録する）
+        previous_tokens = [
+            row.session_token for row in session.query(UserSession.session_token).filter(
+                UserSession.user_id == user_id,
+                UserSession.is_active == True
+            ).all()
+        ]
         session.query(UserSession).filter(
             UserSession.user_id == user_id,
             UserSession.is_active == True
@@ -34,7 +51,17 @@ def create_session(user_id):
         )
         
         session.add(new_session)
+        
+        # 署名付きトークンはセッションIDを埋め込むため、採番後に発行し直す
+        if signed_tokens_enabled():
+            session.flush()
+            session_token = issue_signed_token(user_id, new_session.id)
+            new_session.session_token = session_token
+        
         session.commit()
+        invalidate_sessions(previous_tokens)
+        revoke_signed_tokens(previous_tokens)
+        session_sweeper.ensure_started()
         
         return session_token
         
@@ -48,27 +75,37 @@ def create_session(user_id):
 
 def validate_session(session_token):
     """セッションを検証"""
+    # 署名付きトークンはDBを参照せずに検証する
+    if is_signed_token(session_token):
+        user_id = validate_signed_token(session_token)
+        if user_id:
+            activity_buffer.record(session_token, datetime.datetime.utcnow())
+        return user_id
+    
+    # 直近に検証済みのトークンはDBを照会しない
+    user_id = get_cached_session(session_token)
+    if user_id:
+        activity_buffer.record(session_token, datetime.datetime.utcnow())
+        return user_id
+    
     try:
         session = get_session()
         
-        # セッションを検索
+        # セッションを検索（有効期限切れの行は条件で除外し、削除はスイーパーに任せる）
         user_session = session.query(UserSession).filter(
             UserSession.session_token == session_token,
-            UserSession.is_active == True
+            UserSession.is_active == True,
+            UserSession.created_at > session_expiry_cutoff()
         ).first()
         
         if not user_session:
             return None
         
-        # セッションの有効期限チェック（24時間）
-        if datetime.datetime.utcnow() - user_session.created_at > datetime.timedelta(hours=24):
-            user_session.is_active = False
-            session.commit()
-            return None
+        # 最終アクティビティはバッファに記録し、まとめて書き込む（検証自体は読み取りのみ）
+        activity_buffer.record(session_token, datetime.datetime.utcnow(), user_session.last_activity)
         
-        # 最終アクティビティを更新
-        user_session.last_activity = datetime.datetime.utcnow()
-        session.commit()
+        expires_at = user_session.created_at.replace(tzinfo=datetime.timezone.utc).timestamp() + SESSION_TTL_SECONDS
+        cache_session(session_token, user_session.user_id, expires_at)
         
         return user_session.user_id
         
@@ -93,6 +130,11 @@ def logout_user(session_token):
         if user_session:
             user_session.is_active = False
             session.commit()
+        
+        invalidate_sessions([session_token])
+        if user_session:
+            activity_buffer.discard(session_token)
+            revoke_signed_tokens([session_token])
             return True
         return False
             
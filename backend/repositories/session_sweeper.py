@@ -0,0 +1,148 @@
+"""
+期限切れ・無効化済みセッションの削除（user_sessions の肥大化を防ぐ）
+バックグラウンドのスレッドで一定間隔ごとに、件数を区切ったDELETEで少しずつ削除する
+"""
+import os
+import time
+import logging
+import datetime
+import threading
+from models import UserSession
+from . import database
+from .session_tokens import SESSION_TTL_SECONDS, TOKEN_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# 削除を実行する間隔（秒）。0以下の場合はバックグラウンドで実行しない
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "300"))
+
+# 1回のDELETE文で削除する行数の上限
+SWEEP_BATCH_SIZE = int(os.getenv("SESSION_SWEEP_BATCH_SIZE", "1000"))
+
+# 1回の実行で発行するDELETE文の上限（残りは次回に回す）
+SWEEP_MAX_BATCHES = int(os.getenv("SESSION_SWEEP_MAX_BATCHES", "50"))
+
+# DELETE文の間に空ける秒数（他のクエリにロックを譲る）
+SWEEP_BATCH_PAUSE_SECONDS = float(os.getenv("SESSION_SWEEP_BATCH_PAUSE_SECONDS", "0.05"))
+
+
+def session_expiry_cutoff(now=None):
+    """この時刻以前に作成されたセッションは有効期限切れ"""
+    now = now or datetime.datetime.utcnow()
+    return now - datetime.timedelta(seconds=SESSION_TTL_SECONDS)
+
+
+def _expired_filter(cutoff):
+    return [UserSession.created_at <= cutoff]
+
+
+def _inactive_filter(cutoff):
+    # 署名付きトークンの無効化済み行は、DBから失効セットを同期する際に使うため有効期限まで残す
+    return [
+        UserSession.is_active == False,
+        UserSession.created_at > cutoff,
+        ~UserSession.session_token.like(f"{TOKEN_PREFIX}%"),
+    ]
+
+
+class SessionSweeper:
+    """期限切れ・無効化済みのセッションを件数を区切って削除する"""
+
+    def __init__(self, interval=SWEEP_INTERVAL_SECONDS, batch_size=SWEEP_BATCH_SIZE,
+                 max_batches=SWEEP_MAX_BATCHES, pause=SWEEP_BATCH_PAUSE_SECONDS):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.pause = pause
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {
+            'runs': 0,
+            'deleted_expired': 0,
+            'deleted_inactive': 0,
+            'last_run_at': None,
+            'last_duration_ms': None,
+            'last_deleted': 0,
+            'backlog_remaining': False,
+            'errors': 0,
+        }
+
+    def sweep(self, now=None):
+        """1回分の削除を実行（削除した行数を返す）"""
+        started = time.monotonic()
+        cutoff = session_expiry_cutoff(now)
+        batches = 0
+        deleted = {'expired': 0, 'inactive': 0}
+        remaining = False
+
+        session = database.get_session()
+        try:
+            for kind, conditions in (('expired', _expired_filter(cutoff)), ('inactive', _inactive_filter(cutoff))):
+                while batches < self.max_batches:
+                    ids = [row.id for row in session.query(UserSession.id).filter(*conditions)
+                           .order_by(UserSession.id).limit(self.batch_size).all()]
+                    if not ids:
+                        break
+
+                    session.query(UserSession).filter(UserSession.id.in_(ids)).delete(synchronize_session=False)
+                    session.commit()
+                    deleted[kind] += len(ids)
+                    batches += 1
+
+                    if len(ids) < self.batch_size:
+                        break
+                    if self.pause > 0:
+                        time.sleep(self.pause)
+                else:
+                    remaining = True
+        except Exception as e:
+            logger.error(f"Error sweeping sessions: {e}")
+            session.rollback()
+            with self._lock:
+                self._stats['errors'] += 1
+        finally:
+            session.close()
+
+        total = deleted['expired'] + deleted['inactive']
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['deleted_expired'] += deleted['expired']
+            self._stats['deleted_inactive'] += deleted['inactive']
+            self._stats['last_run_at'] = datetime.datetime.utcnow().isoformat()
+            self._stats['last_duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+            self._stats['last_deleted'] = total
+            self._stats['backlog_remaining'] = remaining
+
+        if total:
+            logger.info(f"Swept {deleted['expired']} expired and {deleted['inactive']} inactive sessions")
+        return total
+
+    def stats(self):
+        with self._lock:
+            return {
+                'interval_seconds': self.interval,
+                'batch_size': self.batch_size,
+                'running': self._thread is not None and self._thread.is_alive(),
+                **self._stats,
+            }
+
+    def ensure_started(self):
+        """バックグラウンドの削除スレッドを起動（起動済み・無効の場合は何もしない）"""
+        if self.interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="session-sweeper", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.sweep()
+
+
+# プロセス全体で共有するスイーパー
+session_sweeper = SessionSweeper()
@@ -0,0 +1,212 @@
+"""
+署名付きセッショントークン（v1形式）と失効セットの管理
+トークンにユーザーID・セッションID・発行時刻とHMAC署名を埋め込み、DBを参照せずに検証する
+失効（ログアウト・再ログインによる旧セッションの無効化）は失効セットで判定する
+"""
+import os
+import hmac
+import time
+import base64
+import hashlib
+import logging
+import threading
+import datetime
+from models import UserSession
+from . import database
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PREFIX = "v1."
+
+# セッションの有効期間（秒）
+SESSION_TTL_SECONDS = int(float(os.getenv("SESSION_TTL_HOURS", "24")) * 3600)
+
+# 失効セットを同期する間隔（秒）
+REVOCATION_SYNC_SECONDS = float(os.getenv("SESSION_REVOCATION_SYNC_SECONDS", "5"))
+
+# Redisの失効セット（sorted set: member=セッションID, score=トークンの有効期限）
+REVOCATION_REDIS_KEY = "session:revoked"
+
+
+# ============================================
+# トークンの発行・検証
+# ============================================
+
+def signed_tokens_enabled():
+    """署名付きトークンを発行するか（SESSION_TOKEN_FORMAT=signed かつ秘密鍵が設定されている場合）"""
+    return os.getenv("SESSION_TOKEN_FORMAT", "opaque") == "signed" and _secret() is not None
+
+
+def is_signed_token(session_token):
+    return bool(session_token) and session_token.startswith(TOKEN_PREFIX)
+
+
+def _secret():
+    secret = os.getenv("SESSION_TOKEN_SECRET") or os.getenv("SECRET_KEY")
+    return secret.encode() if secret else None
+
+
+def _sign(payload):
+    digest = hmac.new(_secret(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def issue_signed_token(user_id, session_id, issued_at=None):
+    """署名付きトークンを発行（v1.<user_id>.<session_id>.<issued_at>.<signature>）"""
+    issued_at = int(issued_at if issued_at is not None else time.time())
+    payload = f"{TOKEN_PREFIX}{user_id}.{session_id}.{issued_at}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def parse_signed_token(session_token):
+    """署名を検証してトークンの内容を返す（不正な場合はNone）
+
+    戻り値: (user_id, session_id, issued_at)
+    """
+    if not is_signed_token(session_token) or _secret() is None:
+        return None
+
+    payload, _, signature = session_token.rpartition(".")
+    parts = payload[len(TOKEN_PREFIX):].split(".")
+    if len(parts) != 3 or not hmac.compare_digest(signature, _sign(payload)):
+        return None
+
+    try:
+        user_id, session_id, issued_at = (int(part) for part in parts)
+    except ValueError:
+        return None
+    return user_id, session_id, issued_at
+
+
+def validate_signed_token(session_token):
+    """署名・有効期限・失効を確認してユーザーIDを返す（無効な場合はNone）"""
+    claims = parse_signed_token(session_token)
+    if claims is None:
+        return None
+
+    user_id, session_id, issued_at = claims
+    if time.time() - issued_at > SESSION_TTL_SECONDS:
+        return None
+    if revocation_set.is_revoked(session_id):
+        return None
+    return user_id
+
+
+def revoke_signed_tokens(session_tokens):
+    """署名付きトークンのセッションを失効セットに登録（署名付きでないトークンは無視）"""
+    for session_token in session_tokens:
+        claims = parse_signed_token(session_token)
+        if claims:
+            _, session_id, issued_at = claims
+            revocation_set.revoke([session_id], expires_at=issued_at + SESSION_TTL_SECONDS)
+
+
+# ============================================
+# 失効セット
+# ============================================
+
+def _redis():
+    """共有キャッシュのRedisクライアント（利用できない場合はNone）"""
+    try:
+        from cache import redis_client
+        return redis_client
+    except Exception:
+        return None
+
+
+class RevocationSet:
+    """失効したセッションIDの集合（有効期間内のものだけを保持）
+
+    同期元はRedisの失効セット（利用できない場合は user_sessions の無効化済み行）で、
+    REVOCATION_SYNC_SECONDS ごとに取り込む。自プロセスでの失効は即時に反映する
+    """
+
+    def __init__(self, sync_interval=REVOCATION_SYNC_SECONDS):
+        self.sync_interval = sync_interval
+        self._revoked = {}  # セッションID -> 失効情報を保持する期限（epoch）
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+
+    def revoke(self, session_ids, expires_at=None):
+        """セッションIDを失効させる（expires_atはトークンの有効期限。以降は保持しない）"""
+        expires_at = expires_at or time.time() + SESSION_TTL_SECONDS
+        session_ids = list(session_ids)
+        if not session_ids:
+            return
+
+        with self._lock:
+            for session_id in session_ids:
+                self._revoked[session_id] = expires_at
+
+        client = _redis()
+        if client is not None:
+            try:
+                client.zadd(REVOCATION_REDIS_KEY, {str(session_id): expires_at for session_id in session_ids})
+            except Exception as e:
+                logger.warning(f"Failed to publish session revocation to Redis: {e}")
+
+    def is_revoked(self, session_id):
+        if time.monotonic() - self._synced_at >= self.sync_interval:
+            self.sync()
+        return session_id in self._revoked
+
+    def sync(self):
+        """同期元から失効セットを取り込む"""
+        # 同期中に他のスレッドが重ねて同期しないよう、先に同期時刻を進める
+        with self._lock:
+            if time.monotonic() - self._synced_at < self.sync_interval:
+                return
+            self._synced_at = time.monotonic()
+
+        now = time.time()
+        try:
+            revoked = self._load_from_redis(now)
+            if revoked is None:
+                revoked = self._load_from_db(now)
+        except Exception as e:
+            logger.error(f"Error syncing session revocations: {e}")
+            return
+
+        with self._lock:
+            # 同期元にまだ反映されていない自プロセスの失効は残す
+            for session_id, expires_at in self._revoked.items():
+                if expires_at > now:
+                    revoked.setdefault(session_id, expires_at)
+            self._revoked = revoked
+
+    def _load_from_redis(self, now):
+        client = _redis()
+        if client is None:
+            return None
+        try:
+            client.zremrangebyscore(REVOCATION_REDIS_KEY, "-inf", now)
+            members = client.zrange(REVOCATION_REDIS_KEY, 0, -1, withscores=True)
+        except Exception as e:
+            logger.warning(f"Failed to load session revocations from Redis: {e}")
+            return None
+        return {int(member): score for member, score in members}
+
+    def _load_from_db(self, now):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=SESSION_TTL_SECONDS)
+        session = database.get_session()
+        try:
+            rows = session.query(UserSession.id, UserSession.created_at).filter(
+                UserSession.is_active == False,
+                UserSession.created_at >= cutoff,
+                UserSession.session_token.like(f"{TOKEN_PREFIX}%")
+            ).all()
+        finally:
+            session.close()
+        return {
+            session_id: created_at.replace(tzinfo=datetime.timezone.utc).timestamp() + SESSION_TTL_SECONDS
+            for session_id, created_at in rows
+        }
+
+    def clear(self):
+        with self._lock:
+            self._revoked = {}
+            self._synced_at = 0.0
+
+
+# プロセス全体で共有する失効セット
+revocation_set = RevocationSet()
@@ -1,10 +1,10 @@
 """
 サブスクリプション関連のリポジトリ
 """
-import os
 import datetime
 import logging
 from models import Subscription
+from plan_catalog import plan_catalog
 from .database import get_session
 
 logger = logging.getLogger(__name__)
@@ -125,13 +125,5 @@ def get_user_subscriptions(user_id):
 
 
 def get_plan_name_from_price_id(price_id):
-    """price_idからプラン名を取得"""
-    premium_price_id = os.getenv("PREMIUM_PRICE_ID", os.getenv("PRICE_ID"))
-    standard_price_id = os.getenv("STANDARD_PRICE_ID")
-    
-    if price_id == premium_price_id:
-        return "プレミアムプラン"
-    elif price_id == standard_price_id:
-        return "スタンダードプラン"
-    else:
-        return "不明なプラン"
+    """price_idからプラン名を取得（プランカタログを辞書で引く）"""
+    return plan_catalog.plan_name(price_id)
@@ -0,0 +1,136 @@
+"""
+サブスクリプションスケジュール（プラン変更予約）のリポジトリ
+Webhookとプラン変更APIで受け取ったスケジュールを保存し、マイページはStripeを呼ばずにこのテーブルから予約を表示する
+"""
+import logging
+from models import SubscriptionSchedule, Subscription
+from .database import get_session
+
+logger = logging.getLogger(__name__)
+
+# 変更予約が有効な状態
+PENDING_STATUSES = ('not_started', 'active')
+
+# 終了した状態（同じスケジュールが再び有効になることはない）
+FINISHED_STATUSES = ('completed', 'released', 'canceled', 'aborted')
+
+
+# ============================================
+# 内部ユーティリティ
+# ============================================
+
+def _phase_price_id(phase):
+    """フェーズの最初の品目の価格ID（展開済みの場合はオブジェクトからIDを取り出す）"""
+    items = phase.get('items') or []
+    if not items:
+        return None
+    price = items[0].get('price')
+    if isinstance(price, dict):
+        return price.get('id')
+    return price
+
+
+def _parse_phases(schedule_object):
+    """(現在の価格ID, 次の価格ID, 切り替え日時) を返す"""
+    phases = schedule_object.get('phases') or []
+    if not phases:
+        return None, None, None
+
+    # current_phase の開始日時と一致するフェーズを現在のフェーズとする（開始前は先頭）
+    current_index = 0
+    current_phase = schedule_object.get('current_phase') or {}
+    current_start = current_phase.get('start_date')
+    if current_start is not None:
+        for index, phase in enumerate(phases):
+            if phase.get('start_date') == current_start:
+                current_index = index
+                break
+
+    current = phases[current_index]
+    if current_index + 1 >= len(phases):
+        return _phase_price_id(current), None, None
+
+    next_phase = phases[current_index + 1]
+    change_date = next_phase.get('start_date') or current.get('end_date')
+    return _phase_price_id(current), _phase_price_id(next_phase), change_date
+
+
+def _resolve_user_id(session, schedule_object, subscription_id):
+    """メタデータ → サブスクリプションの所有者 の順にユーザーIDを解決"""
+    user_id = (schedule_object.get('metadata') or {}).get('user_id')
+    if user_id:
+        return int(user_id)
+    if subscription_id:
+        row = session.query(Subscription.user_id).filter_by(id=subscription_id).first()
+        if row:
+            return row.user_id
+    return None
+
+
+# ============================================
+# 公開関数
+# ============================================
+
+def upsert_subscription_schedule(schedule_object, user_id=None):
+    """Stripeのスケジュールオブジェクトを保存（保存した行を返す）"""
+    schedule_id = schedule_object.get('id')
+    status = schedule_object.get('status')
+    subscription_id = schedule_object.get('subscription') or schedule_object.get('released_subscription')
+    current_price_id, next_price_id, change_date = _parse_phases(schedule_object)
+
+    session = get_session()
+    try:
+        schedule = session.get(SubscriptionSchedule, schedule_id)
+
+        # 順序が入れ替わって届いた古いイベントで、終了済みのスケジュールを有効に戻さない
+        if schedule is not None and schedule.status in FINISHED_STATUSES and status not in FINISHED_STATUSES:
+            logger.info(f"Ignoring stale schedule update for {schedule_id}: {schedule.status} -> {status}")
+            session.expunge(schedule)
+            return schedule
+
+        if schedule is None:
+            schedule = SubscriptionSchedule(id=schedule_id)
+            session.add(schedule)
+
+        if user_id is None:
+            user_id = schedule.user_id or _resolve_user_id(session, schedule_object, subscription_id)
+
+        schedule.subscription_id = subscription_id or schedule.subscription_id
+        schedule.user_id = user_id
+        schedule.customer_id = schedule_object.get('customer') or schedule.customer_id
+        schedule.status = status
+        schedule.current_price_id = current_price_id
+        schedule.next_price_id = next_price_id if status in PENDING_STATUSES else None
+        schedule.change_date = change_date if status in PENDING_STATUSES else None
+        session.commit()
+        session.refresh(schedule)
+        session.expunge(schedule)
+        logger.info(f"Subscription schedule saved: {schedule_id} ({status})")
+        return schedule
+    except Exception as e:
+        logger.error(f"Error saving subscription schedule {schedule_id}: {e}")
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+def get_pending_schedules(subscription_ids):
+    """サブスクリプションIDごとの有効な変更予約を1回のクエリで取得（{subscription_id: SubscriptionSchedule}）"""
+    subscription_ids = list(subscription_ids)
+    if not subscription_ids:
+        return {}
+
+    session = get_session()
+    try:
+        schedules = session.query(SubscriptionSchedule).filter(
+            SubscriptionSchedule.subscription_id.in_(subscription_ids),
+            SubscriptionSchedule.status.in_(PENDING_STATUSES),
+            SubscriptionSchedule.next_price_id.isnot(None),
+        ).all()
+        return {schedule.subscription_id: schedule for schedule in schedules}
+    except Exception as e:
+        logger.error(f"Error getting subscription schedules: {e}")
+        raise e
+    finally:
+        session.close()
@@ -2,11 +2,12 @@
 ユーザー関連のリポジトリ
 """
 import logging
-import hashlib
-import secrets
 import stripe
 from models import User, Ledger
 from .database import get_session
+from .password_hasher import make_password_hash, check_password_hash, needs_rehash, PasswordHasherBusy
+from .customer_cache import is_customer_verified, mark_customer_verified, invalidate_customer
+from .customer_provisioning import enqueue_customer_provisioning, provision_pending_customer, customer_provisioner
 
 logger = logging.getLogger(__name__)
 
@@ -16,20 +17,13 @@ logger = logging.getLogger(__name__)
 # ============================================
 
 def hash_password(password):
-    """パスワードをハッシュ化"""
-    salt = secrets.token_hex(16)
-    password_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), 100000)
-    return f"{salt}:{password_hash.hex()}"
+    """パスワードをハッシュ化（計算はプロセスプールで実行）"""
+    return make_password_hash(password)
 
 
 def verify_password(password, password_hash):
-    """パスワードを検証"""
-    try:
-        salt, hash_hex = password_hash.split(':')
-        password_hash_check = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), 100000)
-        return password_hash_check.hex() == hash_hex
-    except:
-        return False
+    """パスワードを検証（計算はプロセスプールで実行）"""
+    return check_password_hash(password, password_hash)
 
 
 # ============================================
@@ -55,8 +49,12 @@ def create_user(email, password_hash, name, phone=None, birthdate=None, terms_ac
             privacy_accepted=privacy_accepted
         )
         session.add(user)
+        session.flush()
+        # Stripe Customerはユーザーと同じトランザクションで積んだジョブからバックグラウンドで作成する
+        enqueue_customer_provisioning(session, user)
         session.commit()
         logger.info(f"User created: {user.email}")
+        customer_provisioner.notify()
         return user
     except Exception as e:
         logger.error(f"Error creating user: {e}")
@@ -129,6 +127,17 @@ def authenticate_user(email, password):
         if not verify_password(password, user.password_hash):
             return None
         
+        # 旧形式・反復回数の少ないハッシュはログイン成功時に現在の設定で作り直す
+        if needs_rehash(user.password_hash):
+            try:
+                user.password_hash = hash_password(password)
+                session.commit()
+                session.refresh(user)
+                logger.info(f"Password hash upgraded for user {user.id}")
+            except PasswordHasherBusy:
+                # 混雑時は再ハッシュを見送り、次回のログインで行う
+                logger.info(f"Password hash upgrade deferred for user {user.id}")
+        
         return user
     except Exception as e:
         logger.error(f"Error authenticating user: {e}")
@@ -145,14 +154,24 @@ def upsert_stripe_customer(user):
     """ユーザーのStripe Customerを作成または取得"""
     # 既にStripe Customer IDが存在する場合は返す
     if user.stripe_customer_id:
+        # 期限内に確認済みであればStripeに問い合わせない（削除はcustomer.deletedで反映される）
+        if is_customer_verified(user.stripe_customer_id):
+            return user.stripe_customer_id
         try:
             # Stripeで有効なCustomerか確認
             customer = stripe.Customer.retrieve(user.stripe_customer_id)
             if not customer.get('deleted'):
+                mark_customer_verified(user.stripe_customer_id)
                 return user.stripe_customer_id
         except stripe.error.StripeError:
             # Customer IDが無効な場合は新規作成
             pass
+        invalidate_customer(user.stripe_customer_id)
+    else:
+        # 登録時のジョブが未完了であれば、ワーカーと同じ冪等キーで作成する（二重に作成しない）
+        customer_id = provision_pending_customer(user)
+        if customer_id:
+            return customer_id
     
     # 新しいStripe Customerを作成
     try:
@@ -178,7 +197,28 @@ def upsert_stripe_customer(user):
         finally:
             session.close()
         
+        mark_customer_verified(customer.id)
         return customer.id
     except stripe.error.StripeError as e:
         logger.error(f"Error creating Stripe Customer: {e}")
         raise e
+
+
+def clear_stripe_customer(customer_id):
+    """削除されたStripe Customerをユーザーから外す（次回の購入時に新しいCustomerを作成する）"""
+    invalidate_customer(customer_id)
+    session = get_session()
+    try:
+        updated = session.query(User).filter_by(stripe_customer_id=customer_id).update(
+            {'stripe_customer_id': None}, synchronize_session=False
+        )
+        session.commit()
+        if updated:
+            logger.info(f"Cleared deleted Stripe Customer {customer_id} from {updated} user(s)")
+        return updated
+    except Exception as e:
+        logger.error(f"Error clearing stripe_customer_id {customer_id}: {e}")
+        session.rollback()
+        raise e
+    finally:
+        session.close()
@@ -7,10 +7,12 @@ from .auth_routes import auth_bp
 from .user_routes import user_bp
 from .payment_routes import payment_bp
 from .webhook_routes import webhook_bp
+from .admin_routes import admin_bp
 
 __all__ = [
     'auth_bp',
     'user_bp',
     'payment_bp',
     'webhook_bp',
+    'admin_bp',
 ]
@@ -0,0 +1,223 @@
+"""
+管理者向けのルート（売上分析）
+"""
+from flask import Blueprint, request, jsonify
+import datetime
+import click
+import logging
+from security import admin_required
+
+logger = logging.getLogger(__name__)
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
+
+
+def _parse_period():
+    """クエリパラメータから集計期間を取得（デフォルトは直近30日）"""
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    end = request.args.get("end") or (today + datetime.timedelta(days=1)).isoformat()
+    start = request.args.get("start") or (today - datetime.timedelta(days=29)).isoformat()
+    return datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+
+
+@admin_bp.route("/metrics", methods=["GET"])
+@admin_required
+def revenue_metrics():
+    """MRR・チャーン・ARPU・プラン構成の取得API"""
+    try:
+        from analytics import compute_revenue_metrics
+        
+        start, end = _parse_period()
+        if end <= start:
+            return jsonify({"success": False, "error": "endはstartより後の日付を指定してください"}), 400
+        
+        return jsonify({
+            "success": True,
+            "metrics": compute_revenue_metrics(start, end)
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"日付の形式が正しくありません: {str(e)}"}), 400
+    except Exception as e:
+        logger.error(f"Error computing revenue metrics: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@admin_bp.route("/metrics/mrr-series", methods=["GET"])
+@admin_required
+def mrr_series():
+    """MRR推移の取得API"""
+    try:
+        from analytics import compute_mrr_series
+        
+        start, end = _parse_period()
+        if end <= start:
+            return jsonify({"success": False, "error": "endはstartより後の日付を指定してください"}), 400
+        interval_days = int(request.args.get("interval_days", 1))
+        
+        return jsonify({
+            "success": True,
+            "series": compute_mrr_series(start, end, interval_days)
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"パラメータの形式が正しくありません: {str(e)}"}), 400
+    except Exception as e:
+        logger.error(f"Error computing MRR series: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@admin_bp.route("/revenue/rollups", methods=["GET"])
+@admin_required
+def revenue_rollups():
+    """日次・月次の売上ロールアップの取得API"""
+    try:
+        from repositories import get_revenue_rollups
+        
+        grain = request.args.get("grain", "day")
+        if grain not in ("day", "month"):
+            return jsonify({"success": False, "error": "grainはdayまたはmonthを指定してください"}), 400
+        
+        start, end = _parse_period()
+        if end <= start:
+            return jsonify({"success": False, "error": "endはstartより後の日付を指定してください"}), 400
+        
+        if grain == "day":
+            start_period, end_period = start.isoformat(), end.isoformat()
+        else:
+            # 月次は end の前日を含む月まで
+            last_month = end - datetime.timedelta(days=1)
+            start_period = start.strftime("%Y-%m")
+            end_period = (last_month.replace(day=28) + datetime.timedelta(days=4)).strftime("%Y-%m")
+        
+        return jsonify({
+            "success": True,
+            "grain": grain,
+            "rollups": get_revenue_rollups(grain, start_period, end_period, request.args.get("currency"))
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"日付の形式が正しくありません: {str(e)}"}), 400
+    except Exception as e:
+        logger.error(f"Error getting revenue rollups: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@admin_bp.route("/revenue/rollups/rebuild", methods=["POST"])
+@admin_required
+def rebuild_rollups():
+    """指定期間の売上ロールアップ再集計API"""
+    try:
+        from repositories import rebuild_revenue_rollups
+        from repositories.revenue_rollup_repository import DEFAULT_REBUILD_WORKERS, MAX_REBUILD_WORKERS
+        
+        data = request.get_json(silent=True) or {}
+        start = datetime.date.fromisoformat(data["start"])
+        end = datetime.date.fromisoformat(data["end"])
+        if end <= start:
+            return jsonify({"success": False, "error": "endはstartより後の日付を指定してください"}), 400
+        
+        # 並列数は正の整数のみ受け付け、上限を超える値は上限に丸める
+        workers = data.get("workers", DEFAULT_REBUILD_WORKERS)
+        if isinstance(workers, bool) or not isinstance(workers, int) or workers < 1:
+            return jsonify({"success": False, "error": f"workersは1〜{MAX_REBUILD_WORKERS}の整数で指定してください"}), 400
+        
+        result = rebuild_revenue_rollups(start, end, min(workers, MAX_REBUILD_WORKERS))
+        return jsonify({"success": True, **result}), 200
+        
+    except (KeyError, ValueError) as e:
+        return jsonify({"success": False, "error": f"start・endをYYYY-MM-DD形式で指定してください: {str(e)}"}), 400
+    except Exception as e:
+        logger.error(f"Error rebuilding revenue rollups: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# ============================================
+# CLIコマンド（flask admin rebuild-revenue-rollups）
+# ============================================
+
+@admin_bp.cli.command("rebuild-revenue-rollups")
+@click.argument("start")
+@click.argument("end")
+@click.option("--workers", default=4, show_default=True, help="並列数")
+def rebuild_rollups_command(start, end, workers):
+    """[START, END) の売上ロールアップを再集計（日付はYYYY-MM-DD）"""
+    from repositories import rebuild_revenue_rollups
+    
+    result = rebuild_revenue_rollups(
+        datetime.date.fromisoformat(start),
+        datetime.date.fromisoformat(end),
+        workers
+    )
+    click.echo(f"再集計完了: {result['days']}日 / {result['months']}か月 / {result['rows']}行")
+
+
+@admin_bp.cli.command("maintain-partitions")
+@click.option("--months-ahead", default=None, type=int, help="先行作成する月数（デフォルト: PARTITION_MONTHS_AHEAD）")
+@click.option("--retain-months", default=None, type=int, help="オンラインに残す月数（デフォルト: PARTITION_RETAIN_MONTHS）")
+@click.option("--archive/--no-archive", default=True, show_default=True, help="古い月をアーカイブするか")
+def maintain_partitions_command(months_ahead, retain_months, archive):
+    """台帳・請求書の月次パーティションを先行作成し、古い月をアーカイブ（cronで日次実行を想定）"""
+    from repositories import ensure_future_partitions, archive_old_partitions
+    
+    created = ensure_future_partitions(**({"months_ahead": months_ahead} if months_ahead is not None else {}))
+    click.echo(f"作成したパーティション: {', '.join(created) or 'なし'}")
+    
+    if archive:
+        archived = archive_old_partitions(**({"retain_months": retain_months} if retain_months is not None else {}))
+        click.echo(f"アーカイブ: {', '.join(archived) or 'なし'}")
+
+
+@admin_bp.cli.command("sweep-sessions")
+@click.option("--until-empty/--once", default=True, show_default=True, help="削除対象がなくなるまで繰り返すか")
+def sweep_sessions_command(until_empty):
+    """期限切れ・無効化済みのセッションを削除"""
+    from repositories.session_sweeper import session_sweeper
+    
+    total = session_sweeper.sweep()
+    while until_empty and session_sweeper.stats()['backlog_remaining']:
+        total += session_sweeper.sweep()
+    click.echo(f"削除したセッション: {total}")
+
+
+@admin_bp.cli.command("provision-stripe-customers")
+def provision_stripe_customers_command():
+    """登録時に積んだStripe Customer作成ジョブのうち期限の来たものを処理（ワーカーを止めている環境・障害後の再実行用）"""
+    from repositories.customer_provisioning import customer_provisioner
+    
+    total = 0
+    while True:
+        processed = customer_provisioner.run_once()
+        total += processed
+        if processed < customer_provisioner.batch_size:
+            break
+    stats = customer_provisioner.stats()
+    click.echo(f"処理したジョブ: {total}（作成 {stats['provisioned']}件, 失敗 {stats['failed_attempts']}件）")
+
+
+@admin_bp.cli.command("push-ip-filter")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--replace/--append", default=False, show_default=True, help="Redisのリストを置き換えるか追記するか")
+def push_ip_filter_command(path, replace):
+    """許可・拒否リストのファイルをRedisへ登録（全プロセスが次の確認時に読み込む）"""
+    from ip_filter import parse_entries, publish_to_redis
+    
+    with open(path, encoding='utf-8') as f:
+        allow, block = parse_entries(f)
+    publish_to_redis(allow=allow, block=block, replace=replace)
+    click.echo(f"登録: allow {len(allow)}件, block {len(block)}件")
+
+
+@admin_bp.cli.command("sync-subscription-schedules")
+def sync_subscription_schedules_command():
+    """Stripeのサブスクリプションスケジュールをローカルのテーブルへ取り込む（Webhook導入前の予約の移行用）"""
+    import stripe
+    from handlers import handle_subscription_schedule_event
+    from stripe_client import stripe_lane
+    
+    count = 0
+    with stripe_lane('background'):
+        for schedule in stripe.SubscriptionSchedule.list(limit=100).auto_paging_iter():
+            handle_subscription_schedule_event(schedule)
+            count += 1
+    click.echo(f"取り込んだスケジュール: {count}")
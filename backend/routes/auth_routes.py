@@ -1,7 +1,7 @@
 """
 認証関連のルート
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, jsonify
 import logging
 from repositories import (
     create_user,
@@ -10,19 +10,52 @@ from repositories import (
     create_session,
     logout_user,
     validate_session,
-    upsert_stripe_customer,
+    PasswordHasherBusy,
 )
+from validation import Schema, Field, validate_json, get_validated_json, EMAIL_PATTERN, DATE_PATTERN
 
 logger = logging.getLogger(__name__)
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/api')
 
+# リクエストボディのスキーマ
+_REGISTER_REQUIRED = "メールアドレス、パスワード、お名前は必須です"
+REGISTER_SCHEMA = Schema({
+    "email": Field(required=True, max_length=255, pattern=EMAIL_PATTERN,
+                   required_message=_REGISTER_REQUIRED, message="メールアドレスの形式が正しくありません"),
+    "password": Field(required=True, min_length=8, max_length=128,
+                      required_message=_REGISTER_REQUIRED, message="パスワードは8文字以上で入力してください"),
+    "name": Field(required=True, max_length=100,
+                  required_message=_REGISTER_REQUIRED, message="お名前は100文字以内で入力してください"),
+    "phone": Field(max_length=20, message="電話番号の形式が正しくありません"),
+    "birthdate": Field(pattern=DATE_PATTERN, message="生年月日の形式が正しくありません"),
+    "terms": Field(type=(bool, str)),
+    "privacy": Field(type=(bool, str)),
+})
+
+LOGIN_SCHEMA = Schema({
+    "email": Field(required=True, max_length=255, message="メールアドレスとパスワードが必要です"),
+    "password": Field(required=True, max_length=128, message="メールアドレスとパスワードが必要です"),
+})
+
+SESSION_TOKEN_SCHEMA = Schema({
+    "session_token": Field(required=True, max_length=512, message="セッショントークンが必要です"),
+})
+
+
+def _busy_response():
+    """パスワード処理が混み合っている場合の応答"""
+    response = jsonify({"error": "アクセスが集中しています。しばらくしてから再度お試しください"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
 
 @auth_bp.route("/register", methods=["POST"])
+@validate_json(REGISTER_SCHEMA)
 def register():
     """ユーザー登録API"""
     try:
-        data = request.get_json()
+        data = get_validated_json()
         email = data.get("email")
         password = data.get("password")
         name = data.get("name")
@@ -31,22 +64,14 @@ def register():
         terms_accepted = data.get("terms") == "on" or data.get("terms") == True
         privacy_accepted = data.get("privacy") == "on" or data.get("privacy") == True
         
-        # 必須項目のチェック
-        if not email or not password or not name:
-            return jsonify({"error": "メールアドレス、パスワード、お名前は必須です"}), 400
-        
         # 利用規約とプライバシーポリシーの同意チェック
         if not terms_accepted or not privacy_accepted:
             return jsonify({"error": "利用規約とプライバシーポリシーに同意してください"}), 400
         
-        # パスワードの長さチェック
-        if len(password) < 8:
-            return jsonify({"error": "パスワードは8文字以上で入力してください"}), 400
-        
         # パスワードをハッシュ化
         password_hash = hash_password(password)
         
-        # ユーザーを作成
+        # ユーザーを作成（Stripe Customerは登録と同じトランザクションで積んだジョブからバックグラウンドで作成）
         user = create_user(
             email=email,
             password_hash=password_hash,
@@ -57,14 +82,6 @@ def register():
             privacy_accepted=privacy_accepted
         )
         
-        # Stripe Customerを作成
-        try:
-            stripe_customer_id = upsert_stripe_customer(user)
-            logger.info(f"Stripe Customer created for user {user.id}: {stripe_customer_id}")
-        except Exception as e:
-            logger.error(f"Failed to create Stripe Customer: {e}")
-            # Customerの作成に失敗してもユーザー登録は継続
-        
         # セッションを作成
         session_token = create_session(user.id)
         
@@ -81,20 +98,20 @@ def register():
         
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except PasswordHasherBusy:
+        return _busy_response()
     except Exception as e:
         return jsonify({"error": f"登録処理中にエラーが発生しました: {str(e)}"}), 500
 
 
 @auth_bp.route("/login", methods=["POST"])
+@validate_json(LOGIN_SCHEMA)
 def login():
     """ログインAPI"""
     try:
-        data = request.get_json()
-        email = data.get("email")
-        password = data.get("password")
-        
-        if not email or not password:
-            return jsonify({"error": "メールアドレスとパスワードが必要です"}), 400
+        data = get_validated_json()
+        email = data["email"]
+        password = data["password"]
         
         # ユーザーを認証
         user = authenticate_user(email, password)
@@ -119,19 +136,18 @@ def login():
             "session_token": session_token
         }), 200
         
+    except PasswordHasherBusy:
+        return _busy_response()
     except Exception as e:
         return jsonify({"error": f"ログイン処理中にエラーが発生しました: {str(e)}"}), 500
 
 
 @auth_bp.route("/logout", methods=["POST"])
+@validate_json(SESSION_TOKEN_SCHEMA)
 def logout():
     """ログアウトAPI"""
     try:
-        data = request.get_json()
-        session_token = data.get("session_token")
-        
-        if not session_token:
-            return jsonify({"error": "セッショントークンが必要です"}), 400
+        session_token = get_validated_json()["session_token"]
         
         # セッションを検証
         user_id = validate_session(session_token)
@@ -154,17 +170,14 @@ def logout():
 
 
 @auth_bp.route("/verify-session", methods=["POST"])
+@validate_json(SESSION_TOKEN_SCHEMA)
 def verify_session():
     """セッション検証API"""
     try:
-        data = request.get_json()
-        session_token = data.get("session_token")
+        session_token = get_validated_json()["session_token"]
         
         print(f"セッション検証: token={session_token[:10] if session_token else None}...")
         
-        if not session_token:
-            return jsonify({"error": "セッショントークンが必要です"}), 400
-        
         # セッションを検証
         user_id = validate_session(session_token)
         print(f"セッション検証結果: user_id={user_id}")
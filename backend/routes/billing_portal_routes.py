@@ -1,32 +1,29 @@
 """
 Stripe Customer Portal関連のルート
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, jsonify
 import os
 import stripe
 import logging
-from repositories import get_user_by_id
+from security import login_required, current_user_id, get_current_user
+from stripe_client import stripe_available
+from repositories.hosted_session_cache import get_open_session, remember_session
 
 logger = logging.getLogger(__name__)
 
 billing_bp = Blueprint('billing', __name__, url_prefix='/api')
 
-# Stripeの設定
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
-
 
 @billing_bp.route("/billing-portal/start", methods=["POST"])
+@login_required
+@stripe_available("portal")
 def start_billing_portal():
     """Stripe Customer Portalセッション作成"""
     try:
-        data = request.get_json()
-        user_id = data.get("user_id")
-        
-        if not user_id:
-            return jsonify({"success": False, "error": "ユーザーIDが必要です"}), 400
+        user_id = current_user_id()
         
         # ユーザー情報を取得
-        user = get_user_by_id(user_id)
+        user = get_current_user()
         if not user:
             return jsonify({"success": False, "error": "ユーザーが見つかりません"}), 404
         
@@ -36,11 +33,20 @@ def start_billing_portal():
         # 戻り先URLを設定（マイページ）
         return_url = os.getenv("FRONTEND_URL", "http://localhost:8080") + "/mypage.html"
         
+        # 直前に作成したポータルセッションがあればそのまま返す
+        open_session = get_open_session(user_id, "portal", None, user.stripe_customer_id)
+        if open_session:
+            return jsonify({
+                "success": True,
+                "url": open_session["url"]
+            }), 200
+        
         # Stripe Customer Portalセッションを作成
         session = stripe.billing_portal.Session.create(
             customer=user.stripe_customer_id,
             return_url=return_url,
         )
+        remember_session(user_id, "portal", None, user.stripe_customer_id, session)
         
         logger.info(f"Created billing portal session for user {user_id}, customer {user.stripe_customer_id}")
         
@@ -1,19 +1,26 @@
 """
 決済・サブスクリプション関連のルート
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, jsonify
 import os
 import stripe
 import datetime
 import logging
 from repositories import (
-    validate_session,
-    get_user_by_id,
     upsert_stripe_customer,
     get_plan_name_from_price_id,
     get_session,
+    refresh_subscription_summary,
+    set_scheduled_change,
+    clear_scheduled_change,
+    upsert_subscription_schedule,
 )
+from repositories.hosted_session_cache import get_open_session, remember_session, forget_session
 from models import Subscription
+from security import login_required, current_user_id, get_current_user
+from validation import Schema, Field, validate_json, get_validated_json
+from stripe_client import stripe_available
+from plan_catalog import get_plan_by_type
 
 logger = logging.getLogger(__name__)
 
@@ -21,32 +28,66 @@ payment_bp = Blueprint('payment', __name__, url_prefix='/api')
 
 # 環境変数
 BASE_URL = os.getenv("BASE_URL")
-PRICE_ID = os.getenv("PRICE_ID")
+
+# リクエストボディのスキーマ（プランタイプの有無はプランカタログで確認する）
+PLAN_TYPE_PATTERN = r"^[a-z0-9_]+$"
+INVALID_PLAN_TYPE_MESSAGE = "プランタイプが正しくありません"
+
+SUBSCRIPTION_SCHEMA = Schema({
+    "plan_name": Field(max_length=100, default="プレミアムプラン"),
+    "plan_type": Field(max_length=50, pattern=PLAN_TYPE_PATTERN, default="premium", message=INVALID_PLAN_TYPE_MESSAGE),
+})
+
+SCHEDULE_PLAN_CHANGE_SCHEMA = Schema({
+    "new_plan_type": Field(required=True, max_length=50, pattern=PLAN_TYPE_PATTERN,
+                           required_message="新しいプランタイプが必要です", message=INVALID_PLAN_TYPE_MESSAGE),
+})
+
+SCHEDULE_ID_SCHEMA = Schema({
+    "schedule_id": Field(required=True, max_length=255, pattern=r"^sub_sched_",
+                         required_message="スケジュールIDが必要です", message="スケジュールIDが正しくありません"),
+})
+
+SUBSCRIPTION_ID_SCHEMA = Schema({
+    "subscription_id": Field(required=True, max_length=255, pattern=r"^sub_",
+                             required_message="サブスクリプションIDが必要です", message="サブスクリプションIDが正しくありません"),
+})
+
+CHECKOUT_SESSION_ID_SCHEMA = Schema({
+    "session_id": Field(required=True, max_length=255, pattern=r"^cs_",
+                        required_message="セッションIDが必要です", message="セッションIDが正しくありません"),
+})
+
+
+def _save_schedule(schedule, user_id=None):
+    """Stripeが返したスケジュールをローカルに保存（失敗してもWebhookで追って反映されるため処理は続ける）"""
+    try:
+        upsert_subscription_schedule(schedule, user_id=user_id)
+    except Exception as e:
+        logger.error(f"Error saving subscription schedule {schedule.get('id')}: {e}")
 
 
 @payment_bp.route("/checkout", methods=["POST"])
+@login_required
+@stripe_available("checkout")
 def checkout():
     """オリジナルプロテイン購入API"""
     try:
-        # セッショントークンからユーザーIDを取得
-        session_token = request.headers.get('Authorization')
-        if not session_token or not session_token.startswith('Bearer '):
-            return jsonify({"error": "ログインが必要です"}), 401
-        
-        token = session_token[7:]  # "Bearer "を除去
-        user_id = validate_session(token)
-        
-        if not user_id:
-            return jsonify({"error": "無効なセッションです。再度ログインしてください"}), 401
+        user_id = current_user_id()
         
         # ユーザー情報を取得
-        user = get_user_by_id(user_id)
+        user = get_current_user()
         if not user:
             return jsonify({"error": "ユーザーが見つかりません"}), 404
         
         # Stripe Customerを取得または作成
         stripe_customer_id = upsert_stripe_customer(user)
         
+        # ダブルクリック・再読み込みでは開いたままのセッションを返す
+        open_session = get_open_session(user_id, "payment", "original_protein", stripe_customer_id)
+        if open_session:
+            return jsonify({"id": open_session["id"]})
+        
         # StripeのCheckout Sessionを作成
         checkout_session = stripe.checkout.Session.create(
             customer = stripe_customer_id,  # Customer IDを指定
@@ -69,42 +110,35 @@ def checkout():
                 'product_name': 'オリジナルプロテイン'
             }
         )
+        remember_session(user_id, "payment", "original_protein", stripe_customer_id, checkout_session)
         return jsonify({"id": checkout_session.id})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @payment_bp.route("/subscription", methods=["POST"])
+@validate_json(SUBSCRIPTION_SCHEMA)
+@login_required
+@stripe_available("checkout")
 def subscription():
     """サブスクリプション課金API"""
     try:
         # リクエストボディからプラン情報を取得
-        data = request.get_json()
-        plan_name = data.get("plan_name", "プレミアムプラン")
-        plan_type = data.get("plan_type", "premium")  # standard または premium
-        
-        # セッショントークンからユーザーIDを取得
-        session_token = request.headers.get('Authorization')
-        if not session_token or not session_token.startswith('Bearer '):
-            return jsonify({"error": "ログインが必要です"}), 401
-        
-        token = session_token[7:]  # "Bearer "を除去
-        user_id = validate_session(token)
+        data = get_validated_json()
+        plan_name = data["plan_name"]
+        plan_type = data["plan_type"]  # standard / premium などカタログのプランタイプ
+        user_id = current_user_id()
         
-        if not user_id:
-            return jsonify({"error": "無効なセッションです。再度ログインしてください"}), 401
+        # プランタイプに応じて価格IDを決定
+        plan = get_plan_by_type(plan_type)
+        if plan is None:
+            return jsonify({"success": False, "error": INVALID_PLAN_TYPE_MESSAGE}), 400
+        price_id = plan.price_id
+        product_name = plan.name
         
         # ユーザーが既に同じプランに契約していないかチェック
         session = get_session()
         try:
-            # プランタイプに応じて価格IDを決定
-            if plan_type == "standard":
-                price_id = os.getenv("STANDARD_PRICE_ID", PRICE_ID)
-                product_name = "スタンダードプラン"
-            else:
-                price_id = os.getenv("PREMIUM_PRICE_ID", PRICE_ID)
-                product_name = "プレミアムプラン"
-            
             # アクティブなサブスクリプションをチェック
             active_subscription = session.query(Subscription).filter_by(
                 user_id=user_id,
@@ -123,20 +157,17 @@ def subscription():
             session.close()
         
         # ユーザー情報を取得
-        user = get_user_by_id(user_id)
+        user = get_current_user()
         if not user:
             return jsonify({"error": "ユーザーが見つかりません"}), 404
         
         # Stripe Customerを取得または作成
         stripe_customer_id = upsert_stripe_customer(user)
         
-        # プランタイプに応じて価格IDを決定
-        if plan_type == "standard":
-            price_id = os.getenv("STANDARD_PRICE_ID", PRICE_ID)
-            product_name = "スタンダードプラン"
-        else:
-            price_id = os.getenv("PREMIUM_PRICE_ID", PRICE_ID)
-            product_name = "プレミアムプラン"
+        # ダブルクリック・再読み込みでは開いたままのセッションを返す
+        open_session = get_open_session(user_id, "subscription", price_id, stripe_customer_id)
+        if open_session:
+            return jsonify({"id": open_session["id"]})
         
         subscription_session = stripe.checkout.Session.create(
             customer = stripe_customer_id,  # Customer IDを指定
@@ -152,39 +183,29 @@ def subscription():
                 'plan_type': plan_type
             }
         )
+        remember_session(user_id, "subscription", price_id, stripe_customer_id, subscription_session)
         return jsonify({"id": subscription_session.id})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @payment_bp.route("/schedule-plan-change", methods=["POST"])
+@validate_json(SCHEDULE_PLAN_CHANGE_SCHEMA)
+@login_required
+@stripe_available("schedules")
 def schedule_plan_change():
     """プラン変更予約API（次回更新時にプラン変更）"""
     try:
-        data = request.get_json()
-        new_plan_type = data.get("new_plan_type")
+        new_plan_type = get_validated_json()["new_plan_type"]
         
-        if not new_plan_type:
-            return jsonify({"success": False, "error": "新しいプランタイプが必要です"}), 400
-        
-        # セッショントークンからユーザーIDを取得
-        session_token = request.headers.get('Authorization')
-        if not session_token or not session_token.startswith('Bearer '):
-            return jsonify({"error": "ログインが必要です"}), 401
-        
-        token = session_token[7:]
-        user_id = validate_session(token)
-        
-        if not user_id:
-            return jsonify({"error": "無効なセッションです"}), 401
+        user_id = current_user_id()
         
         # 新しいプランの価格IDを取得
-        if new_plan_type == "standard":
-            new_price_id = os.getenv("STANDARD_PRICE_ID", PRICE_ID)
-            new_plan_name = "スタンダードプラン"
-        else:
-            new_price_id = os.getenv("PREMIUM_PRICE_ID", PRICE_ID)
-            new_plan_name = "プレミアムプラン"
+        new_plan = get_plan_by_type(new_plan_type)
+        if new_plan is None:
+            return jsonify({"success": False, "error": INVALID_PLAN_TYPE_MESSAGE}), 400
+        new_price_id = new_plan.price_id
+        new_plan_name = new_plan.name
         
         # 現在のアクティブなサブスクリプションを取得
         session = get_session()
@@ -275,6 +296,10 @@ def schedule_plan_change():
             
             logger.info(f"Subscription schedule created: {schedule.id} for user {user_id}")
             
+            # ローカルのスケジュールと請求サマリーに変更予約を記録（Webhookの到着を待たずに表示へ反映）
+            _save_schedule(schedule, user_id=user_id)
+            set_scheduled_change(user_id, schedule.id, new_price_id, active_subscription.current_period_end)
+            
             return jsonify({
                 "success": True,
                 "message": f"次回更新時（{datetime.datetime.fromtimestamp(active_subscription.current_period_end).strftime('%Y年%m月%d日')}）に{new_plan_name}へ変更予約が完了しました",
@@ -296,31 +321,23 @@ def schedule_plan_change():
 
 
 @payment_bp.route("/cancel-scheduled-change", methods=["POST"])
+@validate_json(SCHEDULE_ID_SCHEMA)
+@login_required
+@stripe_available("schedules")
 def cancel_scheduled_change():
     """プラン変更予約取り消しAPI"""
     try:
-        data = request.get_json()
-        schedule_id = data.get("schedule_id")
-        
-        if not schedule_id:
-            return jsonify({"success": False, "error": "スケジュールIDが必要です"}), 400
-        
-        # セッショントークンからユーザーIDを取得
-        session_token = request.headers.get('Authorization')
-        if not session_token or not session_token.startswith('Bearer '):
-            return jsonify({"success": False, "error": "ログインが必要です"}), 401
-        
-        token = session_token[7:]
-        user_id = validate_session(token)
-        
-        if not user_id:
-            return jsonify({"success": False, "error": "無効なセッションです"}), 401
+        schedule_id = get_validated_json()["schedule_id"]
         
         # スケジュールを解除（サブスクリプションを通常の状態に戻す）
-        stripe.SubscriptionSchedule.release(schedule_id)
+        schedule = stripe.SubscriptionSchedule.release(schedule_id)
         
         logger.info(f"Subscription schedule released: {schedule_id}")
         
+        # ローカルのスケジュールと請求サマリーから変更予約を削除
+        _save_schedule(schedule)
+        clear_scheduled_change(schedule_id)
+        
         return jsonify({
             "success": True,
             "message": "プラン変更予約をキャンセルしました"
@@ -335,24 +352,15 @@ def cancel_scheduled_change():
 
 
 @payment_bp.route("/cancel-subscription", methods=["POST"])
+@validate_json(SUBSCRIPTION_ID_SCHEMA)
+@login_required
+@stripe_available("subscriptions")
 def cancel_subscription():
     """サブスクリプション解約API"""
     try:
-        data = request.get_json()
-        subscription_id = data.get("subscription_id")
+        subscription_id = get_validated_json()["subscription_id"]
         
-        if not subscription_id:
-            return jsonify({"success": False, "error": "サブスクリプションIDが必要です"}), 400
-        
-        # セッショントークンからユーザーIDを取得
-        user_id = None
-        session_token = request.headers.get('Authorization')
-        if session_token and session_token.startswith('Bearer '):
-            token = session_token[7:]  # "Bearer "を除去
-            user_id = validate_session(token)
-        
-        if not user_id:
-            return jsonify({"success": False, "error": "ログインが必要です"}), 401
+        user_id = current_user_id()
         
         # Stripeでサブスクリプションをキャンセル
         stripe.Subscription.modify(
@@ -374,6 +382,9 @@ def cancel_subscription():
         finally:
             session.close()
         
+        # 請求サマリーの解約予定フラグを更新
+        refresh_subscription_summary(user_id)
+        
         return jsonify({
             "success": True,
             "message": "サブスクリプションの解約予約が完了しました。現在の期間終了時にキャンセルされます。"
@@ -386,25 +397,15 @@ def cancel_subscription():
 
 
 @payment_bp.route("/reactivate-subscription", methods=["POST"])
+@validate_json(SUBSCRIPTION_ID_SCHEMA)
+@login_required
+@stripe_available("subscriptions")
 def reactivate_subscription():
     """サブスクリプション解約取り消しAPI"""
     try:
-        data = request.get_json()
-        subscription_id = data.get("subscription_id")
-        
-        if not subscription_id:
-            return jsonify({"success": False, "error": "サブスクリプションIDが必要です"}), 400
-        
-        # セッショントークンからユーザーIDを取得
-        session_token = request.headers.get('Authorization')
-        if not session_token or not session_token.startswith('Bearer '):
-            return jsonify({"success": False, "error": "ログインが必要です"}), 401
+        subscription_id = get_validated_json()["subscription_id"]
         
-        token = session_token[7:]
-        user_id = validate_session(token)
-        
-        if not user_id:
-            return jsonify({"success": False, "error": "無効なセッションです"}), 401
+        user_id = current_user_id()
         
         # Stripeで解約を取り消す
         stripe.Subscription.modify(
@@ -426,6 +427,9 @@ def reactivate_subscription():
         finally:
             session.close()
         
+        # 請求サマリーの解約予定フラグを更新
+        refresh_subscription_summary(user_id)
+        
         return jsonify({
             "success": True,
             "message": "サブスクリプションの解約を取り消しました。引き続きご利用いただけます。"
@@ -438,18 +442,20 @@ def reactivate_subscription():
 
 
 @payment_bp.route("/get-checkout-session", methods=["POST"])
+@validate_json(CHECKOUT_SESSION_ID_SCHEMA)
+@stripe_available("checkout")
 def get_checkout_session():
     """チェックアウトセッション情報取得API"""
     try:
-        data = request.get_json()
-        session_id = data.get("session_id")
-        
-        if not session_id:
-            return jsonify({"success": False, "error": "セッションIDが必要です"}), 400
+        session_id = get_validated_json()["session_id"]
         
         # Stripeからセッション情報を取得
         session = stripe.checkout.Session.retrieve(session_id)
         
+        # 成功画面まで進んだセッションは、完了のWebhookより先でも購入開始で再利用しない
+        if session.get('status') != 'open':
+            forget_session(session.id)
+        
         # メタデータから情報を抽出
         metadata = session.get('metadata', {})
         product_name = metadata.get('product_name', '不明な商品')
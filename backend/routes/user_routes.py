@@ -1,17 +1,18 @@
 """
 ユーザー情報関連のルート
 """
-from flask import Blueprint, request, jsonify
-import os
+from flask import Blueprint, jsonify
 from repositories import (
-    get_user_by_id,
     get_user_purchase_history,
     get_user_subscriptions,
     get_plan_name_from_price_id,
     get_session,
+    get_billing_summary,
+    get_pending_schedules,
 )
 from models import Subscription
-import stripe
+from security import login_required, current_user_id, get_current_user
+from plan_catalog import get_plan
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,17 +20,24 @@ logger = logging.getLogger(__name__)
 user_bp = Blueprint('user', __name__, url_prefix='/api')
 
 
+def _scheduled_change(schedule):
+    """ローカルに保存した変更予約をレスポンスの形式に変換"""
+    if schedule is None:
+        return None
+    return {
+        "schedule_id": schedule.id,
+        "next_price_id": schedule.next_price_id,
+        "next_plan_name": get_plan_name_from_price_id(schedule.next_price_id),
+        "change_date": schedule.change_date
+    }
+
+
 @user_bp.route("/user-info", methods=["POST"])
+@login_required
 def user_info():
     """ユーザー情報取得API"""
     try:
-        data = request.get_json()
-        user_id = data.get("user_id")
-        
-        if not user_id:
-            return jsonify({"success": False, "error": "ユーザーIDが必要です"}), 400
-        
-        user = get_user_by_id(user_id)
+        user = get_current_user()
         if user:
             return jsonify({
                 "success": True,
@@ -50,14 +58,11 @@ def user_info():
 
 
 @user_bp.route("/user-purchase-history", methods=["POST"])
+@login_required
 def user_purchase_history():
     """ユーザー購入履歴取得API"""
     try:
-        data = request.get_json()
-        user_id = data.get("user_id")
-        
-        if not user_id:
-            return jsonify({"success": False, "error": "ユーザーIDが必要です"}), 400
+        user_id = current_user_id()
         
         purchases = get_user_purchase_history(user_id)
         return jsonify({
@@ -80,14 +85,11 @@ def user_purchase_history():
 
 
 @user_bp.route("/user-active-subscriptions", methods=["POST"])
+@login_required
 def user_active_subscriptions():
     """ユーザーのアクティブサブスクリプション取得API"""
     try:
-        data = request.get_json()
-        user_id = data.get("user_id")
-        
-        if not user_id:
-            return jsonify({"success": False, "error": "ユーザーIDが必要です"}), 400
+        user_id = current_user_id()
         
         session = get_session()
         try:
@@ -97,46 +99,27 @@ def user_active_subscriptions():
                 status='active'
             ).all()
             
-            PRICE_ID = os.getenv("PRICE_ID")
-            premium_price_id = os.getenv("PREMIUM_PRICE_ID", PRICE_ID)
-            standard_price_id = os.getenv("STANDARD_PRICE_ID")
-            
             result = {
                 "has_premium": False,
                 "has_standard": False,
                 "subscriptions": []
             }
             
+            # 変更予約はWebhookで保存したテーブルから1回のクエリで取得
+            schedules = get_pending_schedules(sub.id for sub in active_subscriptions)
+            
             for sub in active_subscriptions:
-                if sub.price_id == premium_price_id:
-                    result["has_premium"] = True
-                elif sub.price_id == standard_price_id:
-                    result["has_standard"] = True
+                plan = get_plan(sub.price_id)
+                if plan is not None and f"has_{plan.plan_type}" in result:
+                    result[f"has_{plan.plan_type}"] = True
                 
-                # スケジュール情報を取得
-                scheduled_change = None
-                try:
-                    stripe_sub = stripe.Subscription.retrieve(sub.id)
-                    schedule_id = stripe_sub.get('schedule')
-                    
-                    if schedule_id:
-                        schedule = stripe.SubscriptionSchedule.retrieve(schedule_id)
-                        if len(schedule.phases) > 1:
-                            next_phase = schedule.phases[1]
-                            next_price_id = next_phase['items'][0]['price']
-                            scheduled_change = {
-                                "schedule_id": schedule_id,
-                                "next_price_id": next_price_id,
-                                "next_plan_name": get_plan_name_from_price_id(next_price_id),
-                                "change_date": sub.current_period_end
-                            }
-                except Exception as e:
-                    logger.error(f"Error retrieving schedule for subscription {sub.id}: {e}")
+                scheduled_change = _scheduled_change(schedules.get(sub.id))
                 
                 result["subscriptions"].append({
                     "id": sub.id,
                     "price_id": sub.price_id,
                     "plan_name": get_plan_name_from_price_id(sub.price_id),
+                    "plan_type": plan.plan_type if plan else None,
                     "status": sub.status,
                     "current_period_end": sub.current_period_end,  # 有効期限（Unix timestamp）
                     "scheduled_change": scheduled_change
@@ -156,17 +139,19 @@ def user_active_subscriptions():
 
 
 @user_bp.route("/user-subscription-history", methods=["POST"])
+@login_required
 def user_subscription_history():
     """ユーザーサブスクリプション履歴取得API"""
     try:
-        data = request.get_json()
-        user_id = data.get("user_id")
-        
-        if not user_id:
-            return jsonify({"success": False, "error": "ユーザーIDが必要です"}), 400
+        user_id = current_user_id()
         
         subscriptions = get_user_subscriptions(user_id)
         
+        # アクティブなサブスクリプションの変更予約をまとめて取得
+        schedules = get_pending_schedules(
+            subscription.id for subscription in subscriptions if subscription.status == 'active'
+        )
+        
         # 各サブスクリプションにスケジュール情報を追加
         subscriptions_with_schedule = []
         for subscription in subscriptions:
@@ -179,33 +164,9 @@ def user_subscription_history():
                 "created_at": subscription.created_at,
                 "current_period_end": subscription.current_period_end,
                 "cancel_at_period_end": subscription.cancel_at_period_end or False,
-                "scheduled_change": None  # デフォルトはなし
+                "scheduled_change": _scheduled_change(schedules.get(subscription.id))
             }
             
-            # アクティブなサブスクリプションの場合、スケジュールを確認
-            if subscription.status == 'active':
-                try:
-                    stripe_sub = stripe.Subscription.retrieve(subscription.id)
-                    schedule_id = stripe_sub.get('schedule')
-                    
-                    if schedule_id:
-                        # スケジュールの詳細を取得
-                        schedule = stripe.SubscriptionSchedule.retrieve(schedule_id)
-                        
-                        # 次のフェーズがあるかチェック
-                        if len(schedule.phases) > 1:
-                            next_phase = schedule.phases[1]
-                            next_price_id = next_phase['items'][0]['price']
-                            
-                            sub_data["scheduled_change"] = {
-                                "schedule_id": schedule_id,
-                                "next_price_id": next_price_id,
-                                "next_plan_name": get_plan_name_from_price_id(next_price_id),
-                                "change_date": subscription.current_period_end
-                            }
-                except Exception as e:
-                    logger.error(f"Error retrieving schedule for subscription {subscription.id}: {e}")
-            
             subscriptions_with_schedule.append(sub_data)
         
         return jsonify({
@@ -215,3 +176,46 @@ def user_subscription_history():
         
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
+
+
+@user_bp.route("/user-billing-summary", methods=["POST"])
+@login_required
+def user_billing_summary():
+    """ユーザー請求サマリー取得API（マイページ用の集約済みデータ）"""
+    try:
+        user_id = current_user_id()
+        
+        summary = get_billing_summary(user_id)
+        
+        scheduled_change = None
+        if summary.scheduled_schedule_id:
+            scheduled_change = {
+                "schedule_id": summary.scheduled_schedule_id,
+                "next_price_id": summary.scheduled_price_id,
+                "next_plan_name": get_plan_name_from_price_id(summary.scheduled_price_id),
+                "change_date": summary.scheduled_change_date
+            }
+        
+        return jsonify({
+            "success": True,
+            "summary": {
+                "subscription_id": summary.subscription_id,
+                "price_id": summary.price_id,
+                "plan_name": summary.plan_name,
+                "status": summary.subscription_status,
+                "cancel_at_period_end": summary.cancel_at_period_end or False,
+                "current_period_end": summary.current_period_end,
+                "scheduled_change": scheduled_change,
+                "lifetime_spend": float(summary.lifetime_spend) if summary.lifetime_spend else 0,
+                "currency": summary.currency,
+                "last_purchase": {
+                    "session_id": summary.last_purchase_session_id,
+                    "product_name": summary.last_purchase_product,
+                    "amount": float(summary.last_purchase_amount) if summary.last_purchase_amount else 0,
+                    "created_at": summary.last_purchase_at
+                } if summary.last_purchase_session_id else None
+            }
+        }), 200
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
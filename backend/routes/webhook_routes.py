@@ -11,6 +11,10 @@ from handlers import (
     handle_subscription_created,
     handle_subscription_updated,
     handle_subscription_deleted,
+    handle_subscription_schedule_event,
+    handle_checkout_expired,
+    handle_customer_deleted,
+    handle_plan_catalog_event,
     is_event_processed,
     mark_event_processed
 )
@@ -19,6 +23,26 @@ webhook_bp = Blueprint('webhook', __name__)
 
 WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 
+# ローカルのsubscription_schedulesテーブルに反映するイベント
+SUBSCRIPTION_SCHEDULE_EVENTS = (
+    "subscription_schedule.created",
+    "subscription_schedule.updated",
+    "subscription_schedule.released",
+    "subscription_schedule.canceled",
+    "subscription_schedule.completed",
+    "subscription_schedule.aborted",
+)
+
+# プランカタログ（価格IDとプラン名の対応）に反映するイベント
+PLAN_CATALOG_EVENTS = (
+    "price.created",
+    "price.updated",
+    "price.deleted",
+    "product.created",
+    "product.updated",
+    "product.deleted",
+)
+
 
 @webhook_bp.route("/webhook", methods=["POST"])
 def stripe_webhook():
@@ -71,6 +95,14 @@ def stripe_webhook():
         handle_subscription_updated(webhook_object)
     elif event_type == "customer.subscription.deleted":
         handle_subscription_deleted(webhook_object)
+    elif event_type in SUBSCRIPTION_SCHEDULE_EVENTS:
+        handle_subscription_schedule_event(webhook_object)
+    elif event_type == "checkout.session.expired":
+        handle_checkout_expired(webhook_object)
+    elif event_type == "customer.deleted":
+        handle_customer_deleted(webhook_object)
+    elif event_type in PLAN_CATALOG_EVENTS:
+        handle_plan_catalog_event(event_type, webhook_object)
     else:
         print(f"⚠ Unhandled event type: {event_type}")
         return "", 200
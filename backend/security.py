@@ -6,6 +6,7 @@ import logging
 from functools import wraps
 from flask import request, jsonify, g, redirect
 from werkzeug.exceptions import TooManyRequests
+from werkzeug.middleware.proxy_fix import ProxyFix
 try:
     import redis
     REDIS_AVAILABLE = True
@@ -14,7 +15,11 @@ except ImportError:
     redis = None
 from datetime import datetime, timedelta
 import hashlib
+import hmac
+import time
+import threading
 import ipaddress
+from ip_filter import IPFilter
 
 logger = logging.getLogger(__name__)
 
@@ -34,9 +39,30 @@ class SecurityConfig:
     RATE_LIMIT_REQUESTS_PER_MINUTE = 60
     RATE_LIMIT_REQUESTS_PER_HOUR = 1000
     
+    # Blueprintごとのレート制限（"回数/秒数"、環境変数で上書き。0で無効）
+    BLUEPRINT_RATE_LIMITS = {
+        'auth': ('RATE_LIMIT_AUTH', '10/60'),
+        'payment': ('RATE_LIMIT_CHECKOUT', '20/60'),
+        'billing': ('RATE_LIMIT_CHECKOUT', '20/60'),
+        'webhook': ('RATE_LIMIT_WEBHOOK', '300/60'),
+    }
+    
+    @classmethod
+    def blueprint_rate_limits(cls):
+        limits = {}
+        for blueprint, (env_name, default) in cls.BLUEPRINT_RATE_LIMITS.items():
+            limit = parse_rate_limit(os.getenv(env_name, default))
+            if limit:
+                limits[blueprint] = limit
+        return limits
+    
+    # 前段の信頼するリバースプロキシの段数（既定は0で X-Forwarded-For を信頼しない。nginx経由の構成ではデプロイ設定で1を指定）
+    # X-Forwarded-For の右からこの段数分だけを信頼し、レート制限・IP制限の送信元とする
+    TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '0'))
+    
     # IP制限設定
-    ALLOWED_IPS = []  # 本番では管理者IPなど
-    BLOCKED_IPS = []  # 問題のあるIP
+    ALLOWED_IPS = []  # 本番では管理者IPなど（CIDR可）
+    BLOCKED_IPS = []  # 問題のあるIP（CIDR可）。大きなリストは IP_FILTER_FILE か Redis で与える
     
     # セキュリティヘッダー設定
     SECURITY_HEADERS = {
@@ -49,6 +75,10 @@ class SecurityConfig:
     }
 
 
+# IP制限（SecurityConfigのリストに IP_FILTER_FILE / Redis のリストを合わせて判定）
+ip_filter = IPFilter(SecurityConfig.ALLOWED_IPS, SecurityConfig.BLOCKED_IPS)
+
+
 def setup_security_headers(app):
     """セキュリティヘッダーの設定"""
     
@@ -79,63 +109,195 @@ def is_valid_ip(ip_str):
 
 
 def is_ip_allowed(ip_str):
-    """IPアドレスが許可されているかチェック"""
-    if not is_valid_ip(ip_str):
-        return False
-    
-    # ブロックリストチェック
-    if ip_str in SecurityConfig.BLOCKED_IPS:
-        return False
-    
-    # 許可リスト設定されている場合はホワイトリスト型
-    if SecurityConfig.ALLOWED_IPS:
-        return ip_str in SecurityConfig.ALLOWED_IPS
-    
-    # 許可リスト未設定の場合は基本的に全許可
-    return True
+    """IPアドレスが許可されているかチェック（CIDR対応。リストの変更は ip_filter が定期的に取り込む）"""
+    return ip_filter.is_allowed(ip_str)
+
+
+# ============================================
+# レート制限
+# ============================================
+
+# GCRA（Generic Cell Rate Algorithm）を1回のラウンドトリップで判定するLuaスクリプト
+# KEYS[1]: キー / ARGV[1]: 1リクエストあたりの間隔（ミリ秒） / ARGV[2]: 許容するバースト（ミリ秒）
+# 戻り値: {許可(1/0), 残り回数, 再試行までのミリ秒}
+GCRA_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = now_parts[1] * 1000 + math.floor(now_parts[2] / 1000)
+local interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local new_tat = tat + interval
+local allow_at = new_tat - burst
+if now < allow_at then
+    return {0, 0, allow_at - now}
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', new_tat - now)
+return {1, math.floor((burst - (new_tat - now)) / interval), 0}
+"""
+
+
+class RateLimitResult:
+    """レート制限の判定結果"""
+
+    def __init__(self, allowed, remaining, retry_after):
+        self.allowed = allowed
+        self.remaining = remaining
+        self.retry_after = retry_after  # 秒
+
+    def headers(self):
+        if self.allowed:
+            return {'X-RateLimit-Remaining': str(self.remaining)}
+        return {'Retry-After': str(max(1, int(self.retry_after + 0.999)))}
+
+
+class LocalTokenBucket:
+    """プロセス内のトークンバケット（Redisが使えない場合の代替）"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = {}  # キー -> (残りトークン, 最終更新時刻)
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, period):
+        rate = limit / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (limit, now))
+            tokens = min(limit, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return RateLimitResult(False, 0, (1 - tokens) / rate)
+
+            if key not in self._buckets and len(self._buckets) >= self.max_keys:
+                self._evict(now, rate)
+            self._buckets[key] = (tokens - 1, now)
+            return RateLimitResult(True, int(tokens - 1), 0)
+
+    def _evict(self, now, rate):
+        # 満杯まで回復したバケットは初期状態と同じなので捨てる。それでも減らなければ最も古いものから捨てる
+        full = [key for key, (tokens, updated) in self._buckets.items() if (now - updated) * rate >= 1]
+        for key in full:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_keys:
+            oldest = sorted(self._buckets, key=lambda key: self._buckets[key][1])[:len(self._buckets) // 10 + 1]
+            for key in oldest:
+                del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets = {}
+
+
+class RateLimiter:
+    """Redis上のGCRAで判定し、Redisに接続できない場合はプロセス内のトークンバケットで判定する"""
+
+    KEY_PREFIX = "rate_limit"
+
+    # Redisでエラーになった後、再びRedisを試すまでの秒数（その間はプロセス内で判定）
+    REDIS_RETRY_SECONDS = 30
+
+    def __init__(self, client=None):
+        self.client = client
+        self.local = LocalTokenBucket()
+        self._script = None
+        self._redis_retry_at = 0.0
+        self.fallbacks = 0
+
+    def hit(self, key, limit, period):
+        """1リクエスト分を消費して判定（limit回 / period秒）"""
+        if self.client is not None and time.monotonic() >= self._redis_retry_at:
+            try:
+                if self._script is None:
+                    self._script = self.client.register_script(GCRA_SCRIPT)
+                interval = period * 1000 / limit
+                allowed, remaining, retry_after_ms = self._script(
+                    keys=[f"{self.KEY_PREFIX}:{key}"], args=[int(interval), int(interval * limit)]
+                )
+                return RateLimitResult(bool(allowed), int(remaining), int(retry_after_ms) / 1000)
+            except Exception as e:
+                self.fallbacks += 1
+                self._redis_retry_at = time.monotonic() + self.REDIS_RETRY_SECONDS
+                logger.warning(f"Rate limiter falling back to local buckets: {e}")
+        return self.local.hit(key, limit, period)
+
+    def stats(self):
+        using_redis = self.client is not None and time.monotonic() >= self._redis_retry_at
+        return {
+            'backend': 'redis' if using_redis else 'local',
+            'fallbacks': self.fallbacks,
+        }
+
+
+# プロセス全体で共有するレート制限
+rate_limiter = RateLimiter(redis_client)
+
+
+def parse_rate_limit(value):
+    """「回数/秒数」形式の設定を (回数, 秒数) に変換（"0" や空文字は無効としてNone）"""
+    if not value or value.strip() in ('0', 'off'):
+        return None
+    count, _, seconds = value.partition('/')
+    return int(count), float(seconds or 60)
+
+
+def rate_limit_identity():
+    """レート制限の識別子（ログイン中はユーザーID、それ以外はIPアドレス）"""
+    user_id = current_user_id() if get_bearer_token() else None
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"ip:{request.remote_addr}"
+
+
+def _rate_limited_response(result):
+    response = jsonify({
+        'error': 'Rate limit exceeded',
+        'retry_after': max(1, int(result.retry_after + 0.999))
+    })
+    response.status_code = 429
+    response.headers.update(result.headers())
+    return response
 
 
 def rate_limit(key_func=None, max_requests=None, window_size=60):
-    """レート制限デコレータ"""
-    if not redis_client:
-        # Redisが使用できない場合はスキップ
-        return lambda fn: fn
-    
+    """レート制限デコレータ（クライアント・エンドポイントごとに window_size 秒あたり max_requests 回）"""
+    max_requests = max_requests or SecurityConfig.RATE_LIMIT_REQUESTS_PER_MINUTE
+
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # クライアント識別子を取得
-            if key_func:
-                client_id = key_func()
-            else:
-                client_id = request.remote_addr
-            
-            # ウィンドウサイズを秒で設定
-            key = f"rate_limit:{client_id}:{func.__name__}"
-            
-            # 現在のリクエスト数を取得
-            current_requests = redis_client.get(key)
-            if current_requests is None:
-                # 新しいウィンドウ
-                redis_client.setex(key, window_size, 1)
-            else:
-                current_requests = int(current_requests)
-                if current_requests >= max_requests:
-                    logger.warning(f"Rate limit exceeded for {client_id} on {func.__name__}")
-                    return jsonify({
-                        'error': 'Rate limit exceeded',
-                        'retry_after': window_size
-                    }), 429
-                
-                # インクリメント
-                redis_client.incr(key)
-            
+            client_id = key_func() if key_func else rate_limit_identity()
+            result = rate_limiter.hit(f"{func.__name__}:{client_id}", max_requests, window_size)
+            if not result.allowed:
+                logger.warning(f"Rate limit exceeded for {client_id} on {func.__name__}")
+                return _rate_limited_response(result)
             return func(*args, **kwargs)
-        
+
         return wrapper
     return decorator
 
 
+def setup_rate_limits(app, limits=None):
+    """Blueprintごとのレート制限を設定（エンドポイント × クライアントごとに判定）
+
+    limits: {Blueprint名: (回数, 秒数)}。省略時は SecurityConfig.blueprint_rate_limits()
+    """
+    limits = SecurityConfig.blueprint_rate_limits() if limits is None else limits
+
+    @app.before_request
+    def apply_blueprint_rate_limit():
+        limit = limits.get(request.blueprint)
+        if not limit or request.method == 'OPTIONS':
+            return None
+
+        identity = rate_limit_identity()
+        result = rate_limiter.hit(f"{request.endpoint}:{identity}", *limit)
+        if not result.allowed:
+            log_security_event("rate_limit_exceeded", f"{identity} on {request.endpoint}", severity="warning")
+            return _rate_limited_response(result)
+        return None
+
+
 def log_security_event(event_type, details, severity="info"):
     """セキュリティイベントをログ記録"""
     
@@ -158,27 +320,9 @@ def log_security_event(event_type, details, severity="info"):
 
 
 def validate_user_input(data, rules):
-    """ユーザー入力のバリデーション"""
-    errors = []
-    
-    for field, rule_data in rules.items():
-        value = data.get(field)
-        field_rules = rule_data if isinstance(rule_data, list) else [rule_data]
-        
-        for rule in field_rules:
-            if rule == 'required' and (value is None or value == ''):
-                errors.append(f"Field {field} is required")
-            elif rule == 'email' and value and '@' not in value:
-                errors.append(f"Field {field} must be a valid email")
-            elif rule == 'password' and value and len(value) < 8:
-                errors.append(f"Field {field} must be at least 8 characters")
-            elif isinstance(rule, dict):
-                if 'min_length' in rule and len(str(value)) < rule['min_length']:
-                    errors.append(f"Field {field} must be at least {rule['min_length']} characters")
-                if 'max_length' in rule and len(str(value)) > rule['max_length']:
-                    errors.append(f"Field {field} must not exceed {rule['max_length']} characters")
-    
-    return errors
+    """ユーザー入力のバリデーション（ルール辞書は初回に検証関数へ変換して使い回す）"""
+    from validation import compile_legacy_rules
+    return compile_legacy_rules(rules)(data)
 
 
 def sanitize_log_data(data):
@@ -209,10 +353,20 @@ def create_hash(input_string, algorithm='sha256'):
     return hash_obj.hexdigest()
 
 
+def setup_proxy_fix(app, hops=None):
+    """リバースプロキシ配下で request.remote_addr をクライアントのIPにする（0の場合は何もしない）"""
+    hops = SecurityConfig.TRUSTED_PROXY_HOPS if hops is None else hops
+    if hops > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+
 # アプリケーションルートでのセキュリティチェック
 def setup_app_security(app):
     """アプリケーション全体のセキュリティ設定"""
     
+    # レート制限・IP制限がプロキシのIPではなくクライアントのIPで判定されるようにする
+    setup_proxy_fix(app)
+    
     @app.before_request
     def before_request():
         """リクエスト前のセキュリティチェック"""
@@ -239,7 +393,11 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         # TODO: 実際の管理者認証ロジックを実装
         # 後でJWT、OAuth、セッション認証などに置き換え
-        is_admin = False  # 仮実装
+        # 暫定: ADMIN_API_KEYが設定されている場合のみ X-Admin-Key ヘッダーで許可
+        admin_key = request.headers.get('X-Admin-Key', '')
+        expected_key = os.getenv('ADMIN_API_KEY')
+        # 非ASCIIの文字列は compare_digest が TypeError になるため、バイト列で比較する
+        is_admin = bool(expected_key) and hmac.compare_digest(admin_key.encode('utf-8'), expected_key.encode('utf-8'))
         
         if not is_admin:
             log_security_event("unauthorized_admin_access", f"Access denied to admin endpoint")
@@ -263,3 +421,68 @@ def api_key_required(f):
         
         return f(*args, **kwargs)
     return decorated_function
+
+
+# ============================================
+# ログインユーザー認証
+# ============================================
+
+def get_bearer_token():
+    """Authorizationヘッダーからセッショントークンを取り出す（ない場合はNone）"""
+    authorization = request.headers.get('Authorization', '')
+    if not authorization.startswith('Bearer '):
+        return None
+    return authorization[7:] or None
+
+
+def _auth_state():
+    """リクエストごとの認証結果（flask.g に保存）
+
+    アプリケーションコンテキストが複数のリクエストで共有される場合（テストクライアントなど）に
+    前のリクエストの結果を使わないよう、リクエストが変わったら作り直す
+    """
+    current_request = request._get_current_object()
+    state = g.get('auth_state')
+    if state is None or state['request'] is not current_request:
+        state = g.auth_state = {'request': current_request}
+    return state
+
+
+def current_user_id():
+    """リクエストのセッショントークンを検証してユーザーIDを返す（無効な場合はNone）
+
+    検証結果は flask.g に保存し、同じリクエスト内では再検証しない
+    """
+    state = _auth_state()
+    if 'user_id' not in state:
+        from repositories import validate_session
+        token = get_bearer_token()
+        state['user_id'] = validate_session(token) if token else None
+    return state['user_id']
+
+
+def get_current_user():
+    """ログインユーザーを返す（初回呼び出し時にだけ読み込み、同じリクエスト内では使い回す）"""
+    state = _auth_state()
+    if 'user' not in state:
+        user_id = current_user_id()
+        if user_id is None:
+            state['user'] = None
+        else:
+            from repositories import get_user_by_id
+            state['user'] = get_user_by_id(user_id)
+    return state['user']
+
+
+def login_required(f):
+    """ログインが必要なデコレータ（Authorization: Bearer <セッショントークン>）"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if get_bearer_token() is None:
+            return jsonify({"success": False, "error": "ログインが必要です"}), 401
+
+        if current_user_id() is None:
+            return jsonify({"success": False, "error": "無効なセッションです。再度ログインしてください"}), 401
+
+        return f(*args, **kwargs)
+    return decorated_function
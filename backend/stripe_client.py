@@ -0,0 +1,725 @@
+"""
+Stripe APIクライアントの設定
+すべてのStripe呼び出しが共有する、接続を使い回すHTTPセッションとタイムアウトを設定し、呼び出しごとの所要時間と
+新規接続（TCP + TLSハンドシェイク）の時間を記録する
+エンドポイントの系統ごとのサーキットブレーカーで障害時は待たずに失敗させ、安全な呼び出しだけを間隔を空けて再試行する
+送信レートは全プロセス共通のトークンバケットで揃え、画面からの操作をバックグラウンド処理より優先する
+複数の呼び出しが必要な処理向けに、同時実行数と全体の期限を持つ並列実行（stripe_fanout）を提供する
+"""
+import os
+import re
+import time
+import random
+import logging
+import threading
+import contextvars
+from functools import wraps
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+import requests
+import stripe
+from flask import jsonify
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPSConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# 接続の確立（TCP + TLS）を待つ秒数
+STRIPE_CONNECT_TIMEOUT_SECONDS = float(os.getenv("STRIPE_CONNECT_TIMEOUT_SECONDS", "3"))
+
+# レスポンスを待つ秒数
+STRIPE_READ_TIMEOUT_SECONDS = float(os.getenv("STRIPE_READ_TIMEOUT_SECONDS", "20"))
+
+# Stripe APIへの接続を保持する数（同時にStripeを呼ぶスレッド数に合わせる）
+STRIPE_POOL_SIZE = int(os.getenv("STRIPE_POOL_SIZE", "10"))
+
+# ネットワークエラー・5xx時の再試行回数（読み取りと、冪等キー付きの書き込みのみ再試行する）
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "2"))
+
+# 再試行の待ち時間（秒）。指数的に延ばした上限までの範囲でランダムに待つ
+STRIPE_RETRY_BASE_DELAY_SECONDS = float(os.getenv("STRIPE_RETRY_BASE_DELAY_SECONDS", "0.5"))
+STRIPE_RETRY_MAX_DELAY_SECONDS = float(os.getenv("STRIPE_RETRY_MAX_DELAY_SECONDS", "4"))
+
+# 連続で何回失敗したらブレーカーを開くか（ネットワークエラー・5xx）
+STRIPE_BREAKER_FAILURE_THRESHOLD = int(os.getenv("STRIPE_BREAKER_FAILURE_THRESHOLD", "5"))
+
+# ブレーカーを開いてから試験的な呼び出し（half-open）を許すまでの秒数
+STRIPE_BREAKER_RESET_SECONDS = float(os.getenv("STRIPE_BREAKER_RESET_SECONDS", "30"))
+
+# 1回の並列取得で同時に実行するStripe呼び出しの上限
+STRIPE_FANOUT_CONCURRENCY = int(os.getenv("STRIPE_FANOUT_CONCURRENCY", "4"))
+
+# 1回の並列取得全体の待ち時間（秒）。超えた分は結果なしとして返す
+STRIPE_FANOUT_DEADLINE_SECONDS = float(os.getenv("STRIPE_FANOUT_DEADLINE_SECONDS", "5"))
+
+# 呼び出し単位で上書きするタイムアウト（stripe_call_timeout で設定）
+_timeout_override = contextvars.ContextVar("stripe_timeout_override", default=None)
+
+# 呼び出しの優先度（interactive / background。stripe_lane で設定）
+_lane = contextvars.ContextVar("stripe_lane", default="interactive")
+
+# レートの空きを待ってよい期限（time.monotonic() の値。並列取得の中で取得全体の期限を設定）
+_wait_deadline = contextvars.ContextVar("stripe_wait_deadline", default=None)
+
+# Stripe APIを呼ぶ全プロセス合計のレート（「回数/秒数」。Stripeの上限は本番100回/秒・テストモード25回/秒。0で無効）
+STRIPE_RATE_LIMIT = os.getenv("STRIPE_RATE_LIMIT", "80/1")
+
+# バックグラウンド処理（Webhookの後処理・一括処理）が使ってよいレートの割合（残りは画面からの操作用）
+STRIPE_BACKGROUND_SHARE = float(os.getenv("STRIPE_BACKGROUND_SHARE", "0.5"))
+
+# レートの空きを待つ最大秒数（画面からの操作は超えたら送信し、バックグラウンド処理は諦める）
+STRIPE_INTERACTIVE_MAX_WAIT_SECONDS = float(os.getenv("STRIPE_INTERACTIVE_MAX_WAIT_SECONDS", "1"))
+STRIPE_BACKGROUND_MAX_WAIT_SECONDS = float(os.getenv("STRIPE_BACKGROUND_MAX_WAIT_SECONDS", "30"))
+
+# ブレーカーを分けるエンドポイントの系統（パスの先頭で判定。どれにも当たらないものは other）
+BREAKER_FAMILIES = {
+    'checkout': ('/v1/checkout/',),
+    'schedules': ('/v1/subscription_schedules',),
+    'subscriptions': ('/v1/subscriptions', '/v1/subscription_items'),
+    'portal': ('/v1/billing_portal/',),
+    'customers': ('/v1/customers',),
+}
+
+# 再送しても結果が変わらないメソッド（DELETEは2回目がエラーや別の結果になり得るため、冪等キー付きの場合だけ再試行する）
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+# パス中のオブジェクトID（cus_xxx, sub_sched_xxx など。subscription_schedules のようなリソース名と区別するため数字を含むもの）
+_OBJECT_ID = re.compile(r"^[a-z]+(?:_[a-z]+)*_(?=[A-Za-z]*\d)[A-Za-z0-9]{6,}$")
+
+
+# ============================================
+# 計測
+# ============================================
+
+def endpoint_family(method, url):
+    """「GET /v1/subscriptions/{id}」のように、IDを除いた呼び出しの種類"""
+    path = urlsplit(url).path
+    segments = ["{id}" if _OBJECT_ID.match(segment) else segment for segment in path.split("/")]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+class StripeCallStats:
+    """Stripe呼び出しの回数・所要時間と新規接続の時間"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._calls = {}
+            self._connections = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            self._fanouts = {'count': 0, 'calls': 0, 'errors': 0, 'timed_out': 0, 'max_ms': 0.0}
+            self._retries = 0
+
+    def record_call(self, family, elapsed_ms, ok):
+        with self._lock:
+            entry = self._calls.setdefault(family, {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            if not ok:
+                entry['errors'] += 1
+
+    def record_connect(self, elapsed_ms):
+        with self._lock:
+            self._connections['count'] += 1
+            self._connections['total_ms'] += elapsed_ms
+            self._connections['max_ms'] = max(self._connections['max_ms'], elapsed_ms)
+
+    def record_retry(self):
+        with self._lock:
+            self._retries += 1
+
+    def record_fanout(self, calls, errors, timed_out, elapsed_ms):
+        with self._lock:
+            self._fanouts['count'] += 1
+            self._fanouts['calls'] += calls
+            self._fanouts['errors'] += errors
+            self._fanouts['timed_out'] += timed_out
+            self._fanouts['max_ms'] = max(self._fanouts['max_ms'], elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            calls = {
+                family: {
+                    'count': entry['count'],
+                    'errors': entry['errors'],
+                    'avg_ms': round(entry['total_ms'] / entry['count'], 1),
+                    'max_ms': round(entry['max_ms'], 1),
+                }
+                for family, entry in self._calls.items()
+            }
+            connections = dict(self._connections)
+            fanouts = {**self._fanouts, 'max_ms': round(self._fanouts['max_ms'], 1)}
+            retries = self._retries
+        total_calls = sum(entry['count'] for entry in calls.values())
+        return {
+            'calls': calls,
+            'new_connections': connections['count'],
+            'connect_avg_ms': round(connections['total_ms'] / connections['count'], 1) if connections['count'] else 0.0,
+            'connect_max_ms': round(connections['max_ms'], 1),
+            # 1に近いほど呼び出しごとにTLSハンドシェイクしている
+            'connections_per_call': round(connections['count'] / total_calls, 3) if total_calls else 0.0,
+            'retries': retries,
+            'fanouts': fanouts,
+        }
+
+
+stripe_stats = StripeCallStats()
+
+
+# ============================================
+# サーキットブレーカー
+# ============================================
+
+class StripeCircuitOpenError(Exception):
+    """ブレーカーが開いているため呼び出さなかった"""
+
+    def __init__(self, family, retry_after):
+        super().__init__(f"Stripe {family} circuit is open (retry after {retry_after:.0f}s)")
+        self.family = family
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """連続した失敗で開き、一定時間後に1件だけ試験的に通して（half-open）成功すれば閉じる"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=STRIPE_BREAKER_FAILURE_THRESHOLD, reset_timeout=STRIPE_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._stats = {'opened': 0, 'rejected': 0}
+
+    def retry_after(self):
+        """次に試験的な呼び出しを許すまでの秒数（開いていない場合は0）"""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+    def is_open(self):
+        """呼び出しても拒否される状態か（試験的な呼び出しの枠は消費しない）"""
+        return self.retry_after() > 0
+
+    def allow_request(self):
+        """呼び出してよいか（half-open の場合は1件だけ許す）"""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probing = False
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"Stripe {self.name} circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._stats['opened'] += 1
+                    logger.warning(f"Stripe {self.name} circuit opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def reset(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                **self._stats,
+            }
+
+
+stripe_breakers = {name: CircuitBreaker(name) for name in (*BREAKER_FAMILIES, 'other')}
+
+
+def breaker_family(url):
+    """URLのパスからブレーカーの系統名を返す"""
+    path = urlsplit(url).path
+    for name, prefixes in BREAKER_FAMILIES.items():
+        if path.startswith(prefixes):
+            return name
+    return 'other'
+
+
+def _should_retry_response(response):
+    """Stripeの指示（Stripe-Should-Retry）・競合・レート制限・5xxのときに再試行する"""
+    should_retry = response.headers.get('Stripe-Should-Retry')
+    if should_retry is not None:
+        return should_retry == 'true'
+    return response.status_code in (409, 429) or response.status_code >= 500
+
+
+def _retry_delay(attempt, response=None):
+    """指数的に延ばした上限までの範囲でランダムな待ち時間（Retry-Afterが妥当な値ならそれ以上待つ）"""
+    delay = random.uniform(0, min(STRIPE_RETRY_MAX_DELAY_SECONDS, STRIPE_RETRY_BASE_DELAY_SECONDS * (2 ** attempt)))
+    if response is not None:
+        retry_after = _retry_after_seconds(response) or 0
+        if retry_after <= STRIPE_RETRY_MAX_DELAY_SECONDS:
+            delay = max(delay, retry_after)
+    return delay
+
+
+def _retry_after_seconds(response):
+    try:
+        return float(response.headers.get('Retry-After', 0)) or None
+    except ValueError:
+        return None
+
+
+def stripe_available(family):
+    """指定した系統のブレーカーが開いている間は、Stripeを呼ぶ前に503を返すデコレータ"""
+    breaker = stripe_breakers[family]
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            retry_after = breaker.retry_after()
+            if retry_after > 0:
+                response = jsonify({
+                    "success": False,
+                    "error": "決済サービスに接続できません。しばらくしてから再度お試しください",
+                    "retry_after": int(retry_after) + 1
+                })
+                response.status_code = 503
+                response.headers['Retry-After'] = str(int(retry_after) + 1)
+                return response
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+# ============================================
+# レートの調整（全プロセス共通のトークンバケット）
+# ============================================
+
+class StripeThrottledError(Exception):
+    """バックグラウンド処理（または並列取得の中の呼び出し）がレートの空きを待ちきれなかった"""
+
+    def __init__(self, wait):
+        super().__init__(f"Stripe rate limit budget exhausted for background calls (wait {wait:.1f}s)")
+        self.wait = wait
+
+
+@contextmanager
+def stripe_lane(lane):
+    """このブロック内のStripe呼び出しの優先度を設定（'background' は画面からの操作に枠を譲る）"""
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class StripeGovernor:
+    """Stripe APIへの呼び出しレートを全プロセスで揃える
+
+    画面からの操作は全体の枠だけを使い、バックグラウンド処理は全体の枠に加えて専用の枠（全体の一部）も消費する。
+    429を受けたら Retry-After の間は全プロセスで送信を止め、レートを半分に下げて成功のたびに少しずつ戻す
+    """
+
+    KEY_PREFIX = "stripe"
+    PAUSE_KEY = "stripe_governor:pause"
+
+    def __init__(self, limiter=None, rate=STRIPE_RATE_LIMIT, background_share=STRIPE_BACKGROUND_SHARE,
+                 max_wait=None):
+        from security import parse_rate_limit
+        self._limiter = limiter
+        self.limit = parse_rate_limit(rate)
+        self.background_share = background_share
+        self.max_wait = max_wait or {
+            'interactive': STRIPE_INTERACTIVE_MAX_WAIT_SECONDS,
+            'background': STRIPE_BACKGROUND_MAX_WAIT_SECONDS,
+        }
+        self._lock = threading.Lock()
+        self._factor = 1.0
+        self._paused_until = 0.0
+        self._stats = {lane: {'calls': 0, 'waited': 0, 'throttled': 0} for lane in self.max_wait}
+        self._stats['rate_limited'] = 0
+
+    @property
+    def limiter(self):
+        if self._limiter is None:
+            from security import RateLimiter
+            from cache import redis_client
+            self._limiter = RateLimiter(redis_client)
+        return self._limiter
+
+    def _pause_remaining(self):
+        remaining = self._paused_until - time.monotonic()
+        client = self.limiter.client
+        if client is not None:
+            try:
+                shared = client.pttl(self.PAUSE_KEY)
+                if shared and shared > 0:
+                    remaining = max(remaining, shared / 1000)
+            except Exception:
+                pass
+        return max(remaining, 0.0)
+
+    def _try_acquire(self, lane):
+        """枠を1つ消費する（消費できない場合は空くまでの秒数を返す）"""
+        count, period = self.limit
+        count = max(1, int(count * self._factor))
+        if lane == 'background':
+            result = self.limiter.hit(f"{self.KEY_PREFIX}:background", max(1, int(count * self.background_share)), period)
+            if not result.allowed:
+                return result.retry_after or period / count
+        result = self.limiter.hit(f"{self.KEY_PREFIX}:all", count, period)
+        if not result.allowed:
+            return result.retry_after or period / count
+        return 0.0
+
+    def acquire(self, lane=None):
+        """送信してよくなるまで待つ（バックグラウンド処理・並列取得の中の呼び出しは待ちきれない場合 StripeThrottledError）"""
+        if self.limit is None:
+            return
+        lane = lane or _lane.get()
+        deadline = time.monotonic() + self.max_wait.get(lane, 0)
+        # 並列取得の中では取得全体の期限を過ぎて待たない（期限後の結果は使われないため送信もしない）
+        fanout_deadline = _wait_deadline.get()
+        in_fanout = fanout_deadline is not None and fanout_deadline < deadline
+        if in_fanout:
+            deadline = fanout_deadline
+        waited = False
+        while True:
+            wait = self._pause_remaining() or self._try_acquire(lane)
+            if wait <= 0:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if lane == 'background' or in_fanout:
+                    with self._lock:
+                        self._stats[lane]['throttled'] += 1
+                    raise StripeThrottledError(wait)
+                # 画面からの操作は待ちすぎないよう、枠がなくても送信する（429は再試行で吸収する）
+                break
+            waited = True
+            time.sleep(min(wait, remaining))
+
+        with self._lock:
+            stats = self._stats.setdefault(lane, {'calls': 0, 'waited': 0, 'throttled': 0})
+            stats['calls'] += 1
+            if waited:
+                stats['waited'] += 1
+
+    def observe(self, status_code, retry_after=None):
+        """Stripeの応答を反映する（429でレートを下げて一時停止、それ以外で少しずつ戻す）"""
+        if self.limit is None:
+            return
+        with self._lock:
+            if status_code != 429:
+                if self._factor < 1.0:
+                    self._factor = min(1.0, self._factor + 0.05)
+                return
+            self._stats['rate_limited'] += 1
+            self._factor = max(0.1, self._factor / 2)
+            pause = retry_after if retry_after and retry_after > 0 else 1.0
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        logger.warning(f"Stripe rate limited: pausing {pause:.1f}s, rate factor {self._factor:.2f}")
+
+        client = self.limiter.client
+        if client is not None:
+            try:
+                client.set(self.PAUSE_KEY, "1", px=int(pause * 1000))
+            except Exception:
+                pass
+
+    def reset(self):
+        with self._lock:
+            self._factor = 1.0
+            self._paused_until = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': f"{self.limit[0]}/{self.limit[1]:g}" if self.limit else None,
+                'background_share': self.background_share,
+                'rate_factor': round(self._factor, 2),
+                'paused_seconds': round(max(self._paused_until - time.monotonic(), 0.0), 1),
+                'backend': self.limiter.stats()['backend'] if self._limiter is not None else None,
+                **{key: dict(value) if isinstance(value, dict) else value for key, value in self._stats.items()},
+            }
+
+
+stripe_governor = StripeGovernor()
+
+
+# ============================================
+# 接続とHTTPセッション
+# ============================================
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    """接続の確立（TCP + TLSハンドシェイク）にかかった時間を記録する"""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            stripe_stats.record_connect((time.perf_counter() - started) * 1000)
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class StripeHTTPAdapter(HTTPAdapter):
+    """接続の確立時間を計測するHTTPSアダプター"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            **self.poolmanager.pool_classes_by_scheme,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+class StripeSession(requests.Session):
+    """全スレッドで共有する Stripe API 用のHTTPセッション（keep-alive の接続プールを持つ）"""
+
+    def __init__(self, pool_size=STRIPE_POOL_SIZE):
+        super().__init__()
+        adapter = StripeHTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        override = _timeout_override.get()
+        if override is not None:
+            kwargs['timeout'] = override
+
+        family = endpoint_family(method, url)
+        breaker = stripe_breakers[breaker_family(url)]
+        # 書き込みは冪等キー付きのもの（同じキーで再送すればStripeが1回分の結果を返す）だけ再試行する
+        headers = kwargs.get('headers') or {}
+        retryable = method.upper() in SAFE_METHODS or 'Idempotency-Key' in headers
+        max_retries = STRIPE_MAX_NETWORK_RETRIES if retryable else 0
+
+        attempt = 0
+        while True:
+            stripe_governor.acquire()
+            if not breaker.allow_request():
+                raise StripeCircuitOpenError(breaker.name, breaker.retry_after())
+
+            started = time.perf_counter()
+            ok = False
+            try:
+                response = super().request(method, url, *args, **kwargs)
+                ok = response.status_code < 500
+            except requests.exceptions.SSLError:
+                breaker.record_failure()
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                breaker.record_failure()
+                if attempt >= max_retries:
+                    raise
+                delay = _retry_delay(attempt)
+                logger.info(f"Retrying {family} after {type(e).__name__} (attempt {attempt + 1}, {delay:.2f}s)")
+            except Exception:
+                breaker.record_failure()
+                raise
+            else:
+                stripe_governor.observe(response.status_code, _retry_after_seconds(response))
+                if ok:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                if attempt >= max_retries or not _should_retry_response(response):
+                    return response
+                delay = _retry_delay(attempt, response)
+                logger.info(f"Retrying {family} after HTTP {response.status_code} (attempt {attempt + 1}, {delay:.2f}s)")
+                response.close()
+            finally:
+                stripe_stats.record_call(family, (time.perf_counter() - started) * 1000, ok)
+
+            attempt += 1
+            stripe_stats.record_retry()
+            time.sleep(delay)
+
+
+# ============================================
+# クライアントの設定
+# ============================================
+
+_http_client = None
+_configure_lock = threading.Lock()
+
+
+def configure_stripe(api_key=None):
+    """stripe モジュールのAPIキー・HTTPクライアントを設定（アプリ起動時に1回呼ぶ）
+
+    stripe.Customer.create などモジュール経由の呼び出しはすべてここで設定したHTTPクライアントを使う
+    """
+    global _http_client
+    with _configure_lock:
+        stripe.api_key = api_key or os.getenv("STRIPE_SECRET_KEY")
+        # 負荷試験などでStripeの代わりのサーバーに向ける場合（例: tests/fake_stripe.py）
+        if os.getenv("STRIPE_API_BASE"):
+            stripe.api_base = os.getenv("STRIPE_API_BASE")
+        # 再試行は StripeSession が系統ごとのブレーカーと合わせて行うため、stripe-python 側では行わない
+        stripe.max_network_retries = 0
+        if _http_client is None:
+            _http_client = stripe.RequestsClient(
+                timeout=(STRIPE_CONNECT_TIMEOUT_SECONDS, STRIPE_READ_TIMEOUT_SECONDS),
+                session=StripeSession(),
+            )
+        stripe.default_http_client = _http_client
+    return _http_client
+
+
+def get_stripe_client():
+    """設定済みのHTTPクライアントを使う StripeClient を返す"""
+    http_client = _http_client or configure_stripe()
+    return stripe.StripeClient(stripe.api_key, http_client=http_client, max_network_retries=0)
+
+
+def get_stripe_session():
+    """全スレッドで共有している StripeSession（テスト用のアダプターを差し込む場合など）"""
+    return (_http_client or configure_stripe())._session
+
+
+@contextmanager
+def stripe_call_timeout(read=None, connect=None):
+    """このブロック内のStripe呼び出しのタイムアウトを上書きする（例: Webhook処理中の短い読み取り待ち）"""
+    token = _timeout_override.set((connect or STRIPE_CONNECT_TIMEOUT_SECONDS, read or STRIPE_READ_TIMEOUT_SECONDS))
+    try:
+        yield
+    finally:
+        _timeout_override.reset(token)
+
+
+def get_stripe_stats():
+    """Stripe呼び出しの計測値（/health/internal 用）"""
+    return {
+        'connect_timeout_seconds': STRIPE_CONNECT_TIMEOUT_SECONDS,
+        'read_timeout_seconds': STRIPE_READ_TIMEOUT_SECONDS,
+        'pool_size': STRIPE_POOL_SIZE,
+        'max_retries': STRIPE_MAX_NETWORK_RETRIES,
+        'breakers': {name: breaker.stats() for name, breaker in stripe_breakers.items()},
+        'governor': stripe_governor.stats(),
+        'fanout_concurrency': STRIPE_FANOUT_CONCURRENCY,
+        'fanout_deadline_seconds': STRIPE_FANOUT_DEADLINE_SECONDS,
+        **stripe_stats.snapshot(),
+    }
+
+
+# ============================================
+# 並列取得
+# ============================================
+
+# 全リクエストで共有するワーカー（HTTP接続プールと同じ数）
+_fanout_executor = None
+_fanout_lock = threading.Lock()
+
+
+def _get_fanout_executor():
+    global _fanout_executor
+    if _fanout_executor is None:
+        with _fanout_lock:
+            if _fanout_executor is None:
+                _fanout_executor = ThreadPoolExecutor(max_workers=STRIPE_POOL_SIZE, thread_name_prefix="stripe-fanout")
+    return _fanout_executor
+
+
+class FanoutResult:
+    """並列取得の結果（results: 成功した値 / errors: 例外 / timed_out: 期限内に終わらなかったキー）"""
+
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+        self.timed_out = set()
+
+    @property
+    def complete(self):
+        return not self.errors and not self.timed_out
+
+
+def stripe_fanout(calls, max_concurrency=STRIPE_FANOUT_CONCURRENCY, deadline=STRIPE_FANOUT_DEADLINE_SECONDS):
+    """{キー: 引数なしの関数} を並列に実行し、期限までに終わった分の結果を返す
+
+    同時に実行するのは max_concurrency 件まで。期限を過ぎた呼び出しは待たずに timed_out に入れる
+    （実行中のものは裏で完了するが結果は使わない）。各呼び出しの読み取りタイムアウトとレートの空き待ちは期限の残りに縮める
+    """
+    result = FanoutResult()
+    pending_calls = list(calls.items())
+    if not pending_calls:
+        return result
+
+    executor = _get_fanout_executor()
+    started = time.monotonic()
+    expires_at = started + deadline
+    running = {}
+
+    def submit(key, call):
+        remaining = max(expires_at - time.monotonic(), 0.1)
+        read = min(remaining, (_timeout_override.get() or (None, STRIPE_READ_TIMEOUT_SECONDS))[1])
+        context = contextvars.copy_context()
+
+        def run():
+            token = _wait_deadline.set(expires_at)
+            try:
+                with stripe_call_timeout(read=read):
+                    return call()
+            finally:
+                _wait_deadline.reset(token)
+
+        running[executor.submit(context.run, run)] = key
+
+    while pending_calls and len(running) < max_concurrency:
+        submit(*pending_calls.pop(0))
+
+    while running:
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            break
+        done, _ = wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            key = running.pop(future)
+            try:
+                result.results[key] = future.result()
+            except Exception as e:
+                result.errors[key] = e
+            if pending_calls:
+                submit(*pending_calls.pop(0))
+
+    for future, key in running.items():
+        future.cancel()
+        result.timed_out.add(key)
+    result.timed_out.update(key for key, _ in pending_calls)
+
+    stripe_stats.record_fanout(len(calls), len(result.errors), len(result.timed_out),
+                               (time.monotonic() - started) * 1000)
+    if result.timed_out:
+        logger.warning(f"Stripe fan-out deadline exceeded: {len(result.timed_out)}/{len(calls)} calls without result")
+    return result
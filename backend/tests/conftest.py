@@ -2,6 +2,10 @@ import pytest
 import os
 import datetime
 import stripe
+
+# 登録時のStripe Customer作成はバックグラウンドで起動せず、テスト内で run_once() を呼んで処理する
+os.environ.setdefault("STRIPE_CUSTOMER_PROVISION_INTERVAL_SECONDS", "0")
+
 from app import app
 from repositories import init_db, get_session
 from models import Base, User, Subscription, ProcessedEvent, Ledger
@@ -19,7 +23,9 @@ def db_engine():
         init_db()
         engine = get_session().get_bind() # 現在のセッションからエンジンを取得
         yield engine
-        # テストセッション終了時にテーブルを削除
+        # 書き込み待ちのセッションアクティビティを先に書き込んでからテーブルを削除
+        from repositories.session_activity import activity_buffer
+        activity_buffer.flush()
         Base.metadata.drop_all(engine)
 
 @pytest.fixture()
@@ -0,0 +1,601 @@
+"""
+Stripeの代わりに使う状態を持ったフェイク（負荷試験・オフラインのE2Eテスト用）
+customers / checkout sessions / subscriptions / subscription schedules / billing portal / prices を扱い、
+遅延の分布と失敗（5xx・429・タイムアウト）を注入でき、状態の変化を署名付きWebhookとして送り返す
+
+プロセス内で使う（共有の StripeSession にアダプターを差し込む）:
+
+    fake = FakeStripe(latency=Latency(median_ms=80, p99_ms=400), webhook_secret="whsec_test")
+    with fake.installed():
+        ...  # stripe.checkout.Session.create などはフェイクに届く
+        fake.complete_checkout(session_id)
+        fake.deliver_webhooks(send)  # send(payload, headers) でアプリの /webhook に送る
+
+HTTPサーバーとして起動する（アプリは STRIPE_API_BASE=http://localhost:12111 で起動）:
+
+    python -m tests.fake_stripe --port 12111 --latency 80:400 --error-rate 0.01 \\
+        --webhook-url http://localhost:5000/webhook --webhook-secret whsec_test
+
+    # 支払いの完了は POST /_fake/checkout/sessions/{id}/complete
+"""
+import re
+import hmac
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qsl
+import requests
+from requests.adapters import BaseAdapter
+from stripe_client import breaker_family, get_stripe_session
+
+logger = logging.getLogger(__name__)
+
+_KEY = re.compile(r"([^\[\]]+)|\[([^\[\]]*)\]")
+
+# 1か月（サブスクリプションの請求期間）
+PERIOD_SECONDS = 30 * 24 * 3600
+
+
+# ============================================
+# 遅延と失敗の注入
+# ============================================
+
+class Latency:
+    """対数正規分布の遅延（中央値とp99で指定）"""
+
+    def __init__(self, median_ms=0, p99_ms=None):
+        self.median_ms = median_ms
+        self.p99_ms = p99_ms if p99_ms is not None else median_ms
+        # p99 = 中央値 * exp(2.326 * sigma)
+        self.sigma = math.log(self.p99_ms / self.median_ms) / 2.326 if self.median_ms and self.p99_ms > self.median_ms else 0
+
+    @classmethod
+    def parse(cls, value):
+        """「中央値:p99」（ミリ秒）形式"""
+        median, _, p99 = value.partition(':')
+        return cls(float(median), float(p99) if p99 else None)
+
+    def sample(self, rng):
+        if not self.median_ms:
+            return 0.0
+        return self.median_ms * math.exp(rng.gauss(0, self.sigma)) / 1000
+
+
+class Faults:
+    """失敗の割合（error: 500 / rate_limit: 429 / timeout: 応答しない）"""
+
+    def __init__(self, error_rate=0.0, rate_limit_rate=0.0, timeout_rate=0.0, retry_after=1):
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.retry_after = retry_after
+
+    def pick(self, rng):
+        roll = rng.random()
+        for kind, rate in (('timeout', self.timeout_rate), ('error', self.error_rate),
+                           ('rate_limit', self.rate_limit_rate)):
+            if roll < rate:
+                return kind
+            roll -= rate
+        return None
+
+
+class FakeStripeError(Exception):
+    def __init__(self, status, message, code=None, param=None, error_type="invalid_request_error"):
+        super().__init__(message)
+        self.status = status
+        self.body = {"error": {"type": error_type, "message": message, "code": code, "param": param}}
+
+
+def _not_found(resource, object_id):
+    return FakeStripeError(404, f"No such {resource}: '{object_id}'", code="resource_missing", param="id")
+
+
+# ============================================
+# リクエストの解釈
+# ============================================
+
+def _listify(value):
+    """キーがすべて数字の辞書をリストに変換（line_items[0][price] など）"""
+    if isinstance(value, dict):
+        value = {key: _listify(item) for key, item in value.items()}
+        if value and all(key.isdigit() for key in value):
+            return [value[key] for key in sorted(value, key=int)]
+    return value
+
+
+def decode_params(encoded):
+    """stripe-python のフォーム形式（metadata[user_id]=1 など）を入れ子の辞書に変換"""
+    params = {}
+    for raw_key, value in parse_qsl(encoded or "", keep_blank_values=True):
+        parts = [plain or bracket for plain, bracket in _KEY.findall(raw_key)]
+        target = params
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return _listify(params)
+
+
+def _as_bool(value):
+    return value in (True, "true", "True", "1")
+
+
+def _as_int(value, now):
+    if value in (None, ""):
+        return None
+    if value == "now":
+        return now
+    return int(value)
+
+
+# ============================================
+# フェイク本体
+# ============================================
+
+class FakeStripe:
+    """Stripe APIの一部をメモリ上の状態で再現する"""
+
+    def __init__(self, latency=None, faults=None, family_latency=None, family_faults=None,
+                 webhook_secret=None, seed=None):
+        self.latency = latency or Latency()
+        self.faults = faults or Faults()
+        self.family_latency = family_latency or {}
+        self.family_faults = family_faults or {}
+        self.webhook_secret = webhook_secret
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self.objects = {kind: {} for kind in ('customer', 'checkout.session', 'subscription',
+                                              'subscription_schedule', 'invoice', 'price', 'product')}
+        self.events = []
+        self.stats = {'requests': 0, 'injected': {'error': 0, 'rate_limit': 0, 'timeout': 0}, 'by_family': {}}
+
+    # --------------------------------------------
+    # 状態
+    # --------------------------------------------
+
+    def _id(self, prefix):
+        return f"{prefix}_fake{uuid.uuid4().hex[:14]}"
+
+    def _get(self, kind, object_id, resource):
+        obj = self.objects[kind].get(object_id)
+        if obj is None:
+            raise _not_found(resource, object_id)
+        return obj
+
+    def _emit(self, event_type, obj):
+        self.events.append({
+            "id": self._id("evt"),
+            "object": "event",
+            "type": event_type,
+            "created": int(time.time()),
+            "data": {"object": json.loads(json.dumps(obj))},
+        })
+
+    def add_customer(self, customer_id, email=None, name=None):
+        """既存のCustomerを登録（DBに保存済みのCustomer IDをそのまま使う場合）"""
+        with self._lock:
+            customer = {"id": customer_id, "object": "customer", "created": int(time.time()),
+                        "email": email, "name": name, "metadata": {}}
+            self.objects['customer'][customer_id] = customer
+            return customer
+
+    def add_price(self, price_id, product_name, unit_amount, currency="jpy", interval="month", metadata=None):
+        """カタログに価格を登録（product も作る）"""
+        with self._lock:
+            product_id = f"prod_{price_id}"
+            self.objects['product'][product_id] = {
+                "id": product_id, "object": "product", "name": product_name, "active": True,
+                "metadata": metadata or {},
+            }
+            price = {
+                "id": price_id, "object": "price", "product": product_id, "active": True,
+                "unit_amount": unit_amount, "currency": currency, "recurring": {"interval": interval},
+                "metadata": metadata or {},
+            }
+            self.objects['price'][price_id] = price
+            return price
+
+    # --------------------------------------------
+    # 操作（支払いの完了など、ユーザーやStripe側で起きること）
+    # --------------------------------------------
+
+    def complete_checkout(self, session_id):
+        """Checkoutでの支払いが完了した状態にし、対応するWebhookイベントを積む"""
+        with self._lock:
+            session = self._get('checkout.session', session_id, 'checkout.session')
+            now = int(time.time())
+            session.update(status="complete", payment_status="paid")
+
+            if session["mode"] == "subscription":
+                price_id = session["_line_items"][0].get("price")
+                subscription = {
+                    "id": self._id("sub"), "object": "subscription", "customer": session["customer"],
+                    "status": "active", "cancel_at_period_end": False, "created": now,
+                    "current_period_start": now, "current_period_end": now + PERIOD_SECONDS,
+                    "items": {"object": "list", "data": [{"price": self._price(price_id), "quantity": 1,
+                                                          "current_period_end": now + PERIOD_SECONDS}]},
+                    "metadata": {}, "schedule": None, "latest_invoice": None, "trial_end": None,
+                }
+                invoice = {
+                    "id": self._id("in"), "object": "invoice", "subscription": subscription["id"],
+                    "customer": session["customer"], "status": "paid", "created": now,
+                    "amount_due": self._price(price_id).get("unit_amount") or 0, "currency": "jpy",
+                }
+                subscription["latest_invoice"] = invoice["id"]
+                session["subscription"] = subscription["id"]
+                self.objects['subscription'][subscription["id"]] = subscription
+                self.objects['invoice'][invoice["id"]] = invoice
+                self._emit("customer.subscription.created", subscription)
+                self._emit("invoice.paid", invoice)
+
+            self._emit("checkout.session.completed", self._public(session))
+            return session
+
+    def _price(self, price_id):
+        return self.objects['price'].get(price_id) or {"id": price_id, "object": "price"}
+
+    @staticmethod
+    def _public(obj):
+        return {key: value for key, value in obj.items() if not key.startswith('_')}
+
+    # --------------------------------------------
+    # APIの処理
+    # --------------------------------------------
+
+    def handle(self, method, path, params):
+        """(ステータス, 本文) を返す"""
+        with self._lock:
+            try:
+                return 200, self._public(self._route(method.upper(), path.rstrip('/'), params))
+            except FakeStripeError as e:
+                return e.status, e.body
+
+    def _route(self, method, path, params):
+        parts = path.split('/')[2:]  # 先頭の /v1 を除く
+        resource = '/'.join(parts[:2]) if parts[:1] in (['checkout'], ['billing_portal']) else parts[0]
+        rest = parts[2:] if parts[:1] in (['checkout'], ['billing_portal']) else parts[1:]
+        handler = getattr(self, f"_{resource.replace('/', '_')}", None)
+        if handler is None:
+            raise FakeStripeError(404, f"Unrecognized request URL ({method}: {path})")
+        return handler(method, rest, params)
+
+    def _list(self, items, params):
+        limit = int(params.get("limit") or 10)
+        items = list(items)
+        return {"object": "list", "data": [self._public(item) for item in items[:limit]],
+                "has_more": len(items) > limit, "url": ""}
+
+    def _customers(self, method, rest, params):
+        if not rest:
+            if method == "POST":
+                customer = {
+                    "id": self._id("cus"), "object": "customer", "created": int(time.time()),
+                    "email": params.get("email"), "name": params.get("name"), "metadata": params.get("metadata") or {},
+                }
+                self.objects['customer'][customer["id"]] = customer
+                return customer
+            return self._list((c for c in self.objects['customer'].values() if not c.get("deleted")), params)
+
+        customer = self._get('customer', rest[0], 'customer')
+        if method == "DELETE":
+            customer.clear()
+            customer.update(id=rest[0], object="customer", deleted=True)
+            self._emit("customer.deleted", customer)
+        return customer
+
+    def _checkout_sessions(self, method, rest, params):
+        if not rest:
+            if method == "POST":
+                customer_id = params.get("customer")
+                if customer_id:
+                    customer = self._get('customer', customer_id, 'customer')
+                    if customer.get("deleted"):
+                        raise _not_found('customer', customer_id)
+                line_items = params.get("line_items") or []
+                amount = sum(int((item.get("price_data") or {}).get("unit_amount") or
+                                 self._price(item.get("price")).get("unit_amount") or 0) * int(item.get("quantity") or 1)
+                             for item in line_items)
+                now = int(time.time())
+                session = {
+                    "id": self._id("cs_test"), "object": "checkout.session", "mode": params.get("mode", "payment"),
+                    "customer": customer_id, "metadata": params.get("metadata") or {}, "status": "open",
+                    "payment_status": "unpaid", "amount_total": amount, "currency": "jpy", "subscription": None,
+                    "created": now, "expires_at": now + 24 * 3600, "success_url": params.get("success_url"),
+                    "_line_items": line_items,
+                }
+                session["url"] = f"https://checkout.stripe.test/c/pay/{session['id']}"
+                self.objects['checkout.session'][session["id"]] = session
+                return session
+            sessions = [s for s in reversed(list(self.objects['checkout.session'].values()))
+                        if not params.get("customer") or s["customer"] == params["customer"]]
+            return self._list(sessions, params)
+
+        session = self._get('checkout.session', rest[0], 'checkout.session')
+        if rest[1:] == ["expire"] and method == "POST":
+            if session["status"] != "open":
+                raise FakeStripeError(400, "Only open sessions can be expired")
+            session["status"] = "expired"
+            self._emit("checkout.session.expired", self._public(session))
+        return session
+
+    def _billing_portal_sessions(self, method, rest, params):
+        self._get('customer', params.get("customer"), 'customer')
+        session_id = self._id("bps")
+        return {"id": session_id, "object": "billing_portal.session", "customer": params.get("customer"),
+                "return_url": params.get("return_url"), "url": f"https://billing.stripe.test/p/session/{session_id}",
+                "created": int(time.time())}
+
+    def _subscriptions(self, method, rest, params):
+        if not rest:
+            return self._list(self.objects['subscription'].values(), params)
+        subscription = self._get('subscription', rest[0], 'subscription')
+        if method == "POST":
+            if "cancel_at_period_end" in params:
+                subscription["cancel_at_period_end"] = _as_bool(params["cancel_at_period_end"])
+            if "metadata" in params:
+                subscription["metadata"].update(params["metadata"])
+            self._emit("customer.subscription.updated", subscription)
+        elif method == "DELETE":
+            subscription["status"] = "canceled"
+            self._emit("customer.subscription.deleted", subscription)
+        return subscription
+
+    def _subscription_schedules(self, method, rest, params):
+        now = int(time.time())
+        if not rest:
+            if method != "POST":
+                return self._list(self.objects['subscription_schedule'].values(), params)
+            subscription = self._get('subscription', params.get("from_subscription"), 'subscription')
+            if subscription.get("schedule"):
+                raise FakeStripeError(400, "You cannot migrate a subscription that is already attached to a schedule")
+            price_id = subscription["items"]["data"][0]["price"]["id"]
+            schedule = {
+                "id": self._id("sub_sched"), "object": "subscription_schedule", "status": "active",
+                "subscription": subscription["id"], "customer": subscription["customer"], "end_behavior": "release",
+                "current_phase": {"start_date": subscription["current_period_start"],
+                                  "end_date": subscription["current_period_end"]},
+                "phases": [{"start_date": subscription["current_period_start"],
+                            "end_date": subscription["current_period_end"],
+                            "items": [{"price": price_id, "quantity": 1}]}],
+                "metadata": {}, "released_subscription": None, "created": now,
+            }
+            subscription["schedule"] = schedule["id"]
+            self.objects['subscription_schedule'][schedule["id"]] = schedule
+            self._emit("subscription_schedule.created", schedule)
+            return schedule
+
+        schedule = self._get('subscription_schedule', rest[0], 'subscription_schedule')
+        if method != "POST":
+            return schedule
+        if rest[1:] == ["release"]:
+            if schedule["status"] not in ("not_started", "active"):
+                raise FakeStripeError(400, f"You cannot release a subscription schedule that is currently in the `{schedule['status']}` status.")
+            subscription = self.objects['subscription'].get(schedule["subscription"])
+            if subscription is not None:
+                subscription["schedule"] = None
+            schedule.update(status="released", released_subscription=schedule["subscription"], subscription=None,
+                            current_phase=None)
+            self._emit("subscription_schedule.released", schedule)
+            return schedule
+
+        if "phases" in params:
+            phases = []
+            for phase in params["phases"]:
+                phases.append({
+                    "start_date": _as_int(phase.get("start_date"), now),
+                    "end_date": _as_int(phase.get("end_date"), now),
+                    "items": [{"price": item.get("price"), "quantity": int(item.get("quantity") or 1)}
+                              for item in phase.get("items") or []],
+                })
+            # 終了日の省略されたフェーズは前のフェーズの終了日から1期間
+            for previous, phase in zip(phases, phases[1:]):
+                phase["start_date"] = phase["start_date"] or previous["end_date"]
+                phase["end_date"] = phase["end_date"] or phase["start_date"] + PERIOD_SECONDS
+            schedule["phases"] = phases
+        if "end_behavior" in params:
+            schedule["end_behavior"] = params["end_behavior"]
+        if "metadata" in params:
+            schedule["metadata"].update(params["metadata"])
+        self._emit("subscription_schedule.updated", schedule)
+        return schedule
+
+    def _prices(self, method, rest, params):
+        if rest:
+            return self._get('price', rest[0], 'price')
+        prices = [p for p in self.objects['price'].values()
+                  if "active" not in params or p["active"] == _as_bool(params["active"])]
+        return self._list(prices, params)
+
+    def _products(self, method, rest, params):
+        if rest:
+            return self._get('product', rest[0], 'product')
+        return self._list(self.objects['product'].values(), params)
+
+    # --------------------------------------------
+    # 遅延・失敗の注入と統計
+    # --------------------------------------------
+
+    def plan_request(self, url):
+        """このリクエストの (遅延秒, 注入する失敗) を決める"""
+        family = breaker_family(url)
+        with self._lock:
+            latency = self.family_latency.get(family, self.latency).sample(self._rng)
+            fault = self.family_faults.get(family, self.faults).pick(self._rng)
+            self.stats['requests'] += 1
+            self.stats['by_family'][family] = self.stats['by_family'].get(family, 0) + 1
+            if fault:
+                self.stats['injected'][fault] += 1
+        return latency, fault
+
+    def fault_response(self, fault, url):
+        faults = self.family_faults.get(breaker_family(url), self.faults)
+        if fault == 'rate_limit':
+            return 429, {"error": {"type": "invalid_request_error", "code": "rate_limit",
+                                   "message": "Too many requests hit the API too quickly."}}, \
+                {"Retry-After": str(faults.retry_after)}
+        return 500, {"error": {"type": "api_error", "message": "An unknown error occurred"}}, {}
+
+    # --------------------------------------------
+    # Webhook
+    # --------------------------------------------
+
+    def sign(self, payload, timestamp=None):
+        """Stripe-Signature ヘッダーの値"""
+        timestamp = timestamp or int(time.time())
+        signature = hmac.new(self.webhook_secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+        return f"t={timestamp},v1={signature}"
+
+    def pop_events(self):
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    def deliver_webhooks(self, send):
+        """積まれたイベントを署名して送る（send(payload: str, headers: dict) -> ステータスコード）"""
+        statuses = []
+        for event in self.pop_events():
+            payload = json.dumps(event)
+            headers = {"Content-Type": "application/json"}
+            if self.webhook_secret:
+                headers["Stripe-Signature"] = self.sign(payload)
+            statuses.append(send(payload, headers))
+        return statuses
+
+    # --------------------------------------------
+    # プロセス内での利用
+    # --------------------------------------------
+
+    @contextmanager
+    def installed(self, base_url=None, session=None):
+        """共有の StripeSession に差し込み、ブロックを抜けたら外す"""
+        import stripe
+        base_url = (base_url or stripe.api_base).rstrip('/') + '/'
+        session = session or get_stripe_session()
+        previous = session.adapters.get(base_url)
+        session.mount(base_url, FakeStripeAdapter(self))
+        try:
+            yield self
+        finally:
+            if previous is not None:
+                session.mount(base_url, previous)
+            else:
+                session.adapters.pop(base_url, None)
+
+
+class FakeStripeAdapter(BaseAdapter):
+    """requests のアダプターとしてフェイクに処理させる（ネットワークを使わない）"""
+
+    def __init__(self, fake):
+        super().__init__()
+        self.fake = fake
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        latency, fault = self.fake.plan_request(request.url)
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+
+        if fault == 'timeout' or (read_timeout is not None and latency > read_timeout):
+            time.sleep(read_timeout if read_timeout is not None else latency)
+            raise requests.exceptions.ReadTimeout(f"Fake Stripe did not respond ({request.url})", request=request)
+        if latency:
+            time.sleep(latency)
+
+        if fault:
+            status, body, headers = self.fake.fault_response(fault, request.url)
+        else:
+            url = urlsplit(request.url)
+            body_text = request.body.decode() if isinstance(request.body, bytes) else request.body
+            params = decode_params(body_text if request.method == "POST" else url.query)
+            status, body = self.fake.handle(request.method, url.path, params)
+            headers = {}
+
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        response.headers.update({"Content-Type": "application/json", "Request-Id": f"req_fake{uuid.uuid4().hex[:12]}",
+                                 **headers})
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        return response
+
+    def close(self):
+        pass
+
+
+# ============================================
+# HTTPサーバーとしての利用
+# ============================================
+
+def make_wsgi_app(fake, webhook_url=None):
+    """フェイクをWSGIアプリとして公開（Webhookは webhook_url へ別スレッドで送る）"""
+    from werkzeug.wrappers import Request, Response
+
+    def send(payload, headers):
+        return requests.post(webhook_url, data=payload, headers=headers, timeout=10).status_code
+
+    def flush():
+        if webhook_url:
+            threading.Thread(target=fake.deliver_webhooks, args=(send,), daemon=True).start()
+
+    @Request.application
+    def app(request):
+        path = request.path
+        match = re.fullmatch(r"/_fake/checkout/sessions/([^/]+)/complete", path)
+        if match:
+            try:
+                session = fake.complete_checkout(match.group(1))
+                status, body, headers = 200, fake._public(session), {}
+            except FakeStripeError as e:
+                status, body, headers = e.status, e.body, {}
+        else:
+            latency, fault = fake.plan_request(request.url)
+            time.sleep(latency if fault != 'timeout' else 60)
+            if fault:
+                status, body, headers = fake.fault_response(fault, request.url)
+            else:
+                encoded = request.get_data(as_text=True) if request.method == "POST" else request.query_string.decode()
+                status, body = fake.handle(request.method, path, decode_params(encoded))
+                headers = {}
+        flush()
+        return Response(json.dumps(body), status=status, headers=headers, content_type="application/json")
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="負荷試験用のフェイクStripeサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency", default="0", help="遅延の「中央値:p99」（ミリ秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--webhook-url")
+    parser.add_argument("--webhook-secret")
+    parser.add_argument("--price", action="append", default=[], help="price_id:商品名:金額（複数指定可）")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    fake = FakeStripe(
+        latency=Latency.parse(args.latency),
+        faults=Faults(args.error_rate, args.rate_limit_rate, args.timeout_rate),
+        webhook_secret=args.webhook_secret,
+        seed=args.seed,
+    )
+    for price in args.price:
+        price_id, name, amount = price.split(":")
+        fake.add_price(price_id, name, int(amount))
+
+    from werkzeug.serving import run_simple
+    run_simple(args.host, args.port, make_wsgi_app(fake, args.webhook_url), threaded=True)
+
+
+if __name__ == "__main__":
+    main()
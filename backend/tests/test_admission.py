@@ -0,0 +1,78 @@
+"""
+流入制御テスト：バルクヘッドの待ち行列と負荷遮断をテスト
+"""
+import threading
+import pytest
+from flask import Flask, Blueprint, jsonify
+from admission import Bulkhead, AdmissionController, setup_admission_control
+
+
+@pytest.mark.unit
+def test_bulkhead_queues_then_sheds():
+    """上限を超えた分は待ち行列で待ち、待ち行列も満杯なら遮断する"""
+    bulkhead = Bulkhead("test", max_concurrent=1, max_queue=1, queue_timeout=5)
+    assert bulkhead.try_acquire()
+
+    waiter_result = []
+    waiter = threading.Thread(target=lambda: waiter_result.append(bulkhead.try_acquire()))
+    waiter.start()
+    while bulkhead.stats()["waiting"] == 0:
+        pass
+
+    # 実行中1件・待ち1件で満杯
+    assert not bulkhead.try_acquire()
+
+    bulkhead.release()
+    waiter.join(timeout=5)
+    assert waiter_result == [True]
+
+    stats = bulkhead.stats()
+    assert stats["in_flight"] == 1
+    assert stats["admitted"] == 2
+    assert stats["shed"] == 1
+
+
+@pytest.mark.unit
+def test_bulkhead_wait_times_out():
+    bulkhead = Bulkhead("test", max_concurrent=1, max_queue=4, queue_timeout=0.01)
+    assert bulkhead.try_acquire()
+    assert not bulkhead.try_acquire()
+    assert bulkhead.stats()["timed_out"] == 1
+
+
+@pytest.mark.api
+def test_low_priority_is_shed_while_critical_has_capacity():
+    """低優先度のクラスが満杯でも、Webhook等のクラスの枠は使える"""
+    app = Flask(__name__)
+    user_bp = Blueprint('user', __name__)
+    webhook_bp = Blueprint('webhook', __name__)
+
+    @user_bp.route('/mypage')
+    def mypage():
+        return jsonify({"success": True})
+
+    @webhook_bp.route('/webhook', methods=['POST'])
+    def webhook():
+        return jsonify({"success": True})
+
+    app.register_blueprint(user_bp)
+    app.register_blueprint(webhook_bp)
+    controller = AdmissionController(limits={'critical': (1, 0), 'low': (1, 0)},
+                                     route_classes={'webhook': 'critical', 'user': 'low'})
+    setup_admission_control(app, controller)
+    client = app.test_client()
+
+    # 低優先度の枠を使い切った状態にする
+    assert controller.bulkheads['low'].try_acquire()
+
+    response = client.get('/mypage')
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+    assert client.post('/webhook').status_code == 200
+
+    controller.bulkheads['low'].release()
+    assert client.get('/mypage').status_code == 200
+    stats = controller.stats()
+    assert stats['low']['in_flight'] == 0
+    assert stats['low']['shed'] == 1
+    assert stats['critical']['admitted'] == 1
@@ -0,0 +1,98 @@
+"""
+売上分析テスト：MRR・チャーン・ARPU・プラン構成の計算をテスト
+"""
+import pytest
+import numpy as np
+
+from analytics import RevenueDataset, to_epoch
+
+DAY = 86400
+JAN_1 = to_epoch("2025-01-01")
+FEB_1 = to_epoch("2025-02-01")
+
+
+def _dataset():
+    """3件のサブスクリプション（継続・期間中に新規・期間中に解約）と単発購入1件"""
+    subscriptions = (
+        np.array(["sub_keep", "sub_new", "sub_churn"], dtype=object),
+        np.array([1, 2, 3], dtype=object),
+        np.array(["price_premium_test", "price_standard_test", "price_standard_test"], dtype=object),
+        np.array(["active", "active", "canceled"], dtype=object),
+        np.array([FEB_1 + 10 * DAY, FEB_1 + 10 * DAY, JAN_1 + 15 * DAY], dtype=object),
+        np.array(["2024-12-01T00:00:00+00:00", "2025-01-10T00:00:00+00:00", "2024-11-15T00:00:00+00:00"], dtype=object),
+    )
+    invoices = (
+        np.array(["sub_keep", "sub_keep", "sub_new", "sub_churn", "sub_churn"], dtype=object),
+        np.array(["paid", "paid", "paid", "paid", "open"], dtype=object),
+        np.array([2980.0, 4980.0, 2980.0, 2980.0, 2980.0]),
+        np.array(["jpy"] * 5, dtype=object),
+        np.array([JAN_1 - 31 * DAY, JAN_1 + DAY, JAN_1 + 9 * DAY, JAN_1 - 17 * DAY, JAN_1 + 14 * DAY], dtype=np.int64),
+    )
+    ledger = (
+        np.array([1, 2], dtype=np.int64),
+        np.array([4980.0, 1000.0]),
+        np.array(["jpy", "jpy"], dtype=object),
+        np.array(["paid", "unpaid"], dtype=object),
+        np.array(["2025-01-20T12:00:00+00:00", "2025-01-21T12:00:00+00:00"], dtype=object),
+    )
+    return RevenueDataset(subscriptions, invoices, ledger)
+
+
+@pytest.mark.unit
+def test_compute_metrics():
+    """期間内のMRR・新規・解約・収益が正しく集計されるか"""
+    metrics = _dataset().compute_metrics(JAN_1, FEB_1)
+    jpy = metrics["currencies"]["jpy"]
+    
+    # 月額は直近の支払い済み請求書（sub_keepは4980に変更済み）
+    assert jpy["mrr_start"] == 4980 + 2980
+    assert jpy["mrr_end"] == 4980 + 2980
+    assert jpy["new_mrr"] == 2980
+    assert jpy["churned_mrr"] == 2980
+    assert jpy["net_new_mrr"] == 0
+    assert jpy["arpu"] == pytest.approx((4980 + 2980) / 2)
+    
+    # 期間内の支払い済みのみ
+    assert jpy["revenue"]["subscription"] == 4980 + 2980
+    assert jpy["revenue"]["one_time"] == 4980
+    
+    assert metrics["subscribers"] == {"start": 2, "end": 2, "new": 1, "churned": 1}
+    assert metrics["churn_rate"] == 0.5
+
+
+@pytest.mark.unit
+def test_plan_mix_and_series():
+    """プラン構成とMRR推移の計算"""
+    dataset = _dataset()
+    
+    mix = {plan["price_id"]: plan for plan in dataset.compute_metrics(JAN_1, FEB_1)["plan_mix"]}
+    assert mix["price_premium_test"]["subscribers"] == 1
+    assert mix["price_standard_test"]["share"] == 0.5
+    
+    series = dataset.mrr_series(JAN_1, FEB_1, interval_days=7)
+    assert len(series["points"]) == 5
+    # 1/1: keep + churn, 1/15: keep + new + churn, 1/22: keep + new
+    assert series["mrr"]["jpy"][0] == 4980 + 2980
+    assert series["mrr"]["jpy"][2] == 4980 + 2980 + 2980
+    assert series["mrr"]["jpy"][3] == 4980 + 2980
+
+
+@pytest.mark.unit
+def test_empty_dataset():
+    """データがなくてもエラーにならない"""
+    empty = np.array([], dtype=object)
+    dataset = RevenueDataset(
+        (empty, empty, empty, empty, empty, empty),
+        (empty, empty, np.array([]), empty, np.array([], dtype=np.int64)),
+        (np.array([], dtype=np.int64), np.array([]), empty, empty, empty),
+    )
+    metrics = dataset.compute_metrics(JAN_1, FEB_1)
+    assert metrics["subscribers"]["end"] == 0
+    assert metrics["currencies"] == {}
+
+
+@pytest.mark.api
+def test_admin_metrics_requires_admin(client):
+    """管理者キーなしでは403"""
+    response = client.get('/api/admin/metrics')
+    assert response.status_code == 403
@@ -0,0 +1,91 @@
+"""
+非同期リポジトリテスト：SQLAlchemy asyncio版リポジトリの動作確認
+"""
+import asyncio
+import pytest
+from sqlalchemy import create_engine
+
+pytest.importorskip("aiosqlite")
+
+from models import Base
+from repositories import aio
+from repositories.aio.database import to_async_url
+
+
+@pytest.fixture()
+def async_db(tmp_path, monkeypatch):
+    """テスト用のSQLiteファイルを作成して非同期リポジトリを向ける"""
+    db_url = f"sqlite:///{tmp_path / 'async_test.db'}"
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    monkeypatch.setenv("ASYNC_DATABASE_URL", db_url)
+    aio.init_db()
+    yield
+
+
+def test_to_async_url():
+    """同期用URLが非同期ドライバのURLに変換されるかテスト"""
+    assert to_async_url("postgresql://u:p@db:5432/app") == "postgresql+asyncpg://u:p@db:5432/app"
+    assert to_async_url("postgres://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert to_async_url("sqlite:///tmp/app.db") == "sqlite+aiosqlite:///tmp/app.db"
+    assert to_async_url("postgresql+asyncpg://db/app") == "postgresql+asyncpg://db/app"
+
+
+@pytest.mark.unit
+def test_async_user_and_session_flow(async_db):
+    """ユーザー作成からセッション検証・ログアウトまで"""
+
+    async def scenario():
+        password_hash = await aio.hash_password("password123")
+        user = await aio.create_user("async@example.com", password_hash, "非同期ユーザー")
+
+        authenticated = await aio.authenticate_user("async@example.com", "password123")
+        assert authenticated.id == user.id
+        assert await aio.authenticate_user("async@example.com", "wrong-password") is None
+
+        token = await aio.create_session(user.id)
+        assert await aio.validate_session(token) == user.id
+
+        # 複数クエリを同時に待ち合わせできる
+        found, history = await asyncio.gather(
+            aio.get_user_from_session(token),
+            aio.get_user_purchase_history(user.id),
+        )
+        assert found.email == "async@example.com"
+        assert history == []
+
+        assert await aio.logout_user(token) is True
+        assert await aio.validate_session(token) is None
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_async_webhook_records(async_db):
+    """台帳・請求書・サブスクリプションの記録が冪等に動くか"""
+
+    async def scenario():
+        checkout = {"id": "cs_async_1", "amount_total": 4980, "currency": "jpy",
+                    "payment_status": "paid", "created": 1700000000}
+        await aio.record_ledger(checkout, user_id=1, product_name="オリジナルプロテイン")
+        await aio.record_ledger(checkout, user_id=1, product_name="オリジナルプロテイン")
+        assert len(await aio.get_ledger()) == 1
+
+        invoice = {"id": "in_async_1", "subscription": "sub_async_1", "status": "paid",
+                   "amount_due": 2980, "currency": "jpy", "created": 1700000000}
+        await aio.record_invoice(invoice)
+        assert (await aio.record_invoice(invoice)).id == "in_async_1"
+
+        subscription = {"id": "sub_async_1", "customer": "cus_async", "status": "active",
+                        "items": {"data": [{"price": {"id": "price_premium_test"}}]},
+                        "current_period_end": 1700086400, "created": 1700000000}
+        await aio.upsert_subscription(subscription, user_id=1)
+        await aio.upsert_subscription({**subscription, "cancel_at_period_end": True})
+
+        subscriptions = await aio.get_user_subscriptions(1)
+        assert len(subscriptions) == 1
+        assert subscriptions[0].cancel_at_period_end is True
+
+    asyncio.run(scenario())
@@ -0,0 +1,59 @@
+"""
+認証テスト：ログイン必須エンドポイントのセッション検証とリクエスト内のユーザー使い回しをテスト
+"""
+import pytest
+from unittest.mock import patch
+import repositories
+from repositories import create_session, logout_user
+from models import UserSession
+
+
+@pytest.fixture()
+def auth_headers(client, db_session, sample_user):
+    token = create_session(sample_user.id)
+    yield {"Authorization": f"Bearer {token}"}
+    logout_user(token)
+    db_session.query(UserSession).filter_by(user_id=sample_user.id).delete()
+    db_session.commit()
+
+
+@pytest.mark.api
+def test_login_required_rejects_missing_and_invalid_tokens(client):
+    """トークンなし・無効なトークンは401"""
+    response = client.post('/api/user-info', json={})
+    assert response.status_code == 401
+    assert 'ログイン' in response.get_json()['error']
+
+    response = client.post('/api/user-info', headers={"Authorization": "Bearer invalid-token"})
+    assert response.status_code == 401
+    assert response.get_json()['success'] is False
+
+
+@pytest.mark.api
+def test_user_is_resolved_from_token_not_body(client, auth_headers, sample_user):
+    """ユーザーはリクエストボディのuser_idではなくセッションから決まる"""
+    response = client.post('/api/user-info', json={"user_id": sample_user.id + 1}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.get_json()['user']['id'] == sample_user.id
+
+
+@pytest.mark.api
+def test_session_and_user_are_loaded_once_per_request(client, auth_headers, sample_user):
+    """1リクエスト内でセッション検証とユーザー取得は1回だけ"""
+    from flask import jsonify
+    from security import login_required, current_user_id, get_current_user
+
+    with patch.object(repositories, 'validate_session', wraps=repositories.validate_session) as validate, \
+            patch.object(repositories, 'get_user_by_id', wraps=repositories.get_user_by_id) as load_user:
+        with client.application.test_request_context('/', headers=auth_headers):
+            @login_required
+            def view():
+                assert current_user_id() == sample_user.id
+                assert get_current_user() is get_current_user()
+                return jsonify({"success": True})
+
+            response = view()
+            assert response.status_code == 200
+
+    assert validate.call_count == 1
+    assert load_user.call_count == 1
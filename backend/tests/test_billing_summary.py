@@ -0,0 +1,150 @@
+"""
+請求サマリーテスト：Webhookで更新される読み取りモデルの整合性をテスト
+"""
+import random
+import pytest
+import handlers
+from repositories import (
+    record_ledger,
+    record_invoice,
+    upsert_subscription,
+    get_billing_summary,
+    refresh_subscription_summary,
+    set_scheduled_change,
+    clear_scheduled_change,
+)
+from models import Ledger, Invoice, Subscription, UserBillingSummary
+
+
+@pytest.fixture()
+def summary_user_id(db_session):
+    """他のテストと衝突しないユーザーIDを払い出し、終了時に関連データを削除"""
+    user_id = random.randint(100000, 999999)
+    yield user_id
+    db_session.query(UserBillingSummary).filter_by(user_id=user_id).delete()
+    db_session.query(Ledger).filter_by(user_id=user_id).delete()
+    db_session.query(Invoice).filter(Invoice.subscription_id.like(f"sub_summary_{user_id}%")).delete(synchronize_session=False)
+    db_session.query(Subscription).filter_by(user_id=user_id).delete()
+    db_session.commit()
+
+
+def _checkout(user_id, suffix, amount=4980, created=1700000000):
+    return {
+        "id": f"cs_summary_{user_id}_{suffix}",
+        "amount_total": amount,
+        "currency": "jpy",
+        "payment_status": "paid",
+        "created": created,
+    }
+
+
+def _subscription(user_id, suffix, price_id="price_premium_test", **overrides):
+    data = {
+        "id": f"sub_summary_{user_id}_{suffix}",
+        "customer": "cus_summary",
+        "status": "active",
+        "items": {"data": [{"price": {"id": price_id}}]},
+        "current_period_end": 1800000000,
+        "cancel_at_period_end": False,
+        "created": 1700000000,
+    }
+    data.update(overrides)
+    return data
+
+
+@pytest.mark.unit
+def test_summary_rebuilds_from_existing_rows(client, summary_user_id):
+    """サマリー未作成のユーザーは既存の台帳から再構築される"""
+    record_ledger(_checkout(summary_user_id, 1), user_id=summary_user_id, product_name="オリジナルプロテイン")
+    
+    summary = get_billing_summary(summary_user_id)
+    
+    assert float(summary.lifetime_spend) == 4980
+    assert summary.last_purchase_product == "オリジナルプロテイン"
+    assert summary.subscription_id is None
+
+
+@pytest.mark.unit
+def test_payments_are_applied_incrementally_once(client, summary_user_id):
+    """支払いは記録時に加算され、同じ支払いの再送や古い購入の遅れた配信で直近購入は戻らない"""
+    get_billing_summary(summary_user_id)
+    
+    checkout = _checkout(summary_user_id, 2, amount=1000, created=1700000100)
+    for _ in range(2):
+        record_ledger(checkout, user_id=summary_user_id, product_name="シェイカー")
+    
+    upsert_subscription(_subscription(summary_user_id, 1), user_id=summary_user_id)
+    invoice = {"id": f"in_summary_{summary_user_id}", "subscription": f"sub_summary_{summary_user_id}_1",
+               "status": "paid", "amount_due": 2980, "currency": "jpy", "created": 1700000200}
+    for _ in range(2):
+        record_invoice(invoice)
+    record_ledger(_checkout(summary_user_id, 3, amount=500, created=1700000050), user_id=summary_user_id,
+                  product_name="オリジナルプロテイン")
+    
+    summary = get_billing_summary(summary_user_id)
+    assert float(summary.lifetime_spend) == 4480
+    assert summary.last_purchase_session_id == checkout["id"]
+
+
+@pytest.mark.unit
+def test_subscription_changes_update_current_plan(client, summary_user_id):
+    """プラン・解約予定・変更予約がサマリーに反映される"""
+    upsert_subscription(_subscription(summary_user_id, 1), user_id=summary_user_id)
+    refresh_subscription_summary(summary_user_id)
+    
+    summary = get_billing_summary(summary_user_id)
+    assert summary.subscription_id == f"sub_summary_{summary_user_id}_1"
+    assert summary.price_id == "price_premium_test"
+    
+    set_scheduled_change(summary_user_id, "sub_sched_summary", "price_standard_test", 1800000000)
+    assert get_billing_summary(summary_user_id).scheduled_price_id == "price_standard_test"
+    clear_scheduled_change("sub_sched_summary")
+    assert get_billing_summary(summary_user_id).scheduled_schedule_id is None
+    
+    # 旧プランが解約予定になり新プランが作成された場合は新プランを表示
+    upsert_subscription(_subscription(summary_user_id, 1, cancel_at_period_end=True), user_id=summary_user_id)
+    upsert_subscription(_subscription(summary_user_id, 2, price_id="price_standard_test"), user_id=summary_user_id)
+    refresh_subscription_summary(summary_user_id)
+    
+    summary = get_billing_summary(summary_user_id)
+    assert summary.subscription_id == f"sub_summary_{summary_user_id}_2"
+    assert summary.cancel_at_period_end is False
+    
+    # 全て解約されたらプラン情報は空になる
+    upsert_subscription(_subscription(summary_user_id, 2, status="canceled"), user_id=summary_user_id)
+    upsert_subscription(_subscription(summary_user_id, 1, status="canceled"), user_id=summary_user_id)
+    refresh_subscription_summary(summary_user_id)
+    assert get_billing_summary(summary_user_id).subscription_id is None
+
+
+@pytest.mark.unit
+def test_invoice_paid_before_user_link_is_counted(client, summary_user_id):
+    """ユーザーと紐づく前に届いた請求書の支払いも、チェックアウト完了で紐づいた時点でサマリーに含まれる"""
+    get_billing_summary(summary_user_id)
+    upsert_subscription(_subscription(summary_user_id, 1))
+    handlers.handle_invoice_paid({"id": f"in_summary_{summary_user_id}_early", "subscription": f"sub_summary_{summary_user_id}_1",
+                                  "status": "paid", "amount_due": 2980, "currency": "jpy", "created": 1700000200})
+    assert float(get_billing_summary(summary_user_id).lifetime_spend) == 0
+
+    handlers.handle_checkout_completed({
+        "id": f"cs_summary_{summary_user_id}_sub", "mode": "subscription", "status": "complete",
+        "subscription": f"sub_summary_{summary_user_id}_1", "metadata": {"user_id": str(summary_user_id)},
+        "created": 1700000100,
+    })
+
+    summary = get_billing_summary(summary_user_id)
+    assert float(summary.lifetime_spend) == 2980
+    assert summary.subscription_id == f"sub_summary_{summary_user_id}_1"
+
+
+@pytest.mark.unit
+def test_payment_in_other_currency_is_not_added(client, summary_user_id):
+    """最初の支払いでサマリーが作成され、通貨が異なる支払いは累計に混ぜない"""
+    record_ledger(_checkout(summary_user_id, 1, amount=1000), user_id=summary_user_id, product_name="シェイカー")
+    usd_checkout = dict(_checkout(summary_user_id, 2, amount=30, created=1700000100), currency="usd")
+    record_ledger(usd_checkout, user_id=summary_user_id, product_name="シェイカー")
+
+    summary = get_billing_summary(summary_user_id)
+    assert float(summary.lifetime_spend) == 1000
+    assert summary.currency == "jpy"
+    assert summary.last_purchase_session_id == f"cs_summary_{summary_user_id}_1"
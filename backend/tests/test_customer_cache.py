@@ -0,0 +1,62 @@
+"""
+Stripe Customer確認キャッシュテスト：確認済みのCustomerでStripeを呼ばないこと、customer.deletedでの無効化をテスト
+"""
+import pytest
+import stripe
+from repositories import upsert_stripe_customer, get_user_by_id
+from repositories.customer_cache import clear_customer_cache, is_customer_verified
+
+
+@pytest.fixture()
+def stripe_customers(client, monkeypatch):
+    """Customerの取得・作成を記録するだけの偽のStripe"""
+    calls = {'retrieve': [], 'create': []}
+
+    def retrieve(customer_id, **kwargs):
+        calls['retrieve'].append(customer_id)
+        return stripe.Customer.construct_from({'id': customer_id, 'object': 'customer'}, 'sk_test')
+
+    def create(**kwargs):
+        customer_id = f"cus_created_{len(calls['create']) + 1}"
+        calls['create'].append(kwargs)
+        return stripe.Customer.construct_from({'id': customer_id, 'object': 'customer'}, 'sk_test')
+
+    monkeypatch.setattr(stripe.Customer, "retrieve", retrieve)
+    monkeypatch.setattr(stripe.Customer, "create", create)
+    monkeypatch.setenv("STRIPE_WEBHOOK_BYPASS_SIGNATURE", "true")
+    clear_customer_cache()
+    yield calls
+    clear_customer_cache()
+
+
+@pytest.mark.unit
+def test_known_customer_is_verified_once(stripe_customers, sample_user):
+    """確認済みのCustomerは期限内はStripeに問い合わせない"""
+    for _ in range(3):
+        assert upsert_stripe_customer(sample_user) == sample_user.stripe_customer_id
+
+    assert stripe_customers['retrieve'] == [sample_user.stripe_customer_id]
+    assert stripe_customers['create'] == []
+
+
+@pytest.mark.api
+def test_customer_deleted_webhook_invalidates_customer(client, stripe_customers, sample_user):
+    """customer.deleted でユーザーのCustomer IDが外れ、次の購入開始で作り直す"""
+    customer_id = sample_user.stripe_customer_id
+    upsert_stripe_customer(sample_user)
+    assert is_customer_verified(customer_id)
+
+    response = client.post('/webhook', json={
+        "id": f"evt_customer_deleted_{sample_user.id}",
+        "type": "customer.deleted",
+        "data": {"object": {"id": customer_id, "object": "customer", "deleted": True}},
+    })
+    assert response.status_code == 200
+
+    assert not is_customer_verified(customer_id)
+    user = get_user_by_id(sample_user.id)
+    assert user.stripe_customer_id is None
+
+    assert upsert_stripe_customer(user) == "cus_created_1"
+    assert get_user_by_id(sample_user.id).stripe_customer_id == "cus_created_1"
+    assert is_customer_verified("cus_created_1")
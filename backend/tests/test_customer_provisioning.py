@@ -0,0 +1,122 @@
+"""
+Stripe Customer非同期作成テスト：登録ではStripeを呼ばずにジョブを積み、ワーカーと購入開始が同じ冪等キーで作成することをテスト
+"""
+import datetime
+import uuid
+import pytest
+import stripe
+import stripe_client
+from repositories import upsert_stripe_customer, get_user_by_email, get_user_by_id
+from repositories.customer_cache import clear_customer_cache
+from repositories.customer_provisioning import customer_provisioner, idempotency_key
+from models import CustomerProvisioningJob, User, UserSession
+
+
+@pytest.fixture()
+def provisioning(client, db_session, monkeypatch):
+    """冪等キーごとに同じCustomerを返す偽のStripe（ワーカーのスレッドは起動しない）"""
+    calls = []
+    customers = {}
+
+    def create(**kwargs):
+        calls.append({**kwargs, 'lane': stripe_client._lane.get()})
+        key = kwargs.get('idempotency_key') or uuid.uuid4().hex
+        customer_id = customers.setdefault(key, f"cus_provisioned_{uuid.uuid4().hex[:12]}")
+        return stripe.Customer.construct_from({'id': customer_id, 'object': 'customer'}, 'sk_test')
+
+    monkeypatch.setattr(stripe.Customer, "create", create)
+    monkeypatch.setattr(customer_provisioner, "notify", lambda: None)
+    # 他のテストで登録したユーザーのジョブは処理しない
+    db_session.query(CustomerProvisioningJob).filter(CustomerProvisioningJob.status != 'done').delete()
+    db_session.commit()
+    clear_customer_cache()
+    user_ids = []
+    yield calls, user_ids
+
+    clear_customer_cache()
+    for user_id in user_ids:
+        db_session.query(CustomerProvisioningJob).filter_by(user_id=user_id).delete()
+        db_session.query(UserSession).filter_by(user_id=user_id).delete()
+        db_session.query(User).filter_by(id=user_id).delete()
+    db_session.commit()
+
+
+def _register(client, email):
+    return client.post('/api/register', json={
+        'email': email, 'password': 'password123', 'name': '登録テスト', 'terms': True, 'privacy': True,
+    })
+
+
+def _job(db_session, user_id):
+    db_session.expire_all()
+    return db_session.query(CustomerProvisioningJob).filter_by(user_id=user_id).one()
+
+
+@pytest.mark.api
+def test_registration_enqueues_job_and_worker_creates_customer(client, db_session, provisioning):
+    """登録時はStripeを呼ばずにジョブを積み、ワーカーがバックグラウンドの枠で作成する"""
+    calls, user_ids = provisioning
+    email = f"provision_{uuid.uuid4().hex[:8]}@example.com"
+
+    response = _register(client, email)
+    assert response.status_code == 201
+    user = get_user_by_email(email)
+    user_ids.append(user.id)
+    assert calls == []
+    assert user.stripe_customer_id is None
+    assert _job(db_session, user.id).status == 'pending'
+
+    customer_provisioner.run_once()
+
+    job = _job(db_session, user.id)
+    assert job.status == 'done'
+    assert get_user_by_id(user.id).stripe_customer_id == job.customer_id
+    assert [call['lane'] for call in calls if call['idempotency_key'] == idempotency_key(job.id)] == ['background']
+
+
+@pytest.mark.unit
+def test_checkout_creates_pending_customer_with_same_key(client, db_session, provisioning, monkeypatch):
+    """ワーカーが失敗していても購入開始時に同じ冪等キーで作成し、ワーカーとの二重作成にならない"""
+    calls, user_ids = provisioning
+    email = f"provision_{uuid.uuid4().hex[:8]}@example.com"
+    assert _register(client, email).status_code == 201
+    user = get_user_by_email(email)
+    user_ids.append(user.id)
+
+    def unavailable(**kwargs):
+        raise stripe.error.APIConnectionError("Stripe unavailable")
+    with monkeypatch.context() as patched:
+        patched.setattr(stripe.Customer, "create", unavailable)
+        customer_provisioner.run_once()
+    job = _job(db_session, user.id)
+    assert (job.status, job.attempts) == ('pending', 1)
+    assert job.next_attempt_at > datetime.datetime.utcnow()
+    assert "Stripe unavailable" in job.last_error
+
+    customer_id = upsert_stripe_customer(user)
+
+    job = _job(db_session, user.id)
+    assert job.status == 'done'
+    assert get_user_by_id(user.id).stripe_customer_id == customer_id == job.customer_id
+    # 作成済みのジョブは再試行の期限が来ても処理しない
+    customer_provisioner.run_once(now=datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+    assert [call['lane'] for call in calls if call['idempotency_key'] == idempotency_key(job.id)] == ['interactive']
+
+
+@pytest.mark.unit
+def test_failed_job_is_created_without_stale_key(client, db_session, provisioning):
+    """諦めたジョブは保存済みのエラーが返る古い冪等キーを使わずに作成し、ジョブを完了にする"""
+    calls, user_ids = provisioning
+    email = f"provision_{uuid.uuid4().hex[:8]}@example.com"
+    assert _register(client, email).status_code == 201
+    user = get_user_by_email(email)
+    user_ids.append(user.id)
+    db_session.query(CustomerProvisioningJob).filter_by(user_id=user.id).update({'status': 'failed'})
+    db_session.commit()
+
+    customer_id = upsert_stripe_customer(user)
+
+    job = _job(db_session, user.id)
+    assert job.status == 'done'
+    assert get_user_by_id(user.id).stripe_customer_id == customer_id == job.customer_id
+    assert [call.get('idempotency_key') for call in calls] == [None]
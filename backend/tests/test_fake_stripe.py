@@ -0,0 +1,108 @@
+"""
+フェイクStripeテスト：ネットワークなしで購入開始→支払い完了→署名付きWebhookまでを通し、遅延・失敗の注入をテスト
+"""
+import pytest
+import stripe
+import stripe_client
+from routes import webhook_routes
+from repositories import create_session, logout_user, get_user_by_id
+from repositories.customer_cache import clear_customer_cache
+from models import Ledger, UserSession, UserBillingSummary
+from security import RateLimiter
+from stripe_client import StripeGovernor, StripeSession, stripe_breakers
+from tests.fake_stripe import FakeStripe, FakeStripeAdapter, Faults, Latency, decode_params
+
+WEBHOOK_SECRET = "whsec_fake_test"
+
+
+@pytest.fixture()
+def fake_stripe(monkeypatch):
+    """共有の StripeSession に差し込んだフェイク（Webhookは本物と同じ形式で署名する）"""
+    monkeypatch.setattr(stripe_client, "STRIPE_RETRY_BASE_DELAY_SECONDS", 0)
+    monkeypatch.setattr(stripe_client, "stripe_governor", StripeGovernor(RateLimiter(None), rate="1000/1"))
+    monkeypatch.setattr(stripe, "api_key", "sk_test_fake")
+    monkeypatch.setattr(webhook_routes, "WEBHOOK_SECRET", WEBHOOK_SECRET)
+    monkeypatch.delenv("STRIPE_WEBHOOK_BYPASS_SIGNATURE", raising=False)
+    for breaker in stripe_breakers.values():
+        breaker.reset()
+    clear_customer_cache()
+
+    fake = FakeStripe(webhook_secret=WEBHOOK_SECRET, seed=1)
+    with fake.installed():
+        yield fake
+
+    clear_customer_cache()
+    for breaker in stripe_breakers.values():
+        breaker.reset()
+
+
+@pytest.mark.unit
+def test_decode_params_builds_nested_objects():
+    """フォーム形式の入れ子（配列・辞書）を元の構造に戻す"""
+    params = decode_params("mode=payment&line_items[0][price]=price_a&line_items[0][quantity]=1"
+                           "&line_items[1][price]=price_b&metadata[user_id]=7")
+    assert params == {
+        "mode": "payment",
+        "line_items": [{"price": "price_a", "quantity": "1"}, {"price": "price_b"}],
+        "metadata": {"user_id": "7"},
+    }
+
+
+@pytest.mark.api
+def test_checkout_flow_end_to_end(client, db_session, sample_user, fake_stripe):
+    """購入開始→支払い完了→署名付きWebhookで請求サマリーに反映される"""
+    token = create_session(sample_user.id)
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        response = client.post('/api/checkout', headers=headers)
+        assert response.status_code == 200
+        session_id = response.get_json()["id"]
+
+        # フェイクに存在しないCustomer IDは作り直される
+        customer_id = get_user_by_id(sample_user.id).stripe_customer_id
+        assert customer_id in fake_stripe.objects['customer']
+        assert fake_stripe.objects['checkout.session'][session_id]["customer"] == customer_id
+
+        fake_stripe.complete_checkout(session_id)
+        statuses = fake_stripe.deliver_webhooks(
+            lambda payload, hook_headers: client.post('/webhook', data=payload, headers=hook_headers).status_code)
+        assert statuses == [200]
+
+        summary = client.post('/api/user-billing-summary', headers=headers).get_json()["summary"]
+        assert summary["last_purchase"]["session_id"] == session_id
+        assert summary["lifetime_spend"] == 4980
+
+        # 署名が一致しないWebhookは受け付けない
+        forged = client.post('/webhook', data='{"id": "evt_forged", "type": "customer.deleted"}',
+                             headers={"Stripe-Signature": fake_stripe.sign('{}')})
+        assert forged.status_code == 400
+    finally:
+        logout_user(token)
+        db_session.query(Ledger).filter_by(user_id=sample_user.id).delete()
+        db_session.query(UserBillingSummary).filter_by(user_id=sample_user.id).delete()
+        db_session.query(UserSession).filter_by(user_id=sample_user.id).delete()
+        db_session.commit()
+
+
+@pytest.mark.unit
+def test_injected_faults_are_retried_and_timeouts_surface(fake_stripe, monkeypatch):
+    """注入した5xxは再試行され、読み取り待ちを超える遅延はタイムアウトになる"""
+    customer = stripe.Customer.create(email="fake@example.com")
+    monkeypatch.setattr(stripe_client, "STRIPE_MAX_NETWORK_RETRIES", 2)
+    session = StripeSession()
+    session.mount(stripe.api_base + "/", FakeStripeAdapter(fake_stripe))
+    url = f"{stripe.api_base}/v1/customers/{customer.id}"
+
+    fake_stripe.family_faults["customers"] = Faults(error_rate=1.0)
+    assert session.request("get", url, timeout=5).status_code == 500
+    assert fake_stripe.stats['injected']['error'] == 3
+
+    fake_stripe.family_faults.clear()
+    response = session.request("get", url, timeout=5)
+    assert response.status_code == 200
+    assert response.json()["email"] == "fake@example.com"
+
+    fake_stripe.latency = Latency(median_ms=200)
+    with stripe_client.stripe_call_timeout(read=0.05):
+        with pytest.raises(stripe.error.APIConnectionError):
+            stripe.Customer.retrieve(customer.id)
@@ -0,0 +1,105 @@
+"""
+ホスト画面セッション再利用テスト：購入開始の繰り返しで開いたままのセッションを返し、完了・期限切れのWebhookで作り直すことをテスト
+"""
+import pytest
+import stripe
+import stripe_client
+from routes import webhook_routes
+from repositories import create_session, logout_user
+from repositories.customer_cache import clear_customer_cache
+from repositories import hosted_session_cache
+from repositories.hosted_session_cache import clear_hosted_session_cache
+from models import Ledger, UserSession, UserBillingSummary
+from security import RateLimiter
+from stripe_client import StripeGovernor, stripe_breakers
+from tests.fake_stripe import FakeStripe
+
+WEBHOOK_SECRET = "whsec_hosted_session_test"
+
+
+@pytest.fixture()
+def hosted(client, db_session, sample_user, monkeypatch):
+    """フェイクStripeとログイン済みのユーザー"""
+    monkeypatch.setattr(stripe, "api_key", "sk_test_fake")
+    monkeypatch.setattr(stripe_client, "stripe_governor", StripeGovernor(RateLimiter(None), rate="1000/1"))
+    monkeypatch.setattr(webhook_routes, "WEBHOOK_SECRET", WEBHOOK_SECRET)
+    monkeypatch.delenv("STRIPE_WEBHOOK_BYPASS_SIGNATURE", raising=False)
+    for breaker in stripe_breakers.values():
+        breaker.reset()
+    clear_customer_cache()
+    clear_hosted_session_cache()
+
+    fake = FakeStripe(webhook_secret=WEBHOOK_SECRET)
+    token = create_session(sample_user.id)
+    with fake.installed():
+        yield fake, {"Authorization": f"Bearer {token}"}
+
+    clear_customer_cache()
+    clear_hosted_session_cache()
+    logout_user(token)
+    db_session.query(Ledger).filter_by(user_id=sample_user.id).delete()
+    db_session.query(UserBillingSummary).filter_by(user_id=sample_user.id).delete()
+    db_session.query(UserSession).filter_by(user_id=sample_user.id).delete()
+    db_session.commit()
+
+
+def _deliver(client, fake):
+    return fake.deliver_webhooks(
+        lambda payload, headers: client.post('/webhook', data=payload, headers=headers).status_code)
+
+
+@pytest.mark.api
+def test_checkout_reuses_open_session_until_completed_or_expired(client, hosted):
+    """同じ購入の開始は同じセッションを返し、完了・期限切れの後は新しく作成する"""
+    fake, headers = hosted
+
+    first = client.post('/api/checkout', headers=headers).get_json()["id"]
+    assert client.post('/api/checkout', headers=headers).get_json()["id"] == first
+    assert len(fake.objects['checkout.session']) == 1
+
+    fake.complete_checkout(first)
+    assert _deliver(client, fake) == [200]
+    second = client.post('/api/checkout', headers=headers).get_json()["id"]
+    assert second != first
+
+    stripe.checkout.Session.expire(second)
+    assert _deliver(client, fake) == [200]
+    third = client.post('/api/checkout', headers=headers).get_json()["id"]
+    assert third not in (first, second)
+    assert len(fake.objects['checkout.session']) == 3
+
+
+@pytest.mark.api
+def test_billing_portal_reuses_recent_session(client, hosted, sample_user):
+    """直前に作成したポータルセッションのURLを返し、Stripeを再度呼ばない"""
+    fake, headers = hosted
+    fake.add_customer(sample_user.stripe_customer_id, email=sample_user.email)
+
+    first = client.post('/api/billing-portal/start', headers=headers).get_json()
+    second = client.post('/api/billing-portal/start', headers=headers).get_json()
+
+    assert first["success"] and second["url"] == first["url"]
+    assert fake.stats['by_family']['portal'] == 1
+
+
+@pytest.mark.api
+def test_success_page_stops_reuse_before_webhook(client, hosted):
+    """完了のWebhookより先に成功画面を表示した場合も、次の購入開始では新しいセッションを作成する"""
+    fake, headers = hosted
+
+    first = client.post('/api/checkout', headers=headers).get_json()["id"]
+    fake.complete_checkout(first)
+    assert client.post('/api/get-checkout-session', json={"session_id": first}).status_code == 200
+
+    assert client.post('/api/checkout', headers=headers).get_json()["id"] != first
+
+
+@pytest.mark.unit
+def test_checkout_reuse_is_short_without_redis(monkeypatch):
+    """Redisがない場合は他のプロセスの完了を消せないため、Checkoutの再利用を短い時間に限る"""
+    monkeypatch.setattr(hosted_session_cache, "_redis", lambda: None)
+    stats = hosted_session_cache.get_hosted_session_cache_stats()
+
+    assert stats["shared"] is False
+    assert stats["checkout_reuse_seconds"] == min(hosted_session_cache.CHECKOUT_SESSION_REUSE_SECONDS,
+                                                  hosted_session_cache.LOCAL_CHECKOUT_SESSION_REUSE_SECONDS)
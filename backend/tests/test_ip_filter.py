@@ -0,0 +1,59 @@
+"""
+IPフィルターテスト：CIDRの判定とリストの再読み込みをテスト
+"""
+import os
+import ipaddress
+import pytest
+from ip_filter import IPMatcher, IPFilter, CIDRTrie, parse_entries
+
+
+@pytest.mark.unit
+def test_cidr_block_and_allow():
+    """拒否リストはCIDRで判定し、許可リストがある場合はそれ以外を拒否する"""
+    matcher = IPMatcher(block=["203.0.113.0/24", "2001:db8::/32", "198.51.100.7"])
+    assert not matcher.is_allowed("203.0.113.99")
+    assert not matcher.is_allowed("2001:db8::1")
+    assert not matcher.is_allowed("::ffff:198.51.100.7")
+    assert matcher.is_allowed("198.51.100.8")
+    assert matcher.is_allowed("2001:db9::1")
+    assert not matcher.is_allowed("not-an-ip")
+
+    matcher = IPMatcher(allow=["10.0.0.0/8"], block=["10.1.0.0/16"])
+    assert matcher.is_allowed("10.2.3.4")
+    assert not matcher.is_allowed("10.1.2.3")
+    assert not matcher.is_allowed("192.0.2.1")
+
+
+@pytest.mark.unit
+def test_trie_keeps_widest_range():
+    """広い範囲を登録すると、それに含まれる範囲は重複して保持しない"""
+    trie = CIDRTrie(["10.1.0.0/16", "10.0.0.0/8", "10.2.0.0/16"])
+    assert trie.size == 2
+    assert trie.contains(ipaddress.ip_address("10.1.2.3"))
+    assert trie.contains(ipaddress.ip_address("10.200.0.1"))
+    assert not trie.contains(ipaddress.ip_address("11.0.0.1"))
+
+
+@pytest.mark.unit
+def test_parse_entries_skips_invalid_lines():
+    allow, block = parse_entries(["# comment", "allow 192.0.2.0/24", "block 203.0.113.5 # attacker", "block nope", "deny 1.2.3.4"])
+    assert [str(network) for network in allow] == ["192.0.2.0/24"]
+    assert [str(network) for network in block] == ["203.0.113.5/32"]
+
+
+@pytest.mark.unit
+def test_filter_reloads_changed_file(tmp_path):
+    """ファイルが変わると次の確認で新しいリストに差し替わる"""
+    path = tmp_path / "ip_filter.txt"
+    path.write_text("block 203.0.113.0/24\n")
+    ip_filter = IPFilter(path=str(path), use_redis=False, reload_interval=0)
+
+    assert not ip_filter.is_allowed("203.0.113.10")
+    assert ip_filter.is_allowed("198.51.100.10")
+
+    path.write_text("block 198.51.100.0/24\n")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert ip_filter.is_allowed("203.0.113.10")
+    assert not ip_filter.is_allowed("198.51.100.10")
+    assert ip_filter.stats()["reloads"] == 2
@@ -0,0 +1,105 @@
+"""
+パーティション管理テスト：SQLiteでのフォールバック（アーカイブテーブルへの移動）と重複チェックをテスト
+"""
+import datetime
+import pytest
+import stripe
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from repositories import (
+    record_ledger,
+    record_invoice,
+    ensure_future_partitions,
+    archive_old_partitions,
+)
+from repositories.partitioning import partition_name, create_partition_sql, month_range
+from repositories.payment_repository import insert_if_absent_statement
+from models import Ledger, Invoice
+
+# 他のテストのデータを巻き込まないよう、2000年より前のデータだけをアーカイブ対象にする
+TODAY = datetime.date(2001, 1, 1)
+RETAIN_MONTHS = 12
+OLD_EPOCH = int(datetime.datetime(1999, 6, 15, tzinfo=datetime.timezone.utc).timestamp())
+RECENT_EPOCH = int(datetime.datetime(2000, 6, 15, tzinfo=datetime.timezone.utc).timestamp())
+
+
+@pytest.fixture()
+def cleanup_partition_rows(db_session):
+    yield
+    db_session.query(Ledger).filter(Ledger.session_id.like("cs_partition_%")).delete(synchronize_session=False)
+    db_session.query(Invoice).filter(Invoice.id.like("in_partition_%")).delete(synchronize_session=False)
+    for table in ("ledger_archive", "invoices_archive"):
+        db_session.execute(text(f"DROP TABLE IF EXISTS {table}"))
+    db_session.commit()
+
+
+@pytest.mark.unit
+def test_partition_ddl():
+    """パーティション名とDDLの境界値が月単位になる"""
+    month = datetime.date(2026, 12, 1)
+    assert partition_name("ledger", month) == "ledger_y2026m12"
+    assert "FROM ('2026-12-01') TO ('2027-01-01')" in create_partition_sql("ledger", month)
+    assert "FROM (1796083200) TO (1798761600)" in create_partition_sql("invoices", month)
+    assert month_range(datetime.date(2026, 11, 20), datetime.date(2027, 1, 1)) == [
+        datetime.date(2026, 11, 1), datetime.date(2026, 12, 1), datetime.date(2027, 1, 1)
+    ]
+
+
+@pytest.mark.unit
+def test_sqlite_fallback_archives_old_rows(client, db_session, cleanup_partition_rows):
+    """SQLiteではパーティションを作成せず、古い行をアーカイブテーブルへ移動する"""
+    assert ensure_future_partitions(today=TODAY) == []
+
+    for suffix, created in (("old", OLD_EPOCH), ("recent", RECENT_EPOCH)):
+        record_ledger({
+            "id": f"cs_partition_{suffix}", "amount_total": 1000, "currency": "jpy",
+            "payment_status": "paid", "created": created,
+        }, user_id=1, product_name="オリジナルプロテイン")
+        record_invoice({
+            "id": f"in_partition_{suffix}", "subscription": None, "status": "paid",
+            "amount_due": 2980, "currency": "jpy", "created": created,
+        })
+
+    archived = archive_old_partitions(retain_months=RETAIN_MONTHS, today=TODAY)
+
+    assert archived == ["ledger_archive (1 rows)", "invoices_archive (1 rows)"]
+    assert db_session.query(Ledger).filter(Ledger.session_id.like("cs_partition_%")).count() == 1
+    assert db_session.query(Invoice).filter(Invoice.id.like("in_partition_%")).count() == 1
+    assert db_session.execute(text(
+        "SELECT session_id FROM ledger_archive WHERE session_id LIKE 'cs_partition_%'"
+    )).scalars().all() == ["cs_partition_old"]
+
+
+@pytest.mark.unit
+def test_duplicate_webhook_is_found_with_partition_key(client, db_session, cleanup_partition_rows):
+    """createdを含めた重複チェックでも同じWebhookの再送は1件として扱われる"""
+    invoice = {
+        "id": "in_partition_dup", "subscription": None, "status": "paid",
+        "amount_due": 2980, "currency": "jpy", "created": RECENT_EPOCH,
+    }
+    record_invoice(invoice)
+    record_invoice(invoice)
+
+    assert db_session.query(Invoice).filter_by(id="in_partition_dup").count() == 1
+
+
+@pytest.mark.unit
+def test_insert_ignores_duplicates_on_partition_key():
+    """PostgreSQLでは複合主キー（IDとパーティションキー）のON CONFLICTで重複を無視する"""
+    stmt = insert_if_absent_statement('postgresql', Invoice, {"id": "in_partition_sql", "created": RECENT_EPOCH})
+    assert "ON CONFLICT (id, created) DO NOTHING" in str(stmt.compile(dialect=postgresql.dialect()))
+
+
+@pytest.mark.unit
+def test_missing_created_is_taken_from_stripe(client, db_session, cleanup_partition_rows, monkeypatch):
+    """createdが欠けた再送も記録時刻ではなくStripeのcreatedで記録し、同じ行として扱う"""
+    monkeypatch.setattr(stripe.Invoice, "retrieve", lambda invoice_id: {"id": invoice_id, "created": RECENT_EPOCH})
+    invoice = {
+        "id": "in_partition_nocreated", "subscription": None, "status": "paid",
+        "amount_due": 2980, "currency": "jpy",
+    }
+    record_invoice(invoice)
+    record_invoice(invoice)
+
+    rows = db_session.query(Invoice).filter_by(id="in_partition_nocreated").all()
+    assert [row.created for row in rows] == [RECENT_EPOCH]
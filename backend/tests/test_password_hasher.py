@@ -0,0 +1,122 @@
+"""
+パスワードハッシュテスト：保存形式・旧形式の互換性・再ハッシュ・混雑時の503をテスト
+"""
+import hashlib
+import threading
+import pytest
+from repositories import hash_password, verify_password, authenticate_user
+from repositories.password_hasher import PasswordHasherPool, PasswordHasherBusy, needs_rehash
+from repositories import password_hasher
+from models import User
+
+
+def _legacy_hash(password, salt="0123456789abcdef"):
+    """旧形式（salt:hash、反復回数100000）のハッシュ"""
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), 100000)
+    return f"{salt}:{digest.hex()}"
+
+
+@pytest.mark.unit
+def test_hash_records_parameters():
+    """新しいハッシュは反復回数を含む形式で保存される"""
+    password_hash = hash_password("password123")
+
+    algorithm, iterations, salt, digest = password_hash.split("$")
+    assert algorithm == "pbkdf2_sha256"
+    assert int(iterations) == password_hasher.PASSWORD_HASH_ITERATIONS
+    assert verify_password("password123", password_hash)
+    assert not verify_password("wrong-password", password_hash)
+    assert not needs_rehash(password_hash)
+
+
+@pytest.mark.unit
+def test_legacy_hash_is_verified_and_flagged():
+    """旧形式のハッシュも検証でき、再ハッシュ対象になる"""
+    legacy = _legacy_hash("password123")
+
+    assert verify_password("password123", legacy)
+    assert not verify_password("wrong-password", legacy)
+    assert needs_rehash(legacy)
+    assert not verify_password("password123", "broken-hash")
+
+
+@pytest.mark.unit
+def test_login_upgrades_weak_hash(db_session, sample_user, monkeypatch):
+    """ログイン成功時に旧形式・反復回数の少ないハッシュを現在の設定で作り直す"""
+    db_session.query(User).filter_by(id=sample_user.id).update({"password_hash": _legacy_hash("password123")})
+    db_session.commit()
+    monkeypatch.setattr(password_hasher, "PASSWORD_HASH_ITERATIONS", 120000)
+
+    user = authenticate_user(sample_user.email, "password123")
+
+    assert user is not None
+    assert user.password_hash.startswith("pbkdf2_sha256$120000$")
+    assert authenticate_user(sample_user.email, "password123").password_hash == user.password_hash
+
+
+@pytest.mark.unit
+def test_pool_rejects_when_queue_is_full(monkeypatch):
+    """待ち行列の上限を超えた計算は PasswordHasherBusy になる"""
+    pool = PasswordHasherPool(workers=1, max_queue=0, timeout=5)
+    started = threading.Event()
+    release = threading.Event()
+
+    # ワーカー1件を占有した状態を作る（プロセスを起動せずに計算を差し替える）
+    class _BlockingExecutor:
+        def submit(self, fn, *args):
+            started.set()
+            release.wait(5)
+            from concurrent.futures import Future
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+    monkeypatch.setattr(pool, "_get_executor", lambda: _BlockingExecutor())
+    worker = threading.Thread(target=pool.compute, args=("password123", "salt", 1000))
+    worker.start()
+    started.wait(5)
+
+    with pytest.raises(PasswordHasherBusy):
+        pool.compute("password123", "salt", 1000)
+    release.set()
+    worker.join(5)
+    assert pool.stats()["rejected"] == 1
+
+
+@pytest.mark.api
+def test_login_returns_503_when_busy(client, db_session, sample_user, monkeypatch):
+    """混雑時のログインは503とRetry-Afterを返す"""
+    db_session.query(User).filter_by(id=sample_user.id).update({"password_hash": _legacy_hash("password123")})
+    db_session.commit()
+
+    def busy(*args, **kwargs):
+        raise PasswordHasherBusy("busy")
+
+    monkeypatch.setattr(password_hasher.hasher_pool, "compute", busy)
+    response = client.post("/api/login", json={"email": sample_user.email, "password": "password123"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+@pytest.mark.unit
+def test_timed_out_computation_keeps_its_slot_until_done(monkeypatch):
+    """待ちきれない計算は PasswordHasherBusy になり、プールで終わるまでは実行中として数える"""
+    from concurrent.futures import Future
+    pool = PasswordHasherPool(workers=1, max_queue=0, timeout=0.01)
+    pending = Future()
+
+    class _PendingExecutor:
+        def submit(self, fn, *args):
+            return pending
+
+    monkeypatch.setattr(pool, "_get_executor", lambda: _PendingExecutor())
+    with pytest.raises(PasswordHasherBusy):
+        pool.compute("password123", "salt", 1000)
+    assert pool.stats()["in_flight"] == 1
+    assert pool.stats()["timed_out"] == 1
+    with pytest.raises(PasswordHasherBusy):
+        pool.compute("password123", "salt", 1000)
+
+    pending.set_result("hash")
+    assert pool.stats()["in_flight"] == 0
@@ -0,0 +1,116 @@
+"""
+プランカタログテスト：設定とStripeから一度だけ読み込み、価格ID・プランタイプで引けること、Webhookでの更新をテスト
+"""
+import json
+import pytest
+import stripe
+import plan_catalog as plan_catalog_module
+from plan_catalog import PlanCatalog, plan_catalog
+from repositories import create_session, logout_user
+from repositories.customer_cache import clear_customer_cache
+from models import UserSession
+from tests.fake_stripe import FakeStripe
+
+GOLD_PLAN = {"plan_type": "gold", "price_id": "price_gold_test", "name": "ゴールドプラン"}
+
+
+@pytest.mark.unit
+def test_configured_plans_are_read_once(monkeypatch):
+    """設定のプランを価格ID・プランタイプで引け、読み込み後は環境変数を読まない"""
+    monkeypatch.setenv("PLAN_CATALOG", json.dumps([GOLD_PLAN]))
+    catalog = PlanCatalog(stripe_sync=False)
+
+    assert catalog.get_by_type("standard").price_id == "price_standard_test"
+    monkeypatch.setattr(plan_catalog_module.os, "getenv", lambda *args: pytest.fail("env read after load"))
+
+    assert catalog.plan_name("price_premium_test") == "プレミアムプラン"
+    assert catalog.plan_name("price_gold_test") == "ゴールドプラン"
+    assert catalog.plan_name("price_unknown") == "不明なプラン"
+    assert catalog.plan_types() == ("standard", "premium", "gold")
+
+
+@pytest.mark.unit
+def test_stripe_prices_sync_and_follow_webhooks(monkeypatch):
+    """plan_type を持つStripeの価格を取り込み、商品名の変更・価格の削除を反映する"""
+    monkeypatch.setattr(stripe, "api_key", "sk_test_fake")
+    fake = FakeStripe()
+    fake.add_price("price_gold_stripe", "Gold", 2980, metadata={"plan_type": "gold"})
+    fake.add_price("price_other", "Protein", 4980)
+
+    with fake.installed():
+        catalog = PlanCatalog(stripe_sync=True)
+        gold = catalog.get_by_type("gold")
+        assert (gold.price_id, gold.name, gold.unit_amount) == ("price_gold_stripe", "Gold", 2980)
+        assert catalog.get("price_other") is None
+        assert catalog.get_by_type("premium").price_id == "price_premium_test"
+
+        catalog.handle_event("product.updated", {"id": "prod_price_gold_stripe", "object": "product",
+                                                 "name": "ゴールドプラン", "active": True, "metadata": {}})
+        assert catalog.plan_name("price_gold_stripe") == "ゴールドプラン"
+
+        catalog.handle_event("price.deleted", {"id": "price_gold_stripe", "object": "price",
+                                               "product": "prod_price_gold_stripe", "active": False,
+                                               "metadata": {"plan_type": "gold"}})
+        assert catalog.get_by_type("gold") is None
+        # 過去のサブスクリプションの表示名は引き続き解決できる
+        assert catalog.plan_name("price_gold_stripe") == "ゴールドプラン"
+
+
+@pytest.mark.unit
+def test_configured_plan_deactivated_in_stripe_is_not_purchasable(monkeypatch):
+    """設定で定義した価格がStripeで無効になった場合は、プランタイプで引けなくなる"""
+    monkeypatch.setattr(stripe, "api_key", "sk_test_fake")
+    fake = FakeStripe()
+    fake.add_price("price_premium_test", "Premium", 4980, metadata={"plan_type": "premium"})
+
+    with fake.installed():
+        catalog = PlanCatalog(stripe_sync=True)
+        assert catalog.get_by_type("premium").price_id == "price_premium_test"
+
+        catalog.handle_event("price.updated", {"id": "price_premium_test", "object": "price",
+                                               "product": "prod_price_premium_test", "active": False,
+                                               "metadata": {"plan_type": "premium"}})
+        assert catalog.get_by_type("premium") is None
+        assert "premium" not in catalog.plan_types()
+        assert catalog.plan_name("price_premium_test") == "プレミアムプラン"
+
+        catalog.handle_event("price.updated", {"id": "price_premium_test", "object": "price",
+                                               "product": "prod_price_premium_test", "active": True,
+                                               "metadata": {"plan_type": "premium"}})
+        assert catalog.get_by_type("premium").price_id == "price_premium_test"
+
+
+@pytest.fixture()
+def gold_catalog(monkeypatch):
+    """ゴールドプランを追加した共有カタログ（終了後は元の設定で読み込み直す）"""
+    monkeypatch.setenv("PLAN_CATALOG", json.dumps([GOLD_PLAN]))
+    plan_catalog.load()
+    yield plan_catalog
+    monkeypatch.delenv("PLAN_CATALOG")
+    plan_catalog.load()
+
+
+@pytest.mark.api
+def test_subscription_checkout_uses_catalog_plan(client, db_session, sample_user, gold_catalog, monkeypatch):
+    """カタログに追加したプランで購入を開始でき、存在しないプランタイプは400"""
+    monkeypatch.setattr(stripe, "api_key", "sk_test_fake")
+    clear_customer_cache()
+    fake = FakeStripe()
+    token = create_session(sample_user.id)
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        with fake.installed():
+            response = client.post('/api/subscription', headers=headers, json={"plan_type": "gold"})
+            assert response.status_code == 200
+            session = fake.objects['checkout.session'][response.get_json()["id"]]
+            assert session["_line_items"] == [{"price": "price_gold_test", "quantity": "1"}]
+            assert session["metadata"]["product_name"] == "ゴールドプラン"
+
+            response = client.post('/api/subscription', headers=headers, json={"plan_type": "platinum"})
+            assert response.status_code == 400
+            assert response.get_json()["error"] == "プランタイプが正しくありません"
+    finally:
+        clear_customer_cache()
+        logout_user(token)
+        db_session.query(UserSession).filter_by(user_id=sample_user.id).delete()
+        db_session.commit()
@@ -0,0 +1,96 @@
+"""
+レート制限テスト：トークンバケットとBlueprintごとのレート制限をテスト
+"""
+import pytest
+from unittest.mock import MagicMock
+from flask import Flask, Blueprint, jsonify
+from security import LocalTokenBucket, RateLimiter, setup_rate_limits, setup_proxy_fix, parse_rate_limit
+
+
+@pytest.mark.unit
+def test_local_token_bucket_limits_bursts():
+    """上限を超えたリクエストは拒否し、再試行までの秒数を返す"""
+    bucket = LocalTokenBucket()
+    results = [bucket.hit("login:ip:1.2.3.4", 3, 60) for _ in range(4)]
+
+    assert [result.allowed for result in results] == [True, True, True, False]
+    assert results[0].remaining == 2
+    assert 0 < results[3].retry_after <= 20
+    # 別のクライアントは別のバケット
+    assert bucket.hit("login:ip:5.6.7.8", 3, 60).allowed
+
+
+@pytest.mark.unit
+def test_rate_limiter_falls_back_when_redis_fails():
+    """Redisでエラーになった場合はプロセス内のバケットで判定する"""
+    client = MagicMock()
+    client.register_script.return_value.side_effect = ConnectionError("redis down")
+    limiter = RateLimiter(client)
+
+    assert limiter.hit("key", 1, 60).allowed
+    assert not limiter.hit("key", 1, 60).allowed
+    assert limiter.fallbacks == 1
+    assert limiter.stats()["backend"] == "local"
+
+
+@pytest.mark.unit
+def test_parse_rate_limit():
+    assert parse_rate_limit("10/60") == (10, 60.0)
+    assert parse_rate_limit("5") == (5, 60.0)
+    assert parse_rate_limit("0") is None
+
+
+@pytest.mark.api
+def test_blueprint_rate_limit_returns_429(monkeypatch):
+    """Blueprintごとの上限を超えると429とRetry-Afterを返す"""
+    import security
+    monkeypatch.setattr(security, "rate_limiter", RateLimiter(None))
+    app = Flask(__name__)
+    limited_bp = Blueprint('limited', __name__)
+
+    @limited_bp.route('/limited-login', methods=['POST'])
+    def login():
+        return jsonify({"success": True})
+
+    @app.route('/open')
+    def open_endpoint():
+        return jsonify({"success": True})
+
+    app.register_blueprint(limited_bp)
+    setup_rate_limits(app, limits={'limited': (2, 60)})
+    client = app.test_client()
+
+    statuses = [client.post('/limited-login', environ_base={'REMOTE_ADDR': '203.0.113.7'}).status_code
+                for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+    response = client.post('/limited-login', environ_base={'REMOTE_ADDR': '203.0.113.7'})
+    assert int(response.headers['Retry-After']) >= 1
+    assert client.post('/limited-login', environ_base={'REMOTE_ADDR': '203.0.113.8'}).status_code == 200
+    assert all(client.get('/open').status_code == 200 for _ in range(5))
+
+
+@pytest.mark.api
+def test_rate_limit_uses_forwarded_client_ip_behind_proxy(monkeypatch):
+    """プロキシ配下ではX-Forwarded-Forのクライアントごとに判定し、プロキシのIPを共有しない"""
+    import security
+    monkeypatch.setattr(security, "rate_limiter", RateLimiter(None))
+    app = Flask(__name__)
+    limited_bp = Blueprint('limited', __name__)
+
+    @limited_bp.route('/limited-login', methods=['POST'])
+    def login():
+        return jsonify({"success": True})
+
+    app.register_blueprint(limited_bp)
+    setup_rate_limits(app, limits={'limited': (1, 60)})
+    setup_proxy_fix(app, hops=1)
+    client = app.test_client()
+
+    def post(forwarded_for):
+        return client.post('/limited-login', environ_base={'REMOTE_ADDR': '172.18.0.5'},
+                           headers={'X-Forwarded-For': forwarded_for}).status_code
+
+    assert [post('203.0.113.7'), post('203.0.113.8'), post('203.0.113.7')] == [200, 200, 429]
+    # クライアントが付けた偽のX-Forwarded-Forは信頼しない（プロキシが追加した右端を使う）
+    assert post('198.51.100.1, 203.0.113.7') == 429
@@ -0,0 +1,143 @@
+"""
+売上ロールアップテスト：台帳・請求書記録時の増分集計と再集計の整合性をテスト
+"""
+import datetime
+import random
+import pytest
+from repositories import (
+    record_ledger,
+    record_invoice,
+    upsert_subscription,
+    rebuild_revenue_rollups,
+    get_revenue_rollups,
+)
+from models import Ledger, Invoice, Subscription, RevenueRollup
+
+# 他のテストと衝突しないようISOのテスト用通貨コードを使う
+CURRENCY = "xts"
+
+
+@pytest.fixture()
+def rollup_day(db_session):
+    """テストごとに別の日付を払い出し、終了時に関連データを削除"""
+    day = datetime.date(2031, 1, 1) + datetime.timedelta(days=random.randint(0, 3000))
+    suffix = f"rollup_{day.isoformat()}"
+    yield day, suffix
+    db_session.query(RevenueRollup).filter_by(currency=CURRENCY).delete()
+    db_session.query(Ledger).filter(Ledger.session_id.like(f"cs_{suffix}%")).delete(synchronize_session=False)
+    db_session.query(Invoice).filter(Invoice.id.like(f"in_{suffix}%")).delete(synchronize_session=False)
+    db_session.query(Subscription).filter(Subscription.id.like(f"sub_{suffix}%")).delete(synchronize_session=False)
+    db_session.commit()
+
+
+def _epoch(day, hour=12):
+    return int(datetime.datetime.combine(day, datetime.time(hour), tzinfo=datetime.timezone.utc).timestamp())
+
+
+def _record_sample(day, suffix):
+    """単発購入2件（うち1件は未払い）と支払い済み請求書1件・未払い請求書1件を記録"""
+    record_ledger({
+        "id": f"cs_{suffix}_1", "amount_total": 4980, "currency": CURRENCY,
+        "payment_status": "paid", "created": _epoch(day),
+    }, user_id=1, product_name="オリジナルプロテイン")
+    record_ledger({
+        "id": f"cs_{suffix}_2", "amount_total": 1000, "currency": CURRENCY,
+        "payment_status": "unpaid", "created": _epoch(day),
+    }, user_id=1, product_name="オリジナルプロテイン")
+    upsert_subscription({
+        "id": f"sub_{suffix}", "customer": "cus_rollup", "status": "active",
+        "items": {"data": [{"price": {"id": "price_rollup_test"}}]},
+        "current_period_end": _epoch(day) + 30 * 86400, "created": _epoch(day),
+    }, user_id=1)
+    for index, status in enumerate(["paid", "open"]):
+        record_invoice({
+            "id": f"in_{suffix}_{index}", "subscription": f"sub_{suffix}", "status": status,
+            "amount_due": 2980, "currency": CURRENCY, "created": _epoch(day, hour=3),
+        })
+
+
+def _by_source(rows):
+    return {row["source"]: row for row in rows}
+
+
+@pytest.mark.unit
+def test_record_updates_daily_and_monthly_rollups(client, rollup_day):
+    """支払い済みの台帳・請求書だけが日次・月次に加算され、再送は二重加算されない"""
+    day, suffix = rollup_day
+    _record_sample(day, suffix)
+    # 同じWebhookの再送
+    record_ledger({
+        "id": f"cs_{suffix}_1", "amount_total": 4980, "currency": CURRENCY,
+        "payment_status": "paid", "created": _epoch(day),
+    }, user_id=1, product_name="オリジナルプロテイン")
+
+    next_day = (day + datetime.timedelta(days=1)).isoformat()
+    daily = _by_source(get_revenue_rollups("day", day.isoformat(), next_day, CURRENCY))
+    assert daily["ledger"]["amount"] == 4980
+    assert daily["ledger"]["count"] == 1
+    assert daily["ledger"]["product"] == "オリジナルプロテイン"
+    assert daily["invoice"]["amount"] == 2980
+    assert daily["invoice"]["product"] == "price_rollup_test"
+
+    month = day.strftime("%Y-%m")
+    monthly = _by_source(get_revenue_rollups("month", month, month + "~", CURRENCY))
+    assert monthly["ledger"]["amount"] == 4980
+    assert monthly["invoice"]["count"] == 1
+
+
+@pytest.mark.unit
+def test_rebuild_matches_incremental_rollups(client, rollup_day, db_session):
+    """再集計の結果が増分更新の結果と一致する"""
+    day, suffix = rollup_day
+    _record_sample(day, suffix)
+    next_day = (day + datetime.timedelta(days=1)).isoformat()
+    incremental = get_revenue_rollups("day", day.isoformat(), next_day, CURRENCY)
+
+    db_session.query(RevenueRollup).filter_by(currency=CURRENCY).delete()
+    db_session.commit()
+    result = rebuild_revenue_rollups(day - datetime.timedelta(days=1), day + datetime.timedelta(days=2), workers=2)
+
+    assert result["days"] == 3
+    assert get_revenue_rollups("day", day.isoformat(), next_day, CURRENCY) == incremental
+    month = day.strftime("%Y-%m")
+    monthly = _by_source(get_revenue_rollups("month", month, month + "~", CURRENCY))
+    assert monthly["ledger"]["amount"] == 4980
+    assert monthly["invoice"]["amount"] == 2980
+
+
+@pytest.mark.api
+def test_admin_rollups_endpoint(client, rollup_day, monkeypatch):
+    """管理者キーで日次ロールアップを取得できる"""
+    day, suffix = rollup_day
+    _record_sample(day, suffix)
+    monkeypatch.setenv("ADMIN_API_KEY", "test-admin-key")
+    next_day = (day + datetime.timedelta(days=1)).isoformat()
+
+    response = client.get(
+        f"/api/admin/revenue/rollups?grain=month&start={day.isoformat()}&end={next_day}&currency={CURRENCY}",
+        headers={"X-Admin-Key": "test-admin-key"}
+    )
+
+    assert response.status_code == 200
+    rollups = response.get_json()["rollups"]
+    assert {row["source"] for row in rollups} == {"ledger", "invoice"}
+    assert client.get("/api/admin/revenue/rollups").status_code in (401, 403)
+    # 非ASCIIのキーも500にならずに拒否する
+    assert client.get("/api/admin/revenue/rollups", headers={"X-Admin-Key": "clé"}).status_code == 403
+
+
+@pytest.mark.api
+def test_admin_rebuild_rejects_invalid_workers(client, rollup_day, monkeypatch):
+    """並列数が整数でない場合は400を返し、大きすぎる値は上限に丸めて再集計する"""
+    day, _ = rollup_day
+    monkeypatch.setenv("ADMIN_API_KEY", "test-admin-key")
+    headers = {"X-Admin-Key": "test-admin-key"}
+    period = {"start": day.isoformat(), "end": (day + datetime.timedelta(days=1)).isoformat()}
+
+    for workers in ("many", None, 0, [4]):
+        response = client.post("/api/admin/revenue/rollups/rebuild", json={**period, "workers": workers}, headers=headers)
+        assert response.status_code == 400
+
+    response = client.post("/api/admin/revenue/rollups/rebuild", json={**period, "workers": 10000}, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()["days"] == 1
@@ -0,0 +1,51 @@
+"""
+セッションアクティビティのバッファテスト：検証が読み取りのみになり、更新がまとめて書き込まれるかをテスト
+"""
+import datetime
+import pytest
+from repositories import create_session, validate_session
+from repositories.session_activity import SessionActivityBuffer, activity_buffer
+from models import UserSession
+
+
+def _last_activity(db_session, session_token):
+    db_session.expire_all()
+    return db_session.query(UserSession).filter_by(session_token=session_token).one().last_activity
+
+
+@pytest.fixture()
+def user_session_token(db_session, sample_user):
+    session_token = create_session(sample_user.id)
+    yield session_token
+    activity_buffer.discard(session_token)
+    db_session.query(UserSession).filter_by(user_id=sample_user.id).delete()
+    db_session.commit()
+
+
+@pytest.mark.unit
+def test_validate_session_does_not_write(db_session, sample_user, user_session_token):
+    """検証はlast_activityを直接更新せず、最小間隔内のアクセスはバッファにも積まない"""
+    before = _last_activity(db_session, user_session_token)
+
+    assert validate_session(user_session_token) == sample_user.id
+    assert validate_session(user_session_token) == sample_user.id
+
+    assert _last_activity(db_session, user_session_token) == before
+
+
+@pytest.mark.unit
+def test_buffer_flushes_latest_activity_in_batch(db_session, user_session_token):
+    """最小間隔を過ぎたアクティビティだけが記録され、flushでまとめて書き込まれる"""
+    buffer = SessionActivityBuffer(min_interval=60, flush_interval=3600)
+    last_activity = _last_activity(db_session, user_session_token)
+
+    assert not buffer.record(user_session_token, last_activity + datetime.timedelta(seconds=30), last_activity)
+    later = last_activity + datetime.timedelta(seconds=90)
+    assert buffer.record(user_session_token, later, last_activity)
+    assert not buffer.record(user_session_token, later + datetime.timedelta(seconds=5), last_activity)
+    assert buffer.record("unknown-token", later)
+    assert buffer.pending_count() == 2
+
+    assert buffer.flush() == 2
+    assert buffer.pending_count() == 0
+    assert _last_activity(db_session, user_session_token) == later
@@ -0,0 +1,66 @@
+"""
+セッションキャッシュテスト：検証済みセッションのキャッシュと無効化をテスト
+"""
+import time
+import pytest
+from cache import LocalTTLCache
+from repositories import create_session, validate_session, logout_user
+from repositories.session_cache import get_session_cache_stats, clear_session_cache
+from models import UserSession
+
+
+@pytest.fixture()
+def cached_sessions(db_session, sample_user):
+    clear_session_cache()
+    yield sample_user
+    clear_session_cache()
+    db_session.query(UserSession).filter_by(user_id=sample_user.id).delete()
+    db_session.commit()
+
+
+@pytest.mark.unit
+def test_local_ttl_cache_expiry_and_eviction():
+    """期限切れの値は返さず、上限を超えると最も使われていないものから削除する"""
+    cache = LocalTTLCache(ttl=60, max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=0)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+
+    cache.set("c", 3)
+    cache.set("d", 4)
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 2
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.unit
+def test_repeated_validation_uses_cache(cached_sessions, db_session):
+    """2回目以降の検証はDBを照会しない"""
+    user = cached_sessions
+    token = create_session(user.id)
+
+    assert validate_session(token) == user.id
+    # DB上で無効化してもキャッシュの保持時間内はキャッシュから返る
+    db_session.query(UserSession).filter_by(session_token=token).update({"is_active": False})
+    db_session.commit()
+    assert validate_session(token) == user.id
+
+    stats = get_session_cache_stats()
+    assert stats["db_lookups"] == 1
+    assert stats["local_hits"] == 1
+
+
+@pytest.mark.unit
+def test_logout_and_relogin_invalidate_cache(cached_sessions):
+    """ログアウトと再ログインでキャッシュが削除される"""
+    user = cached_sessions
+    first = create_session(user.id)
+    assert validate_session(first) == user.id
+
+    second = create_session(user.id)
+    assert validate_session(first) is None
+    assert validate_session(second) == user.id
+
+    assert logout_user(second) is True
+    assert validate_session(second) is None
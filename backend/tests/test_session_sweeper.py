@@ -0,0 +1,62 @@
+"""
+セッションスイーパーテスト：期限切れ・無効化済みセッションの削除をテスト
+"""
+import datetime
+import pytest
+from repositories import create_session, validate_session
+from repositories.session_sweeper import SessionSweeper
+from repositories.session_tokens import SESSION_TTL_SECONDS
+from repositories.session_cache import clear_session_cache
+from models import UserSession
+
+
+@pytest.fixture()
+def user_sessions(db_session, sample_user):
+    clear_session_cache()
+    yield sample_user
+    clear_session_cache()
+    db_session.query(UserSession).filter_by(user_id=sample_user.id).delete()
+    db_session.commit()
+
+
+def _add_session(db_session, user_id, token, age_seconds, is_active=True):
+    created_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=age_seconds)
+    db_session.add(UserSession(user_id=user_id, session_token=token, created_at=created_at,
+                               last_activity=created_at, is_active=is_active))
+    db_session.commit()
+
+
+@pytest.mark.unit
+def test_expired_session_is_rejected_by_query(user_sessions, db_session):
+    """有効期限切れのセッションは is_active のままでも検証に通らない"""
+    user = user_sessions
+    _add_session(db_session, user.id, "sweeper-expired-token", SESSION_TTL_SECONDS + 60)
+
+    assert validate_session("sweeper-expired-token") is None
+
+
+@pytest.mark.unit
+def test_sweep_deletes_expired_and_inactive_in_batches(user_sessions, db_session):
+    """期限切れ・無効化済みの行だけを件数を区切って削除する"""
+    user = user_sessions
+    for i in range(5):
+        _add_session(db_session, user.id, f"sweeper-old-{i}", SESSION_TTL_SECONDS + 60)
+    for i in range(3):
+        _add_session(db_session, user.id, f"sweeper-inactive-{i}", 60, is_active=False)
+    # 署名付きトークンの無効化済み行は失効の同期に使うため有効期限まで残す
+    _add_session(db_session, user.id, "v1.sweeper.revoked", 60, is_active=False)
+    token = create_session(user.id)
+
+    sweeper = SessionSweeper(interval=0, batch_size=2, max_batches=3, pause=0)
+    assert sweeper.sweep() == 5
+    assert sweeper.stats()["backlog_remaining"] is True
+    assert sweeper.sweep() == 3
+    assert sweeper.stats()["backlog_remaining"] is False
+
+    remaining = {row.session_token for row in db_session.query(UserSession.session_token).filter_by(user_id=user.id)}
+    assert remaining == {token, "v1.sweeper.revoked"}
+    assert validate_session(token) == user.id
+
+    stats = sweeper.stats()
+    assert stats["deleted_expired"] == 5
+    assert stats["deleted_inactive"] == 3
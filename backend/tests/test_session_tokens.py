@@ -0,0 +1,75 @@
+"""
+署名付きセッショントークンテスト：DBを参照しない検証と失効セットの動作をテスト
+"""
+import time
+import pytest
+from repositories import create_session, validate_session, logout_user
+from repositories.session_tokens import issue_signed_token, parse_signed_token, revocation_set
+from models import UserSession
+
+
+@pytest.fixture()
+def signed_tokens(monkeypatch, db_session, sample_user):
+    monkeypatch.setenv("SESSION_TOKEN_FORMAT", "signed")
+    monkeypatch.setenv("SESSION_TOKEN_SECRET", "test-session-secret")
+    revocation_set.clear()
+    yield sample_user
+    revocation_set.clear()
+    db_session.query(UserSession).filter_by(user_id=sample_user.id).delete()
+    db_session.commit()
+
+
+@pytest.mark.unit
+def test_signed_token_roundtrip(monkeypatch):
+    """署名付きトークンの発行と改ざん検知"""
+    monkeypatch.setenv("SESSION_TOKEN_SECRET", "test-session-secret")
+    token = issue_signed_token(42, 7, issued_at=1700000000)
+
+    assert token.startswith("v1.42.7.1700000000.")
+    assert parse_signed_token(token) == (42, 7, 1700000000)
+    assert parse_signed_token(token.replace("v1.42.", "v1.43.")) is None
+    assert parse_signed_token(token[:-2]) is None
+
+    monkeypatch.setenv("SESSION_TOKEN_SECRET", "another-secret")
+    assert parse_signed_token(token) is None
+
+
+@pytest.mark.unit
+def test_signed_session_validates_without_db(signed_tokens, db_session):
+    """署名付きトークンはDBの行を消しても有効期間内なら検証できる"""
+    user = signed_tokens
+    token = create_session(user.id)
+    assert token.startswith(f"v1.{user.id}.")
+
+    db_session.query(UserSession).filter_by(user_id=user.id).delete()
+    db_session.commit()
+    assert validate_session(token) == user.id
+
+    expired = issue_signed_token(user.id, 1, issued_at=time.time() - 25 * 3600)
+    assert validate_session(expired) is None
+
+
+@pytest.mark.unit
+def test_logout_and_relogin_revoke_signed_tokens(signed_tokens):
+    """ログアウトと再ログイン（旧セッションの無効化）で失効セットに登録される"""
+    user = signed_tokens
+    first = create_session(user.id)
+    second = create_session(user.id)
+
+    assert validate_session(first) is None
+    assert validate_session(second) == user.id
+
+    assert logout_user(second) is True
+    assert validate_session(second) is None
+
+
+@pytest.mark.unit
+def test_revocations_sync_from_database(signed_tokens):
+    """他のプロセスで失効したセッションはDBから同期される"""
+    user = signed_tokens
+    token = create_session(user.id)
+    logout_user(token)
+
+    # 自プロセスの失効情報を消してDBからの同期だけで判定させる
+    revocation_set.clear()
+    assert validate_session(token) is None
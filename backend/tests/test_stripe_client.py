@@ -0,0 +1,322 @@
+"""
+Stripeクライアントテスト：共有HTTPクライアントの設定と呼び出しの計測をテスト
+"""
+import time
+import threading
+import pytest
+import stripe
+import requests
+from requests.adapters import BaseAdapter
+from stripe_client import (
+    configure_stripe,
+    endpoint_family,
+    stripe_call_timeout,
+    stripe_stats,
+    StripeSession,
+    stripe_fanout,
+    stripe_breakers,
+    CircuitBreaker,
+    StripeCircuitOpenError,
+    StripeGovernor,
+    StripeThrottledError,
+    stripe_lane,
+)
+import stripe_client
+from security import RateLimiter
+
+
+class _RecordingAdapter(BaseAdapter):
+    """実際には通信せず、受け取ったタイムアウトを記録して200を返す"""
+
+    def __init__(self):
+        super().__init__()
+        self.timeouts = []
+
+    def send(self, request, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b"{}"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.mark.unit
+def test_configure_stripe_installs_shared_client(monkeypatch):
+    """モジュール経由のStripe呼び出しは共有のHTTPクライアントを使う"""
+    monkeypatch.setattr(stripe, "api_key", stripe.api_key)
+    client = configure_stripe("sk_test_configured")
+    assert stripe.default_http_client is client
+    assert stripe.api_key == "sk_test_configured"
+    # 何度呼んでも同じ接続プールを使う
+    assert configure_stripe("sk_test_configured") is client
+
+
+@pytest.mark.unit
+def test_endpoint_family_strips_object_ids():
+    assert endpoint_family("post", "https://api.stripe.com/v1/subscription_schedules/sub_sched_1Nabc234/release") \
+        == "POST /v1/subscription_schedules/{id}/release"
+    assert endpoint_family("get", "https://api.stripe.com/v1/customers/cus_9s6XKzkNRiz8i3") == "GET /v1/customers/{id}"
+
+
+@pytest.mark.unit
+def test_session_records_calls_and_timeout_override():
+    """呼び出しごとの所要時間を記録し、stripe_call_timeout でタイムアウトを上書きできる"""
+    stripe_stats.reset()
+    session = StripeSession()
+    adapter = _RecordingAdapter()
+    session.mount("https://api.stripe.test/", adapter)
+
+    session.request("GET", "https://api.stripe.test/v1/customers/cus_9s6XKzkNRiz8i3", timeout=(3, 20))
+    with stripe_call_timeout(read=2):
+        session.request("GET", "https://api.stripe.test/v1/customers/cus_9s6XKzkNRiz8i3", timeout=(3, 20))
+
+    assert adapter.timeouts == [(3, 20), (3, 2)]
+    calls = stripe_stats.snapshot()["calls"]
+    assert calls["GET /v1/customers/{id}"]["count"] == 2
+    assert calls["GET /v1/customers/{id}"]["errors"] == 0
+
+
+@pytest.mark.unit
+def test_fanout_caps_concurrency_and_runs_in_parallel():
+    """同時実行数の上限を守りつつ、全体の所要時間は最も遅い呼び出しに近くなる"""
+    lock = threading.Lock()
+    active = {'now': 0, 'max': 0}
+
+    def call(value):
+        def run():
+            with lock:
+                active['now'] += 1
+                active['max'] = max(active['max'], active['now'])
+            time.sleep(0.05)
+            with lock:
+                active['now'] -= 1
+            return value
+        return run
+
+    started = time.monotonic()
+    result = stripe_fanout({key: call(key * 2) for key in range(6)}, max_concurrency=3, deadline=5)
+    elapsed = time.monotonic() - started
+
+    assert result.complete
+    assert result.results == {key: key * 2 for key in range(6)}
+    assert active['max'] <= 3
+    assert elapsed < 0.05 * 6
+
+
+@pytest.mark.unit
+def test_fanout_returns_partial_results_at_deadline():
+    """失敗・期限切れの呼び出しがあっても、終わった分の結果は返す"""
+    release = threading.Event()
+
+    def fail():
+        raise stripe.error.APIConnectionError("boom")
+
+    result = stripe_fanout({
+        'fast': lambda: 'ok',
+        'error': fail,
+        'slow': lambda: release.wait(5),
+    }, max_concurrency=3, deadline=0.2)
+    release.set()
+
+    assert result.results == {'fast': 'ok'}
+    assert isinstance(result.errors['error'], stripe.error.APIConnectionError)
+    assert result.timed_out == {'slow'}
+    assert not result.complete
+
+
+class _ScriptedAdapter(BaseAdapter):
+    """決められた順にステータスコードを返す（429にはRetry-Afterを付ける）"""
+
+    def __init__(self, statuses):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(request.headers.get('Idempotency-Key'))
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        if response.status_code == 429:
+            response.headers['Retry-After'] = '0.05'
+        response._content = b"{}"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture()
+def scripted_session(monkeypatch):
+    monkeypatch.setattr(stripe_client, "STRIPE_RETRY_BASE_DELAY_SECONDS", 0)
+    monkeypatch.setattr(stripe_client, "STRIPE_MAX_NETWORK_RETRIES", 2)
+    monkeypatch.setattr(stripe_client, "stripe_governor", StripeGovernor(RateLimiter(None), rate="1000/1"))
+    for breaker in stripe_breakers.values():
+        breaker.reset()
+
+    def make(statuses):
+        session = StripeSession()
+        adapter = _ScriptedAdapter(statuses)
+        session.mount("https://api.stripe.test/", adapter)
+        return session, adapter
+
+    yield make
+    for breaker in stripe_breakers.values():
+        breaker.reset()
+
+
+@pytest.mark.unit
+def test_breaker_opens_and_probes_once_when_half_open():
+    """連続失敗で開き、待機後は1件だけ試験的に通して成功すれば閉じる"""
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+
+    assert breaker.is_open()
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_success()
+
+    assert breaker.stats()['state'] == 'closed'
+    assert breaker.allow_request()
+
+
+@pytest.mark.unit
+def test_reads_and_idempotent_writes_are_retried(scripted_session):
+    """5xxは読み取りと冪等キー付きの書き込みだけ再試行し、同じ冪等キーで再送する"""
+    session, adapter = scripted_session([503, 200])
+    response = session.request("get", "https://api.stripe.test/v1/subscriptions/sub_1Nabc234")
+    assert response.status_code == 200
+    assert len(adapter.sent) == 2
+
+    session, adapter = scripted_session([500, 200])
+    response = session.request("post", "https://api.stripe.test/v1/checkout/sessions",
+                               headers={"Idempotency-Key": "key-1"})
+    assert response.status_code == 200
+    assert adapter.sent == ["key-1", "key-1"]
+
+    session, adapter = scripted_session([500])
+    response = session.request("post", "https://api.stripe.test/v1/checkout/sessions")
+    assert response.status_code == 500
+    assert len(adapter.sent) == 1
+
+    # 冪等キーのないDELETEも再試行しない
+    session, adapter = scripted_session([500])
+    response = session.request("delete", "https://api.stripe.test/v1/subscriptions/sub_1Nabc234")
+    assert response.status_code == 500
+    assert len(adapter.sent) == 1
+
+
+@pytest.mark.unit
+def test_open_breaker_fails_fast_per_family(scripted_session):
+    """開いた系統の呼び出しは送信せずに失敗し、他の系統には影響しない"""
+    url = "https://api.stripe.test/v1/subscription_schedules/sub_sched_1Nabc234"
+    session, adapter = scripted_session([503] * 5 + [200])
+    assert session.request("get", url).status_code == 503
+    assert len(adapter.sent) == 3
+
+    # 再試行の途中でブレーカーが開いた時点で打ち切る
+    with pytest.raises(StripeCircuitOpenError):
+        session.request("get", url)
+    assert len(adapter.sent) == 5
+    assert stripe_breakers['schedules'].is_open()
+
+    with pytest.raises(StripeCircuitOpenError):
+        session.request("get", url)
+    assert len(adapter.sent) == 5
+
+    assert session.request("get", "https://api.stripe.test/v1/customers/cus_9s6XKzkNRiz8i3").status_code == 200
+
+
+@pytest.mark.api
+def test_route_returns_503_while_breaker_is_open(client, scripted_session):
+    """ブレーカーが開いている間は、Stripeを呼ぶAPIが待たずに503とRetry-Afterを返す"""
+    for _ in range(stripe_breakers['checkout'].failure_threshold):
+        stripe_breakers['checkout'].record_failure()
+
+    response = client.post('/api/get-checkout-session', json={"session_id": "cs_test_open"})
+
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) > 0
+    assert response.get_json()['success'] is False
+
+
+@pytest.mark.unit
+def test_governor_reserves_budget_for_interactive_calls():
+    """バックグラウンド処理は専用の枠を使い切ると諦め、画面からの操作は残りの枠で送信できる"""
+    governor = StripeGovernor(RateLimiter(None), rate="4/10", background_share=0.5,
+                              max_wait={'interactive': 0, 'background': 0})
+
+    with stripe_lane('background'):
+        governor.acquire()
+        governor.acquire()
+        with pytest.raises(StripeThrottledError):
+            governor.acquire()
+
+    governor.acquire()
+    governor.acquire()
+
+    stats = governor.stats()
+    assert stats['background'] == {'calls': 2, 'waited': 0, 'throttled': 1}
+    assert stats['interactive']['calls'] == 2
+
+
+@pytest.mark.unit
+def test_governor_backs_off_on_429_and_recovers():
+    """429で送信を一時停止してレートを下げ、成功が続くと元に戻る"""
+    governor = StripeGovernor(RateLimiter(None), rate="100/1", max_wait={'interactive': 1, 'background': 0})
+
+    governor.observe(429, retry_after=0.1)
+    assert governor.stats()['rate_factor'] == 0.5
+    with stripe_lane('background'), pytest.raises(StripeThrottledError):
+        governor.acquire()
+
+    started = time.monotonic()
+    governor.acquire()
+    assert time.monotonic() - started >= 0.05
+
+    for _ in range(10):
+        governor.observe(200)
+    assert governor.stats()['rate_factor'] == 1.0
+
+
+@pytest.mark.unit
+def test_governor_wait_inside_fanout_stops_at_deadline():
+    """並列取得の中のバックグラウンド呼び出しは、取得全体の期限を過ぎてレートの空きを待たない"""
+    governor = StripeGovernor(RateLimiter(None), rate="100/1", max_wait={'interactive': 1, 'background': 30})
+    governor.observe(429, retry_after=10)
+    finished = threading.Event()
+
+    def call():
+        try:
+            governor.acquire()
+        finally:
+            finished.set()
+
+    with stripe_lane('background'):
+        result = stripe_fanout({'throttled': call}, deadline=0.2)
+
+    assert result.timed_out == {'throttled'} or isinstance(result.errors.get('throttled'), StripeThrottledError)
+    assert finished.wait(1)
+    assert governor.stats()['background']['throttled'] == 1
+
+
+@pytest.mark.unit
+def test_session_reports_429_to_governor(scripted_session):
+    """429はRetry-Afterを守って再試行し、調整役に記録される"""
+    session, adapter = scripted_session([429, 200])
+    response = session.request("get", "https://api.stripe.test/v1/customers/cus_9s6XKzkNRiz8i3")
+
+    assert response.status_code == 200
+    assert len(adapter.sent) == 2
+    assert stripe_client.stripe_governor.stats()['rate_limited'] == 1
@@ -0,0 +1,137 @@
+"""
+サブスクリプションスケジュールテスト：Webhookで保存した変更予約をStripeを呼ばずに表示できることをテスト
+"""
+import pytest
+import stripe
+from repositories import (
+    create_session,
+    logout_user,
+    upsert_subscription,
+    upsert_subscription_schedule,
+    get_pending_schedules,
+)
+from models import Subscription, SubscriptionSchedule, UserSession, UserBillingSummary
+
+
+@pytest.fixture()
+def schedule_user(client, db_session, sample_user, monkeypatch):
+    """サブスクリプションを1つ持つユーザー（Stripeの呼び出しは失敗させる）"""
+    def fail(*args, **kwargs):
+        raise AssertionError("Stripe should not be called")
+    monkeypatch.setattr(stripe.Subscription, "retrieve", fail)
+    monkeypatch.setattr(stripe.SubscriptionSchedule, "retrieve", fail)
+    monkeypatch.setenv("STRIPE_WEBHOOK_BYPASS_SIGNATURE", "true")
+
+    subscription_id = f"sub_sched_test_{sample_user.id}"
+    upsert_subscription({
+        "id": subscription_id,
+        "customer": sample_user.stripe_customer_id,
+        "status": "active",
+        "items": {"data": [{"price": {"id": "price_standard_test"}}]},
+        "current_period_end": 1800000000,
+        "created": 1700000000,
+    }, user_id=sample_user.id)
+    token = create_session(sample_user.id)
+
+    yield sample_user, subscription_id, {"Authorization": f"Bearer {token}"}
+
+    logout_user(token)
+    db_session.query(SubscriptionSchedule).filter_by(subscription_id=subscription_id).delete()
+    db_session.query(Subscription).filter_by(id=subscription_id).delete()
+    db_session.query(UserBillingSummary).filter_by(user_id=sample_user.id).delete()
+    db_session.query(UserSession).filter_by(user_id=sample_user.id).delete()
+    db_session.commit()
+
+
+def _schedule(subscription_id, status="active", **overrides):
+    data = {
+        "id": f"sub_sched_{subscription_id}",
+        "object": "subscription_schedule",
+        "subscription": subscription_id,
+        "customer": "cus_sched",
+        "status": status,
+        "current_phase": {"start_date": 1700000000, "end_date": 1800000000},
+        "phases": [
+            {"start_date": 1700000000, "end_date": 1800000000, "items": [{"price": "price_standard_test", "quantity": 1}]},
+            {"start_date": 1800000000, "end_date": 1900000000, "items": [{"price": "price_premium_test", "quantity": 1}]},
+        ],
+        "metadata": {},
+    }
+    data.update(overrides)
+    return data
+
+
+def _send_event(client, event_id, event_type, schedule):
+    return client.post('/webhook', json={"id": event_id, "type": event_type, "data": {"object": schedule}})
+
+
+@pytest.mark.unit
+def test_schedule_phases_are_stored_with_owner(schedule_user):
+    """次のフェーズの価格と切り替え日時を保存し、所有者はサブスクリプションから解決する"""
+    user, subscription_id, _ = schedule_user
+
+    saved = upsert_subscription_schedule(_schedule(subscription_id))
+
+    assert saved.user_id == user.id
+    assert saved.current_price_id == "price_standard_test"
+    assert saved.next_price_id == "price_premium_test"
+    assert saved.change_date == 1800000000
+    assert set(get_pending_schedules([subscription_id])) == {subscription_id}
+
+
+@pytest.mark.unit
+def test_released_schedule_is_not_reactivated_by_stale_update(schedule_user):
+    """解除済みのスケジュールは、後から届いた古い更新イベントで有効に戻らない"""
+    _, subscription_id, _ = schedule_user
+
+    upsert_subscription_schedule(_schedule(subscription_id))
+    upsert_subscription_schedule(_schedule(subscription_id, status="released", subscription=None,
+                                           released_subscription=subscription_id))
+    stale = upsert_subscription_schedule(_schedule(subscription_id))
+
+    assert stale.status == "released"
+    assert get_pending_schedules([subscription_id]) == {}
+
+
+@pytest.mark.unit
+def test_aborted_schedule_is_not_reactivated_by_stale_update(schedule_user):
+    """支払い失敗などで中止されたスケジュールも、古い更新イベントで有効に戻らない"""
+    _, subscription_id, _ = schedule_user
+
+    upsert_subscription_schedule(_schedule(subscription_id, status="aborted"))
+    stale = upsert_subscription_schedule(_schedule(subscription_id))
+
+    assert stale.status == "aborted"
+    assert get_pending_schedules([subscription_id]) == {}
+
+
+@pytest.mark.api
+def test_history_renders_scheduled_change_from_webhook(client, schedule_user):
+    """Webhookで保存した変更予約が履歴・アクティブ一覧にStripeを呼ばずに表示される"""
+    user, subscription_id, headers = schedule_user
+    schedule = _schedule(subscription_id)
+
+    assert _send_event(client, f"evt_sched_{user.id}_1", "subscription_schedule.created", schedule).status_code == 200
+
+    history = client.post('/api/user-subscription-history', headers=headers).get_json()
+    change = history["subscriptions"][0]["scheduled_change"]
+    assert change == {
+        "schedule_id": schedule["id"],
+        "next_price_id": "price_premium_test",
+        "next_plan_name": "プレミアムプラン",
+        "change_date": 1800000000,
+    }
+
+    active = client.post('/api/user-active-subscriptions', headers=headers).get_json()
+    assert active["subscriptions"][0]["scheduled_change"]["schedule_id"] == schedule["id"]
+
+    summary = client.post('/api/user-billing-summary', headers=headers).get_json()["summary"]
+    assert summary["scheduled_change"]["schedule_id"] == schedule["id"]
+
+    released = _schedule(subscription_id, status="released", subscription=None, released_subscription=subscription_id)
+    assert _send_event(client, f"evt_sched_{user.id}_2", "subscription_schedule.released", released).status_code == 200
+
+    history = client.post('/api/user-subscription-history', headers=headers).get_json()
+    assert history["subscriptions"][0]["scheduled_change"] is None
+    summary = client.post('/api/user-billing-summary', headers=headers).get_json()["summary"]
+    assert summary["scheduled_change"] is None
@@ -0,0 +1,65 @@
+"""
+リクエスト検証テスト：スキーマの検証とエンドポイントでの400/413をテスト
+"""
+import pytest
+from validation import Schema, Field, EMAIL_PATTERN
+from security import validate_user_input
+
+
+@pytest.mark.unit
+def test_schema_validates_and_applies_defaults():
+    schema = Schema({
+        "email": Field(required=True, pattern=EMAIL_PATTERN, required_message="必須です", message="形式エラー"),
+        "plan_type": Field(choices=("standard", "premium"), default="premium"),
+        "count": Field(type=int),
+    })
+
+    cleaned, errors = schema.validate({"email": "user@example.com", "extra": 1})
+    assert errors == []
+    assert cleaned == {"email": "user@example.com", "plan_type": "premium", "count": None, "extra": 1}
+
+    _, errors = schema.validate({"plan_type": "gold", "count": True})
+    assert errors == ["必須です", "plan_typeの形式が正しくありません", "countの形式が正しくありません"]
+
+    _, errors = schema.validate({"email": "not-an-email"})
+    assert errors == ["形式エラー"]
+
+
+@pytest.mark.unit
+def test_validate_user_input_keeps_rule_format():
+    rules = {"email": ["required", "email"], "password": ["required", "password"], "name": {"max_length": 3}}
+    assert validate_user_input({"email": "a@b", "password": "longenough", "name": "ab"}, rules) == []
+    assert validate_user_input({"email": "x", "password": "short", "name": "abcd"}, rules) == [
+        "Field email must be a valid email",
+        "Field password must be at least 8 characters",
+        "Field name must not exceed 3 characters",
+    ]
+
+
+@pytest.mark.api
+def test_register_rejects_invalid_bodies(client):
+    """不正なボディはユーザー作成の前に400で返す"""
+    response = client.post('/api/register', json={"email": "test@example.com"})
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "メールアドレス、パスワード、お名前は必須です"
+
+    response = client.post('/api/register', json={"email": "test@example.com", "password": "short", "name": "テスト"})
+    assert response.status_code == 400
+    assert "8文字以上" in response.get_json()["error"]
+
+    response = client.post('/api/register', json=["not", "an", "object"])
+    assert response.status_code == 400
+
+    response = client.post('/api/login', data="x" * 20000, content_type="application/json")
+    assert response.status_code == 413
+
+
+@pytest.mark.api
+def test_payment_body_is_validated_before_auth(client):
+    """決済APIのボディはセッション検証の前に検証する"""
+    response = client.post('/api/cancel-subscription', json={"subscription_id": "not-a-subscription"})
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+    response = client.post('/api/cancel-subscription', json={"subscription_id": "sub_123"})
+    assert response.status_code == 401
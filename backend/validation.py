@@ -0,0 +1,198 @@
+"""
+リクエストボディ（JSON）の検証
+エンドポイントごとのスキーマを import 時に検証関数へ変換しておき、デコレータで適用する
+大きすぎる・壊れたボディはDBやStripeの処理の前に400/413で返す
+"""
+import os
+import re
+import logging
+from functools import wraps
+from flask import request, jsonify, g
+
+logger = logging.getLogger(__name__)
+
+# リクエストボディの上限（バイト）
+MAX_BODY_BYTES = int(os.getenv("VALIDATION_MAX_BODY_BYTES", "16384"))
+
+EMAIL_PATTERN = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
+DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+_MISSING = object()
+
+
+class Field:
+    """1項目の検証ルール"""
+
+    def __init__(self, type=str, required=False, default=None, min_length=None, max_length=None,
+                 pattern=None, choices=None, message=None, required_message=None):
+        self.type = type
+        self.required = required
+        self.default = default
+        self.min_length = min_length
+        self.max_length = max_length
+        self.pattern = pattern
+        self.choices = choices
+        self.message = message
+        self.required_message = required_message
+
+
+def _compile_field(name, field):
+    """Fieldを (値) -> (値, エラーメッセージ) の関数に変換（ルールの有無は変換時に確定させる）"""
+    invalid = field.message or f"{name}の形式が正しくありません"
+    required = field.required_message or field.message or f"{name}は必須です"
+    checks = []
+
+    if field.type is not None:
+        types = field.type if isinstance(field.type, tuple) else (field.type,)
+        # boolはintのサブクラスなので、整数の項目では明示的に除外する
+        reject_bool = bool not in types and int in types
+        checks.append(lambda value: isinstance(value, types) and not (reject_bool and isinstance(value, bool)))
+    if field.min_length is not None:
+        min_length = field.min_length
+        checks.append(lambda value: len(value) >= min_length)
+    if field.max_length is not None:
+        max_length = field.max_length
+        checks.append(lambda value: len(value) <= max_length)
+    if field.pattern is not None:
+        match = re.compile(field.pattern).match
+        checks.append(lambda value: match(value) is not None)
+    if field.choices is not None:
+        choices = frozenset(field.choices)
+        checks.append(lambda value: value in choices)
+
+    is_required = field.required
+    default = field.default
+
+    def validate(value):
+        if value is _MISSING or value is None or value == '':
+            if is_required:
+                return _MISSING, required
+            return default, None
+        for check in checks:
+            if not check(value):
+                return _MISSING, invalid
+        return value, None
+
+    return validate
+
+
+class Schema:
+    """エンドポイントのリクエストボディのスキーマ（作成時に検証関数へ変換する）"""
+
+    def __init__(self, fields, max_bytes=MAX_BODY_BYTES, allow_unknown=True):
+        self.max_bytes = max_bytes
+        self.allow_unknown = allow_unknown
+        self._validators = [(name, _compile_field(name, field)) for name, field in fields.items()]
+        self._names = frozenset(fields)
+
+    def validate(self, data):
+        """検証して (整形済みのデータ, エラーメッセージのリスト) を返す"""
+        cleaned = {}
+        errors = []
+        get = data.get
+        for name, validate in self._validators:
+            value, error = validate(get(name, _MISSING))
+            if error:
+                # 同じメッセージ（例: 複数項目に共通の必須メッセージ）は1回だけ返す
+                if error not in errors:
+                    errors.append(error)
+            else:
+                cleaned[name] = value
+        if self.allow_unknown:
+            for name, value in data.items():
+                if name not in self._names:
+                    cleaned[name] = value
+        else:
+            unknown = [name for name in data if name not in self._names]
+            if unknown:
+                errors.append(f"不明な項目です: {', '.join(sorted(unknown))}")
+        return cleaned, errors
+
+
+def _error_response(message, status=400, errors=None):
+    body = {"success": False, "error": message}
+    if errors:
+        body["errors"] = errors
+    return jsonify(body), status
+
+
+def validate_json(schema):
+    """リクエストボディをスキーマで検証するデコレータ（検証済みの値は get_validated_json() で取得）"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.content_length is not None and request.content_length > schema.max_bytes:
+                return _error_response("リクエストが大きすぎます", 413)
+
+            data = request.get_json(silent=True)
+            if data is None and not request.get_data(cache=True):
+                data = {}
+            if not isinstance(data, dict):
+                return _error_response("リクエストの形式が正しくありません")
+
+            cleaned, errors = schema.validate(data)
+            if errors:
+                return _error_response(errors[0], errors=errors)
+
+            g.validated_json = cleaned
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def get_validated_json():
+    """validate_json で検証済みのリクエストボディ"""
+    return g.get('validated_json', {})
+
+
+# ============================================
+# 旧形式のルール（security.validate_user_input）の変換
+# ============================================
+
+# 旧形式のルール辞書 -> 変換済みのスキーマ（ルールは通常モジュールの定数なので id で引く）
+_legacy_schemas = {}
+
+
+def compile_legacy_rules(rules):
+    """validate_user_input のルール辞書をスキーマに変換（同じ辞書は一度だけ変換する）"""
+    cached = _legacy_schemas.get(id(rules))
+    if cached is not None and cached[0] is rules:
+        return cached[1]
+
+    fields = {}
+    for name, rule_data in rules.items():
+        field_rules = rule_data if isinstance(rule_data, list) else [rule_data]
+        validators = []
+        for rule in field_rules:
+            if rule == 'required':
+                validators.append(Field(type=None, required=True, message=f"Field {name} is required"))
+            elif rule == 'email':
+                validators.append(Field(type=None, pattern=r".*@", message=f"Field {name} must be a valid email"))
+            elif rule == 'password':
+                validators.append(Field(type=None, min_length=8, message=f"Field {name} must be at least 8 characters"))
+            elif isinstance(rule, dict):
+                if 'min_length' in rule:
+                    validators.append(Field(type=None, min_length=rule['min_length'],
+                                            message=f"Field {name} must be at least {rule['min_length']} characters"))
+                if 'max_length' in rule:
+                    validators.append(Field(type=None, max_length=rule['max_length'],
+                                            message=f"Field {name} must not exceed {rule['max_length']} characters"))
+        fields[name] = [_compile_field(name, field) for field in validators]
+
+    def validate(data):
+        errors = []
+        for name, checks in fields.items():
+            value = data.get(name)
+            if value is not None and not isinstance(value, str):
+                value = str(value)
+            for check in checks:
+                _, error = check(value)
+                if error:
+                    errors.append(error)
+        return errors
+
+    # その場で作られたルール辞書が溜まり続けないよう上限を設ける
+    if len(_legacy_schemas) >= 256:
+        _legacy_schemas.clear()
+    _legacy_schemas[id(rules)] = (rules, validate)
+    return validate
@@ -17,7 +17,8 @@ const config = {
         verifySessionEndpoint: "/api/verify-session",
         userInfoEndpoint: "/api/user-info",
         userPurchaseHistoryEndpoint: "/api/user-purchase-history",
-        userSubscriptionHistoryEndpoint: "/api/user-subscription-history"
+        userSubscriptionHistoryEndpoint: "/api/user-subscription-history",
+        userBillingSummaryEndpoint: "/api/user-billing-summary"
 
     },
     
@@ -58,26 +58,84 @@ async function handleScheduledPlanChange(newPlanType, newPlanName) {
     }
 }
 
-// サブスクリプション履歴を一括取得
+// 請求サマリー（現在のプラン・変更予約・累計利用額）を取得
+function loadBillingSummary(userId) {
+    fetch(window.AppConfig.api.baseUrl + window.AppConfig.api.userBillingSummaryEndpoint, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Authorization': `Bearer ${localStorage.getItem('session_token')}`
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success && data.summary) {
+            displayActiveSubscription(summaryToActiveSubscriptions(data.summary));
+            displayBillingTotals(data.summary);
+        } else {
+            displayActiveSubscription([]);
+            displayBillingTotals(null);
+        }
+    })
+    .catch(error => {
+        console.error('請求サマリー取得エラー:', error);
+        displayActiveSubscription([]);
+        displayBillingTotals(null);
+    });
+}
+
+// 請求サマリーの現在のプランをアクティブサブスクリプションの表示形式に変換
+function summaryToActiveSubscriptions(summary) {
+    if (!summary.subscription_id || summary.status !== 'active') {
+        return [];
+    }
+    return [{
+        id: summary.subscription_id,
+        price_id: summary.price_id,
+        plan_name: summary.plan_name,
+        status: summary.status,
+        current_period_end: summary.current_period_end,
+        cancel_at_period_end: summary.cancel_at_period_end,
+        scheduled_change: summary.scheduled_change
+    }];
+}
+
+// 累計利用額と直近の購入を表示
+function displayBillingTotals(summary) {
+    const lifetimeSpend = document.getElementById('user-lifetime-spend');
+    const lastPurchase = document.getElementById('user-last-purchase');
+    
+    if (lifetimeSpend) {
+        lifetimeSpend.textContent = summary
+            ? `${summary.lifetime_spend.toLocaleString('ja-JP')} ${(summary.currency || 'jpy').toUpperCase()}`
+            : '-';
+    }
+    if (lastPurchase) {
+        lastPurchase.textContent = summary && summary.last_purchase
+            ? `${summary.last_purchase.product_name || '商品'}（${new Date(summary.last_purchase.created_at).toLocaleDateString('ja-JP')}）`
+            : '-';
+    }
+}
+
+// サブスクリプション履歴を取得（現在のプランは請求サマリーから表示する）
 function loadSubscriptions(userId) {
     fetch(window.AppConfig.api.baseUrl + '/api/user-subscription-history', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ user_id: userId })
+        headers: {
+            'Content-Type': 'application/json',
+            'Authorization': `Bearer ${localStorage.getItem('session_token')}`
+        }
     })
     .then(response => response.json())
     .then(data => {
         if (data.success && data.subscriptions) {
-            displayActiveSubscription(data.subscriptions);
             displaySubscriptionHistory(data.subscriptions);
         } else {
-            displayActiveSubscription([]);
             displaySubscriptionHistory([]);
         }
     })
     .catch(error => {
         console.error('サブスクリプション取得エラー:', error);
-        displayActiveSubscription([]);
         displaySubscriptionHistory([]);
     });
 }
@@ -135,7 +193,7 @@ function displayActiveSubscription(subscriptions) {
                         <div class="history-item-info">
                             <div class="history-item-details">
                                 <div class="history-item-title">${activeSubscription.plan_name || activeSubscription.price_id || 'サブスクリプション'}</div>
-                                <div class="history-item-date">契約日: ${new Date(activeSubscription.created_at).toLocaleDateString('ja-JP')}</div>
+                                ${activeSubscription.created_at ? `<div class="history-item-date">契約日: ${new Date(activeSubscription.created_at).toLocaleDateString('ja-JP')}</div>` : ''}
                                 ${statusInfo}
                             </div>
                             ${statusBadge}
@@ -334,8 +392,7 @@ function startBillingPortal() {
         headers: { 
             'Content-Type': 'application/json',
             'Authorization': `Bearer ${sessionToken}`
-        },
-        body: JSON.stringify({ user_id: parseInt(userId) })
+        }
     })
     .then(response => response.json())
     .then(data => {
@@ -44,8 +44,10 @@ function checkActiveSubscriptions() {
             // アクティブサブスクリプションを取得
             fetch(window.AppConfig.api.baseUrl + '/api/user-active-subscriptions', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ user_id: data.user_id })
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Authorization': `Bearer ${localStorage.getItem('session_token')}`
+                }
             })
             .then(response => response.json())
             .then(subData => {
@@ -245,8 +245,10 @@ document.addEventListener('DOMContentLoaded', function() {
 function displayUserInfo(userId) {
     fetch(window.AppConfig.api.baseUrl + '/api/user-info', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ user_id: userId })
+        headers: {
+            'Content-Type': 'application/json',
+            'Authorization': `Bearer ${localStorage.getItem('session_token')}`
+        }
     })
     .then(response => response.json())
     .then(data => {
@@ -306,6 +308,7 @@ function loadUserData() {
     .then(data => {
         if (data.success) {
             displayUserInfo(data.user_id);
+            loadBillingSummary(data.user_id);
             loadPurchaseHistory(data.user_id);
             loadSubscriptions(data.user_id);
         } else {
@@ -327,8 +330,10 @@ function loadPurchaseHistory(userId) {
     
     fetch(window.AppConfig.api.baseUrl + '/api/user-purchase-history', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ user_id: userId })
+        headers: {
+            'Content-Type': 'application/json',
+            'Authorization': `Bearer ${localStorage.getItem('session_token')}`
+        }
     })
     .then(response => response.json())
     .then(data => {